@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire admission control
+Bounded in-flight limit and FIFO wait queue in front of the identification endpoints
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Optional, Any, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionController:
+    """Admit at most `max_in_flight` requests, queue up to `max_queue` more for `queue_timeout` seconds.
+
+    Requests beyond the queue are shed immediately with 429; queued requests that cannot start
+    before their deadline are shed with 503. Both carry a Retry-After estimated from recent
+    service times. A released slot is handed straight to the oldest waiter (FIFO).
+    """
+
+    def __init__(self, name: str, max_in_flight: int = 32, max_queue: int = 64, queue_timeout: float = 5.0):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self._service_ewma: Optional[float] = None
+        self.admitted = 0
+        self.queued = 0
+        self.shed_queue_full = 0
+        self.shed_queue_timeout = 0
+        self.max_queue_depth = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @classmethod
+    def from_env(cls, prefix: str = 'IDENTIFY') -> 'AdmissionController':
+        """<PREFIX>_MAX_IN_FLIGHT / <PREFIX>_MAX_QUEUE / <PREFIX>_QUEUE_TIMEOUT (seconds); max in flight 0 disables"""
+        return cls(
+            name=prefix.lower(),
+            max_in_flight=int(os.getenv(f'{prefix}_MAX_IN_FLIGHT', 32)),
+            max_queue=int(os.getenv(f'{prefix}_MAX_QUEUE', 64)),
+            queue_timeout=float(os.getenv(f'{prefix}_QUEUE_TIMEOUT', 5.0)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_in_flight > 0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free: queued work ahead divided by the parallelism"""
+        service = self._service_ewma if self._service_ewma is not None else 1.0
+        ahead = self.queue_depth + 1
+        return max(1, min(60, math.ceil(service * ahead / max(1, self.max_in_flight))))
+
+    def _shed(self, status_code: int, reason: str) -> HTTPException:
+        return HTTPException(
+            status_code=status_code,
+            detail=f"Server busy ({reason}), retry later",
+            headers={'Retry-After': str(self.retry_after())},
+        )
+
+    async def acquire(self) -> float:
+        """Wait for a slot; returns seconds spent queued. Raises 429 (queue full) or 503 (queue deadline)."""
+        if not self.enabled or (self.in_flight < self.max_in_flight and not self.queue_depth):
+            self.in_flight += 1
+            self.admitted += 1
+            return 0.0
+
+        if self.queue_depth >= self.max_queue:
+            self.shed_queue_full += 1
+            raise self._shed(429, 'queue full')
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not (waiter.done() and not waiter.cancelled()):
+                waiter.cancel()
+                self.shed_queue_timeout += 1
+                raise self._shed(503, 'queue wait exceeded')
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # the slot was handed over just as the caller went away
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+        waited = time.perf_counter() - started
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        self.admitted += 1
+        return waited
+
+    def release(self, service_time: Optional[float] = None):
+        """Free a slot, handing it directly to the oldest live waiter"""
+        if service_time is not None:
+            self._service_ewma = service_time if self._service_ewma is None else 0.8 * self._service_ewma + 0.2 * service_time
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)  # in_flight is unchanged: the slot moves to the waiter
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        waited = self.queued - self.shed_queue_timeout
+        return {
+            'enabled': self.enabled,
+            'max_in_flight': self.max_in_flight,
+            'max_queue': self.max_queue,
+            'queue_timeout_seconds': self.queue_timeout,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'shed_queue_full': self.shed_queue_full,
+            'shed_queue_timeout': self.shed_queue_timeout,
+            'avg_queue_wait_ms': round(self._wait_total / waited * 1000, 2) if waited > 0 else 0.0,
+            'max_queue_wait_ms': round(self._wait_max * 1000, 2),
+            'avg_service_ms': round(self._service_ewma * 1000, 2) if self._service_ewma is not None else None,
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware gating POSTs under the given path prefixes.
+
+    Runs before the request body is read, so shed requests never buffer their images, and
+    holds the slot until the response (streamed ones included) has been fully sent.
+    """
+
+    def __init__(self, app, controller: AdmissionController, path_prefixes: Tuple[str, ...] = ('/api/crystal/identify',)):
+        self.app = app
+        self.controller = controller
+        self.path_prefixes = path_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if (scope['type'] != 'http' or scope.get('method') != 'POST'
+                or not scope.get('path', '').startswith(self.path_prefixes)):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.controller.acquire()
+        except HTTPException as e:
+            logger.warning(f"Shedding {scope['path']}: {e.detail}")
+            response = JSONResponse({'detail': e.detail}, status_code=e.status_code, headers=e.headers)
+            await response(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(time.perf_counter() - started)
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire AI JSON parsing
+Whole-answer and incremental (streamed) parsing of model JSON output, repair of truncated or
+sloppy answers, response schemas and parse stats
+"""
+
+import json
+import logging
+from typing import Dict, List, Optional, Any, Tuple, Type
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+def _strip_fences(content: str) -> str:
+    content = content.strip()
+    if content.startswith('```'):
+        content = content.split('\n', 1)[1] if '\n' in content else content[3:]
+        if content.rstrip().endswith('```'):
+            content = content.rstrip()[:-3]
+        content = content.strip()
+    return content
+
+
+def parse_ai_json(content: str) -> Dict:
+    """Parse a model's JSON answer, tolerating markdown code fences and surrounding prose.
+
+    Answers that still fail to parse go through repair_ai_json; outcomes are counted in
+    json_repair_stats. Raises the original JSONDecodeError when nothing can be recovered.
+    """
+    content = _strip_fences(content)
+    candidate = content
+    if not candidate.startswith('{'):
+        start, end = candidate.find('{'), candidate.rfind('}')
+        if start != -1 and end > start:
+            candidate = candidate[start:end + 1]
+    try:
+        parsed = json.loads(candidate)
+    except ValueError as error:
+        try:
+            parsed, repairs = repair_ai_json(content)
+        except ValueError:
+            json_repair_stats.record('unrecoverable')
+            raise error
+        json_repair_stats.record('repaired', repairs)
+        logger.info(f"Repaired AI JSON answer ({', '.join(repairs)}): {error}")
+        return parsed
+    json_repair_stats.record('clean')
+    return parsed
+
+
+# ---------------------------------------------------------------------------
+# Repair of truncated / sloppy answers
+# ---------------------------------------------------------------------------
+
+MAX_REPAIR_STARTS = 16  # candidate '{' positions tried when the first object cannot be salvaged
+MAX_REPAIR_CUTS = 64  # cut points tried (newest first) when closing a truncated object
+
+
+def _salvage_object(text: str, start: int) -> Optional[Tuple[Dict, int, List[str]]]:
+    """Parse the object opening at text[start], dropping comments and trailing commas.
+
+    If the text ends before the object closes, it is cut back to the last point where a
+    member or element was complete and the open brackets are closed. Returns
+    (object, end offset, repairs) or None.
+    """
+    out: List[str] = []
+    closers: List[str] = []
+    cuts: List[Tuple[int, str]] = []  # (length of out, closers to append) where the text can be cut
+    repairs: List[str] = []
+    in_string = escape = False
+    index, length = start, len(text)
+    while index < length:
+        char = text[index]
+        if in_string:
+            out.append(char)
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+            index += 1
+            continue
+        if text.startswith('//', index) or text.startswith('/*', index):
+            line_comment = text[index + 1] == '/'
+            end = text.find('\n', index) if line_comment else text.find('*/', index + 2)
+            index = length if end == -1 else end + (0 if line_comment else 2)
+            if 'comments' not in repairs:
+                repairs.append('comments')
+            continue
+        if char in '}]':
+            last = len(out) - 1
+            while last >= 0 and out[last].isspace():
+                last -= 1
+            if last >= 0 and out[last] == ',':
+                del out[last]
+                if 'trailing_commas' not in repairs:
+                    repairs.append('trailing_commas')
+            if not closers or closers[-1] != char:
+                break  # mismatched bracket: treat everything from here on as lost
+            closers.pop()
+            out.append(char)
+            if not closers:
+                try:
+                    value = json.loads(''.join(out))
+                except ValueError:
+                    return None
+                return (value, index + 1, repairs) if isinstance(value, dict) else None
+            cuts.append((len(out), ''.join(reversed(closers))))
+        elif char in '{[':
+            closers.append('}' if char == '{' else ']')
+            out.append(char)
+            cuts.append((len(out), ''.join(reversed(closers))))
+        else:
+            if char == '"':
+                in_string = True
+            elif char == ',':
+                cuts.append((len(out), ''.join(reversed(closers))))
+            out.append(char)
+        index += 1
+
+    # The object never closed: keep the longest prefix that still parses once closed
+    repairs.append('truncated')
+    cuts.append((len(out), ''.join(reversed(closers))))  # the stream may have stopped right after a value
+    for cut, closing in reversed(cuts[-MAX_REPAIR_CUTS:]):
+        try:
+            value = json.loads(''.join(out[:cut]).rstrip().rstrip(',') + closing)
+        except ValueError:
+            continue
+        return (value, index, repairs) if isinstance(value, dict) else None
+    return None
+
+
+def repair_ai_json(content: str) -> Tuple[Dict, List[str]]:
+    """Recover the largest JSON object from a model answer that json.loads rejects.
+
+    Strips comments and trailing commas, closes unterminated structures (a truncated answer
+    keeps every member that was complete) and, failing that, extracts the longest object that
+    does parse. Returns (object, repairs applied); raises ValueError if nothing is recoverable.
+    """
+    text = _strip_fences(content)
+    starts = [index for index, char in enumerate(text) if char == '{'][:MAX_REPAIR_STARTS]
+    best: Optional[Tuple[Dict, int, List[str]]] = None
+    best_span = 0
+    for start in starts:
+        if best is not None and len(text) - start <= best_span:
+            break
+        salvaged = _salvage_object(text, start)
+        if salvaged is None:
+            continue
+        value, end, repairs = salvaged
+        if value and end - start > best_span:
+            best, best_span = (value, end, repairs + ([] if start == starts[0] else ['extracted'])), end - start
+    if best is None:
+        raise ValueError("No JSON object could be recovered from the AI answer")
+    return best[0], best[2]
+
+
+class JSONRepairStats:
+    """How AI answers parsed: clean, repaired (per repair kind) or unrecoverable; plus partial mappings"""
+
+    def __init__(self):
+        self.clean = 0
+        self.repaired = 0
+        self.unrecoverable = 0
+        self.repairs: Dict[str, int] = {}
+        self.partial = 0
+        self.missing_fields: Dict[str, int] = {}
+
+    def record(self, outcome: str, repairs: Optional[List[str]] = None):
+        setattr(self, outcome, getattr(self, outcome) + 1)
+        for repair in repairs or ():
+            self.repairs[repair] = self.repairs.get(repair, 0) + 1
+
+    def record_partial(self, missing: List[str]):
+        """An answer was mapped although these required fields were missing"""
+        self.partial += 1
+        for path in missing:
+            self.missing_fields[path] = self.missing_fields.get(path, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'clean': self.clean,
+            'repaired': self.repaired,
+            'unrecoverable': self.unrecoverable,
+            'partial': self.partial,
+            # A repaired answer is a paid call that did not have to be re-requested
+            'saved_calls': self.repaired,
+            'repairs': dict(self.repairs),
+            'missing_fields': dict(sorted(self.missing_fields.items(), key=lambda item: -item[1])[:20]),
+        }
+
+
+json_repair_stats = JSONRepairStats()
+
+
+def missing_fields(answer: Any, model: Type[BaseModel], prefix: str = '') -> List[str]:
+    """Dotted paths of `model`'s required fields that `answer` lacks (absent, null or not an object)"""
+    missing: List[str] = []
+    for name, field in model.model_fields.items():
+        value = answer.get(name) if isinstance(answer, dict) else None
+        annotation = field.annotation
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            if isinstance(value, dict):
+                missing.extend(missing_fields(value, annotation, f"{prefix}{name}."))
+            elif field.is_required():
+                missing.append(f"{prefix}{name}")
+        elif field.is_required() and value is None:
+            missing.append(f"{prefix}{name}")
+    return missing
+
+
+class IncrementalJSONParser:
+    """Feed a streamed JSON object chunk by chunk; each top-level member is returned as soon as it closes.
+
+    Anything before the first '{' (code fences, prose) is skipped and anything after the
+    matching '}' is ignored. A nested group such as "identification_details": {...} is complete
+    when its closing bracket arrives; scalar members complete at the following ',' or '}'.
+    """
+
+    def __init__(self):
+        self._raw: List[str] = []
+        self._buffer = ''
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = 1
+        self._member_emitted = False
+        self._end = 0
+        self.groups: Dict[str, Any] = {}
+        self.done = False
+        self.malformed_members = 0
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume a chunk of model output; returns the (key, value) members completed by it"""
+        self._raw.append(chunk)
+        if self.done or not chunk:
+            return []
+        if not self._started:
+            brace = chunk.find('{')
+            if brace == -1:
+                return []
+            chunk = chunk[brace:]
+            self._started = True
+
+        completed: List[Tuple[str, Any]] = []
+        start = len(self._buffer)
+        self._buffer += chunk
+        for index in range(start, len(self._buffer)):
+            char = self._buffer[index]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 1:
+                    self._complete_member(index + 1, completed)
+                elif self._depth == 0:
+                    self._complete_member(index, completed)
+                    self._end = index + 1
+                    self.done = True
+                    break
+            elif char == ',' and self._depth == 1:
+                self._complete_member(index, completed)
+                self._member_start = index + 1
+                self._member_emitted = False
+        return completed
+
+    def _complete_member(self, end: int, completed: List[Tuple[str, Any]]):
+        if self._member_emitted:
+            return
+        self._member_emitted = True
+        text = self._buffer[self._member_start:end].strip()
+        if not text:
+            return
+        try:
+            member = json.loads('{' + text + '}')
+        except ValueError:
+            # Left for the whole-answer fallback in result()
+            self.malformed_members += 1
+            return
+        for key, value in member.items():
+            self.groups[key] = value
+            completed.append((key, value))
+
+    @property
+    def text(self) -> str:
+        return ''.join(self._raw)
+
+    def result(self) -> Dict:
+        """The whole object once the stream has ended; falls back to parse_ai_json on the raw text"""
+        if self.done and not self.malformed_members:
+            try:
+                parsed = json.loads(self._buffer[:self._end])
+            except ValueError:
+                pass
+            else:
+                json_repair_stats.record('clean')
+                return parsed
+        return parse_ai_json(self.text)
+
+
+_GEMINI_TYPES = {
+    'string': 'STRING', 'number': 'NUMBER', 'integer': 'INTEGER', 'boolean': 'BOOLEAN', 'array': 'ARRAY', 'object': 'OBJECT',
+}
+
+
+def gemini_response_schema(model: Type[BaseModel]) -> Dict[str, Any]:
+    """Gemini responseSchema (its OpenAPI subset) for a pydantic model.
+
+    $refs are inlined, Optional[X] becomes X with nullable, and properties keep their
+    declaration order (propertyOrdering) so streamed groups arrive in model order.
+    """
+    json_schema = model.model_json_schema()
+    definitions = json_schema.get('$defs', {})
+
+    def resolve(node: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """Unwrap $ref, single-member allOf and Optional[...] anyOf; returns (schema, nullable)"""
+        extra = {key: value for key, value in node.items() if key not in ('$ref', 'allOf', 'anyOf')}
+        if '$ref' in node:
+            target, nullable = resolve(definitions[node['$ref'].rsplit('/', 1)[-1]])
+            return {**target, **extra}, nullable
+        if len(node.get('allOf', ())) == 1:
+            target, nullable = resolve(node['allOf'][0])
+            return {**target, **extra}, nullable
+        if 'anyOf' in node:
+            options = [option for option in node['anyOf'] if option.get('type') != 'null']
+            if len(options) != 1:
+                raise ValueError(f"Gemini response schemas cannot express unions: {node['anyOf']}")
+            target, _ = resolve(options[0])
+            return {**target, **extra}, len(options) < len(node['anyOf'])
+        return node, False
+
+    def convert(node: Dict[str, Any]) -> Dict[str, Any]:
+        node, nullable = resolve(node)
+        schema: Dict[str, Any] = {'type': _GEMINI_TYPES[node['type']]}
+        if node.get('description'):
+            schema['description'] = node['description']
+        if 'enum' in node:
+            schema['enum'] = node['enum']
+        if nullable:
+            schema['nullable'] = True
+        if schema['type'] == 'OBJECT':
+            properties = node.get('properties') or {}
+            if not properties:
+                raise ValueError("Gemini response schemas need declared properties for every object")
+            schema['properties'] = {name: convert(value) for name, value in properties.items()}
+            schema['propertyOrdering'] = list(properties)
+            if node.get('required'):
+                schema['required'] = node['required']
+        elif schema['type'] == 'ARRAY':
+            schema['items'] = convert(node.get('items', {'type': 'string'}))
+        return schema
+
+    return convert(json_schema)
+
+
+class AIOutputStats:
+    """Prompt size and parse-failure counts per output mode ('schema' = JSON mode, 'prompt' = free text)"""
+
+    def __init__(self):
+        self._modes: Dict[str, Dict[str, int]] = {}
+
+    def record(self, mode: str, prompt_chars: int, parsed: bool):
+        counters = self._modes.setdefault(mode, {'requests': 0, 'parse_failures': 0, 'prompt_chars': 0})
+        counters['requests'] += 1
+        counters['prompt_chars'] += prompt_chars
+        if not parsed:
+            counters['parse_failures'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            mode: {
+                'requests': counters['requests'],
+                'parse_failures': counters['parse_failures'],
+                'parse_failure_rate': round(counters['parse_failures'] / counters['requests'], 4),
+                'avg_prompt_chars': round(counters['prompt_chars'] / counters['requests']),
+            }
+            for mode, counters in self._modes.items()
+        }
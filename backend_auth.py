@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire caller identity
+Firebase ID tokens from the Authorization header, verified with the Admin SDK
+"""
+
+import os
+import asyncio
+import logging
+from typing import Dict, Optional, Any
+
+try:
+    from firebase_admin import auth as firebase_auth
+except ImportError:  # No firebase-admin: no token can be verified and every caller is anonymous
+    firebase_auth = None
+
+logger = logging.getLogger(__name__)
+
+
+def bearer_token(request: Any) -> Optional[str]:
+    """The token of an `Authorization: Bearer <token>` header, if any"""
+    scheme, _, token = (request.headers.get('authorization') or '').partition(' ')
+    token = token.strip()
+    return token if scheme.lower() == 'bearer' and token else None
+
+
+class IdTokenVerifier:
+    """Resolves a request's Firebase uid from its ID token.
+
+    Only a verified uid identifies a caller for budgets and billing; uids in request bodies are
+    never trusted. Requests without a valid token (or when no Firebase app is initialized) are
+    anonymous. Verification checks the signature against Google's cached public keys in a
+    worker thread.
+    """
+
+    def __init__(self, check_revoked: bool = False):
+        self.check_revoked = check_revoked
+        self.verified = 0
+        self.missing = 0
+        self.invalid = 0
+        self.unavailable = 0
+
+    @classmethod
+    def from_env(cls) -> 'IdTokenVerifier':
+        """ID_TOKEN_CHECK_REVOKED (1 also rejects revoked tokens, at one Auth lookup per request)"""
+        return cls(check_revoked=os.getenv('ID_TOKEN_CHECK_REVOKED', '0') == '1')
+
+    async def user_id(self, request: Any) -> Optional[str]:
+        """The verified uid of the caller, or None for anonymous callers"""
+        token = bearer_token(request)
+        if token is None:
+            self.missing += 1
+            return None
+        if firebase_auth is None:
+            self.unavailable += 1
+            return None
+        try:
+            claims = await asyncio.to_thread(firebase_auth.verify_id_token, token, check_revoked=self.check_revoked)
+        except (firebase_auth.InvalidIdTokenError, firebase_auth.UserDisabledError) as e:
+            self.invalid += 1
+            logger.info(f"Rejected ID token, treating caller as anonymous: {e}")
+            return None
+        except Exception as e:
+            # No initialized Firebase app, or Google's public keys could not be fetched
+            self.unavailable += 1
+            logger.warning(f"ID token verification unavailable, treating caller as anonymous: {e}")
+            return None
+        self.verified += 1
+        return claims.get('uid') or claims.get('sub')
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'available': firebase_auth is not None,
+            'check_revoked': self.check_revoked,
+            'verified': self.verified,
+            'missing': self.missing,
+            'invalid': self.invalid,
+            'unavailable': self.unavailable,
+        }
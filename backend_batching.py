@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire micro-batching
+Coalesce concurrent single-image identification calls into multi-image upstream requests
+"""
+
+import os
+import time
+import asyncio
+import logging
+import contextvars
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any, Tuple, Hashable, Callable, Awaitable
+
+from backend_deadline import current_deadline
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Waiter:
+    item: Any
+    future: asyncio.Future
+    queued_at: float
+    # The submitter's context, so fallbacks and cost shares land in its usage scope
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+
+
+class MicroBatcher:
+    """Collect calls with the same key for up to `max_wait` seconds or `max_batch` items, then send them together.
+
+    `send_batch(key, items)` returns (results in item order, None where an item got no usable
+    answer; upstream cost dict) and `send_one(key, item)` is the plain single call. Items
+    without a batched answer, and every item of a batch that raised, fall back to `send_one`.
+    A flush with a single waiting item goes straight to `send_one`. `record_cost(cost, count)`
+    runs in each item's context with the batch cost so callers are billed their share. The
+    batched call runs under the latest deadline among its items (none if any item has none),
+    so the earliest caller's budget does not cut the upstream call short for the others.
+    """
+
+    def __init__(self, send_batch: Callable[[Hashable, List[Any]], Awaitable[Tuple[List[Optional[Any]], Dict[str, float]]]],
+                 send_one: Callable[[Hashable, Any], Awaitable[Any]], name: str = 'batch', max_batch: int = 4,
+                 max_wait: float = 0.005, enabled: bool = True,
+                 record_cost: Optional[Callable[[Dict[str, float], int], None]] = None):
+        self.send_batch = send_batch
+        self.send_one = send_one
+        self.name = name
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.enabled = enabled and max_batch > 1
+        self.record_cost = record_cost
+        self._pending: Dict[Hashable, List[_Waiter]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._tasks: set = set()
+        self.submitted = 0
+        self.batches = 0
+        self.batched_items = 0
+        self.singles = 0
+        self.batch_failures = 0
+        self.fallbacks = 0
+        self.sizes: Dict[int, int] = {}
+        self._queue_ms_total = 0.0
+        self.max_queue_ms = 0.0
+        self._batch_ms_total = 0.0
+        self._batch_tokens_total = 0.0
+
+    @classmethod
+    def from_env(cls, prefix: str, send_batch, send_one,
+                 record_cost: Optional[Callable[[Dict[str, float], int], None]] = None) -> 'MicroBatcher':
+        """<PREFIX>_BATCHING (default off) / <PREFIX>_BATCH_MAX_IMAGES / <PREFIX>_BATCH_MAX_WAIT_MS"""
+        return cls(
+            send_batch, send_one,
+            name=prefix.lower(),
+            max_batch=int(os.getenv(f'{prefix}_BATCH_MAX_IMAGES', 4)),
+            max_wait=float(os.getenv(f'{prefix}_BATCH_MAX_WAIT_MS', 5)) / 1000,
+            enabled=os.getenv(f'{prefix}_BATCHING', 'off').lower() in ('1', 'on', 'true', 'yes'),
+            record_cost=record_cost,
+        )
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        """Result for one item, sent alone or as part of a batch of items with the same key"""
+        if not self.enabled:
+            return await self.send_one(key, item)
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(item, loop.create_future(), time.perf_counter())
+        pending = self._pending.setdefault(key, [])
+        pending.append(waiter)
+        self.submitted += 1
+        if len(pending) >= self.max_batch:
+            self._flush(key)
+        elif len(pending) == 1:
+            self._timers[key] = loop.call_later(self.max_wait, self._flush, key)
+        return await waiter.future
+
+    def _flush(self, key: Hashable):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        waiters = [waiter for waiter in self._pending.pop(key, []) if not waiter.future.done()]
+        if not waiters:
+            return
+        now = time.perf_counter()
+        for waiter in waiters:
+            queued_ms = (now - waiter.queued_at) * 1000
+            self._queue_ms_total += queued_ms
+            self.max_queue_ms = max(self.max_queue_ms, queued_ms)
+
+        if len(waiters) == 1:
+            self.singles += 1
+            self._spawn(self._run_one(key, waiters[0]), waiters[0].context)
+        else:
+            latest = max(waiters, key=self._deadline_at)
+            self._spawn(self._run_batch(key, waiters), latest.context)
+
+    @staticmethod
+    def _deadline_at(waiter: _Waiter) -> float:
+        deadline = waiter.context.run(current_deadline)
+        return float('inf') if deadline is None else deadline.expires_at
+
+    def _spawn(self, coroutine: Awaitable[Any], context: contextvars.Context):
+        task = asyncio.create_task(coroutine, context=context.copy())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_one(self, key: Hashable, waiter: _Waiter):
+        try:
+            result = await self.send_one(key, waiter.item)
+        except Exception as e:
+            if not waiter.future.done():
+                waiter.future.set_exception(e)
+            return
+        if not waiter.future.done():
+            waiter.future.set_result(result)
+
+    async def _run_batch(self, key: Hashable, waiters: List[_Waiter]):
+        self.batches += 1
+        self.batched_items += len(waiters)
+        self.sizes[len(waiters)] = self.sizes.get(len(waiters), 0) + 1
+        started = time.perf_counter()
+        try:
+            results, cost = await self.send_batch(key, [waiter.item for waiter in waiters])
+        except Exception as e:
+            self.batch_failures += 1
+            logger.warning(f"{self.name} batch of {len(waiters)} failed, falling back to single calls: {e}")
+            results, cost = [None] * len(waiters), None
+        self._batch_ms_total += (time.perf_counter() - started) * 1000
+        results = list(results)[:len(waiters)] + [None] * (len(waiters) - len(results))
+
+        if cost is not None:
+            self._batch_tokens_total += cost.get('total_tokens') or 0
+            if self.record_cost is not None:
+                for waiter in waiters:
+                    waiter.context.run(self.record_cost, cost, len(waiters))
+
+        for waiter, result in zip(waiters, results):
+            if waiter.future.done():  # the caller cancelled or gave up while the batch ran
+                continue
+            if result is None:
+                self.fallbacks += 1
+                self._spawn(self._run_one(key, waiter), waiter.context)
+            else:
+                waiter.future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        flushed = self.batched_items + self.singles
+        return {
+            'enabled': self.enabled,
+            'max_batch': self.max_batch,
+            'max_wait_ms': round(self.max_wait * 1000, 2),
+            'submitted': self.submitted,
+            'batches': self.batches,
+            'batched_items': self.batched_items,
+            'singles': self.singles,
+            'avg_batch_size': round(self.batched_items / self.batches, 2) if self.batches else 0.0,
+            'batch_sizes': dict(sorted(self.sizes.items())),
+            'batch_failures': self.batch_failures,
+            'fallbacks': self.fallbacks,
+            'avg_queue_ms': round(self._queue_ms_total / flushed, 2) if flushed else 0.0,
+            'max_queue_ms': round(self.max_queue_ms, 2),
+            'avg_batch_ms': round(self._batch_ms_total / self.batches, 2) if self.batches else 0.0,
+            'avg_tokens_per_batched_image': round(self._batch_tokens_total / self.batched_items, 1) if self.batched_items else 0.0,
+        }
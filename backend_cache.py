@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire shared caches
+In-memory LRU/TTL cache, the content-addressed identification result cache and the Parserator result cache
+"""
+
+import os
+import json
+import copy
+import time
+import base64
+import asyncio
+import hashlib
+import logging
+import binascii
+from collections import OrderedDict
+from typing import Dict, Optional, Any, Tuple, Union, Callable, Awaitable
+
+from backend_deadline import clear_deadline
+
+logger = logging.getLogger(__name__)
+
+
+def canonical_json(value: Any) -> str:
+    """Stable JSON form (sorted keys, no whitespace) used for cache keys"""
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def decode_image_data(image_data: str) -> bytes:
+    """Decode a base64 (optionally data-URL prefixed) image, falling back to the raw string bytes"""
+    if image_data.startswith('data:') and ',' in image_data:
+        image_data = image_data.split(',', 1)[1]
+    try:
+        return base64.b64decode(image_data, validate=False)
+    except (binascii.Error, ValueError):
+        return image_data.encode('utf-8')
+
+
+class TTLCache:
+    """Bounded LRU cache with per-entry TTL and a total-size budget.
+
+    Values are stored as canonical JSON strings so every hit returns a fresh copy
+    and entry sizes are known exactly. `on_evict(key)` is called for entries dropped by
+    the LRU or found expired (not for explicit deletes).
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 32 * 1024 * 1024, ttl_seconds: float = 86400.0,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self._entries: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        stored_at, payload = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            if self.on_evict is not None:
+                self.on_evict(key)
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return json.loads(payload)
+
+    def set(self, key: str, value: Any, stored_at: Optional[float] = None):
+        payload = canonical_json(value)
+        if len(payload) > self.max_bytes:
+            logger.debug(f"Cache entry {key[:12]} larger than the cache budget, not stored")
+            return
+
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() if stored_at is None else stored_at, payload)
+        self._bytes += len(payload)
+
+        # Evict least recently used entries until both budgets are met
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(oldest_key)
+
+    def age(self, key: str) -> Optional[float]:
+        """Seconds since the entry was stored (None if absent)"""
+        entry = self._entries.get(key)
+        return time.monotonic() - entry[0] if entry else None
+
+    def delete(self, key: str) -> bool:
+        if key in self._entries:
+            self._remove(key)
+            return True
+        return False
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def _remove(self, key: str):
+        _, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class IdentificationCache:
+    """Content-addressed cache of raw AI identification responses.
+
+    Keyed on the decoded image bytes, the canonical user_context and the model name.
+    Raw AI JSON is cached (not mapped results) so callers still build fresh ids per response.
+    """
+
+    def __init__(self, memory: TTLCache, disk_dir: Optional[str] = None, max_disk_entries: int = 10000):
+        self.memory = memory
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self.disk_hits = 0
+        self.disk_writes = 0
+        self.disk_evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> 'IdentificationCache':
+        """IDENTIFICATION_CACHE_TTL / _MAX_ENTRIES / _MAX_BYTES / _DIR (unset dir disables the disk tier)"""
+        memory = TTLCache(
+            max_entries=int(os.getenv('IDENTIFICATION_CACHE_MAX_ENTRIES', 1000)),
+            max_bytes=int(os.getenv('IDENTIFICATION_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+            ttl_seconds=float(os.getenv('IDENTIFICATION_CACHE_TTL', 86400)),
+        )
+        return cls(
+            memory,
+            disk_dir=os.getenv('IDENTIFICATION_CACHE_DIR') or None,
+            max_disk_entries=int(os.getenv('IDENTIFICATION_CACHE_MAX_DISK_ENTRIES', 10000)),
+        )
+
+    @staticmethod
+    def make_key(image_data: Union[str, bytes], user_context: Optional[Dict], model: str) -> str:
+        """Key from the base64 image string or its already-decoded bytes"""
+        image_bytes = image_data if isinstance(image_data, bytes) else decode_image_data(image_data)
+        return IdentificationCache.make_key_from_digest(hashlib.sha256(image_bytes).hexdigest(), user_context, model)
+
+    @staticmethod
+    def make_key_from_digest(image_digest: str, user_context: Optional[Dict], model: str) -> str:
+        """Key from the hex SHA-256 of the image bytes (computed while streaming an upload)"""
+        digest = hashlib.sha256()
+        digest.update(image_digest.encode('ascii'))
+        digest.update(b'\x00')
+        digest.update(canonical_json(user_context or {}).encode('utf-8'))
+        digest.update(b'\x00')
+        digest.update(model.encode('utf-8'))
+        return digest.hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict]:
+        value = self.memory.get(key)
+        if value is not None or not self.disk_dir:
+            return value
+
+        value = await asyncio.to_thread(self._read_disk, key)
+        if value is not None:
+            self.disk_hits += 1
+            # Promote to memory so repeats skip the disk
+            self.memory.set(key, value)
+        return value
+
+    async def set(self, key: str, value: Dict):
+        self.memory.set(key, value)
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, value)
+
+    def clear(self):
+        self.memory.clear()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[Dict]:
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.memory.ttl_seconds:
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Identification cache disk read failed for {key[:12]}: {e}")
+            return None
+
+    def _write_disk(self, key: str, value: Dict):
+        path = self._disk_path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(canonical_json(value))
+            os.replace(tmp_path, path)
+            self.disk_writes += 1
+            # Listing the directory is O(entries), so only prune periodically
+            if self.disk_writes % 100 == 0:
+                self._prune_disk()
+        except OSError as e:
+            logger.warning(f"Identification cache disk write failed for {key[:12]}: {e}")
+
+    def _prune_disk(self):
+        entries = [name for name in os.listdir(self.disk_dir) if name.endswith('.json')]
+        if len(entries) <= self.max_disk_entries:
+            return
+        paths = sorted((os.path.join(self.disk_dir, name) for name in entries), key=os.path.getmtime)
+        for path in paths[:len(entries) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+                self.disk_evictions += 1
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'memory': self.memory.stats(),
+            'disk': {
+                'enabled': bool(self.disk_dir),
+                'hits': self.disk_hits,
+                'writes': self.disk_writes,
+                'evictions': self.disk_evictions,
+                'max_entries': self.max_disk_entries,
+            },
+        }
+
+
+class ParseratorCache:
+    """Cache of successful Parserator responses with optional stale-while-revalidate.
+
+    Keyed on the output schema, the prompt template version, the instructions and the
+    canonical input payload. Entries younger than `fresh_seconds` are served as-is; older
+    ones (up to the TTL) are served immediately while one background call refreshes them,
+    or refetched inline when stale-while-revalidate is off. Entries can be tagged (per user)
+    and invalidated by tag when that user's collection changes.
+    """
+
+    def __init__(self, memory: TTLCache, fresh_seconds: float = 3600.0, stale_while_revalidate: bool = True,
+                 enabled: bool = True):
+        self.memory = memory
+        self.fresh_seconds = fresh_seconds
+        self.stale_while_revalidate = stale_while_revalidate
+        self.enabled = enabled
+        # tag -> keys and key -> tag, pruned when the memory cache evicts or expires a key
+        self._tags: Dict[str, set] = {}
+        self._key_tags: Dict[str, str] = {}
+        self.memory.on_evict = self._untag
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self.fresh_hits = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls) -> 'ParseratorCache':
+        """PARSERATOR_CACHE_ENABLED / _TTL / _FRESH_SECONDS / _SWR / _MAX_ENTRIES / _MAX_BYTES"""
+        memory = TTLCache(
+            max_entries=int(os.getenv('PARSERATOR_CACHE_MAX_ENTRIES', 2000)),
+            max_bytes=int(os.getenv('PARSERATOR_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+            ttl_seconds=float(os.getenv('PARSERATOR_CACHE_TTL', 86400)),
+        )
+        return cls(
+            memory,
+            fresh_seconds=float(os.getenv('PARSERATOR_CACHE_FRESH_SECONDS', 3600)),
+            stale_while_revalidate=os.getenv('PARSERATOR_CACHE_SWR', 'on').lower() not in ('0', 'off', 'false', 'no'),
+            enabled=os.getenv('PARSERATOR_CACHE_ENABLED', 'on').lower() not in ('0', 'off', 'false', 'no'),
+        )
+
+    @staticmethod
+    def make_key(output_schema: Dict, instructions: Optional[str], input_data: str, template_version: str) -> str:
+        try:
+            payload = canonical_json(json.loads(input_data))
+        except ValueError:
+            payload = input_data
+        digest = hashlib.sha256()
+        for part in (template_version, canonical_json(output_schema), instructions or '', payload):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+
+    async def fetch(self, key: str, call: Callable[[], Awaitable[Dict]], tag: Optional[str] = None) -> Dict:
+        """Serve `key` from the cache or `call()`; only responses with success=True are stored"""
+        if not self.enabled:
+            return await call()
+
+        cached = self.memory.get(key)
+        if cached is not None:
+            age = self.memory.age(key) or 0.0
+            if age <= self.fresh_seconds:
+                self.fresh_hits += 1
+                return cached
+            if self.stale_while_revalidate:
+                self.stale_hits += 1
+                if key not in self._refreshing:
+                    self._refreshing[key] = asyncio.create_task(self._refresh(key, call, tag))
+                return cached
+
+        result = await call()
+        self._store(key, result, tag)
+        return result
+
+    async def _refresh(self, key: str, call: Callable[[], Awaitable[Dict]], tag: Optional[str]):
+        clear_deadline()  # the refresh outlives the request that served the stale entry
+        try:
+            self._store(key, await call(), tag)
+            self.refreshes += 1
+        except Exception as e:
+            self.refresh_failures += 1
+            logger.warning(f"Parserator cache refresh failed for {key[:12]}: {e}")
+        finally:
+            self._refreshing.pop(key, None)
+
+    def _store(self, key: str, result: Dict, tag: Optional[str]):
+        if not isinstance(result, dict) or not result.get('success'):
+            return
+        self._untag(key)
+        self.memory.set(key, result)
+        if tag is not None and key in self.memory:
+            self._tags.setdefault(tag, set()).add(key)
+            self._key_tags[key] = tag
+
+    def _untag(self, key: str):
+        tag = self._key_tags.pop(key, None)
+        keys = self._tags.get(tag) if tag is not None else None
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+    def invalidate_tag(self, tag: str) -> int:
+        """Drop every entry stored under `tag`; returns how many were still cached"""
+        keys = self._tags.pop(tag, ())
+        for key in keys:
+            self._key_tags.pop(key, None)
+        removed = sum(1 for key in keys if self.memory.delete(key))
+        self.invalidations += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'stale_while_revalidate': self.stale_while_revalidate,
+            'fresh_seconds': self.fresh_seconds,
+            'memory': self.memory.stats(),
+            'fresh_hits': self.fresh_hits,
+            'stale_hits': self.stale_hits,
+            'refreshing': len(self._refreshing),
+            'refreshes': self.refreshes,
+            'refresh_failures': self.refresh_failures,
+            'invalidations': self.invalidations,
+            'tagged_users': len(self._tags),
+        }
+
+
+class SingleFlight:
+    """Share one in-flight call among concurrent callers with the same key.
+
+    The first caller (the leader) starts the call as a task; concurrent callers with the
+    same key await that task instead of starting their own. Each waiter awaits through
+    asyncio.shield, so a cancelled waiter (client retry, disconnect) never cancels the
+    call for the others; the call itself is only cancelled once every waiter has gone.
+    """
+
+    def __init__(self, name: str = 'default'):
+        self.name = name
+        self._flights: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.cancelled_waiters = 0
+        self.abandoned = 0
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]],
+                 on_done: Optional[Callable[[], None]] = None) -> Any:
+        """Await the call for `key`, starting it with factory() if none is in flight.
+
+        on_done runs once when a call started by this invocation finishes or is cancelled.
+        Coalesced callers receive a deep copy so they cannot mutate each other's result.
+        """
+        task = self._flights.get(key)
+        leader = task is None
+        if leader:
+            task = asyncio.ensure_future(factory())
+            self._flights[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda done: self._finish(key, done, on_done))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        self._waiters[key] += 1
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done():
+                self.cancelled_waiters += 1
+            raise
+        finally:
+            if self._flights.get(key) is task:
+                self._waiters[key] -= 1
+                if self._waiters[key] == 0 and not task.done():
+                    # Nobody is left to receive the result
+                    self.abandoned += 1
+                    task.cancel()
+        return result if leader else copy.deepcopy(result)
+
+    def _finish(self, key: str, task: asyncio.Task, on_done: Optional[Callable[[], None]]):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+            del self._waiters[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here so abandoned failures are not logged as unhandled
+        if on_done is not None:
+            on_done()
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self.leaders + self.coalesced
+        return {
+            'in_flight': len(self._flights),
+            'upstream_calls': self.leaders,
+            'coalesced': self.coalesced,
+            'coalesce_rate': round(self.coalesced / calls, 4) if calls else 0.0,
+            'cancelled_waiters': self.cancelled_waiters,
+            'abandoned': self.abandoned,
+        }
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire crystal catalog
+Locally held metaphysical, care and pairing reference data for common stones,
+used to fill enrichment fields without an LLM call
+"""
+
+import os
+import re
+import json
+import copy
+import logging
+from typing import Dict, Optional, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Care that suits any stone when the catalog has no entry for it
+GENERIC_CARE = {
+    'cleansing_methods': ['Sound', 'Smoke cleansing', 'Resting on a selenite plate'],
+    'charging_methods': ['Moonlight', 'Intention setting'],
+    'storage_recommendations': 'Store wrapped in soft cloth, away from harder stones',
+    'handling_notes': 'Check before using water or sunlight; some stones dissolve or fade',
+}
+
+CRYSTAL_CATALOG: Dict[str, Dict[str, Any]] = {
+    'amethyst': {
+        'aliases': ['chevron amethyst', 'purple quartz'],
+        'family': 'Quartz', 'hardness': '7', 'crystal_system': 'Trigonal',
+        'primary_chakras': ['Third Eye', 'Crown'], 'zodiac_signs': ['Pisces', 'Virgo', 'Aquarius', 'Capricorn'],
+        'planetary_rulers': ['Jupiter', 'Neptune'], 'elements': ['Air', 'Water'],
+        'healing_properties': ['Calm and restful sleep', 'Intuition and meditation', 'Releasing habits'],
+        'intentions': ['Clarity', 'Peace', 'Spiritual growth'],
+        'care': {'cleansing_methods': ['Running water', 'Moonlight', 'Sound'],
+                 'charging_methods': ['Moonlight', 'Amethyst or quartz cluster'],
+                 'storage_recommendations': 'Keep out of direct sunlight, which fades the purple',
+                 'handling_notes': 'Avoid sudden temperature changes'},
+        'synergy_crystals': ['Clear Quartz', 'Rose Quartz', 'Selenite', 'Lepidolite'],
+    },
+    'clear quartz': {
+        'aliases': ['quartz', 'rock crystal'],
+        'family': 'Quartz', 'hardness': '7', 'crystal_system': 'Trigonal',
+        'primary_chakras': ['Crown'], 'zodiac_signs': ['Aries', 'Leo', 'Capricorn', 'Aquarius'],
+        'planetary_rulers': ['Sun', 'Moon'], 'elements': ['Fire', 'Water', 'Air', 'Earth'],
+        'healing_properties': ['Amplifying intention', 'Focus and clarity', 'Energy balancing'],
+        'intentions': ['Clarity', 'Healing', 'Manifestation'],
+        'care': {'cleansing_methods': ['Running water', 'Sunlight', 'Moonlight', 'Sound'],
+                 'charging_methods': ['Sunlight', 'Moonlight', 'Earth burial'],
+                 'storage_recommendations': 'Store separately; points chip against other stones',
+                 'handling_notes': 'Points can focus sunlight, keep away from flammables'},
+        'synergy_crystals': ['Amethyst', 'Rose Quartz', 'Citrine', 'Smoky Quartz'],
+    },
+    'rose quartz': {
+        'aliases': ['pink quartz'],
+        'family': 'Quartz', 'hardness': '7', 'crystal_system': 'Trigonal',
+        'primary_chakras': ['Heart'], 'zodiac_signs': ['Taurus', 'Libra'],
+        'planetary_rulers': ['Venus'], 'elements': ['Water', 'Earth'],
+        'healing_properties': ['Self-love and compassion', 'Emotional healing', 'Soothing grief'],
+        'intentions': ['Love', 'Harmony', 'Forgiveness'],
+        'care': {'cleansing_methods': ['Running water', 'Moonlight', 'Sound'],
+                 'charging_methods': ['Moonlight', 'Quartz cluster'],
+                 'storage_recommendations': 'Keep out of direct sunlight, which pales the pink',
+                 'handling_notes': 'Durable; wipe with a soft damp cloth'},
+        'synergy_crystals': ['Amethyst', 'Rhodonite', 'Green Aventurine', 'Moonstone'],
+    },
+    'citrine': {
+        'aliases': ['yellow quartz'],
+        'family': 'Quartz', 'hardness': '7', 'crystal_system': 'Trigonal',
+        'primary_chakras': ['Solar Plexus', 'Sacral'], 'zodiac_signs': ['Aries', 'Leo', 'Gemini', 'Libra'],
+        'planetary_rulers': ['Sun'], 'elements': ['Fire'],
+        'healing_properties': ['Confidence and motivation', 'Optimism', 'Creativity'],
+        'intentions': ['Abundance', 'Confidence', 'Joy'],
+        'care': {'cleansing_methods': ['Running water', 'Sound', 'Smoke cleansing'],
+                 'charging_methods': ['Brief morning sunlight', 'Quartz cluster'],
+                 'storage_recommendations': 'Avoid long exposure to sunlight, which fades the colour',
+                 'handling_notes': 'Much sold citrine is heat-treated amethyst'},
+        'synergy_crystals': ['Pyrite', "Tiger's Eye", 'Clear Quartz', 'Carnelian'],
+    },
+    'smoky quartz': {
+        'aliases': ['smokey quartz', 'morion'],
+        'family': 'Quartz', 'hardness': '7', 'crystal_system': 'Trigonal',
+        'primary_chakras': ['Root'], 'zodiac_signs': ['Capricorn', 'Sagittarius', 'Scorpio'],
+        'planetary_rulers': ['Saturn', 'Pluto'], 'elements': ['Earth', 'Air'],
+        'healing_properties': ['Grounding', 'Releasing stress', 'Protection from negativity'],
+        'intentions': ['Grounding', 'Protection', 'Letting go'],
+        'care': {'cleansing_methods': ['Running water', 'Earth burial', 'Sound'],
+                 'charging_methods': ['Earth burial', 'Moonlight'],
+                 'storage_recommendations': 'Keep out of strong sunlight',
+                 'handling_notes': 'Durable; avoid knocks to points'},
+        'synergy_crystals': ['Black Tourmaline', 'Clear Quartz', 'Hematite', 'Citrine'],
+    },
+    'black tourmaline': {
+        'aliases': ['schorl', 'tourmaline'],
+        'family': 'Tourmaline', 'hardness': '7-7.5', 'crystal_system': 'Trigonal',
+        'primary_chakras': ['Root'], 'zodiac_signs': ['Capricorn', 'Scorpio', 'Libra'],
+        'planetary_rulers': ['Saturn', 'Pluto'], 'elements': ['Earth'],
+        'healing_properties': ['Protection', 'Grounding', 'Clearing negative energy'],
+        'intentions': ['Protection', 'Grounding', 'Stability'],
+        'care': {'cleansing_methods': ['Sound', 'Smoke cleansing', 'Earth burial'],
+                 'charging_methods': ['Earth burial', 'Sunlight'],
+                 'storage_recommendations': 'Store apart; striated crystals split along their length',
+                 'handling_notes': 'Brittle along striations; brief rinses only'},
+        'synergy_crystals': ['Smoky Quartz', 'Selenite', 'Hematite', 'Obsidian'],
+    },
+    'selenite': {
+        'aliases': ['satin spar', 'gypsum'],
+        'family': 'Gypsum', 'hardness': '2', 'crystal_system': 'Monoclinic',
+        'primary_chakras': ['Crown', 'Third Eye'], 'zodiac_signs': ['Taurus', 'Cancer'],
+        'planetary_rulers': ['Moon'], 'elements': ['Air', 'Water'],
+        'healing_properties': ['Cleansing other stones', 'Calm and peace', 'Mental clarity'],
+        'intentions': ['Clarity', 'Peace', 'Cleansing'],
+        'care': {'cleansing_methods': ['Sound', 'Smoke cleansing', 'Moonlight'],
+                 'charging_methods': ['Moonlight'],
+                 'storage_recommendations': 'Keep dry and separate; scratches with a fingernail',
+                 'handling_notes': 'Never put in water, it dissolves'},
+        'synergy_crystals': ['Amethyst', 'Black Tourmaline', 'Clear Quartz', 'Moonstone'],
+    },
+    'labradorite': {
+        'aliases': ['spectrolite'],
+        'family': 'Feldspar', 'hardness': '6-6.5', 'crystal_system': 'Triclinic',
+        'primary_chakras': ['Third Eye', 'Throat'], 'zodiac_signs': ['Leo', 'Scorpio', 'Sagittarius'],
+        'planetary_rulers': ['Uranus', 'Moon'], 'elements': ['Water', 'Air'],
+        'healing_properties': ['Intuition', 'Transformation', 'Energetic protection'],
+        'intentions': ['Intuition', 'Transformation', 'Protection'],
+        'care': {'cleansing_methods': ['Sound', 'Smoke cleansing', 'Moonlight'],
+                 'charging_methods': ['Moonlight'],
+                 'storage_recommendations': 'Wrap separately; polished faces scratch easily',
+                 'handling_notes': 'Avoid prolonged soaking and harsh chemicals'},
+        'synergy_crystals': ['Moonstone', 'Amethyst', 'Black Tourmaline', 'Lapis Lazuli'],
+    },
+    "tiger's eye": {
+        'aliases': ['tigers eye', 'tiger eye', 'golden tiger eye'],
+        'family': 'Quartz', 'hardness': '7', 'crystal_system': 'Trigonal',
+        'primary_chakras': ['Solar Plexus', 'Sacral'], 'zodiac_signs': ['Leo', 'Capricorn'],
+        'planetary_rulers': ['Sun', 'Mars'], 'elements': ['Fire', 'Earth'],
+        'healing_properties': ['Courage', 'Focus and willpower', 'Grounded confidence'],
+        'intentions': ['Courage', 'Confidence', 'Protection'],
+        'care': {'cleansing_methods': ['Running water', 'Sunlight', 'Sound'],
+                 'charging_methods': ['Sunlight', 'Earth burial'],
+                 'storage_recommendations': 'Store with other quartz-hard stones',
+                 'handling_notes': 'Durable; polish with a dry cloth'},
+        'synergy_crystals': ['Citrine', 'Carnelian', 'Pyrite', 'Hematite'],
+    },
+    'obsidian': {
+        'aliases': ['black obsidian', 'snowflake obsidian', 'apache tear'],
+        'family': 'Volcanic glass', 'hardness': '5-5.5', 'crystal_system': 'Amorphous',
+        'primary_chakras': ['Root'], 'zodiac_signs': ['Scorpio', 'Sagittarius'],
+        'planetary_rulers': ['Pluto', 'Saturn'], 'elements': ['Fire', 'Earth'],
+        'healing_properties': ['Protection', 'Shadow work', 'Grounding'],
+        'intentions': ['Protection', 'Truth', 'Grounding'],
+        'care': {'cleansing_methods': ['Running water', 'Smoke cleansing', 'Earth burial'],
+                 'charging_methods': ['Moonlight', 'Earth burial'],
+                 'storage_recommendations': 'Store padded; edges chip and can be sharp',
+                 'handling_notes': 'Conchoidal fractures are razor-sharp'},
+        'synergy_crystals': ['Black Tourmaline', 'Hematite', 'Smoky Quartz', 'Selenite'],
+    },
+    'carnelian': {
+        'aliases': ['cornelian'],
+        'family': 'Chalcedony', 'hardness': '6.5-7', 'crystal_system': 'Trigonal',
+        'primary_chakras': ['Sacral', 'Root'], 'zodiac_signs': ['Aries', 'Leo', 'Virgo'],
+        'planetary_rulers': ['Mars', 'Sun'], 'elements': ['Fire'],
+        'healing_properties': ['Creativity', 'Motivation', 'Vitality'],
+        'intentions': ['Creativity', 'Courage', 'Vitality'],
+        'care': {'cleansing_methods': ['Running water', 'Sunlight', 'Sound'],
+                 'charging_methods': ['Sunlight'],
+                 'storage_recommendations': 'Store with other chalcedony and quartz',
+                 'handling_notes': 'Durable'},
+        'synergy_crystals': ['Citrine', "Tiger's Eye", 'Red Jasper', 'Sunstone'],
+    },
+    'lapis lazuli': {
+        'aliases': ['lapis'],
+        'family': 'Lazurite rock', 'hardness': '5-5.5', 'crystal_system': 'Cubic',
+        'primary_chakras': ['Throat', 'Third Eye'], 'zodiac_signs': ['Sagittarius', 'Libra', 'Taurus'],
+        'planetary_rulers': ['Jupiter', 'Venus'], 'elements': ['Water', 'Air'],
+        'healing_properties': ['Self-expression', 'Truth and wisdom', 'Inner vision'],
+        'intentions': ['Wisdom', 'Truth', 'Communication'],
+        'care': {'cleansing_methods': ['Sound', 'Smoke cleansing', 'Moonlight'],
+                 'charging_methods': ['Moonlight'],
+                 'storage_recommendations': 'Wrap separately; softer than quartz',
+                 'handling_notes': 'Avoid water soaks and salt; contains soluble pyrite and calcite'},
+        'synergy_crystals': ['Sodalite', 'Amethyst', 'Clear Quartz', 'Labradorite'],
+    },
+    'moonstone': {
+        'aliases': ['rainbow moonstone', 'adularia'],
+        'family': 'Feldspar', 'hardness': '6-6.5', 'crystal_system': 'Monoclinic',
+        'primary_chakras': ['Sacral', 'Third Eye', 'Crown'], 'zodiac_signs': ['Cancer', 'Libra', 'Scorpio'],
+        'planetary_rulers': ['Moon'], 'elements': ['Water'],
+        'healing_properties': ['Emotional balance', 'Intuition', 'New beginnings'],
+        'intentions': ['Intuition', 'Balance', 'New beginnings'],
+        'care': {'cleansing_methods': ['Moonlight', 'Sound', 'Brief rinse'],
+                 'charging_methods': ['Full moon light'],
+                 'storage_recommendations': 'Wrap separately; cleaves easily',
+                 'handling_notes': 'Avoid knocks and heat'},
+        'synergy_crystals': ['Labradorite', 'Selenite', 'Rose Quartz', 'Amethyst'],
+    },
+    'fluorite': {
+        'aliases': ['rainbow fluorite', 'green fluorite', 'purple fluorite'],
+        'family': 'Halide', 'hardness': '4', 'crystal_system': 'Cubic',
+        'primary_chakras': ['Third Eye', 'Heart'], 'zodiac_signs': ['Pisces', 'Capricorn'],
+        'planetary_rulers': ['Neptune', 'Mercury'], 'elements': ['Air'],
+        'healing_properties': ['Focus and learning', 'Mental order', 'Decision making'],
+        'intentions': ['Focus', 'Clarity', 'Learning'],
+        'care': {'cleansing_methods': ['Sound', 'Smoke cleansing', 'Moonlight'],
+                 'charging_methods': ['Moonlight'],
+                 'storage_recommendations': 'Store padded and out of sunlight; fades and cleaves',
+                 'handling_notes': 'Soft and brittle; avoid water soaks and heat'},
+        'synergy_crystals': ['Amethyst', 'Clear Quartz', 'Lapis Lazuli', 'Sodalite'],
+    },
+    'malachite': {
+        'aliases': [],
+        'family': 'Carbonate', 'hardness': '3.5-4', 'crystal_system': 'Monoclinic',
+        'primary_chakras': ['Heart', 'Solar Plexus'], 'zodiac_signs': ['Scorpio', 'Capricorn'],
+        'planetary_rulers': ['Venus'], 'elements': ['Earth'],
+        'healing_properties': ['Transformation', 'Emotional release', 'Protection'],
+        'intentions': ['Transformation', 'Protection', 'Growth'],
+        'care': {'cleansing_methods': ['Sound', 'Smoke cleansing', 'Resting on a selenite plate'],
+                 'charging_methods': ['Moonlight'],
+                 'storage_recommendations': 'Keep dry and separate',
+                 'handling_notes': 'Never use water or salt; avoid breathing dust from raw pieces'},
+        'synergy_crystals': ['Azurite', 'Chrysocolla', 'Rose Quartz', 'Smoky Quartz'],
+    },
+    'jade': {
+        'aliases': ['nephrite', 'jadeite'],
+        'family': 'Pyroxene / amphibole', 'hardness': '6-7', 'crystal_system': 'Monoclinic',
+        'primary_chakras': ['Heart'], 'zodiac_signs': ['Taurus', 'Libra', 'Pisces'],
+        'planetary_rulers': ['Venus'], 'elements': ['Earth', 'Water'],
+        'healing_properties': ['Harmony', 'Good fortune', 'Emotional balance'],
+        'intentions': ['Abundance', 'Harmony', 'Luck'],
+        'care': {'cleansing_methods': ['Running water', 'Sound', 'Moonlight'],
+                 'charging_methods': ['Moonlight', 'Earth burial'],
+                 'storage_recommendations': 'Store separately to protect the polish',
+                 'handling_notes': 'Tough; wipe with a soft damp cloth'},
+        'synergy_crystals': ['Green Aventurine', 'Rose Quartz', 'Citrine', 'Moss Agate'],
+    },
+    'green aventurine': {
+        'aliases': ['aventurine'],
+        'family': 'Quartz', 'hardness': '6.5-7', 'crystal_system': 'Trigonal',
+        'primary_chakras': ['Heart'], 'zodiac_signs': ['Taurus', 'Virgo', 'Aries'],
+        'planetary_rulers': ['Venus', 'Mercury'], 'elements': ['Earth'],
+        'healing_properties': ['Luck and opportunity', 'Optimism', 'Emotional calm'],
+        'intentions': ['Luck', 'Abundance', 'Growth'],
+        'care': {'cleansing_methods': ['Running water', 'Moonlight', 'Sound'],
+                 'charging_methods': ['Moonlight', 'Earth burial'],
+                 'storage_recommendations': 'Keep out of strong sunlight',
+                 'handling_notes': 'Durable'},
+        'synergy_crystals': ['Citrine', 'Jade', 'Rose Quartz', 'Pyrite'],
+    },
+    'hematite': {
+        'aliases': [],
+        'family': 'Oxide', 'hardness': '5.5-6.5', 'crystal_system': 'Trigonal',
+        'primary_chakras': ['Root'], 'zodiac_signs': ['Aries', 'Aquarius', 'Capricorn'],
+        'planetary_rulers': ['Mars', 'Saturn'], 'elements': ['Earth', 'Fire'],
+        'healing_properties': ['Grounding', 'Focus', 'Absorbing negativity'],
+        'intentions': ['Grounding', 'Protection', 'Focus'],
+        'care': {'cleansing_methods': ['Sound', 'Smoke cleansing', 'Earth burial'],
+                 'charging_methods': ['Earth burial', 'Sunlight'],
+                 'storage_recommendations': 'Keep dry',
+                 'handling_notes': 'Water causes rust spots; dry straight away if wet'},
+        'synergy_crystals': ['Black Tourmaline', 'Smoky Quartz', "Tiger's Eye", 'Obsidian'],
+    },
+    'pyrite': {
+        'aliases': ["fool's gold", 'iron pyrite'],
+        'family': 'Sulfide', 'hardness': '6-6.5', 'crystal_system': 'Cubic',
+        'primary_chakras': ['Solar Plexus'], 'zodiac_signs': ['Leo'],
+        'planetary_rulers': ['Mars', 'Sun'], 'elements': ['Fire', 'Earth'],
+        'healing_properties': ['Willpower', 'Abundance mindset', 'Protection'],
+        'intentions': ['Abundance', 'Confidence', 'Protection'],
+        'care': {'cleansing_methods': ['Sound', 'Smoke cleansing', 'Resting on a selenite plate'],
+                 'charging_methods': ['Sunlight'],
+                 'storage_recommendations': 'Keep dry with a desiccant; humidity causes pyrite decay',
+                 'handling_notes': 'Never use water or salt'},
+        'synergy_crystals': ['Citrine', "Tiger's Eye", 'Green Aventurine', 'Carnelian'],
+    },
+    'turquoise': {
+        'aliases': [],
+        'family': 'Phosphate', 'hardness': '5-6', 'crystal_system': 'Triclinic',
+        'primary_chakras': ['Throat'], 'zodiac_signs': ['Sagittarius', 'Pisces', 'Scorpio'],
+        'planetary_rulers': ['Jupiter', 'Venus'], 'elements': ['Air', 'Earth'],
+        'healing_properties': ['Communication', 'Protection while travelling', 'Wholeness'],
+        'intentions': ['Protection', 'Communication', 'Wisdom'],
+        'care': {'cleansing_methods': ['Sound', 'Smoke cleansing', 'Moonlight'],
+                 'charging_methods': ['Moonlight'],
+                 'storage_recommendations': 'Keep away from sunlight, oils and cosmetics',
+                 'handling_notes': 'Porous; avoid water, which discolours it'},
+        'synergy_crystals': ['Lapis Lazuli', 'Amazonite', 'Malachite', 'Clear Quartz'],
+    },
+    'moldavite': {
+        'aliases': [],
+        'family': 'Tektite', 'hardness': '5.5', 'crystal_system': 'Amorphous',
+        'primary_chakras': ['Heart', 'Third Eye', 'Crown'], 'zodiac_signs': ['Scorpio', 'Sagittarius'],
+        'planetary_rulers': ['Uranus'], 'elements': ['Fire', 'Air'],
+        'healing_properties': ['Rapid transformation', 'Spiritual awakening', 'Heart opening'],
+        'intentions': ['Transformation', 'Spiritual growth'],
+        'care': {'cleansing_methods': ['Sound', 'Smoke cleansing', 'Moonlight'],
+                 'charging_methods': ['Moonlight', 'Sunlight'],
+                 'storage_recommendations': 'Store padded; glass edges chip',
+                 'handling_notes': 'Brittle natural glass'},
+        'synergy_crystals': ['Clear Quartz', 'Amethyst', 'Smoky Quartz', 'Selenite'],
+    },
+    'amazonite': {
+        'aliases': [],
+        'family': 'Feldspar', 'hardness': '6-6.5', 'crystal_system': 'Triclinic',
+        'primary_chakras': ['Throat', 'Heart'], 'zodiac_signs': ['Virgo', 'Aquarius'],
+        'planetary_rulers': ['Uranus', 'Venus'], 'elements': ['Water', 'Earth'],
+        'healing_properties': ['Soothing worry', 'Honest communication', 'Harmony'],
+        'intentions': ['Truth', 'Harmony', 'Communication'],
+        'care': {'cleansing_methods': ['Sound', 'Smoke cleansing', 'Moonlight'],
+                 'charging_methods': ['Moonlight'],
+                 'storage_recommendations': 'Wrap separately; cleaves easily',
+                 'handling_notes': 'Avoid soaking and heat'},
+        'synergy_crystals': ['Turquoise', 'Lapis Lazuli', 'Rose Quartz', 'Moonstone'],
+    },
+    'sodalite': {
+        'aliases': [],
+        'family': 'Feldspathoid', 'hardness': '5.5-6', 'crystal_system': 'Cubic',
+        'primary_chakras': ['Throat', 'Third Eye'], 'zodiac_signs': ['Sagittarius', 'Virgo'],
+        'planetary_rulers': ['Jupiter', 'Mercury'], 'elements': ['Air', 'Water'],
+        'healing_properties': ['Logic and intuition', 'Calm communication', 'Self-trust'],
+        'intentions': ['Truth', 'Clarity', 'Communication'],
+        'care': {'cleansing_methods': ['Sound', 'Smoke cleansing', 'Brief rinse'],
+                 'charging_methods': ['Moonlight'],
+                 'storage_recommendations': 'Store separately from harder stones',
+                 'handling_notes': 'Avoid long soaks'},
+        'synergy_crystals': ['Lapis Lazuli', 'Fluorite', 'Amethyst', 'Clear Quartz'],
+    },
+}
+
+
+def _normalize(name: Any) -> str:
+    text = str(name or '').lower().replace('’', "'")
+    text = re.sub(r'\([^)]*\)', ' ', text)
+    return re.sub(r'\s+', ' ', re.sub(r"[^a-z' ]", ' ', text)).strip()
+
+
+class CrystalCatalog:
+    """Name/alias lookup over catalog entries and AI-free enrichment of an identification"""
+
+    def __init__(self, entries: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.entries = {_normalize(name): entry for name, entry in (entries or CRYSTAL_CATALOG).items()}
+        self._index: Dict[str, str] = {}
+        for key, entry in self.entries.items():
+            self._index[key] = key
+            for alias in entry.get('aliases') or []:
+                self._index.setdefault(_normalize(alias), key)
+        # Longest names first so "smoky quartz" wins over "quartz" inside "Brazilian smoky quartz"
+        self._by_length = sorted(self._index, key=len, reverse=True)
+        self.lookups = 0
+        self.hits = 0
+        self.misses: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls) -> 'CrystalCatalog':
+        """CRYSTAL_CATALOG_PATH: JSON {name: entry} merged over the built-in catalog"""
+        entries = dict(CRYSTAL_CATALOG)
+        path = os.getenv('CRYSTAL_CATALOG_PATH')
+        if path:
+            try:
+                with open(path, encoding='utf-8') as handle:
+                    entries.update(json.load(handle))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Crystal catalog {path} not loaded, using the built-in catalog: {e}")
+        return cls(entries)
+
+    def lookup(self, *names: Optional[str]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(catalog name, entry) for the first name that matches exactly or contains a catalog name"""
+        self.lookups += 1
+        candidates = [_normalize(name) for name in names if name]
+        for candidate in candidates:
+            if candidate in self._index:
+                self.hits += 1
+                return self._index[candidate], self.entries[self._index[candidate]]
+        for candidate in candidates:
+            padded = f' {candidate} '
+            for known in self._by_length:
+                if f' {known} ' in padded:
+                    self.hits += 1
+                    return self._index[known], self.entries[self._index[known]]
+        missed = candidates[0] if candidates else ''
+        self.misses[missed] = self.misses.get(missed, 0) + 1
+        return None
+
+    def enrich(self, result: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[str]]:
+        """Copy of an identification-only AI result with enrichment groups filled from the catalog.
+
+        Returns the enriched result and the catalog name it matched (None when the stone is not
+        catalogued: metaphysical lists stay empty and generic, stone-safe care is used).
+        """
+        enriched = copy.deepcopy(result)
+        identification = enriched.get('identification') or {}
+        match = self.lookup(identification.get('name'), identification.get('variety'))
+        name, entry = match if match is not None else (None, {})
+
+        enriched['metaphysical_properties'] = {
+            field: list(entry.get(field) or [])
+            for field in ('primary_chakras', 'zodiac_signs', 'planetary_rulers', 'elements',
+                          'healing_properties', 'intentions', 'synergy_crystals')
+        }
+        enriched['care_instructions'] = copy.deepcopy(entry.get('care') or GENERIC_CARE)
+        physical = {field: entry[field] for field in ('hardness', 'crystal_system') if entry.get(field)}
+        # Anything the model did say about the specimen itself wins over catalog defaults
+        physical.update({key: value for key, value in (enriched.get('physical_properties') or {}).items() if value})
+        enriched['physical_properties'] = physical
+        return enriched, name
+
+    def stats(self) -> Dict[str, Any]:
+        top_misses = sorted(self.misses.items(), key=lambda item: item[1], reverse=True)[:20]
+        return {
+            'entries': len(self.entries),
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            'top_misses': dict(top_misses),
+        }
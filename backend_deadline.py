@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire request deadlines
+End-to-end request budgets carried into every upstream call, with cancellation on client disconnect
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Dict, Optional, Any, Tuple, Awaitable, Callable, TypeVar
+
+import httpx
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Seconds per path prefix (longest prefix wins); the mobile client gives up on identification after ~20s
+DEFAULT_DEADLINE_BUDGETS = {
+    '/api/crystal/identify': 20.0,
+    '/api/crystal/identify-enhanced': 25.0,
+    '/api/crystal/identify-batch': 60.0,
+    '/api/crystals': 10.0,
+}
+
+
+class DeadlineExceeded(HTTPException):
+    """The request's end-to-end budget ran out during `stage`"""
+
+    def __init__(self, stage: str):
+        super().__init__(status_code=504, detail=f"Request deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """Remaining budget of one request; `with deadline:` makes it the current deadline"""
+
+    def __init__(self, policy: 'DeadlinePolicy', budget: float, source: str, clock: Callable[[], float] = time.monotonic):
+        self.policy = policy
+        self.budget = budget
+        self.source = source
+        self._clock = clock
+        self.expires_at = clock() + budget
+        self._token = None
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - self._clock())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, default: Optional[float]) -> float:
+        """`default` capped at the remaining budget"""
+        return self.remaining() if default is None else min(default, self.remaining())
+
+    def __enter__(self) -> 'Deadline':
+        self._token = _current_deadline.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current_deadline.reset(self._token)
+        self._token = None
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar('request_deadline', default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Deadline of the request being handled, if any (tasks started inside a request inherit it)"""
+    return _current_deadline.get()
+
+
+def clear_deadline():
+    """Detach the current task from its request's deadline (background work that outlives the request)"""
+    _current_deadline.set(None)
+
+
+def deadline_timeout(default: Optional[float]) -> Optional[float]:
+    """A blocking call's timeout, capped at the remaining budget; unchanged outside a request"""
+    deadline = _current_deadline.get()
+    return default if deadline is None else deadline.timeout(default)
+
+
+def http_timeout(default: httpx.Timeout) -> httpx.Timeout:
+    """Per-request httpx timeout with every phase capped at the remaining budget"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return default
+    remaining = deadline.remaining()
+
+    def cap(value: Optional[float]) -> float:
+        return remaining if value is None else min(value, remaining)
+    return httpx.Timeout(connect=cap(default.connect), read=cap(default.read), write=cap(default.write),
+                         pool=cap(default.pool))
+
+
+def retry_fits(delay: float) -> bool:
+    """Whether a retry after `delay` seconds can still finish within the deadline"""
+    deadline = _current_deadline.get()
+    return deadline is None or delay < deadline.remaining()
+
+
+async def within_deadline(awaitable: Awaitable[T], stage: str) -> T:
+    """Await a stage with only the remaining budget; raises DeadlineExceeded (504) when it runs out"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return await awaitable
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        deadline.policy.record_exceeded(stage)
+        raise DeadlineExceeded(stage)
+    try:
+        return await asyncio.wait_for(awaitable, remaining)
+    except asyncio.TimeoutError:
+        if not deadline.expired():
+            raise  # the stage's own timeout, not ours
+        deadline.policy.record_exceeded(stage)
+        raise DeadlineExceeded(stage)
+
+
+def stage_allowed(stage: str, min_seconds: Optional[float] = None) -> bool:
+    """Whether an optional stage is worth starting with the budget left; records a skip when it is not"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return True
+    needed = deadline.policy.optional_min_seconds if min_seconds is None else min_seconds
+    if deadline.remaining() >= needed:
+        return True
+    deadline.policy.record_skipped(stage)
+    return False
+
+
+class DeadlinePolicy:
+    """Request budgets per path prefix, overridable by the client.
+
+    `header` carries the client's remaining budget in milliseconds (capped at `max_budget`);
+    without it the longest matching prefix in `budgets`, else `default_budget`, applies.
+    Optional stages need at least `optional_min_seconds` left to start.
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, float]] = None, default_budget: float = 30.0,
+                 max_budget: float = 120.0, header: str = 'X-Request-Deadline-Ms', optional_min_seconds: float = 3.0):
+        self.budgets = dict(DEFAULT_DEADLINE_BUDGETS if budgets is None else budgets)
+        self._prefixes = sorted(self.budgets, key=len, reverse=True)
+        self.default_budget = default_budget
+        self.max_budget = max_budget
+        self.header = header.lower()
+        self.optional_min_seconds = optional_min_seconds
+        self.started: Dict[str, int] = {'header': 0, 'default': 0}
+        self.exceeded: Dict[str, int] = {}
+        self.skipped: Dict[str, int] = {}
+        self.disconnected = 0
+        self.expired_on_arrival = 0
+
+    @classmethod
+    def from_env(cls) -> 'DeadlinePolicy':
+        """REQUEST_DEADLINE_BUDGETS (JSON {path prefix: seconds}) / REQUEST_DEADLINE_SECONDS /
+        REQUEST_DEADLINE_MAX_SECONDS / REQUEST_DEADLINE_HEADER / REQUEST_DEADLINE_OPTIONAL_MIN_SECONDS"""
+        budgets = dict(DEFAULT_DEADLINE_BUDGETS)
+        if os.getenv('REQUEST_DEADLINE_BUDGETS'):
+            budgets.update(json.loads(os.environ['REQUEST_DEADLINE_BUDGETS']))
+        return cls(
+            budgets=budgets,
+            default_budget=float(os.getenv('REQUEST_DEADLINE_SECONDS', 30.0)),
+            max_budget=float(os.getenv('REQUEST_DEADLINE_MAX_SECONDS', 120.0)),
+            header=os.getenv('REQUEST_DEADLINE_HEADER', 'X-Request-Deadline-Ms'),
+            optional_min_seconds=float(os.getenv('REQUEST_DEADLINE_OPTIONAL_MIN_SECONDS', 3.0)),
+        )
+
+    def budget_for(self, path: str, header_value: Optional[str] = None) -> Tuple[float, str]:
+        """(seconds, 'header' or 'default') for a request"""
+        if header_value:
+            try:
+                return min(float(header_value) / 1000, self.max_budget), 'header'
+            except ValueError:
+                logger.warning(f"Ignoring malformed {self.header} header: {header_value!r}")
+        for prefix in self._prefixes:
+            if path.startswith(prefix):
+                return self.budgets[prefix], 'default'
+        return self.default_budget, 'default'
+
+    def start(self, path: str, header_value: Optional[str] = None) -> Deadline:
+        budget, source = self.budget_for(path, header_value)
+        self.started[source] += 1
+        return Deadline(self, budget, source)
+
+    def record_exceeded(self, stage: str):
+        self.exceeded[stage] = self.exceeded.get(stage, 0) + 1
+        logger.warning(f"Request deadline exceeded during {stage}")
+
+    def record_skipped(self, stage: str):
+        self.skipped[stage] = self.skipped.get(stage, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'header': self.header,
+            'budgets': dict(self.budgets),
+            'default_budget_seconds': self.default_budget,
+            'optional_min_seconds': self.optional_min_seconds,
+            'started': dict(self.started),
+            'exceeded': dict(self.exceeded),
+            'exceeded_total': sum(self.exceeded.values()),
+            'skipped_stages': dict(self.skipped),
+            'expired_on_arrival': self.expired_on_arrival,
+            'cancelled_disconnected': self.disconnected,
+        }
+
+
+class DeadlineMiddleware:
+    """ASGI middleware giving every request under `path_prefixes` a deadline.
+
+    Once the request body has been read, the connection is watched for a client disconnect;
+    the handler (and every stage it is awaiting) is then cancelled instead of finishing work
+    nobody will receive. A client budget that has already run out gets a 504 straight away.
+    """
+
+    def __init__(self, app, policy: DeadlinePolicy, path_prefixes: Tuple[str, ...] = ('/api/',)):
+        self.app = app
+        self.policy = policy
+        self.path_prefixes = path_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not scope.get('path', '').startswith(self.path_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        header_value = None
+        for name, value in scope.get('headers') or []:
+            if name.decode('latin-1').lower() == self.policy.header:
+                header_value = value.decode('latin-1')
+        deadline = self.policy.start(scope['path'], header_value)
+        if deadline.expired():
+            self.policy.expired_on_arrival += 1
+            response = JSONResponse({'detail': 'Request deadline already exceeded'}, status_code=504)
+            await response(scope, receive, send)
+            return
+
+        body_read = asyncio.Event()
+        disconnected = asyncio.Event()
+
+        async def app_receive():
+            if body_read.is_set():
+                # The watcher owns the connection now; later reads only ever see the disconnect
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                body_read.set()
+            elif not message.get('more_body', False):
+                body_read.set()
+            return message
+
+        with deadline:
+            handler = asyncio.ensure_future(self.app(scope, app_receive, send))
+        watcher = asyncio.ensure_future(self._watch(receive, body_read, disconnected, handler))
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not (disconnected.is_set() and handler.cancelled()):
+                raise
+            logger.info(f"Client disconnected, cancelled {scope['path']}")
+        finally:
+            watcher.cancel()
+
+    async def _watch(self, receive, body_read: asyncio.Event, disconnected: asyncio.Event, handler: asyncio.Future):
+        await body_read.wait()
+        while not disconnected.is_set():
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+        if not handler.done():
+            self.policy.disconnected += 1
+            handler.cancel()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire prompt digests
+Compact, size-bounded summaries of a user's collection and profile for Parserator prompts
+"""
+
+import os
+import json
+import hashlib
+import logging
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Any, Tuple, Iterable
+
+from backend_cache import canonical_json
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (~4 characters per token for JSON/English)"""
+    return (len(text) + 3) // 4
+
+
+def _as_list(value: Any) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [part.strip() for part in value.split(',') if part.strip()]
+    if isinstance(value, (list, tuple)):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [str(value)]
+
+
+def _as_int(value: Any) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _first(entry: Dict[str, Any], *paths: str) -> Any:
+    """First non-empty value among dotted paths (collection entries come in several shapes)"""
+    for path in paths:
+        value: Any = entry
+        for part in path.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        if value not in (None, '', []):
+            return value
+    return None
+
+
+def summarize_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """The few fields of one collection entry that the digest aggregates"""
+    return {
+        'name': str(_first(entry, 'crystal_name', 'name', 'stone_name', 'crystal_core.identification.stone_type') or 'Unknown'),
+        'family': _first(entry, 'crystal_family', 'family', 'crystal_type', 'crystal_core.identification.crystal_family'),
+        'chakras': _as_list(_first(entry, 'chakras', 'primary_chakras', 'chakra', 'crystal_core.energy_mapping.primary_chakra'))
+        + _as_list(_first(entry, 'crystal_core.energy_mapping.secondary_chakras')),
+        'elements': _as_list(_first(entry, 'elements', 'element', 'automatic_enrichment.elements')),
+        'intentions': _as_list(_first(entry, 'intentions', 'intention', 'user_integration.intentions')),
+        'usage_count': _as_int(_first(entry, 'usage_count', 'user_integration.usage_count')),
+        'last_used': str(_first(entry, 'last_used', 'user_integration.last_used') or ''),
+    }
+
+
+class CollectionStats:
+    """Incrementally maintained aggregates over one user's collection, keyed by entry hash"""
+
+    def __init__(self):
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self.chakras: Counter = Counter()
+        self.elements: Counter = Counter()
+        self.families: Counter = Counter()
+        self.intentions: Counter = Counter()
+        self.raw_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _apply(self, summary: Dict[str, Any], sign: int):
+        for counter, values in (
+            (self.chakras, summary['chakras']),
+            (self.elements, summary['elements']),
+            (self.families, [summary['family']] if summary['family'] else []),
+            (self.intentions, [intention.lower() for intention in summary['intentions']]),
+        ):
+            for value in values:
+                counter[str(value)] += sign
+                if counter[str(value)] <= 0:
+                    del counter[str(value)]
+
+    def sync(self, collection: Iterable[Dict[str, Any]]) -> Tuple[int, int]:
+        """Bring the aggregates in line with `collection`; returns (added, removed) entry counts"""
+        current: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        for entry in collection:
+            serialized = canonical_json(entry)
+            key = hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+            copy_number = 1
+            while f"{key}:{copy_number}" in current:  # identical entries still count separately
+                copy_number += 1
+            current[f"{key}:{copy_number}"] = (serialized, entry)
+
+        removed = [key for key in self._entries if key not in current]
+        for key in removed:
+            summary = self._entries.pop(key)
+            self._apply(summary, -1)
+            self.raw_bytes -= summary['raw_bytes']
+        added = 0
+        for key, (serialized, entry) in current.items():
+            if key not in self._entries:
+                summary = summarize_entry(entry)
+                summary['raw_bytes'] = len(serialized) + 2
+                self._entries[key] = summary
+                self._apply(summary, +1)
+                self.raw_bytes += summary['raw_bytes']
+                added += 1
+        return added, len(removed)
+
+    def render(self, top_k: int) -> Dict[str, Any]:
+        entries = list(self._entries.values())
+        most_used = sorted(entries, key=lambda summary: summary['usage_count'], reverse=True)
+        recent = sorted((summary for summary in entries if summary['last_used']),
+                        key=lambda summary: summary['last_used'], reverse=True)
+        return {
+            'total_stones': len(entries),
+            'distinct_stones': len({summary['name'].lower() for summary in entries}),
+            'by_chakra': dict(self.chakras.most_common(top_k)),
+            'by_element': dict(self.elements.most_common(top_k)),
+            'by_family': dict(self.families.most_common(top_k)),
+            'top_intentions': [intention for intention, _ in self.intentions.most_common(top_k)],
+            'most_used': _unique_names(most_used, top_k),
+            'recently_used': _unique_names(recent, top_k),
+        }
+
+
+def _unique_names(summaries: List[Dict[str, Any]], limit: int) -> List[str]:
+    names: List[str] = []
+    for summary in summaries:
+        if summary['name'] not in names:
+            names.append(summary['name'])
+            if len(names) >= limit:
+                break
+    return names
+
+
+def profile_digest(profile: Optional[Dict[str, Any]], max_list_items: int = 5, max_chars: int = 120) -> Dict[str, Any]:
+    """Scalar profile fields (and short scalar lists), truncated; nested structures are dropped"""
+    digest: Dict[str, Any] = {}
+    for key, value in (profile or {}).items():
+        if isinstance(value, str):
+            digest[key] = value[:max_chars]
+        elif isinstance(value, (int, float, bool)) or value is None:
+            digest[key] = value
+        elif isinstance(value, list) and all(isinstance(item, (str, int, float, bool)) for item in value):
+            digest[key] = [item[:max_chars] if isinstance(item, str) else item for item in value[:max_list_items]]
+    return digest
+
+
+def profile_user_id(profile: Optional[Dict[str, Any]]) -> Optional[str]:
+    for key in ('user_id', 'uid', 'id'):
+        if profile and profile.get(key):
+            return str(profile[key])
+    return None
+
+
+class CollectionDigestCache:
+    """Per-user collection digests, updated incrementally and shrunk to a token budget.
+
+    A user's aggregates are kept between calls and only changed entries are re-summarized.
+    The rendered digest drops list lengths (top_k) until it fits `token_budget`.
+    """
+
+    def __init__(self, token_budget: int = 400, top_k: int = 8, max_users: int = 1000):
+        self.token_budget = token_budget
+        self.top_k = top_k
+        self.max_users = max_users
+        self._users: 'OrderedDict[str, CollectionStats]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.entries_added = 0
+        self.entries_removed = 0
+        self.prompts = 0
+        self.prompt_bytes_before = 0
+        self.prompt_bytes_after = 0
+        self.last_prompt_bytes: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def from_env(cls) -> 'CollectionDigestCache':
+        """PARSERATOR_DIGEST_TOKEN_BUDGET / PARSERATOR_DIGEST_TOP_K / COLLECTION_DIGEST_MAX_USERS"""
+        return cls(
+            token_budget=int(os.getenv('PARSERATOR_DIGEST_TOKEN_BUDGET', 400)),
+            top_k=int(os.getenv('PARSERATOR_DIGEST_TOP_K', 8)),
+            max_users=int(os.getenv('COLLECTION_DIGEST_MAX_USERS', 1000)),
+        )
+
+    def _stats_for(self, user_id: Optional[str]) -> CollectionStats:
+        if user_id is None:
+            return CollectionStats()
+        stats = self._users.get(user_id)
+        if stats is None:
+            self.misses += 1
+            stats = self._users[user_id] = CollectionStats()
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self.hits += 1
+            self._users.move_to_end(user_id)
+        return stats
+
+    def invalidate(self, user_id: str):
+        self._users.pop(user_id, None)
+
+    def digest(self, collection: Optional[List[Dict[str, Any]]], user_id: Optional[str] = None) -> Tuple[Dict[str, Any], int]:
+        """(digest, raw collection JSON bytes) for a collection; the digest fits the token budget"""
+        stats = self._stats_for(user_id)
+        added, removed = stats.sync(collection or [])
+        self.entries_added += added
+        self.entries_removed += removed
+
+        top_k = self.top_k
+        rendered = stats.render(top_k)
+        while top_k > 1 and estimate_tokens(json.dumps(rendered)) > self.token_budget:
+            top_k -= 1
+            rendered = stats.render(top_k)
+        return rendered, stats.raw_bytes + 2
+
+    def record_prompt(self, after_bytes: int, raw_bytes: int, digest_bytes: int, copies: int = 2):
+        """Record one Parserator prompt's size, and what it would have been with the raw JSON embedded `copies` times"""
+        before_bytes = after_bytes - digest_bytes + copies * raw_bytes
+        self.prompts += 1
+        self.prompt_bytes_before += before_bytes
+        self.prompt_bytes_after += after_bytes
+        self.last_prompt_bytes = {'before': before_bytes, 'after': after_bytes}
+        logger.info(f"Parserator prompt {before_bytes} -> {after_bytes} bytes")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'users': len(self._users),
+            'max_users': self.max_users,
+            'token_budget': self.token_budget,
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries_added': self.entries_added,
+            'entries_removed': self.entries_removed,
+            'prompts': self.prompts,
+            'avg_prompt_bytes_before': round(self.prompt_bytes_before / self.prompts) if self.prompts else 0,
+            'avg_prompt_bytes_after': round(self.prompt_bytes_after / self.prompts) if self.prompts else 0,
+            'last_prompt_bytes': self.last_prompt_bytes,
+        }
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire shared upstream HTTP clients
+One pooled, keep-alive httpx.AsyncClient per upstream (Gemini, Parserator, ...)
+"""
+
+import os
+import logging
+import importlib.util
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 needs the optional 'h2' package (installed with httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+
+@dataclass
+class UpstreamConfig:
+    """Connection pool and timeout settings for a single upstream"""
+    name: str
+    base_url: str
+    timeout: float = 30.0
+    connect_timeout: float = 5.0
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = True
+
+    @classmethod
+    def from_env(cls, name: str, base_url: str, **defaults) -> 'UpstreamConfig':
+        """Build a config, letting <NAME>_HTTP_* environment variables override the defaults.
+
+        e.g. GEMINI_HTTP_TIMEOUT=20, GEMINI_HTTP_MAX_CONNECTIONS=50, PARSERATOR_HTTP_HTTP2=false
+        """
+        config = cls(name=name, base_url=base_url, **defaults)
+        prefix = f"{name.upper()}_HTTP_"
+        for field_name, cast in (
+            ('timeout', float),
+            ('connect_timeout', float),
+            ('max_connections', int),
+            ('max_keepalive_connections', int),
+            ('keepalive_expiry', float),
+        ):
+            raw = os.getenv(prefix + field_name.upper())
+            if raw:
+                setattr(config, field_name, cast(raw))
+        raw_http2 = os.getenv(prefix + 'HTTP2')
+        if raw_http2:
+            config.http2 = raw_http2.lower() in ('1', 'true', 'yes', 'on')
+        return config
+
+
+class UpstreamClients:
+    """Registry of pooled clients, opened in the FastAPI lifespan hook and closed on shutdown"""
+
+    def __init__(self, configs: List[UpstreamConfig]):
+        self.configs: Dict[str, UpstreamConfig] = {config.name: config for config in configs}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _build_client(self, config: UpstreamConfig) -> httpx.AsyncClient:
+        http2 = config.http2 and HTTP2_AVAILABLE
+        if config.http2 and not HTTP2_AVAILABLE:
+            logger.warning(f"HTTP/2 requested for {config.name} but 'h2' is not installed, using HTTP/1.1")
+
+        return httpx.AsyncClient(
+            base_url=config.base_url,
+            http2=http2,
+            timeout=httpx.Timeout(config.timeout, connect=config.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+        )
+
+    async def start(self):
+        """Open one client per configured upstream"""
+        for name, config in self.configs.items():
+            if name not in self._clients:
+                self._clients[name] = self._build_client(config)
+        logger.info(f"Upstream HTTP pools opened: {', '.join(self._clients)}")
+
+    async def close(self):
+        """Close every client, dropping their pooled connections"""
+        clients, self._clients = self._clients, {}
+        for name, client in clients.items():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing {name} HTTP pool: {e}")
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """Return the pooled client for an upstream.
+
+        Created on first use if the lifespan hook has not run (scripts, tests without a TestClient context).
+        """
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            if name not in self.configs:
+                raise KeyError(f"Unknown upstream: {name}")
+            client = self._build_client(self.configs[name])
+            self._clients[name] = client
+        return client
+
+    def stats(self) -> Dict[str, Any]:
+        """Open, idle, active and waiting connection counts per upstream, for pool sizing"""
+        result = {}
+        for name, config in self.configs.items():
+            pool_stats = {
+                'started': name in self._clients,
+                'http2': config.http2 and HTTP2_AVAILABLE,
+                'max_connections': config.max_connections,
+                'max_keepalive_connections': config.max_keepalive_connections,
+                'timeout': config.timeout,
+                'open_connections': 0,
+                'idle_connections': 0,
+                'active_connections': 0,
+                'waiting_requests': 0,
+            }
+            client = self._clients.get(name)
+            pool = _connection_pool(client) if client is not None else None
+            if pool is not None:
+                connections = list(getattr(pool, '_connections', []))
+                requests = list(getattr(pool, '_requests', []))
+                idle = sum(1 for connection in connections if connection.is_idle())
+                pool_stats['open_connections'] = len(connections)
+                pool_stats['idle_connections'] = idle
+                pool_stats['active_connections'] = len(connections) - idle
+                pool_stats['waiting_requests'] = sum(1 for request in requests if request.is_queued())
+            result[name] = pool_stats
+        return result
+
+
+def _connection_pool(client: httpx.AsyncClient) -> Optional[Any]:
+    """Reach the httpcore pool behind an httpx client (None for custom transports)"""
+    transport = getattr(client, '_transport', None)
+    return getattr(transport, '_pool', None)
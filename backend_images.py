@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire image normalization
+Decode, auto-orient, strip EXIF, downscale and re-encode uploads in a process pool before they go upstream
+"""
+
+import io
+import os
+import math
+import time
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Tuple, Union
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:  # Without Pillow images are forwarded untouched (mime type still sniffed)
+    Image = None
+    ImageOps = None
+    PIL_AVAILABLE = False
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+    HEIF_AVAILABLE = True
+except ImportError:
+    HEIF_AVAILABLE = False
+
+from backend_phash import compute_dhash, dhash_from_image
+
+logger = logging.getLogger(__name__)
+
+# Formats Gemini accepts inline; anything else is re-encoded to JPEG
+UPSTREAM_MIME_TYPES = {'image/jpeg', 'image/png', 'image/webp', 'image/heic', 'image/heif'}
+
+
+def sniff_mime_type(data: bytes) -> str:
+    """Detect the image type from magic bytes (defaults to image/jpeg, the previous hard-coded type)"""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if data[4:8] == b'ftyp':
+        brand = data[8:12]
+        if brand in (b'heic', b'heix', b'hevc', b'hevx'):
+            return 'image/heic'
+        if brand in (b'mif1', b'msf1', b'heif'):
+            return 'image/heif'
+    return 'image/jpeg'
+
+
+def _read_head(source: Union[bytes, str], size: int = 32) -> bytes:
+    if isinstance(source, bytes):
+        return source[:size]
+    with open(source, 'rb') as f:
+        return f.read(size)
+
+
+@dataclass
+class NormalizedImage:
+    data: Optional[bytes]  # None when an on-disk original is forwarded untouched
+    mime_type: str
+    original_bytes: int
+    normalized_bytes: int
+    original_size: Optional[Tuple[int, int]] = None
+    normalized_size: Optional[Tuple[int, int]] = None
+    phash: Optional[int] = None
+    entropy: Optional[float] = None  # grey-level Shannon entropy in bits (0-8), a cheap detail/clutter measure
+    reencoded: bool = False
+    elapsed_ms: float = 0.0
+
+
+def histogram_entropy(histogram: List[int]) -> float:
+    """Shannon entropy (bits) of a pixel-value histogram"""
+    total = sum(histogram)
+    if not total:
+        return 0.0
+    return -sum(count / total * math.log2(count / total) for count in histogram if count)
+
+
+def normalize_image(source: Union[bytes, str], max_edge: int, quality: int) -> NormalizedImage:
+    """Normalize one image; runs inside a worker process so it must stay a picklable top-level function.
+
+    `source` is the encoded bytes or the path of a spooled upload, so large uploads reach
+    the worker without being pickled across the process boundary.
+    """
+    started = time.perf_counter()
+    mime_type = sniff_mime_type(_read_head(source))
+    original_bytes = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+    result = NormalizedImage(data=source if isinstance(source, bytes) else None, mime_type=mime_type,
+                             original_bytes=original_bytes, normalized_bytes=original_bytes)
+    if not PIL_AVAILABLE:
+        result.elapsed_ms = (time.perf_counter() - started) * 1000
+        return result
+
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+            result.original_size = image.size
+            has_exif = bool(image.info.get('exif')) or bool(image.getexif())
+            # JPEG draft mode lets libjpeg decode at 1/2, 1/4 or 1/8 scale when we will downscale anyway
+            if max(image.size) > max_edge * 2:
+                image.draft('RGB', (max_edge, max_edge))
+            oriented = ImageOps.exif_transpose(image)
+            needs_resize = max(oriented.size) > max_edge
+            if needs_resize:
+                oriented.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            result.normalized_size = oriented.size
+            result.phash = dhash_from_image(oriented)
+            result.entropy = round(histogram_entropy(oriented.convert('L').histogram()), 3)
+
+            # Saving without exif= drops EXIF (GPS, device data); keep the colour profile
+            icc_profile = image.info.get('icc_profile')
+            keep_alpha = oriented.mode in ('RGBA', 'LA', 'PA') or 'transparency' in oriented.info
+            out = io.BytesIO()
+            if keep_alpha:
+                oriented.save(out, format='PNG', optimize=True, icc_profile=icc_profile)
+                out_mime = 'image/png'
+            else:
+                oriented.convert('RGB').save(out, format='JPEG', quality=quality, optimize=True, icc_profile=icc_profile)
+                out_mime = 'image/jpeg'
+            encoded = out.getvalue()
+
+        # Keep the original when re-encoding gains nothing and there is no metadata to strip
+        untouched_ok = mime_type in UPSTREAM_MIME_TYPES and not needs_resize and not has_exif
+        if not (untouched_ok and len(encoded) >= original_bytes):
+            result.data = encoded
+            result.mime_type = out_mime
+            result.normalized_bytes = len(encoded)
+            result.reencoded = True
+    except Exception as e:
+        logger.warning(f"Image normalization failed, forwarding original ({mime_type}): {e}")
+
+    result.elapsed_ms = (time.perf_counter() - started) * 1000
+    return result
+
+
+class ImageNormalizer:
+    """Runs normalize_image in a process pool so decoding never blocks the event loop"""
+
+    def __init__(self, max_edge: int = 1536, quality: int = 85, workers: int = 2, enabled: bool = True):
+        self.max_edge = max_edge
+        self.quality = quality
+        self.workers = workers
+        self.enabled = enabled
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.images = 0
+        self.reencoded = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.total_ms = 0.0
+
+    @classmethod
+    def from_env(cls) -> 'ImageNormalizer':
+        """IMAGE_MAX_EDGE / IMAGE_JPEG_QUALITY / IMAGE_WORKERS / IMAGE_NORMALIZATION (off disables)"""
+        return cls(
+            max_edge=int(os.getenv('IMAGE_MAX_EDGE', 1536)),
+            quality=int(os.getenv('IMAGE_JPEG_QUALITY', 85)),
+            workers=int(os.getenv('IMAGE_WORKERS', 2)),
+            enabled=os.getenv('IMAGE_NORMALIZATION', 'on').lower() not in ('0', 'off', 'false', 'no'),
+        )
+
+    def start(self):
+        if self._pool is None and self.enabled and PIL_AVAILABLE:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    def close(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def normalize(self, source: Union[bytes, str]) -> NormalizedImage:
+        """Normalize encoded image bytes or a spooled upload path"""
+        if not self.enabled:
+            original_bytes = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+            return NormalizedImage(data=source if isinstance(source, bytes) else None,
+                                   mime_type=sniff_mime_type(_read_head(source)),
+                                   original_bytes=original_bytes, normalized_bytes=original_bytes,
+                                   phash=await asyncio.to_thread(compute_dhash, source))
+
+        loop = asyncio.get_running_loop()
+        if self._pool is None:
+            # Lifespan not run (scripts/tests): a worker thread still keeps the loop free
+            result = await asyncio.to_thread(normalize_image, source, self.max_edge, self.quality)
+        else:
+            result = await loop.run_in_executor(self._pool, normalize_image, source, self.max_edge, self.quality)
+
+        self.images += 1
+        self.reencoded += int(result.reencoded)
+        self.bytes_in += result.original_bytes
+        self.bytes_out += result.normalized_bytes
+        self.total_ms += result.elapsed_ms
+        logger.info(
+            f"Image normalized: {result.original_bytes} -> {result.normalized_bytes} bytes "
+            f"({result.mime_type}, {result.original_size} -> {result.normalized_size}) in {result.elapsed_ms:.1f}ms"
+        )
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled and PIL_AVAILABLE,
+            'heif_supported': HEIF_AVAILABLE,
+            'max_edge': self.max_edge,
+            'quality': self.quality,
+            'workers': self.workers,
+            'images': self.images,
+            'reencoded': self.reencoded,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_saved_ratio': round(1 - self.bytes_out / self.bytes_in, 4) if self.bytes_in else 0.0,
+            'avg_ms': round(self.total_ms / self.images, 2) if self.images else 0.0,
+        }
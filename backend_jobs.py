@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire background jobs
+Bounded worker pool for slow enhancement work, polled by job id
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+import contextvars
+from collections import deque
+from datetime import datetime
+from typing import Dict, Optional, Any, Callable, Awaitable
+
+from fastapi import HTTPException
+
+from backend_cache import TTLCache
+from backend_deadline import clear_deadline
+
+logger = logging.getLogger(__name__)
+
+
+class JobManager:
+    """Run submitted coroutines on at most `max_workers` concurrent workers.
+
+    Jobs wait FIFO (at most `max_pending`, beyond which submit raises 503) and each run is
+    bounded by `job_timeout`. Finished jobs are kept as JSON snapshots in a TTLCache for
+    `result_ttl` seconds so clients can poll for them.
+    """
+
+    def __init__(self, name: str = 'jobs', max_workers: int = 4, max_pending: int = 100, job_timeout: float = 60.0,
+                 result_ttl: float = 3600.0, max_results: int = 1000, max_result_bytes: int = 16 * 1024 * 1024):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.job_timeout = job_timeout
+        self._active: Dict[str, Dict[str, Any]] = {}
+        self._factories: Dict[str, Callable[[], Awaitable[Any]]] = {}
+        self._submitted_at: Dict[str, float] = {}
+        self._contexts: Dict[str, contextvars.Context] = {}
+        self._queue: deque = deque()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._results = TTLCache(max_entries=max_results, max_bytes=max_result_bytes, ttl_seconds=result_ttl)
+        self._closed = False
+        self.running = 0
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.rejected = 0
+        self._queue_ms_total = 0.0
+        self._run_ms_total = 0.0
+
+    @classmethod
+    def from_env(cls, prefix: str = 'ENHANCEMENT_JOBS') -> 'JobManager':
+        """<PREFIX>_WORKERS / _MAX_PENDING / _TIMEOUT / _RESULT_TTL / _MAX_RESULTS"""
+        return cls(
+            name=prefix.lower(),
+            max_workers=int(os.getenv(f'{prefix}_WORKERS', 4)),
+            max_pending=int(os.getenv(f'{prefix}_MAX_PENDING', 100)),
+            job_timeout=float(os.getenv(f'{prefix}_TIMEOUT', 60.0)),
+            result_ttl=float(os.getenv(f'{prefix}_RESULT_TTL', 3600.0)),
+            max_results=int(os.getenv(f'{prefix}_MAX_RESULTS', 1000)),
+        )
+
+    def submit(self, kind: str, factory: Callable[[], Awaitable[Any]]) -> str:
+        """Queue `factory()` to run in the background; returns the job id. Raises 503 when the queue is full."""
+        if self._closed:
+            raise HTTPException(status_code=503, detail="Job queue is shutting down")
+        if len(self._queue) >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Job queue full", headers={'Retry-After': '5'})
+
+        job_id = uuid.uuid4().hex
+        self._active[job_id] = {
+            'job_id': job_id,
+            'kind': kind,
+            'status': 'queued',
+            'created_at': datetime.utcnow().isoformat(),
+            'finished_at': None,
+            'queued_ms': None,
+            'run_ms': None,
+            'result': None,
+            'error': None,
+        }
+        self._factories[job_id] = factory
+        self._submitted_at[job_id] = time.perf_counter()
+        # Run in the submitter's context (e.g. its usage scope), not whichever job freed the worker
+        self._contexts[job_id] = contextvars.copy_context()
+        self._queue.append(job_id)
+        self.submitted += 1
+        self._pump()
+        return job_id
+
+    def _pump(self):
+        while not self._closed and self.running < self.max_workers and self._queue:
+            job_id = self._queue.popleft()
+            self.running += 1
+            self._tasks[job_id] = asyncio.create_task(self._run(job_id), context=self._contexts.pop(job_id))
+
+    async def _run(self, job_id: str):
+        record = self._active[job_id]
+        factory = self._factories.pop(job_id)
+        clear_deadline()  # bounded by job_timeout, not by the request that has already been answered
+        started = time.perf_counter()
+        record['status'] = 'running'
+        record['queued_ms'] = round((started - self._submitted_at.pop(job_id)) * 1000, 2)
+        try:
+            record['result'] = await asyncio.wait_for(factory(), self.job_timeout)
+            record['status'] = 'succeeded'
+            self.succeeded += 1
+        except asyncio.TimeoutError:
+            record['status'] = 'failed'
+            record['error'] = f"Timed out after {self.job_timeout:g}s"
+            self.failed += 1
+            self.timed_out += 1
+        except asyncio.CancelledError:
+            record['status'] = 'cancelled'
+            raise
+        except Exception as e:
+            logger.warning(f"{record['kind']} job {job_id} failed: {e}")
+            record['status'] = 'failed'
+            record['error'] = e.detail if isinstance(e, HTTPException) else str(e)
+            self.failed += 1
+        finally:
+            record['run_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            record['finished_at'] = datetime.utcnow().isoformat()
+            self._queue_ms_total += record['queued_ms']
+            self._run_ms_total += record['run_ms']
+            self._results.set(job_id, record)
+            del self._active[job_id]
+            self._tasks.pop(job_id, None)
+            self.running -= 1
+            self._pump()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Current snapshot of a job, or None if unknown or expired"""
+        record = self._active.get(job_id)
+        if record is not None:
+            return dict(record)
+        return self._results.get(job_id)
+
+    async def close(self):
+        """Cancel queued and running jobs (app shutdown); the manager can be used again afterwards"""
+        self._closed = True
+        for job_id in self._queue:
+            self._active.pop(job_id, None)
+            self._factories.pop(job_id, None)
+            self._submitted_at.pop(job_id, None)
+            self._contexts.pop(job_id, None)
+        self._queue.clear()
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._closed = False
+
+    def stats(self) -> Dict[str, Any]:
+        finished = self.succeeded + self.failed
+        return {
+            'max_workers': self.max_workers,
+            'max_pending': self.max_pending,
+            'job_timeout_seconds': self.job_timeout,
+            'running': self.running,
+            'queued': len(self._queue),
+            'submitted': self.submitted,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'timed_out': self.timed_out,
+            'rejected': self.rejected,
+            'avg_queue_ms': round(self._queue_ms_total / finished, 2) if finished else 0.0,
+            'avg_run_ms': round(self._run_ms_total / finished, 2) if finished else 0.0,
+            'results': self._results.stats(),
+        }
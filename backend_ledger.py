@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire usage ledger
+Per-user LLM token, image and latency accounting with per-tier daily budgets
+"""
+
+import os
+import json
+import asyncio
+import logging
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Tuple, Callable
+
+from fastapi import HTTPException
+
+from backend_uploads import SpooledImage
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('calls', 'input_tokens', 'output_tokens', 'tokens', 'image_bytes', 'latency_ms')
+
+ANONYMOUS_USER = 'anonymous'
+
+# 0 means unlimited; free users are rejected once over budget, paying tiers fall back to cheaper paths.
+# Anonymous callers are budgeted per client address with the free limits.
+DEFAULT_TIER_BUDGETS = {
+    'anonymous': {'daily_tokens': 100_000, 'daily_calls': 30, 'over_budget': 'reject'},
+    'free': {'daily_tokens': 100_000, 'daily_calls': 30, 'over_budget': 'reject'},
+    'premium': {'daily_tokens': 1_000_000, 'daily_calls': 300, 'over_budget': 'degrade'},
+    'pro': {'daily_tokens': 5_000_000, 'daily_calls': 1500, 'over_budget': 'degrade'},
+    'founders': {'daily_tokens': 0, 'daily_calls': 0},
+}
+
+
+@dataclass
+class TierBudget:
+    daily_tokens: int = 0  # 0 = unlimited
+    daily_calls: int = 0  # upstream LLM calls; 0 = unlimited
+    over_budget: str = 'degrade'  # 'degrade' or 'reject'
+
+    def exceeded(self, usage: Dict[str, float], calls: int = 1) -> bool:
+        """Whether `calls` more upstream calls would go over today's budget"""
+        return ((self.daily_tokens > 0 and usage['tokens'] >= self.daily_tokens)
+                or (self.daily_calls > 0 and usage['calls'] + calls > self.daily_calls))
+
+
+def image_size(image: Any) -> int:
+    """Decoded byte size of an image as sent upstream (bytes, base64 string or spooled upload)"""
+    if isinstance(image, SpooledImage):
+        return image.size
+    if isinstance(image, (bytes, bytearray)):
+        return len(image)
+    if isinstance(image, str):
+        if image.startswith('data:') and ',' in image:
+            image = image.split(',', 1)[1]
+        return len(image) * 3 // 4 - image.count('=', -2)
+    return 0
+
+
+def client_address(request: Any) -> Optional[str]:
+    """The caller's address as seen by the ASGI server (run uvicorn with --proxy-headers behind a trusted proxy)"""
+    client = getattr(request, 'client', None)
+    return client.host if client else None
+
+
+def _today() -> str:
+    return datetime.utcnow().strftime('%Y-%m-%d')
+
+
+def _seconds_until_midnight() -> int:
+    now = datetime.utcnow()
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(1, int((midnight - now).total_seconds()))
+
+
+class UsageScope:
+    """Who the upstream calls made inside `with scope:` are billed to.
+
+    The scope holds the calls reserved at admission; each billed call uses one up and the rest
+    are given back when the scope exits (or, with `track`, once the tasks it started are done).
+    """
+
+    def __init__(self, ledger: 'UsageLedger', user_id: str, tier: str, endpoint: str, degraded: bool,
+                 reserved: int = 0):
+        self.ledger = ledger
+        self.user_id = user_id
+        self.tier = tier
+        self.endpoint = endpoint
+        self.degraded = degraded
+        self.reserved = reserved
+        self._token = None
+        self._open_tasks = 0
+
+    def __enter__(self) -> 'UsageScope':
+        self._token = _current_scope.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current_scope.reset(self._token)
+        self._token = None
+        if not self._open_tasks:
+            self.settle()
+
+    def track(self, task: asyncio.Future) -> asyncio.Future:
+        """Keep the reservation until `task`, started inside the scope but outliving it, is done"""
+        self._open_tasks += 1
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task: asyncio.Future):
+        self._open_tasks -= 1
+        if not self._open_tasks and self._token is None:
+            self.settle()
+
+    def consume(self):
+        """One reserved call was billed"""
+        if self.reserved > 0:
+            self.reserved -= 1
+            self.ledger.release(self.user_id, 1)
+
+    def settle(self):
+        """Give back the reserved calls nothing was billed for (safe to call more than once)"""
+        if self.reserved > 0:
+            self.ledger.release(self.user_id, self.reserved)
+            self.reserved = 0
+
+
+_current_scope: ContextVar[Optional[UsageScope]] = ContextVar('usage_scope', default=None)
+
+
+def current_usage_scope() -> Optional[UsageScope]:
+    """The usage scope of the request being handled, if any (its tier drives model routing)"""
+    return _current_scope.get()
+
+
+def record_upstream_usage(provider: str, input_tokens: int = 0, output_tokens: int = 0, image_bytes: int = 0,
+                          latency_ms: float = 0.0, total_tokens: Optional[int] = None):
+    """Bill one upstream call to the current usage scope (no-op outside `UsageLedger.admit`).
+
+    Tasks started inside a scope (hedges, single-flight calls, background jobs) inherit it.
+    """
+    scope = _current_scope.get()
+    if scope is not None:
+        scope.ledger.record(scope.user_id, scope.endpoint, provider, input_tokens=input_tokens,
+                            output_tokens=output_tokens, image_bytes=image_bytes, latency_ms=latency_ms,
+                            total_tokens=total_tokens)
+        scope.consume()
+
+
+def jsonl_sink(path: str) -> Callable[[List[Dict[str, Any]]], None]:
+    """Append flushed ledger rows to a JSON-lines file"""
+    def write(rows: List[Dict[str, Any]]):
+        with open(path, 'a', encoding='utf-8') as handle:
+            for row in rows:
+                handle.write(json.dumps(row) + '\n')
+    return write
+
+
+class UsageLedger:
+    """In-memory per-(day, user, endpoint, provider) usage counters, flushed periodically to a sink.
+
+    `admit()` bills a verified user id (see backend_auth; anything else is anonymous, counted
+    per client address) and checks today's usage against the tier budget before any upstream
+    call: over-budget requests either run degraded (callers skip expensive steps) or are rejected
+    with 429 until UTC midnight. Neither the id nor the tier is ever taken from the request body;
+    callers pass a tier looked up server-side, else `default_tier` applies.
+    Flushed rows are deltas since the previous flush; failed flushes are retried on the next one.
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, TierBudget]] = None, default_tier: str = 'free',
+                 sink: Optional[Callable[[List[Dict[str, Any]]], None]] = None, flush_interval: float = 60.0):
+        self.budgets = budgets if budgets is not None else {
+            tier: TierBudget(**budget) for tier, budget in DEFAULT_TIER_BUDGETS.items()
+        }
+        self.default_tier = default_tier
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self._day = _today()
+        self._today: Dict[Tuple[str, str, str], Dict[str, float]] = {}
+        self._daily: Dict[str, Dict[str, float]] = {}
+        self._reserved: Dict[str, int] = {}  # calls admitted but not yet billed, per user
+        self._pending: Dict[Tuple[str, str, str, str], Dict[str, float]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self.admitted = 0
+        self.degraded = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.flush_failures = 0
+        self.rows_flushed = 0
+
+    @classmethod
+    def from_env(cls, sink: Optional[Callable[[List[Dict[str, Any]]], None]] = None) -> 'UsageLedger':
+        """USAGE_TIER_BUDGETS (JSON {tier: {daily_tokens, daily_calls, over_budget}}) / USAGE_DEFAULT_TIER /
+        USAGE_LEDGER_FLUSH_SECONDS / USAGE_LEDGER_PATH (JSON-lines sink when no other sink is given)"""
+        budgets = dict(DEFAULT_TIER_BUDGETS)
+        if os.getenv('USAGE_TIER_BUDGETS'):
+            budgets.update(json.loads(os.environ['USAGE_TIER_BUDGETS']))
+        if sink is None and os.getenv('USAGE_LEDGER_PATH'):
+            sink = jsonl_sink(os.environ['USAGE_LEDGER_PATH'])
+        return cls(
+            budgets={tier: TierBudget(**budget) for tier, budget in budgets.items()},
+            default_tier=os.getenv('USAGE_DEFAULT_TIER', 'free'),
+            sink=sink,
+            flush_interval=float(os.getenv('USAGE_LEDGER_FLUSH_SECONDS', 60)),
+        )
+
+    def _roll_day(self):
+        today = _today()
+        if today != self._day:
+            self._day = today
+            self._today.clear()
+            self._daily.clear()
+
+    def resolve(self, user_id: Optional[str], client_ip: Optional[str] = None,
+                tier: Optional[str] = None) -> Tuple[str, str]:
+        """(ledger user id, tier) for a caller.
+
+        `user_id` must be verified (None for anonymous callers) and `tier` must come from a
+        server-side lookup. Missing or unknown tiers get the default tier.
+        """
+        if user_id is None:
+            return (f'{ANONYMOUS_USER}:{client_ip}' if client_ip else ANONYMOUS_USER), ANONYMOUS_USER
+        tier = str(tier or self.default_tier).lower()
+        return user_id, tier if tier in self.budgets else self.default_tier
+
+    def usage(self, user_id: str) -> Dict[str, Any]:
+        """Today's totals for a user, overall and per endpoint/provider"""
+        self._roll_day()
+        return {
+            'day': self._day,
+            'user_id': user_id,
+            'totals': dict(self._daily.get(user_id) or dict.fromkeys(COUNTERS, 0)),
+            'breakdown': [
+                {'endpoint': endpoint, 'provider': provider, **counters}
+                for (user, endpoint, provider), counters in self._today.items() if user == user_id
+            ],
+        }
+
+    def check(self, user_id: str, tier: str, calls: int = 1) -> bool:
+        """True if the request's `calls` upstream calls must run degraded; raises 429 for tiers that reject over budget.
+
+        Calls reserved by requests still in flight count as used.
+        """
+        self._roll_day()
+        budget = self.budgets.get(tier) or self.budgets.get(self.default_tier) or TierBudget()
+        usage = dict(self._daily.get(user_id) or dict.fromkeys(COUNTERS, 0))
+        usage['calls'] += self._reserved.get(user_id, 0)
+        if not budget.exceeded(usage, calls):
+            self.admitted += 1
+            return False
+        if budget.over_budget == 'reject':
+            self.rejected += 1
+            detail = f"Daily AI budget for the {tier} tier exhausted"
+            if calls > 1 and budget.daily_calls > 0:
+                detail += f" ({calls} calls requested, {max(0, budget.daily_calls - int(usage['calls']))} left today)"
+            raise HTTPException(
+                status_code=429,
+                detail=detail,
+                headers={'Retry-After': str(_seconds_until_midnight())},
+            )
+        self.degraded += 1
+        return True
+
+    def admit(self, user_id: Optional[str], endpoint: str, client_ip: Optional[str] = None,
+              tier: Optional[str] = None, calls: int = 1) -> UsageScope:
+        """Budget-check a request making up to `calls` upstream calls (429 when rejected); upstream
+        calls made inside `with` the returned scope are billed to the (verified) caller"""
+        user_id, tier = self.resolve(user_id, client_ip, tier)
+        degraded = self.check(user_id, tier, calls)
+        # Reserved until billed or settled, so concurrent requests cannot all pass the same check
+        self._reserved[user_id] = self._reserved.get(user_id, 0) + calls
+        return UsageScope(self, user_id, tier, endpoint, degraded, reserved=calls)
+
+    def release(self, user_id: str, calls: int):
+        """Drop `calls` of a user's reservation (billed, or not needed after all)"""
+        remaining = self._reserved.get(user_id, 0) - calls
+        if remaining > 0:
+            self._reserved[user_id] = remaining
+        else:
+            self._reserved.pop(user_id, None)
+
+    def record(self, user_id: str, endpoint: str, provider: str, input_tokens: int = 0, output_tokens: int = 0,
+               image_bytes: int = 0, latency_ms: float = 0.0, total_tokens: Optional[int] = None):
+        self._roll_day()
+        delta = {
+            'calls': 1,
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'tokens': total_tokens if total_tokens is not None else input_tokens + output_tokens,
+            'image_bytes': image_bytes,
+            'latency_ms': round(latency_ms, 2),
+        }
+        for counters in (
+            self._today.setdefault((user_id, endpoint, provider), dict.fromkeys(COUNTERS, 0)),
+            self._daily.setdefault(user_id, dict.fromkeys(COUNTERS, 0)),
+            self._pending.setdefault((self._day, user_id, endpoint, provider), dict.fromkeys(COUNTERS, 0)),
+        ):
+            for name, value in delta.items():
+                counters[name] += value
+
+    async def flush(self) -> int:
+        """Hand pending deltas to the sink (in a worker thread); returns the number of rows written"""
+        if not self._pending or self.sink is None:
+            return 0
+        pending, self._pending = self._pending, {}
+        rows = [
+            {'day': day, 'user_id': user_id, 'endpoint': endpoint, 'provider': provider, **counters}
+            for (day, user_id, endpoint, provider), counters in pending.items()
+        ]
+        try:
+            await asyncio.to_thread(self.sink, rows)
+        except Exception as e:
+            self.flush_failures += 1
+            logger.warning(f"Usage ledger flush failed ({len(rows)} rows kept for retry): {e}")
+            for key, counters in pending.items():
+                merged = self._pending.setdefault(key, dict.fromkeys(COUNTERS, 0))
+                for name, value in counters.items():
+                    merged[name] += value
+            return 0
+        self.flushes += 1
+        self.rows_flushed += len(rows)
+        return len(rows)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self.sink is not None and self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        """Stop the periodic flush and write whatever is still pending"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        self._roll_day()
+        return {
+            'day': self._day,
+            'users_today': len(self._daily),
+            'tokens_today': sum(usage['tokens'] for usage in self._daily.values()),
+            'calls_today': sum(usage['calls'] for usage in self._daily.values()),
+            'reserved_calls': sum(self._reserved.values()),
+            'admitted': self.admitted,
+            'degraded': self.degraded,
+            'rejected': self.rejected,
+            'pending_rows': len(self._pending),
+            'flushes': self.flushes,
+            'flush_failures': self.flush_failures,
+            'rows_flushed': self.rows_flushed,
+            'sink': self.sink is not None,
+            'budgets': {tier: vars(budget) for tier, budget in self.budgets.items()},
+        }
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire perceptual-hash index
+Near-duplicate image lookup so re-photographed stones can reuse a previous identification
+"""
+
+import io
+import os
+import time
+import random
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any, Tuple, Union
+
+try:
+    import numpy as np
+    from PIL import Image
+    PHASH_AVAILABLE = True
+except ImportError:  # Pillow/NumPy missing: near-duplicate lookup is disabled, exact caching still works
+    np = None
+    Image = None
+    PHASH_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+
+
+def dhash_from_image(image: 'Image.Image', hash_size: int = 8) -> Optional[int]:
+    """64-bit difference hash: compare horizontally adjacent pixels of a 9x8 greyscale thumbnail"""
+    if not PHASH_AVAILABLE:
+        return None
+    thumbnail = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def compute_dhash(image_bytes: Union[bytes, str], hash_size: int = 8) -> Optional[int]:
+    """dHash of encoded image bytes (or the path of an image file).
+
+    Returns None if the bytes cannot be decoded as an image (or Pillow is unavailable).
+    """
+    if not PHASH_AVAILABLE:
+        return None
+    try:
+        with Image.open(io.BytesIO(image_bytes) if isinstance(image_bytes, bytes) else image_bytes) as image:
+            # JPEG draft mode decodes at a reduced scale, which is far cheaper for 12 MP photos
+            image.draft('L', (hash_size * 8, hash_size * 8))
+            return dhash_from_image(image, hash_size)
+    except Exception as e:
+        logger.debug(f"Perceptual hash skipped, image not decodable: {e}")
+        return None
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+@dataclass
+class _Entry:
+    phash: int
+    namespace: str
+    value: Any
+    stored_at: float = field(default_factory=time.monotonic)
+
+
+class PerceptualHashIndex:
+    """Bounded multi-index hashing (MIH) index over 64-bit perceptual hashes.
+
+    The hash is split into max_distance + 1 chunks; by the pigeonhole principle any hash
+    within max_distance bits of a query shares at least one chunk exactly, so lookups only
+    compare against entries in the query's chunk buckets instead of scanning everything.
+    """
+
+    def __init__(self, max_distance: int = 6, max_entries: int = 50000, ttl_seconds: float = 86400.0,
+                 verify_sample_rate: float = 0.05):
+        if not 0 <= max_distance < HASH_BITS:
+            raise ValueError("max_distance must be between 0 and 63")
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.verify_sample_rate = verify_sample_rate
+
+        chunk_count = max_distance + 1
+        base, extra = divmod(HASH_BITS, chunk_count)
+        self._chunks: List[Tuple[int, int]] = []  # (shift, mask) per chunk
+        shift = 0
+        for i in range(chunk_count):
+            width = base + (1 if i < extra else 0)
+            self._chunks.append((shift, (1 << width) - 1))
+            shift += width
+
+        self._entries: 'OrderedDict[int, _Entry]' = OrderedDict()
+        self._tables: List[Dict[int, set]] = [{} for _ in self._chunks]
+        self._next_id = 0
+
+        self.lookups = 0
+        self.matches = 0
+        self.evictions = 0
+        self.verified_matches = 0
+        self.false_matches = 0
+        self.lookup_seconds = 0.0
+
+    @classmethod
+    def from_env(cls) -> 'PerceptualHashIndex':
+        """PHASH_MAX_DISTANCE / PHASH_MAX_ENTRIES / PHASH_TTL / PHASH_VERIFY_SAMPLE_RATE"""
+        return cls(
+            max_distance=int(os.getenv('PHASH_MAX_DISTANCE', 6)),
+            max_entries=int(os.getenv('PHASH_MAX_ENTRIES', 50000)),
+            ttl_seconds=float(os.getenv('PHASH_TTL', 86400)),
+            verify_sample_rate=float(os.getenv('PHASH_VERIFY_SAMPLE_RATE', 0.05)),
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _chunk_keys(self, phash: int) -> List[int]:
+        return [(phash >> shift) & mask for shift, mask in self._chunks]
+
+    def add(self, phash: int, value: Any, namespace: str = ''):
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = _Entry(phash, namespace, value)
+        for table, key in zip(self._tables, self._chunk_keys(phash)):
+            table.setdefault(key, set()).add(entry_id)
+
+        while len(self._entries) > self.max_entries:
+            oldest_id = next(iter(self._entries))
+            self._remove(oldest_id)
+            self.evictions += 1
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        for table, key in zip(self._tables, self._chunk_keys(entry.phash)):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del table[key]
+
+    def search(self, phash: int, namespace: str = '', max_distance: Optional[int] = None) -> Optional[Tuple[Any, int]]:
+        """Closest stored value within max_distance bits (and the same namespace), with its distance"""
+        started = time.perf_counter()
+        limit = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        now = time.monotonic()
+
+        best: Optional[Tuple[int, int]] = None  # (distance, entry_id)
+        seen = set()
+        expired = []
+        for table, key in zip(self._tables, self._chunk_keys(phash)):
+            for entry_id in table.get(key, ()):
+                if entry_id in seen:
+                    continue
+                seen.add(entry_id)
+                entry = self._entries[entry_id]
+                if now - entry.stored_at > self.ttl_seconds:
+                    expired.append(entry_id)
+                    continue
+                if entry.namespace != namespace:
+                    continue
+                distance = hamming_distance(phash, entry.phash)
+                if distance <= limit and (best is None or distance < best[0]):
+                    best = (distance, entry_id)
+
+        for entry_id in expired:
+            self._remove(entry_id)
+
+        self.lookups += 1
+        self.lookup_seconds += time.perf_counter() - started
+        if best is None:
+            return None
+
+        self.matches += 1
+        self._entries.move_to_end(best[1])
+        return self._entries[best[1]].value, best[0]
+
+    def should_verify(self) -> bool:
+        """Sample a fraction of matches for upstream re-identification to measure false matches"""
+        return random.random() < self.verify_sample_rate
+
+    def record_verification(self, matched: bool):
+        self.verified_matches += 1
+        if not matched:
+            self.false_matches += 1
+
+    def clear(self):
+        self._entries.clear()
+        for table in self._tables:
+            table.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': PHASH_AVAILABLE,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'max_distance': self.max_distance,
+            'lookups': self.lookups,
+            'matches': self.matches,
+            'match_rate': round(self.matches / self.lookups, 4) if self.lookups else 0.0,
+            'evictions': self.evictions,
+            'verified_matches': self.verified_matches,
+            'false_matches': self.false_matches,
+            'false_match_rate': round(self.false_matches / self.verified_matches, 4) if self.verified_matches else 0.0,
+            'avg_lookup_ms': round(self.lookup_seconds * 1000 / self.lookups, 4) if self.lookups else 0.0,
+        }
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire vision providers
+Gemini (single and multi-image) and OpenAI-compatible adapters plus a latency-aware, hedging provider pool
+"""
+
+import os
+import json
+import time
+import base64
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, List, Optional, Any, Tuple, Union, Callable, Awaitable
+
+import httpx
+from fastapi import HTTPException
+
+from backend_ai_json import IncrementalJSONParser, parse_ai_json
+from backend_deadline import http_timeout
+from backend_ledger import image_size, record_upstream_usage
+from backend_resilience import UpstreamResilience
+from backend_uploads import SpooledImage, StreamingJSONBody
+
+logger = logging.getLogger(__name__)
+
+ImageInput = Union[str, bytes, SpooledImage]
+
+
+def _substitute_placeholder(value: Any, replacement: str) -> Any:
+    if value == StreamingJSONBody.PLACEHOLDER:
+        return replacement
+    if isinstance(value, dict):
+        return {key: _substitute_placeholder(item, replacement) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_substitute_placeholder(item, replacement) for item in value]
+    return value
+
+
+async def _post_with_image(client: httpx.AsyncClient, url: str, payload: Dict[str, Any], image: ImageInput,
+                           headers: Optional[Dict[str, str]] = None, value_prefix: str = '',
+                           resilience: Optional[UpstreamResilience] = None, stream: bool = False) -> httpx.Response:
+    """POST a payload containing StreamingJSONBody.PLACEHOLDER; binary images are base64-streamed.
+
+    With stream=True the response body is left unread; the caller must close the response.
+    """
+    if isinstance(image, str):
+        # Base64 already in memory: substitute it directly
+        body = _substitute_placeholder(payload, value_prefix + image)
+
+        def send():
+            return client.send(client.build_request('POST', url, json=body, headers=headers,
+                                                    timeout=http_timeout(client.timeout)), stream=stream)
+    else:
+        def send():
+            # A fresh body per attempt, so retries re-stream the image from the start
+            request_body = StreamingJSONBody(payload, image, value_prefix=value_prefix)
+            request = client.build_request('POST', url, content=request_body,
+                                           headers={**(headers or {}), **request_body.headers},
+                                           timeout=http_timeout(client.timeout))
+            return client.send(request, stream=stream)
+
+    if resilience is None:
+        return await send()
+    return await resilience.call(send)
+
+
+def _record_gemini_usage(usage: Optional[Dict[str, Any]], image: ImageInput, started: float):
+    usage = usage or {}
+    record_upstream_usage('gemini', input_tokens=usage.get('promptTokenCount', 0),
+                          output_tokens=usage.get('candidatesTokenCount', 0), total_tokens=usage.get('totalTokenCount'),
+                          image_bytes=image_size(image), latency_ms=(time.perf_counter() - started) * 1000)
+
+
+def _gemini_payload(prompt: str, mime_type: str, response_schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    payload = {
+        "contents": [{
+            "parts": [
+                {"text": prompt},
+                {
+                    "inline_data": {
+                        "mime_type": mime_type,
+                        "data": StreamingJSONBody.PLACEHOLDER
+                    }
+                }
+            ]
+        }]
+    }
+    if response_schema is not None:
+        # JSON mode: the answer is constrained to the schema, so it always parses
+        payload["generationConfig"] = {"responseMimeType": "application/json", "responseSchema": response_schema}
+    return payload
+
+
+async def gemini_generate_content(client: httpx.AsyncClient, model: str, api_key: str, prompt: str,
+                                  image: ImageInput, mime_type: str = 'image/jpeg',
+                                  resilience: Optional[UpstreamResilience] = None,
+                                  response_schema: Optional[Dict[str, Any]] = None) -> Dict:
+    """Gemini generateContent with one inline image; returns the parsed JSON answer.
+
+    With a `response_schema` (see backend_ai_json.gemini_response_schema) Gemini runs in JSON mode.
+    """
+    started = time.perf_counter()
+    response = await _post_with_image(client, f"/v1beta/models/{model}:generateContent?key={api_key}",
+                                      _gemini_payload(prompt, mime_type, response_schema), image, resilience=resilience)
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=f"Gemini API error: {response.text}")
+
+    result = response.json()
+    _record_gemini_usage(result.get('usageMetadata'), image, started)
+    content = result['candidates'][0]['content']['parts'][0]['text']
+    logger.debug(f"Gemini response: {content}")
+    return parse_ai_json(content)
+
+
+async def gemini_stream_generate_content(client: httpx.AsyncClient, model: str, api_key: str, prompt: str,
+                                         image: ImageInput, mime_type: str = 'image/jpeg',
+                                         resilience: Optional[UpstreamResilience] = None,
+                                         on_group: Optional[Callable[[str, Any], None]] = None,
+                                         response_schema: Optional[Dict[str, Any]] = None) -> Dict:
+    """Gemini streamGenerateContent (SSE); `on_group(key, value)` fires as each top-level member closes"""
+    started = time.perf_counter()
+    response = await _post_with_image(client, f"/v1beta/models/{model}:streamGenerateContent?alt=sse&key={api_key}",
+                                      _gemini_payload(prompt, mime_type, response_schema), image, resilience=resilience,
+                                      stream=True)
+    try:
+        if response.status_code != 200:
+            await response.aread()
+            raise HTTPException(status_code=response.status_code, detail=f"Gemini API error: {response.text}")
+
+        parser = IncrementalJSONParser()
+        usage = None
+        async for line in response.aiter_lines():
+            if not line.startswith('data:'):
+                continue
+            event = json.loads(line[len('data:'):])
+            usage = event.get('usageMetadata', usage)  # cumulative; the last event has the totals
+            for candidate in event.get('candidates', [])[:1]:
+                for part in candidate.get('content', {}).get('parts', []):
+                    for key, value in parser.feed(part.get('text', '')):
+                        if on_group is not None:
+                            on_group(key, value)
+        _record_gemini_usage(usage, image, started)
+        logger.debug(f"Gemini streamed response: {parser.text}")
+        return parser.result()
+    finally:
+        await response.aclose()
+
+
+async def _inline_base64(image: ImageInput) -> str:
+    """Base64 of an image for a request that carries several (batches are built in memory)"""
+    if isinstance(image, str):
+        return image.split(',', 1)[1] if image.startswith('data:') else image
+    if isinstance(image, SpooledImage):
+        if image.path is not None:
+            return base64.b64encode(await asyncio.to_thread(lambda: b''.join(image.iter_chunks()))).decode('ascii')
+        image = image.source()
+    return base64.b64encode(image).decode('ascii')
+
+
+def gemini_batch_prompt(prompt: str, count: int) -> str:
+    """Wrap a single-image prompt for `count` indexed images (the instructions are sent once)"""
+    return (
+        f"You are given {count} separate photos, labelled Image 0 to Image {count - 1}. Analyze each photo on its "
+        f"own and answer with one JSON object: {{\"results\": [{{\"index\": <image number>, \"answer\": <the JSON "
+        f"object described below, for that photo>}}, ...]}}, with exactly one entry per photo.\n\n{prompt}"
+    )
+
+
+def gemini_batch_schema(response_schema: Dict[str, Any]) -> Dict[str, Any]:
+    """responseSchema for a batch: {"results": [{"index", "answer": <single-image schema>}]}"""
+    return {
+        'type': 'OBJECT',
+        'properties': {
+            'results': {
+                'type': 'ARRAY',
+                'items': {
+                    'type': 'OBJECT',
+                    'properties': {'index': {'type': 'INTEGER'}, 'answer': response_schema},
+                    'propertyOrdering': ['index', 'answer'],
+                    'required': ['index', 'answer'],
+                },
+            },
+        },
+        'required': ['results'],
+    }
+
+
+async def gemini_generate_content_batch(client: httpx.AsyncClient, model: str, api_key: str, prompt: str,
+                                        images: List[Tuple[ImageInput, str]],
+                                        resilience: Optional[UpstreamResilience] = None,
+                                        response_schema: Optional[Dict[str, Any]] = None
+                                        ) -> Tuple[List[Optional[Dict]], Dict[str, float]]:
+    """One generateContent call for several (image, mime_type) pairs sharing a prompt.
+
+    Returns the per-image answers in input order (None where the model gave no usable answer)
+    and the call's cost; usage is not recorded here, the caller splits it between requesters.
+    """
+    started = time.perf_counter()
+    parts: List[Dict[str, Any]] = [{"text": gemini_batch_prompt(prompt, len(images))}]
+    for index, (image, mime_type) in enumerate(images):
+        parts.append({"text": f"Image {index}:"})
+        parts.append({"inline_data": {"mime_type": mime_type, "data": await _inline_base64(image)}})
+    payload: Dict[str, Any] = {"contents": [{"parts": parts}]}
+    if response_schema is not None:
+        payload["generationConfig"] = {"responseMimeType": "application/json",
+                                       "responseSchema": gemini_batch_schema(response_schema)}
+
+    def send():
+        return client.post(f"/v1beta/models/{model}:generateContent?key={api_key}", json=payload,
+                           timeout=http_timeout(client.timeout))
+
+    response = await (send() if resilience is None else resilience.call(send))
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=f"Gemini API error: {response.text}")
+
+    result = response.json()
+    content = result['candidates'][0]['content']['parts'][0]['text']
+    logger.debug(f"Gemini batch response: {content}")
+    answers: List[Optional[Dict]] = [None] * len(images)
+    for entry in parse_ai_json(content).get('results') or []:
+        index = entry.get('index') if isinstance(entry, dict) else None
+        if isinstance(index, int) and 0 <= index < len(images) and answers[index] is None \
+                and isinstance(entry.get('answer'), dict):
+            answers[index] = entry['answer']
+
+    usage = result.get('usageMetadata') or {}
+    cost = {
+        'input_tokens': usage.get('promptTokenCount', 0),
+        'output_tokens': usage.get('candidatesTokenCount', 0),
+        'total_tokens': usage.get('totalTokenCount') or usage.get('promptTokenCount', 0) + usage.get('candidatesTokenCount', 0),
+        'image_bytes': sum(image_size(image) for image, _ in images),
+        'latency_ms': (time.perf_counter() - started) * 1000,
+    }
+    return answers, cost
+
+
+def record_batch_usage_share(cost: Dict[str, float], count: int):
+    """Bill the current usage scope its 1/count share of a batched Gemini call"""
+    record_upstream_usage('gemini', input_tokens=cost['input_tokens'] // count,
+                          output_tokens=cost['output_tokens'] // count, total_tokens=cost['total_tokens'] // count,
+                          image_bytes=cost['image_bytes'] // count, latency_ms=cost['latency_ms'])
+
+
+async def openai_chat_vision(client: httpx.AsyncClient, model: str, api_key: str, prompt: str,
+                             image: ImageInput, mime_type: str = 'image/jpeg',
+                             resilience: Optional[UpstreamResilience] = None) -> Dict:
+    """OpenAI-compatible /v1/chat/completions with an image_url data URL; returns the parsed JSON answer"""
+    started = time.perf_counter()
+    sent_bytes = image_size(image)
+    if isinstance(image, str) and image.startswith('data:'):
+        value_prefix, image = image.split(',', 1)[0] + ',', image.split(',', 1)[1]
+    else:
+        value_prefix = f"data:{mime_type};base64,"
+    payload = {
+        "model": model,
+        "messages": [{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": StreamingJSONBody.PLACEHOLDER}}
+            ]
+        }],
+        "response_format": {"type": "json_object"},
+        "max_tokens": 2048
+    }
+    response = await _post_with_image(client, "/v1/chat/completions", payload, image,
+                                      headers={"Authorization": f"Bearer {api_key}"}, value_prefix=value_prefix,
+                                      resilience=resilience)
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=f"OpenAI API error: {response.text}")
+
+    result = response.json()
+    usage = result.get('usage') or {}
+    record_upstream_usage('openai', input_tokens=usage.get('prompt_tokens', 0),
+                          output_tokens=usage.get('completion_tokens', 0), total_tokens=usage.get('total_tokens'),
+                          image_bytes=sent_bytes, latency_ms=(time.perf_counter() - started) * 1000)
+    content = result['choices'][0]['message']['content']
+    logger.debug(f"OpenAI response: {content}")
+    return parse_ai_json(content)
+
+
+class VisionProvider:
+    """One identification backend: a name, the model it reports, and how to call it.
+
+    `call(image, user_context, mime_type=...)` returns the raw AI JSON; `configured()`
+    is checked per request so keys can be rotated (or patched) at runtime.
+    """
+
+    def __init__(self, name: str, model: str, call: Callable[..., Awaitable[Dict]],
+                 configured: Callable[[], bool] = lambda: True):
+        self.name = name
+        self.model = model
+        self.call = call
+        self.configured = configured
+
+
+class ProviderStats:
+    """Rolling latency and outcome windows for one provider"""
+
+    def __init__(self, window: int = 100):
+        self.latencies: deque = deque(maxlen=window)  # seconds, successful calls only
+        self.outcomes: deque = deque(maxlen=window)  # True for success
+        self.calls = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.wins = 0
+        self.in_flight = 0
+
+    def percentile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        if len(self.latencies) < max(1, min_samples):
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+    @property
+    def error_rate(self) -> float:
+        return (self.outcomes.count(False) / len(self.outcomes)) if self.outcomes else 0.0
+
+
+class ProviderPool:
+    """Latency- and error-aware provider selection with hedged requests.
+
+    Providers are ranked by expected time to a successful answer (rolling median latency
+    divided by the success rate). The best one is called first; if it has not answered
+    within its rolling p90 latency (clamped, with a fixed default until enough samples
+    exist) the next provider is raced against it. The first valid result wins and the
+    other call is cancelled. A provider that fails outright is failed over immediately.
+    """
+
+    def __init__(self, providers: List[VisionProvider], hedging: bool = True, hedge_percentile: float = 90,
+                 default_hedge_delay: float = 8.0, min_hedge_delay: float = 0.5, max_hedge_delay: float = 20.0,
+                 min_samples: int = 10, window: int = 100):
+        self.providers = providers
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.min_samples = min_samples
+        self._stats = {provider.name: ProviderStats(window) for provider in providers}
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    @classmethod
+    def from_env(cls, providers: List[VisionProvider]) -> 'ProviderPool':
+        """PROVIDER_HEDGING / PROVIDER_HEDGE_PERCENTILE / PROVIDER_HEDGE_DELAY / PROVIDER_MIN_HEDGE_DELAY /
+        PROVIDER_MAX_HEDGE_DELAY / PROVIDER_MIN_SAMPLES / PROVIDER_LATENCY_WINDOW"""
+        return cls(
+            providers,
+            hedging=os.getenv('PROVIDER_HEDGING', 'on').lower() not in ('0', 'off', 'false', 'no'),
+            hedge_percentile=float(os.getenv('PROVIDER_HEDGE_PERCENTILE', 90)),
+            default_hedge_delay=float(os.getenv('PROVIDER_HEDGE_DELAY', 8.0)),
+            min_hedge_delay=float(os.getenv('PROVIDER_MIN_HEDGE_DELAY', 0.5)),
+            max_hedge_delay=float(os.getenv('PROVIDER_MAX_HEDGE_DELAY', 20.0)),
+            min_samples=int(os.getenv('PROVIDER_MIN_SAMPLES', 10)),
+            window=int(os.getenv('PROVIDER_LATENCY_WINDOW', 100)),
+        )
+
+    def configured(self) -> List[VisionProvider]:
+        return [provider for provider in self.providers if provider.configured()]
+
+    def cache_namespace(self) -> str:
+        """Stable across hedging outcomes: the set of configured models, not the one that answered"""
+        return '+'.join(provider.model for provider in self.configured())
+
+    def expected_latency(self, provider: VisionProvider) -> float:
+        stats = self._stats[provider.name]
+        median = stats.percentile(50, self.min_samples)
+        expected = self.default_hedge_delay if median is None else median
+        return expected / max(0.05, 1.0 - stats.error_rate)
+
+    def ranked(self) -> List[VisionProvider]:
+        configured = self.configured()
+        # Stable sort keeps declaration order as the tie-break (cold start prefers the first provider)
+        return sorted(configured, key=self.expected_latency)
+
+    def hedge_delay(self, provider: VisionProvider) -> float:
+        p90 = self._stats[provider.name].percentile(self.hedge_percentile, self.min_samples)
+        delay = self.default_hedge_delay if p90 is None else p90
+        return min(self.max_hedge_delay, max(self.min_hedge_delay, delay))
+
+    async def _call(self, provider: VisionProvider, args: Tuple, kwargs: Dict) -> Dict:
+        stats = self._stats[provider.name]
+        stats.calls += 1
+        stats.in_flight += 1
+        started = time.perf_counter()
+        try:
+            result = await provider.call(*args, **kwargs)
+            if not isinstance(result, dict):
+                raise ValueError(f"{provider.name} returned {type(result).__name__}, expected a JSON object")
+        except asyncio.CancelledError:
+            stats.cancelled += 1
+            raise
+        except Exception:
+            stats.errors += 1
+            stats.outcomes.append(False)
+            raise
+        finally:
+            stats.in_flight -= 1
+        stats.latencies.append(time.perf_counter() - started)
+        stats.outcomes.append(True)
+        return result
+
+    async def identify(self, *args, hedge: bool = True, models: Optional[Dict[str, str]] = None,
+                       **kwargs) -> Tuple[Dict, str]:
+        """Call providers with hedging; returns the first valid result and the model that produced it.
+
+        hedge=False (budget-degraded requests) still fails over but never races a second provider.
+        `models` maps provider names to a per-request model, passed as `model=` when it differs from the
+        provider's default (e.g. a ModelRouter escalation).
+        """
+        models = models or {}
+        remaining = self.ranked()
+        if not remaining:
+            raise HTTPException(status_code=503, detail="No AI services configured for identification.")
+
+        pending: Dict[asyncio.Task, Tuple[VisionProvider, float]] = {}
+        primary = remaining[0]
+        last_error: Optional[BaseException] = None
+
+        def launch():
+            provider = remaining.pop(0)
+            override = models.get(provider.name, provider.model)
+            call_kwargs = {**kwargs, 'model': override} if override != provider.model else kwargs
+            pending[asyncio.ensure_future(self._call(provider, args, call_kwargs))] = (provider, time.monotonic())
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if self.hedging and hedge and remaining and len(pending) == 1:
+                    provider, started = next(iter(pending.values()))
+                    timeout = max(0.0, started + self.hedge_delay(provider) - time.monotonic())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    running, _ = next(iter(pending.values()))
+                    logger.info(f"Hedging identification: {running.name} slower than its p{self.hedge_percentile:g}, "
+                                f"racing {remaining[0].name}")
+                    self.hedges += 1
+                    launch()
+                    continue
+
+                for task in done:
+                    provider, _ = pending.pop(task)
+                    if task.exception() is None:
+                        self._stats[provider.name].wins += 1
+                        if provider is not primary:
+                            self.hedge_wins += 1
+                        return task.result(), models.get(provider.name, provider.model)
+                    last_error = task.exception()
+                    logger.warning(f"Provider {provider.name} failed: {last_error}")
+
+                if not pending and remaining:
+                    self.failovers += 1
+                    launch()
+            raise last_error
+        finally:
+            # The losing (or abandoned) calls are cancelled; their connections are released
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        providers = {}
+        for provider in self.providers:
+            stats = self._stats[provider.name]
+            p50 = stats.percentile(50)
+            p90 = stats.percentile(self.hedge_percentile)
+            providers[provider.name] = {
+                'model': provider.model,
+                'configured': provider.configured(),
+                'calls': stats.calls,
+                'errors': stats.errors,
+                'error_rate': round(stats.error_rate, 4),
+                'cancelled': stats.cancelled,
+                'wins': stats.wins,
+                'in_flight': stats.in_flight,
+                'p50_ms': round(p50 * 1000, 2) if p50 is not None else None,
+                'p90_ms': round(p90 * 1000, 2) if p90 is not None else None,
+                'hedge_delay_ms': round(self.hedge_delay(provider) * 1000, 2),
+            }
+        return {
+            'hedging': self.hedging,
+            'ranking': [provider.name for provider in self.ranked()],
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'failovers': self.failovers,
+            'providers': providers,
+        }
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire upstream resilience
+Per-upstream circuit breaker, bulkhead and jittered retries around pooled httpx calls
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Tuple, Callable, Awaitable, FrozenSet
+
+import httpx
+from fastapi import HTTPException
+
+from backend_deadline import retry_fits
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying: throttling and transient upstream/gateway failures
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+# The request never reached the upstream, so retrying cannot duplicate work
+RETRYABLE_TRANSPORT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class UpstreamUnavailable(HTTPException):
+    """Raised without calling the upstream: its breaker is open or its bulkhead is full"""
+
+    def __init__(self, upstream: str, reason: str, retry_after: float):
+        super().__init__(
+            status_code=503,
+            detail=f"{upstream} temporarily unavailable ({reason})",
+            headers={'Retry-After': str(max(1, int(retry_after + 0.999)))},
+        )
+        self.upstream = upstream
+        self.reason = reason
+
+
+@dataclass
+class ResilienceConfig:
+    """Breaker, bulkhead and retry settings for a single upstream"""
+    name: str
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+    half_open_max_calls: int = 1
+    max_concurrent: int = 20
+    max_attempts: int = 3
+    base_delay: float = 0.25
+    max_delay: float = 4.0
+    retry_statuses: FrozenSet[int] = RETRYABLE_STATUS_CODES
+
+    @classmethod
+    def from_env(cls, name: str, **defaults) -> 'ResilienceConfig':
+        """Build a config, letting <NAME>_* environment variables override the defaults.
+
+        e.g. GEMINI_BREAKER_FAILURES=3, GEMINI_BREAKER_RESET_SECONDS=15, PARSERATOR_BULKHEAD_MAX_CONCURRENT=8,
+        GEMINI_RETRY_ATTEMPTS=2, GEMINI_RETRY_BASE_DELAY=0.5, GEMINI_RETRY_MAX_DELAY=2
+        """
+        config = cls(name=name, **defaults)
+        prefix = name.upper()
+        for env_name, field_name, cast in (
+            ('BREAKER_FAILURES', 'failure_threshold', int),
+            ('BREAKER_RESET_SECONDS', 'reset_timeout', float),
+            ('BREAKER_HALF_OPEN_CALLS', 'half_open_max_calls', int),
+            ('BULKHEAD_MAX_CONCURRENT', 'max_concurrent', int),
+            ('RETRY_ATTEMPTS', 'max_attempts', int),
+            ('RETRY_BASE_DELAY', 'base_delay', float),
+            ('RETRY_MAX_DELAY', 'max_delay', float),
+        ):
+            raw = os.getenv(f"{prefix}_{env_name}")
+            if raw:
+                setattr(config, field_name, cast(raw))
+        return config
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with half-open probing.
+
+    closed -> open after `failure_threshold` consecutive failures; open rejects every call
+    until `reset_timeout` has passed; half_open then lets `half_open_max_calls` probes through,
+    closing on a successful probe and re-opening on a failed one.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 half_open_max_calls: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+            logger.info(f"Circuit for {self.name} half-open, probing")
+        return self._state
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker will let a probe through"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout - self._clock())
+
+    def allow(self) -> bool:
+        """Reserve a call; every allowed call must end in record_success/record_failure/release"""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self._probes < self.half_open_max_calls:
+            self._probes += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def release(self):
+        """End a call without an outcome (cancelled), freeing its half-open probe slot"""
+        if self._state == HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record_success(self):
+        if self._state != CLOSED:
+            logger.info(f"Circuit for {self.name} closed")
+        self._state = CLOSED
+        self._probes = 0
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self._state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self._state != OPEN:
+                self.trips += 1
+                logger.warning(f"Circuit for {self.name} opened after {self.consecutive_failures} consecutive failures")
+            self._state = OPEN
+            self._opened_at = self._clock()
+            self._probes = 0
+
+
+class UpstreamResilience:
+    """Runs calls to one upstream through its bulkhead, breaker and retry policy"""
+
+    def __init__(self, config: ResilienceConfig, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], Awaitable[None]] = asyncio.sleep):
+        self.config = config
+        self.breaker = CircuitBreaker(config.name, config.failure_threshold, config.reset_timeout,
+                                      config.half_open_max_calls, clock=clock)
+        self._sleep = sleep
+        self.in_flight = 0
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected_bulkhead = 0
+        self.deadline_stops = 0
+
+    def backoff(self, attempt: int, response: Optional[httpx.Response] = None) -> Optional[float]:
+        """Full-jitter exponential delay before retry `attempt` (1-based); None when Retry-After is too long"""
+        delay = random.uniform(0, min(self.config.max_delay, self.config.base_delay * 2 ** (attempt - 1)))
+        retry_after = _retry_after_seconds(response) if response is not None else None
+        if retry_after is not None:
+            if retry_after > self.config.max_delay:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+    def _is_failure(self, response: httpx.Response) -> bool:
+        # Client errors mean the upstream is healthy and said no; only overload/server errors count
+        return response.status_code == 429 or response.status_code >= 500
+
+    async def call(self, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        """Send a request with bounded, jittered retries.
+
+        `send` is called once per attempt so streamed bodies are rebuilt. Returns the last
+        response (retryable statuses included, once attempts run out or the request deadline
+        leaves no room for the backoff); raises UpstreamUnavailable when the bulkhead is full or
+        the breaker is open.
+        """
+        name = self.config.name
+        if self.in_flight >= self.config.max_concurrent:
+            self.rejected_bulkhead += 1
+            raise UpstreamUnavailable(name, 'too many concurrent calls', 1.0)
+
+        self.in_flight += 1
+        self.calls += 1
+        try:
+            attempt = 0
+            while True:
+                attempt += 1
+                if not self.breaker.allow():
+                    raise UpstreamUnavailable(name, 'circuit open', self.breaker.retry_after())
+                self.attempts += 1
+                response = None
+                try:
+                    response = await send()
+                except RETRYABLE_TRANSPORT_ERRORS as e:
+                    self.failures += 1
+                    self.breaker.record_failure()
+                    if attempt >= self.config.max_attempts:
+                        raise
+                    error = e
+                    logger.warning(f"{name} connection failed ({e!r}), retrying")
+                except httpx.TransportError:
+                    self.failures += 1
+                    self.breaker.record_failure()
+                    raise
+                except BaseException:
+                    self.breaker.release()
+                    raise
+                else:
+                    if self._is_failure(response):
+                        self.failures += 1
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()
+                    if response.status_code not in self.config.retry_statuses or attempt >= self.config.max_attempts:
+                        return response
+
+                delay = self.backoff(attempt, response)
+                if delay is None:
+                    return response
+                if not retry_fits(delay):
+                    self.deadline_stops += 1
+                    if response is None:
+                        raise error
+                    return response
+                if response is not None:
+                    logger.warning(f"{name} returned {response.status_code}, retry {attempt} in {delay:.2f}s")
+                    await response.aclose()
+                self.retries += 1
+                await self._sleep(delay)
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.breaker.state,
+            'consecutive_failures': self.breaker.consecutive_failures,
+            'trips': self.breaker.trips,
+            'rejected_open': self.breaker.rejected,
+            'retry_after_seconds': round(self.breaker.retry_after(), 2),
+            'in_flight': self.in_flight,
+            'max_concurrent': self.config.max_concurrent,
+            'rejected_bulkhead': self.rejected_bulkhead,
+            'calls': self.calls,
+            'attempts': self.attempts,
+            'retries': self.retries,
+            'failures': self.failures,
+            'deadline_stops': self.deadline_stops,
+        }
+
+
+class UpstreamResilienceRegistry:
+    """One UpstreamResilience per upstream, mirroring UpstreamClients"""
+
+    def __init__(self, configs: List[ResilienceConfig]):
+        self._upstreams = {config.name: UpstreamResilience(config) for config in configs}
+
+    def get(self, name: str) -> UpstreamResilience:
+        return self._upstreams[name]
+
+    def stats(self) -> Dict[str, Any]:
+        """Breaker state and rejection counts per upstream, for monitoring"""
+        return {name: upstream.stats() for name, upstream in self._upstreams.items()}
+
+
+NORMAL = 'normal'
+BROWNOUT = 'brownout'
+
+
+class BrownoutController:
+    """Switch to a cheap serving mode while upstreams are slow or failing.
+
+    Calls to each upstream are observed over the last `window_seconds`. Brownout starts when any
+    upstream with at least `min_samples` calls has a p90 latency above `enter_latency` or an error
+    rate above `enter_error_rate`; it ends once it has lasted `min_duration` and every upstream is
+    back under the lower `exit_latency` / `exit_error_rate`, so the mode does not flap at the
+    threshold. `mode` 'on' or 'off' pins the state (BROWNOUT=on for drills, off to disable).
+    """
+
+    def __init__(self, enter_latency: float = 12.0, exit_latency: float = 6.0, enter_error_rate: float = 0.5,
+                 exit_error_rate: float = 0.2, window_seconds: float = 60.0, min_samples: int = 5,
+                 min_duration: float = 30.0, mode: str = 'auto', clock: Callable[[], float] = time.monotonic):
+        self.enter_latency = enter_latency
+        self.exit_latency = exit_latency
+        self.enter_error_rate = enter_error_rate
+        self.exit_error_rate = exit_error_rate
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self.min_duration = min_duration
+        self.mode = mode
+        self._clock = clock
+        self._calls: Dict[str, deque] = {}
+        self._state = NORMAL
+        self._entered_at = 0.0
+        self.reason: Optional[str] = 'BROWNOUT=on' if mode == 'on' else None
+        self.entries = 0
+        self.exits = 0
+        self.degraded_responses = 0
+        self._brownout_seconds = 0.0
+
+    @classmethod
+    def from_env(cls) -> 'BrownoutController':
+        """BROWNOUT (auto/on/off) / BROWNOUT_ENTER_P90_SECONDS / BROWNOUT_EXIT_P90_SECONDS /
+        BROWNOUT_ENTER_ERROR_RATE / BROWNOUT_EXIT_ERROR_RATE / BROWNOUT_WINDOW_SECONDS /
+        BROWNOUT_MIN_SAMPLES / BROWNOUT_MIN_SECONDS"""
+        return cls(
+            enter_latency=float(os.getenv('BROWNOUT_ENTER_P90_SECONDS', 12.0)),
+            exit_latency=float(os.getenv('BROWNOUT_EXIT_P90_SECONDS', 6.0)),
+            enter_error_rate=float(os.getenv('BROWNOUT_ENTER_ERROR_RATE', 0.5)),
+            exit_error_rate=float(os.getenv('BROWNOUT_EXIT_ERROR_RATE', 0.2)),
+            window_seconds=float(os.getenv('BROWNOUT_WINDOW_SECONDS', 60.0)),
+            min_samples=int(os.getenv('BROWNOUT_MIN_SAMPLES', 5)),
+            min_duration=float(os.getenv('BROWNOUT_MIN_SECONDS', 30.0)),
+            mode=os.getenv('BROWNOUT', 'auto').lower(),
+        )
+
+    def observe(self, upstream: str, latency: float, ok: bool = True):
+        """Record one upstream call (seconds; ok=False for errors, timeouts and open breakers)"""
+        self._calls.setdefault(upstream, deque()).append((self._clock(), latency, ok))
+
+    def _health(self, upstream: str) -> Tuple[int, Optional[float], float]:
+        """(samples, p90 latency, error rate) over the window"""
+        calls = self._calls[upstream]
+        horizon = self._clock() - self.window_seconds
+        while calls and calls[0][0] < horizon:
+            calls.popleft()
+        if not calls:
+            return 0, None, 0.0
+        latencies = sorted(latency for _, latency, _ in calls)
+        p90 = latencies[min(len(latencies) - 1, int(round(0.9 * (len(latencies) - 1))))]
+        return len(calls), p90, sum(1 for _, _, ok in calls if not ok) / len(calls)
+
+    def _breach(self, latency_limit: float, error_limit: float) -> Optional[str]:
+        for upstream in self._calls:
+            samples, p90, error_rate = self._health(upstream)
+            if samples < self.min_samples:
+                continue
+            if error_rate > error_limit:
+                return f"{upstream} error rate {error_rate:.0%}"
+            if p90 is not None and p90 > latency_limit:
+                return f"{upstream} p90 {p90:.1f}s"
+        return None
+
+    def active(self) -> bool:
+        """Whether requests should be served in brownout right now (re-evaluated on every call)"""
+        if self.mode in ('on', 'off'):
+            return self.mode == 'on'
+        now = self._clock()
+        if self._state == NORMAL:
+            reason = self._breach(self.enter_latency, self.enter_error_rate)
+            if reason is not None:
+                self._state = BROWNOUT
+                self._entered_at = now
+                self.reason = reason
+                self.entries += 1
+                logger.warning(f"Entering brownout: {reason}")
+        elif now - self._entered_at >= self.min_duration and self._breach(self.exit_latency, self.exit_error_rate) is None:
+            self._state = NORMAL
+            self._brownout_seconds += now - self._entered_at
+            self.exits += 1
+            logger.info(f"Leaving brownout after {now - self._entered_at:.0f}s ({self.reason})")
+            self.reason = None
+        return self._state == BROWNOUT
+
+    def record_degraded(self):
+        self.degraded_responses += 1
+
+    def stats(self) -> Dict[str, Any]:
+        active = self.active()
+        current = self._clock() - self._entered_at if self._state == BROWNOUT else 0.0
+        upstreams = {}
+        for upstream in self._calls:
+            samples, p90, error_rate = self._health(upstream)
+            upstreams[upstream] = {
+                'samples': samples,
+                'p90_ms': round(p90 * 1000, 2) if p90 is not None else None,
+                'error_rate': round(error_rate, 3),
+            }
+        return {
+            'mode': self.mode,
+            'active': active,
+            'reason': self.reason if active else None,
+            'entries': self.entries,
+            'exits': self.exits,
+            'current_seconds': round(current, 2),
+            'total_seconds': round(self._brownout_seconds + current, 2),
+            'degraded_responses': self.degraded_responses,
+            'enter_p90_seconds': self.enter_latency,
+            'exit_p90_seconds': self.exit_latency,
+            'enter_error_rate': self.enter_error_rate,
+            'exit_error_rate': self.exit_error_rate,
+            'upstreams': upstreams,
+        }
+
+
+def _retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    raw = response.headers.get('retry-after')
+    if not raw:
+        return None
+    try:
+        return max(0.0, float(raw))
+    except ValueError:
+        return None  # HTTP-date form: fall back to our own backoff
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire model routing
+Per-request Gemini model choice from image complexity, subscription tier and upstream latency,
+with escalation to the stronger model when the cheap answer is unsure
+"""
+
+import os
+import time
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Optional, Any, Tuple, Callable, Awaitable
+
+from backend_ledger import current_usage_scope
+
+logger = logging.getLogger(__name__)
+
+
+def _tiers(value: str) -> Tuple[str, ...]:
+    return tuple(tier.strip().lower() for tier in value.split(',') if tier.strip())
+
+
+@dataclass
+class RouteDecision:
+    model: str
+    reason: str
+    complexity: Optional[float] = None
+    tier: Optional[str] = None
+
+
+class ModelLatency:
+    """Rolling call latencies (seconds) for one model"""
+
+    def __init__(self, window: int = 100):
+        self.latencies: deque = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+
+    def percentile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        if len(self.latencies) < max(1, min_samples):
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class ModelRouter:
+    """Choose between a cheap and a strong Gemini model for each identification.
+
+    Complex images (high resolution and grey-level entropy) from tiers in `strong_tiers` start on
+    the strong model unless its rolling median latency exceeds `max_strong_latency`. Everything
+    else starts on the cheap model and is re-run on the strong one when the answer's confidence
+    is below `escalation_confidence` and the tier is in `escalation_tiers`. Over-budget
+    (degraded) requests always stay on the cheap model.
+    """
+
+    def __init__(self, cheap_model: str, strong_model: str, enabled: bool = True,
+                 strong_tiers: Tuple[str, ...] = ('pro', 'founders'),
+                 escalation_tiers: Tuple[str, ...] = ('premium', 'pro', 'founders'),
+                 complexity_threshold: float = 0.7, escalation_confidence: float = 0.6,
+                 max_strong_latency: float = 20.0, reference_megapixels: float = 12.0,
+                 min_samples: int = 5, window: int = 100):
+        self.cheap_model = cheap_model
+        self.strong_model = strong_model
+        self.enabled = enabled and cheap_model != strong_model
+        self.strong_tiers = strong_tiers
+        self.escalation_tiers = escalation_tiers
+        self.complexity_threshold = complexity_threshold
+        self.escalation_confidence = escalation_confidence
+        self.max_strong_latency = max_strong_latency
+        self.reference_megapixels = reference_megapixels
+        self.min_samples = min_samples
+        self._window = window
+        self._models: Dict[str, ModelLatency] = {}
+        self.decisions: Dict[str, int] = {}
+        self.routed: Dict[str, int] = {}
+        self.escalations = 0
+        self.escalations_improved = 0
+        self.escalation_failures = 0
+
+    @classmethod
+    def from_env(cls, cheap_model: str) -> 'ModelRouter':
+        """MODEL_ROUTING (off disables) / GEMINI_STRONG_MODEL / ROUTING_STRONG_TIERS / ROUTING_ESCALATION_TIERS /
+        ROUTING_COMPLEXITY_THRESHOLD / ROUTING_ESCALATION_CONFIDENCE / ROUTING_MAX_STRONG_LATENCY"""
+        return cls(
+            cheap_model=cheap_model,
+            strong_model=os.getenv('GEMINI_STRONG_MODEL', 'gemini-1.5-pro'),
+            enabled=os.getenv('MODEL_ROUTING', 'on').lower() not in ('0', 'off', 'false', 'no'),
+            strong_tiers=_tiers(os.getenv('ROUTING_STRONG_TIERS', 'pro,founders')),
+            escalation_tiers=_tiers(os.getenv('ROUTING_ESCALATION_TIERS', 'premium,pro,founders')),
+            complexity_threshold=float(os.getenv('ROUTING_COMPLEXITY_THRESHOLD', 0.7)),
+            escalation_confidence=float(os.getenv('ROUTING_ESCALATION_CONFIDENCE', 0.6)),
+            max_strong_latency=float(os.getenv('ROUTING_MAX_STRONG_LATENCY', 20.0)),
+        )
+
+    def complexity(self, size: Optional[Tuple[int, int]], entropy: Optional[float]) -> Optional[float]:
+        """0-1 score from the original resolution and grey-level entropy; None when the image was not decoded"""
+        if size is None or entropy is None:
+            return None
+        resolution = min(1.0, size[0] * size[1] / 1e6 / self.reference_megapixels)
+        return round(0.4 * resolution + 0.6 * min(1.0, entropy / 8), 3)
+
+    def _latency(self, model: str) -> ModelLatency:
+        if model not in self._models:
+            self._models[model] = ModelLatency(self._window)
+        return self._models[model]
+
+    def strong_model_slow(self) -> bool:
+        median = self._latency(self.strong_model).percentile(50, self.min_samples)
+        return median is not None and median > self.max_strong_latency
+
+    def route(self, complexity: Optional[float], tier: Optional[str], degraded: bool = False) -> RouteDecision:
+        if not self.enabled:
+            reason = 'disabled'
+        elif degraded:
+            reason = 'over_budget'
+        elif tier not in self.strong_tiers:
+            reason = 'tier'
+        elif complexity is None:
+            reason = 'unknown_complexity'
+        elif complexity < self.complexity_threshold:
+            reason = 'simple_image'
+        elif self.strong_model_slow():
+            reason = 'strong_model_slow'
+        else:
+            return RouteDecision(self.strong_model, 'complex_image', complexity, tier)
+        return RouteDecision(self.cheap_model, reason, complexity, tier)
+
+    def cache_namespace(self, degraded: bool = False) -> str:
+        """The Gemini models the current request can be routed to, for identification cache keys.
+
+        An image's complexity follows from its bytes, so requests with the same image and the same
+        routing options get the same model; answers are never shared across differently routed
+        requests (a cheap answer is not served where the strong model would have been used).
+        """
+        if not self.enabled or degraded or self.strong_model_slow():
+            return self.cheap_model
+        scope = current_usage_scope()
+        tier = scope.tier if scope is not None else None
+        namespace = self.cheap_model
+        if tier in self.strong_tiers:
+            namespace += f'|complex:{self.strong_model}'
+        if tier in self.escalation_tiers:
+            namespace += f'|unsure:{self.strong_model}'
+        return namespace
+
+    def should_escalate(self, decision: RouteDecision, answered_by: str, confidence: float,
+                        degraded: bool = False) -> bool:
+        """Only cheap-model answers (not failovers to another provider) are escalated"""
+        return (self.enabled and not degraded and answered_by == self.cheap_model
+                and decision.model == self.cheap_model and decision.tier in self.escalation_tiers
+                and confidence < self.escalation_confidence and not self.strong_model_slow())
+
+    async def _timed(self, call: Callable[[str, bool], Awaitable[Tuple[Dict, str]]], model: str,
+                     escalated: bool) -> Tuple[Dict, str]:
+        started = time.perf_counter()
+        try:
+            result, answered_by = await call(model, escalated)
+        except Exception:
+            self._latency(model).errors += 1
+            raise
+        latency = self._latency(answered_by)
+        latency.calls += 1
+        latency.latencies.append(time.perf_counter() - started)
+        return result, answered_by
+
+    async def identify(self, call: Callable[[str, bool], Awaitable[Tuple[Dict, str]]], complexity: Optional[float],
+                       confidence: Callable[[Dict], float], degraded: bool = False) -> Tuple[Dict, str]:
+        """Run `call(model, escalated)` (which returns (result, model that answered)) on the routed model.
+
+        The caller's tier comes from the current usage scope. Of an escalated pair, the answer
+        with the higher confidence is returned.
+        """
+        scope = current_usage_scope()
+        decision = self.route(complexity, scope.tier if scope is not None else None, degraded)
+        self.decisions[decision.reason] = self.decisions.get(decision.reason, 0) + 1
+        self.routed[decision.model] = self.routed.get(decision.model, 0) + 1
+        logger.info(f"Routing identification to {decision.model} ({decision.reason}, "
+                    f"complexity={decision.complexity}, tier={decision.tier})")
+
+        result, answered_by = await self._timed(call, decision.model, False)
+        score = confidence(result)
+        if not self.should_escalate(decision, answered_by, score, degraded):
+            return result, answered_by
+
+        self.escalations += 1
+        logger.info(f"Escalating identification to {self.strong_model}: {answered_by} confidence {score:.2f}")
+        try:
+            stronger, strong_answered_by = await self._timed(call, self.strong_model, True)
+        except Exception as e:
+            self.escalation_failures += 1
+            logger.warning(f"Escalation to {self.strong_model} failed, keeping the {answered_by} answer: {e}")
+            return result, answered_by
+        if confidence(stronger) < score:
+            return result, answered_by
+        self.escalations_improved += 1
+        return stronger, strong_answered_by
+
+    def stats(self) -> Dict[str, Any]:
+        models = {}
+        for model, latency in self._models.items():
+            p50, p90 = latency.percentile(50), latency.percentile(90)
+            models[model] = {
+                'calls': latency.calls,
+                'errors': latency.errors,
+                'p50_ms': round(p50 * 1000, 2) if p50 is not None else None,
+                'p90_ms': round(p90 * 1000, 2) if p90 is not None else None,
+            }
+        return {
+            'enabled': self.enabled,
+            'cheap_model': self.cheap_model,
+            'strong_model': self.strong_model,
+            'strong_tiers': list(self.strong_tiers),
+            'escalation_tiers': list(self.escalation_tiers),
+            'complexity_threshold': self.complexity_threshold,
+            'escalation_confidence': self.escalation_confidence,
+            'strong_model_slow': self.strong_model_slow(),
+            'decisions': dict(self.decisions),
+            'routed': dict(self.routed),
+            'escalations': self.escalations,
+            'escalations_improved': self.escalations_improved,
+            'escalation_failures': self.escalation_failures,
+            'models': models,
+        }
@@ -6,23 +6,46 @@ High-performance API server with Exoditical Moral Architecture validation
 
 import os
 import json
+import time
 import base64
 import asyncio
 import logging
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple, Union, Callable
 from dataclasses import dataclass, asdict
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks, Query
+from fastapi import FastAPI, HTTPException, Request, BackgroundTasks, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import uvicorn
 import httpx
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import firebase_admin
 from firebase_admin import credentials, firestore
 import uuid
 
+from backend_http import UpstreamClients, UpstreamConfig
+from backend_images import ImageNormalizer
+from backend_admission import AdmissionController, AdmissionMiddleware
+from backend_resilience import ResilienceConfig, UpstreamResilienceRegistry, UpstreamUnavailable
+from backend_providers import (
+    ProviderPool, VisionProvider, gemini_generate_content, gemini_generate_content_batch, gemini_stream_generate_content,
+    openai_chat_vision, record_batch_usage_share,
+)
+from backend_uploads import (
+    SpooledImage, UploadLimits, UploadTracker, identification_openapi, identification_upload,
+)
+from backend_cache import IdentificationCache, SingleFlight, TTLCache, canonical_json, decode_image_data
+from backend_phash import PerceptualHashIndex
+from backend_ai_json import AIOutputStats, gemini_response_schema, json_repair_stats, missing_fields
+from backend_batching import MicroBatcher
+from backend_deadline import DeadlineExceeded, DeadlineMiddleware, DeadlinePolicy, deadline_timeout, within_deadline
+from backend_routing import ModelRouter
+from backend_ledger import UsageLedger, UsageScope, client_address
+from backend_auth import IdTokenVerifier
+from backend_validation import VALIDATORS, EMAValidator, ValidationPool, ValidationReport, validation_memo
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -35,10 +58,72 @@ PARSERATOR_API_KEY = os.getenv('PARSERATOR_API_KEY', '')
 PORT = int(os.getenv('PORT', 8081))
 ENVIRONMENT = os.getenv('ENVIRONMENT', 'development')
 
+# Batch identification: items per request and items identified concurrently per batch
+IDENTIFY_BATCH_MAX_ITEMS = int(os.getenv('IDENTIFY_BATCH_MAX_ITEMS', 50))
+IDENTIFY_BATCH_CONCURRENCY = int(os.getenv('IDENTIFY_BATCH_CONCURRENCY', 4))
+
+# Bulk validation: crystals per request
+VALIDATE_BATCH_MAX_ITEMS = int(os.getenv('VALIDATE_BATCH_MAX_ITEMS', 5000))
+
 # Parserator configuration
 PARSERATOR_BASE_URL = 'https://app-5108296280.us-central1.run.app'
 PARSERATOR_ENDPOINT = '/v1/parse'
 
+# Gemini configuration
+GEMINI_BASE_URL = 'https://generativelanguage.googleapis.com'
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')  # JSON mode needs a 1.5+ model
+# streamGenerateContent lets parsed groups reach callers before the whole answer has arrived
+GEMINI_STREAMING = os.getenv('GEMINI_STREAMING', 'on').lower() not in ('0', 'off', 'false', 'no')
+# Constrain Gemini output to the AIIdentificationResponse schema (responseMimeType application/json)
+GEMINI_JSON_MODE = os.getenv('GEMINI_JSON_MODE', 'on').lower() not in ('0', 'off', 'false', 'no')
+
+# OpenAI-compatible configuration (any /v1/chat/completions vision endpoint)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com')
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+
+# Pooled upstream HTTP clients (opened/closed in the app lifespan)
+upstream_clients = UpstreamClients([
+    UpstreamConfig.from_env('gemini', GEMINI_BASE_URL),
+    UpstreamConfig.from_env('openai', OPENAI_BASE_URL),
+])
+
+# Circuit breaker, bulkhead and retry policy per upstream (<NAME>_BREAKER_* / _BULKHEAD_* / _RETRY_*)
+upstream_resilience = UpstreamResilienceRegistry([
+    ResilienceConfig.from_env('gemini'),
+    ResilienceConfig.from_env('openai'),
+])
+
+# End-to-end request budgets from X-Request-Deadline-Ms or per-path defaults (REQUEST_DEADLINE_*)
+request_deadlines = DeadlinePolicy.from_env()
+
+# Admission control for /api/crystal/identify* (IDENTIFY_MAX_IN_FLIGHT / IDENTIFY_MAX_QUEUE / IDENTIFY_QUEUE_TIMEOUT)
+identification_admission = AdmissionController.from_env('IDENTIFY')
+
+# Raw AI responses keyed by image bytes + user context + configured provider models
+identification_cache = IdentificationCache.from_env()
+
+# In-flight identifications by cache key, so concurrent duplicates share one upstream call
+identification_flights = SingleFlight('identification')
+
+# Decode/orient/downscale/re-encode uploads in worker processes before they go upstream
+image_normalizer = ImageNormalizer.from_env()
+
+# EMA/ethics scoring of whole collections, chunked across worker processes
+validation_pool = ValidationPool.from_env()
+
+# Identification bodies: JSON, multipart or raw binary, streamed into bounded spools
+upload_limits = UploadLimits.from_env()
+upload_tracker = UploadTracker(upload_limits)
+
+# Recently identified images by perceptual hash, for near-duplicate reuse
+phash_index = PerceptualHashIndex.from_env()
+
+# Batch identification counters for /api/metrics
+batch_stats = {'batches': 0, 'streamed_batches': 0, 'items': 0, 'failed_items': 0}
+
+# Gemini prompt sizes and parse failures, JSON mode vs free-text prompt
+gemini_output_stats = AIOutputStats()
+
 # Initialize Firebase Admin SDK
 try:
     cred = credentials.Certificate("firebase-service-account.json")
@@ -51,12 +136,91 @@ except Exception as e:
 
 crystals_collection = db.collection('crystals') if db else None
 
+# Per-RPC Firestore timeout, further capped by the request deadline
+FIRESTORE_TIMEOUT = float(os.getenv('FIRESTORE_TIMEOUT', 10.0))
+
+async def firestore_call(method: Callable[..., Any], *args: Any) -> Any:
+    """Run a blocking Firestore call in a worker thread with the request's remaining budget as its timeout"""
+    return await within_deadline(
+        asyncio.to_thread(method, *args, timeout=deadline_timeout(FIRESTORE_TIMEOUT)), 'firestore'
+    )
+
+def _firestore_usage_sink(rows: List[Dict[str, Any]]):
+    """Add flushed ledger deltas to usage_ledger/{day}_{user}_{endpoint}_{provider}"""
+    batch = db.batch()
+    for row in rows:
+        document = db.collection('usage_ledger').document(
+            f"{row['day']}_{row['user_id']}_{row['endpoint']}_{row['provider']}".replace('/', '_')
+        )
+        keys = {key: row[key] for key in ('day', 'user_id', 'endpoint', 'provider')}
+        counters = {key: firestore.Increment(value) for key, value in row.items() if key not in keys}
+        batch.set(document, {**keys, **counters}, merge=True)
+    batch.commit()
+
+# Per-user token/image/latency ledger and tier budgets (USAGE_TIER_BUDGETS / USAGE_LEDGER_FLUSH_SECONDS)
+usage_ledger = UsageLedger.from_env(sink=_firestore_usage_sink if db else None)
+
+# Callers are identified by their Firebase ID token (Authorization: Bearer), never by the request body
+id_tokens = IdTokenVerifier.from_env()
+
+# Subscription tiers read server-side from users/{uid}, never from the request (USER_TIER_CACHE_SECONDS)
+user_tiers = TTLCache(max_entries=10000, ttl_seconds=float(os.getenv('USER_TIER_CACHE_SECONDS', 300)))
+
+async def lookup_subscription_tier(user_id: Optional[str]) -> Optional[str]:
+    """The user's subscriptionTier from their Firestore profile; None (the default tier) when unknown"""
+    if not user_id or not db:
+        return None
+    cached = user_tiers.get(user_id)
+    if cached is not None:
+        return cached['tier']
+    try:
+        doc = await firestore_call(db.collection('users').document(user_id).get)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.warning(f"Subscription tier lookup failed for {user_id}, using the default tier: {e}")
+        return None
+    profile = (doc.to_dict() or {}) if doc.exists else {}
+    tier = profile.get('subscriptionTier') or profile.get('subscription_tier')
+    tier = str(tier) if tier else None
+    user_tiers.set(user_id, {'tier': tier})
+    return tier
+
+async def admit_usage(http_request: Request, endpoint: str, calls: int = 1) -> UsageScope:
+    """Budget-check a request: ID-token verified callers against their server-side tier, anyone else
+    as anonymous by client address"""
+    user_id = await id_tokens.user_id(http_request)
+    tier = await lookup_subscription_tier(user_id)
+    return usage_ledger.admit(user_id, endpoint, client_ip=client_address(http_request), tier=tier, calls=calls)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared upstream resources on startup and release them on shutdown"""
+    await upstream_clients.start()
+    image_normalizer.start()
+    validation_pool.start()
+    usage_ledger.start()
+    try:
+        yield
+    finally:
+        await usage_ledger.close()
+        validation_pool.close()
+        image_normalizer.close()
+        await upstream_clients.close()
+
 app = FastAPI(
     title="Crystal Grimoire Enhanced API",
     description="Production backend with Parserator integration and Exoditical Moral Architecture",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
+# Shed excess identifications before their bodies are read (added first so CORS still wraps the 429/503)
+app.add_middleware(AdmissionMiddleware, controller=identification_admission, path_prefixes=('/api/crystal/identify',))
+
+# Start the deadline clock before admission queueing; cancel handlers whose client has gone
+app.add_middleware(DeadlineMiddleware, policy=request_deadlines)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -163,6 +327,79 @@ class UnifiedCrystalData(BaseModel):
     crystal_core: CrystalCore
     user_integration: Optional[UserIntegration] = None
     automatic_enrichment: Optional[AutomaticEnrichment] = None
+    missing_fields: List[str] = []  # required AI answer fields that were absent (partial answer), filled with defaults
+
+# AI-facing groups: what the vision model returns and map_ai_response_to_unified_data reads.
+# Gemini's responseSchema is generated from AIIdentificationResponse.
+
+class AIIdentificationDetails(BaseModel):
+    stone_name: str = Field(description="Common name, e.g. Amethyst")
+    variety: Optional[str] = Field(None, description="e.g. Chevron Amethyst")
+    crystal_family: Optional[str] = Field(None, description="e.g. Quartz, Feldspar, Beryl")
+    identification_confidence: float = Field(description="0.0 to 1.0, confidence in stone_name")
+
+class AIPhysicalPropertiesSummary(BaseModel):
+    hardness: Optional[str] = Field(None, description="Mohs scale, e.g. '7'")
+    crystal_system: Optional[str] = Field(None, description="e.g. Hexagonal, Trigonal, Cubic")
+
+class AIMetaphysicalAspects(BaseModel):
+    primary_chakra: str = Field(description="e.g. Third Eye, Root")
+    secondary_chakras: List[str] = []
+    vibration_level: Optional[str] = Field(None, description="Low, Medium, High or Very High")
+    primary_zodiac_signs: List[str] = []
+    planetary_rulers: List[str] = []
+    elements: List[str] = Field([], description="e.g. Water, Earth")
+
+class AINumerologyInsights(BaseModel):
+    crystal_number_association: Optional[int] = None
+    color_vibration_number: Optional[int] = None
+    chakra_number_for_numerology: Optional[int] = Field(None, description="e.g. 6 for Third Eye")
+    master_numerology_number_suggestion: Optional[int] = None
+
+class AIIdentificationResponse(BaseModel):
+    identification_details: AIIdentificationDetails
+    overall_confidence_score: float = Field(description="0.0 to 1.0, confidence in the whole answer")
+    visual_characteristics: VisualAnalysis
+    physical_properties_summary: AIPhysicalPropertiesSummary
+    metaphysical_aspects: AIMetaphysicalAspects
+    numerology_insights: AINumerologyInsights
+    enrichment_details: AutomaticEnrichment
+
+GEMINI_IDENTIFICATION_SCHEMA = gemini_response_schema(AIIdentificationResponse)
+
+class CrystalBatchItem(BaseModel):
+    image_data: str  # base64 encoded image
+    id: Optional[str] = None  # client-side reference echoed back in the result
+    user_context: Optional[Dict[str, Any]] = None  # overrides the batch-level context
+
+class CrystalBatchIdentificationRequest(BaseModel):
+    images: List[CrystalBatchItem]
+    user_context: Optional[Dict[str, Any]] = None
+
+class CrystalBatchItemResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    status: str  # "ok" or "error"
+    result: Optional[UnifiedCrystalData] = None
+    ema_compliance: Optional[Dict[str, Any]] = None
+    error: Optional[Dict[str, Any]] = None  # {"status_code": int, "detail": str}
+    elapsed_ms: float
+
+class CrystalBatchIdentificationResponse(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    elapsed_ms: float
+    results: List[CrystalBatchItemResult]  # in request order
+
+class CrystalValidationBatchRequest(BaseModel):
+    crystals: Optional[List[Dict[str, Any]]] = None  # crystal data to validate, or
+    user_id: Optional[str] = None  # the user whose saved collection is validated
+    validators: List[str] = Field(default_factory=lambda: list(VALIDATORS))  # "ema" and/or "exoditical"
+
+class CrystalValidationBatchResponse(BaseModel):
+    summary: Dict[str, Any]  # total, elapsed_ms and per-validator aggregates
+    results: List[Dict[str, Any]]  # {"index", "id", "validations": {validator: result}} in request order
 
 # Numerology Constants and Calculation
 NUMEROLOGY_LETTER_VALUES = {
@@ -197,13 +434,24 @@ def map_ai_response_to_unified_data(ai_response: Dict) -> UnifiedCrystalData:
     # Simplified parsing logic for map_ai_response_to_unified_data
     # AI response is expected to be a single JSON object with potential groups.
 
-    # Get logical groups from AI response, defaulting to empty dict if group is missing
-    id_details = ai_response.get("identification_details", {})
-    visual_chars = ai_response.get("visual_characteristics", {})
-    physical_props_summary = ai_response.get("physical_properties_summary", {})
-    meta_aspects = ai_response.get("metaphysical_aspects", {})
-    num_insights = ai_response.get("numerology_insights", {})
-    enrich_details = ai_response.get("enrichment_details", {})
+    # Get logical groups from AI response, defaulting to empty dict if group is missing.
+    # Repaired (truncated) or partial answers are mapped with defaults and their gaps flagged.
+    missing = missing_fields(ai_response, AIIdentificationResponse)
+    if missing:
+        json_repair_stats.record_partial(missing)
+        logger.warning(f"AI answer is missing {len(missing)} fields: {', '.join(missing)}")
+
+    def group(name: str) -> Dict:
+        # JSON-mode answers send null for unknown optional fields; drop them so the defaults below apply
+        value = ai_response.get(name)
+        return {key: item for key, item in value.items() if item is not None} if isinstance(value, dict) else {}
+
+    id_details = group("identification_details")
+    visual_chars = group("visual_characteristics")
+    physical_props_summary = group("physical_properties_summary")
+    meta_aspects = group("metaphysical_aspects")
+    num_insights = group("numerology_insights")
+    enrich_details = group("enrichment_details")
 
     # Visual Analysis
     visual_analysis = VisualAnalysis(
@@ -322,7 +570,7 @@ def map_ai_response_to_unified_data(ai_response: Dict) -> UnifiedCrystalData:
     crystal_core = CrystalCore(
         id=str(uuid.uuid4()),
         timestamp=datetime.utcnow().isoformat(),
-        confidence_score=ai_response.get("overall_confidence_score", 0.0), # From top-level
+        confidence_score=ai_response.get("overall_confidence_score") or 0.0, # From top-level
         visual_analysis=visual_analysis,
         identification=identification,
         energy_mapping=energy_mapping,
@@ -331,8 +579,6 @@ def map_ai_response_to_unified_data(ai_response: Dict) -> UnifiedCrystalData:
     )
 
     # Automatic Enrichment
-    ae_data = enrichment_data # alias for brevity
-
     # Attempt to derive mineral_class if not provided by AI (from enrichment_details)
     # and identification.crystal_family is known
     derived_mineral_class = None
@@ -388,18 +634,28 @@ def map_ai_response_to_unified_data(ai_response: Dict) -> UnifiedCrystalData:
     return UnifiedCrystalData(
         crystal_core=crystal_core,
         automatic_enrichment=automatic_enrichment,
-        user_integration=user_integration
+        user_integration=user_integration,
+        missing_fields=missing
     )
 
 # AI Service Integration
 class AIService:
     @staticmethod
-    async def identify_crystal_with_gemini(image_data: str, user_context: Dict = None) -> Dict:
-        """Identify crystal using Gemini Pro Vision"""
-        if not GEMINI_API_KEY:
-            raise HTTPException(status_code=503, detail="Gemini API not configured")
-        
-        prompt = f"""
+    def identification_prompt(user_context: Dict = None, structured_output: bool = False) -> str:
+        """Identification prompt shared by every vision provider.
+
+        With `structured_output` the answer format comes from GEMINI_IDENTIFICATION_SCHEMA, so
+        the JSON layout and formatting instructions are left out.
+        """
+        if structured_output:
+            return f"""
+        You are an expert crystal identification and metaphysical guidance system.
+        Analyze the crystal in this image and fill in every field as accurately as possible;
+        use null or an empty list when a value is unknown.
+
+        USER CONTEXT: {json.dumps(user_context) if user_context else 'None provided'}
+        """
+        return f"""
         You are an expert crystal identification and metaphysical guidance system.
         Analyze this crystal image and provide comprehensive information in JSON format.
         The goal is to populate the 'CrystalCore' and 'AutomaticEnrichment' sections of our UnifiedCrystalData model.
@@ -469,45 +725,43 @@ class AIService:
         Example for a key: "stone_name": "Amethyst"
         Example for a list: "healing_properties": ["Promotes calmness", "Enhances intuition"]
         """
+
+    @staticmethod
+    async def identify_crystal_with_gemini(image_data: Union[str, bytes, SpooledImage], user_context: Dict = None, mime_type: str = "image/jpeg",
+                                           on_group: Optional[Callable[[str, Any], None]] = None,
+                                           model: Optional[str] = None) -> Dict:
+        """Identify crystal using Gemini (GEMINI_MODEL, or the routed `model`); `on_group(key, value)` receives each top-level group as soon as it has streamed in"""
+        if not GEMINI_API_KEY:
+            raise HTTPException(status_code=503, detail="Gemini API not configured")
+        
+        prompt = AIService.identification_prompt(user_context, structured_output=GEMINI_JSON_MODE)
+        response_schema = GEMINI_IDENTIFICATION_SCHEMA if GEMINI_JSON_MODE else None
+        output_mode = 'schema' if GEMINI_JSON_MODE else 'prompt'
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro-vision:generateContent?key={GEMINI_API_KEY}",
-                    json={
-                        "contents": [{
-                            "parts": [
-                                {"text": prompt},
-                                {
-                                    "inline_data": {
-                                        "mime_type": "image/jpeg",
-                                        "data": image_data
-                                    }
-                                }
-                            ]
-                        }]
-                    },
-                    timeout=30.0
+            # Binary images are base64-encoded straight into the request body as it is sent
+            if gemini_batcher.enabled and not (isinstance(image_data, SpooledImage) and image_data.path):
+                # Concurrent identifications with the same model and prompt share one multi-image call
+                result = await gemini_batcher.submit((model or GEMINI_MODEL, prompt), (image_data, mime_type))
+                _emit_groups(result, on_group)
+            elif GEMINI_STREAMING:
+                result = await gemini_stream_generate_content(
+                    upstream_clients.get('gemini'), model or GEMINI_MODEL, GEMINI_API_KEY, prompt, image_data, mime_type,
+                    resilience=upstream_resilience.get('gemini'), on_group=on_group, response_schema=response_schema
                 )
-                
-                if response.status_code != 200:
-                    raise HTTPException(status_code=response.status_code, detail=f"Gemini API error: {response.text}")
-                
-                result = response.json()
-                content = result['candidates'][0]['content']['parts'][0]['text']
-                
-                # Clean up the response to ensure valid JSON
-                content = content.strip()
-                # Remove markdown ```json and ``` if present
-                if content.startswith("```json") and content.endswith("```"):
-                    content = content[7:-3].strip()
-                elif content.startswith("```") and content.endswith("```"): # More generic markdown block
-                    content = content[3:-3].strip()
-
-                logger.debug(f"Cleaned AI Response: {content}")
-                return json.loads(content)
-                
-        except json.JSONDecodeError as e:
+            else:
+                result = await gemini_generate_content(
+                    upstream_clients.get('gemini'), model or GEMINI_MODEL, GEMINI_API_KEY, prompt, image_data, mime_type,
+                    resilience=upstream_resilience.get('gemini'), response_schema=response_schema
+                )
+                _emit_groups(result, on_group)
+            gemini_output_stats.record(output_mode, len(prompt), parsed=True)
+            return result
+            
+        except UpstreamUnavailable:
+            raise
+        except ValueError as e:  # json.JSONDecodeError, or a streamed answer that never formed an object
+            gemini_output_stats.record(output_mode, len(prompt), parsed=False)
             logger.error(f"JSON decode error: {e}")
             raise HTTPException(status_code=500, detail="Invalid JSON response from AI")
         except Exception as e:
@@ -515,14 +769,170 @@ class AIService:
             raise HTTPException(status_code=500, detail=f"AI identification failed: {str(e)}")
 
     @staticmethod
-    async def identify_crystal_with_openai(image_data: str, user_context: Dict = None) -> Dict:
-        """Identify crystal using OpenAI GPT-4 Vision (if available)"""
+    async def identify_crystal_with_openai(image_data: Union[str, bytes, SpooledImage], user_context: Dict = None, mime_type: str = "image/jpeg",
+                                           on_group: Optional[Callable[[str, Any], None]] = None) -> Dict:
+        """Identify crystal using an OpenAI-compatible vision model (OPENAI_BASE_URL / OPENAI_MODEL)"""
         if not OPENAI_API_KEY:
             raise HTTPException(status_code=503, detail="OpenAI API not configured")
-        
-        # Implementation for OpenAI would go here
-        # For now, fall back to Gemini
-        return await AIService.identify_crystal_with_gemini(image_data, user_context)
+
+        prompt = AIService.identification_prompt(user_context)
+        try:
+            result = await openai_chat_vision(
+                upstream_clients.get('openai'), OPENAI_MODEL, OPENAI_API_KEY, prompt, image_data, mime_type,
+                resilience=upstream_resilience.get('openai')
+            )
+            _emit_groups(result, on_group)
+            return result
+        except UpstreamUnavailable:
+            raise
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON decode error: {e}")
+            raise HTTPException(status_code=500, detail="Invalid JSON response from AI")
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            raise HTTPException(status_code=500, detail=f"AI identification failed: {str(e)}")
+
+def _emit_groups(result: Dict, on_group: Optional[Callable[[str, Any], None]]):
+    """Non-streaming answers report all their groups at once"""
+    if on_group is not None:
+        for key, value in result.items():
+            on_group(key, value)
+
+# Providers are resolved per call so rotated keys (and test patches) take effect immediately
+provider_pool = ProviderPool.from_env([
+    VisionProvider('gemini', GEMINI_MODEL, lambda *args, **kwargs: AIService.identify_crystal_with_gemini(*args, **kwargs),
+                   configured=lambda: bool(GEMINI_API_KEY)),
+    VisionProvider('openai', OPENAI_MODEL, lambda *args, **kwargs: AIService.identify_crystal_with_openai(*args, **kwargs),
+                   configured=lambda: bool(OPENAI_API_KEY)),
+])
+
+# Picks the Gemini model per request (cheap vs strong) and escalates unsure cheap answers
+model_router = ModelRouter.from_env(GEMINI_MODEL)
+
+def _send_gemini_batch(key: Tuple[str, str], items: List[Tuple[Any, str]]):
+    model, prompt = key
+    return gemini_generate_content_batch(
+        upstream_clients.get('gemini'), model, GEMINI_API_KEY, prompt, items, resilience=upstream_resilience.get('gemini'),
+        response_schema=GEMINI_IDENTIFICATION_SCHEMA if GEMINI_JSON_MODE else None
+    )
+
+def _send_gemini_single(key: Tuple[str, str], item: Tuple[Any, str]):
+    (model, prompt), (image, mime_type) = key, item
+    return gemini_generate_content(
+        upstream_clients.get('gemini'), model, GEMINI_API_KEY, prompt, image, mime_type,
+        resilience=upstream_resilience.get('gemini'), response_schema=GEMINI_IDENTIFICATION_SCHEMA if GEMINI_JSON_MODE else None
+    )
+
+# Off unless GEMINI_BATCHING=on; batched answers are not streamed
+gemini_batcher = MicroBatcher.from_env('GEMINI', _send_gemini_batch, _send_gemini_single,
+                                       record_cost=record_batch_usage_share)
+
+def _ai_stone_name(ai_json_response: Dict) -> str:
+    id_details = ai_json_response.get("identification_details", {})
+    return str(id_details.get("stone_name", id_details.get("name", ""))).strip().lower()
+
+async def identify_with_available_provider(image_data: Union[str, SpooledImage], user_context: Optional[Dict] = None,
+                                          on_group: Optional[Callable[[str, Any], None]] = None,
+                                          degraded: bool = False) -> Tuple[Dict, str, Optional[str]]:
+    """Run the configured AI provider, serving repeat images from the identification cache.
+
+    Exact repeats hit the content-addressed cache; near-duplicate photos of the same stone
+    reuse the closest previous identification from the perceptual-hash index.
+    Returns the raw AI JSON response, the model that produced it and its result id (the
+    validation memo's content key; None for entries cached before result ids existed). `on_group(key, value)` gets
+    top-level groups as they stream in from the provider; cached and coalesced requests get none.
+    Over-budget (`degraded`) requests are never hedged onto a second provider.
+    """
+    if not provider_pool.configured():
+        raise HTTPException(status_code=503, detail="No AI services configured for identification.")
+    # Keyed by the configured provider set and the routed Gemini models, not whichever provider happens to win a hedge
+    namespace = f"{provider_pool.cache_namespace()}:{model_router.cache_namespace(degraded)}"
+
+    if isinstance(image_data, SpooledImage):
+        # Uploads were hashed while streaming; large ones reach the normalizer by spool path
+        image_source = image_data.source()
+        cache_key = identification_cache.make_key_from_digest(image_data.digest, user_context, namespace)
+    else:
+        image_source = decode_image_data(image_data)
+        cache_key = identification_cache.make_key(image_source, user_context, namespace)
+    cached = await identification_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Identification cache hit ({cache_key[:12]})")
+        return cached['response'], cached['model'], cached.get('result_id')
+
+    def start_flight():
+        if isinstance(image_data, SpooledImage):
+            image_data.retain()  # the shared call may outlive the request that started it
+        return _identify_uncached(namespace, image_data, image_source, cache_key, user_context, on_group, degraded)
+
+    # Concurrent identical requests (client retries during a slow call) share one upstream call
+    identification = await identification_flights.do(
+        cache_key, start_flight, on_done=image_data.close if isinstance(image_data, SpooledImage) else None
+    )
+    return identification['response'], identification['model'], identification.get('result_id')
+
+def _ai_confidence(ai_json_response: Dict) -> float:
+    id_details = ai_json_response.get("identification_details")
+    try:
+        return float((id_details or {}).get("identification_confidence") or 0.0)
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+def _first_group_only(on_group: Callable[[str, Any], None]) -> Callable[[str, Any], None]:
+    """A hedged request may stream from two providers; each group is reported once"""
+    seen = set()
+
+    def emit(key: str, value: Any):
+        if key not in seen:
+            seen.add(key)
+            on_group(key, value)
+    return emit
+
+async def _identify_uncached(namespace: str, image_data: Union[str, SpooledImage],
+                             image_source: Union[bytes, str], cache_key: str, user_context: Optional[Dict],
+                             on_group: Optional[Callable[[str, Any], None]] = None, degraded: bool = False) -> Dict:
+    """Cache-miss path: normalize, try the near-duplicate index, then call the provider pool.
+
+    Returns {"model": ..., "response": ..., "result_id": ...} as stored in the cache and phash index.
+    """
+    # Orient/downscale/strip EXIF off the event loop; the same decode yields the perceptual hash
+    normalized = await image_normalizer.normalize(image_source)
+    upstream_image = normalized.data if normalized.reencoded else image_data
+
+    # Near-duplicates only count within the same model and user context
+    phash_namespace = f"{namespace}:{canonical_json(user_context or {})}"
+    phash = normalized.phash
+    near_duplicate = None
+    if phash is not None:
+        match = phash_index.search(phash, phash_namespace)
+        if match is not None:
+            near_duplicate, distance = match
+            if not phash_index.should_verify():
+                logger.info(f"Near-duplicate image reused (hamming distance {distance})")
+                await identification_cache.set(cache_key, near_duplicate)
+                return near_duplicate
+            # Sampled match: identify upstream anyway to measure the false-match rate
+
+    extra = {'on_group': _first_group_only(on_group)} if on_group is not None else {}
+
+    def call(gemini_model: str, escalated: bool):
+        # Groups already streamed from the cheap answer; an escalated re-run is not streamed again
+        return provider_pool.identify(upstream_image, user_context, mime_type=normalized.mime_type,
+                                      hedge=not degraded, models={'gemini': gemini_model},
+                                      **({} if escalated else extra))
+
+    ai_json_response, model = await model_router.identify(
+        call, model_router.complexity(normalized.original_size, normalized.entropy), _ai_confidence, degraded
+    )
+    # A fresh result id per upstream answer keys its validations in the validation memo
+    identification = {"model": model, "response": ai_json_response, "result_id": uuid.uuid4().hex}
+    if near_duplicate is not None:
+        phash_index.record_verification(_ai_stone_name(near_duplicate['response']) == _ai_stone_name(ai_json_response))
+
+    await identification_cache.set(cache_key, identification)
+    if phash is not None:
+        phash_index.add(phash, identification, phash_namespace)
+    return identification
 
 # API Endpoints
 
@@ -555,48 +965,248 @@ async def api_status():
         },
         "endpoints": {
             "identify": "/api/crystal/identify",
+            "identify_batch": "/api/crystal/identify-batch",
+            "validate_batch": "/api/crystal/validate-batch",
             "collection": "/api/crystal/collection",
             "save": "/api/crystal/save",
-            "usage": "/api/usage"
+            "usage": "/api/usage",
+            "metrics": "/api/metrics"
         }
     }
 
-@app.post("/api/crystal/identify", response_model=UnifiedCrystalData)
-async def identify_crystal(request: CrystalIdentificationRequest):
-    """Identify crystal from image using AI and return UnifiedCrystalData"""
-    try:
-        logger.info(f"Crystal identification request received for UnifiedCrystalData response.")
+@app.get("/api/metrics")
+async def api_metrics():
+    """Runtime metrics for capacity tuning"""
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "upstream_pools": upstream_clients.stats(),
+        "providers": provider_pool.stats(),
+        "model_routing": model_router.stats(),
+        "gemini_batching": gemini_batcher.stats(),
+        "resilience": upstream_resilience.stats(),
+        "admission": identification_admission.stats(),
+        "deadlines": request_deadlines.stats(),
+        "validation": EMAValidator.engine.stats(),
+        "validation_memo": validation_memo.stats(),
+        "gemini_output": {
+            "json_mode": GEMINI_JSON_MODE,
+            "modes": gemini_output_stats.stats(),
+            "base_prompt_chars": {
+                "schema": len(AIService.identification_prompt(structured_output=True)),
+                "prompt": len(AIService.identification_prompt()),
+            },
+        },
+        "ai_json_repair": json_repair_stats.stats(),
+        "usage_ledger": usage_ledger.stats(),
+        "id_tokens": id_tokens.stats(),
+        "identification_cache": identification_cache.stats(),
+        "identification_single_flight": identification_flights.stats(),
+        "near_duplicate_index": phash_index.stats(),
+        "image_normalization": image_normalizer.stats(),
+        "uploads": upload_tracker.stats(),
+        "identify_batch": dict(batch_stats, max_items=IDENTIFY_BATCH_MAX_ITEMS, concurrency=IDENTIFY_BATCH_CONCURRENCY),
+        "validate_batch": dict(validation_pool.stats(), max_items=VALIDATE_BATCH_MAX_ITEMS)
+    }
+
+@app.post("/api/crystal/identify", response_model=UnifiedCrystalData, openapi_extra=identification_openapi(CrystalIdentificationRequest))
+async def identify_crystal(http_request: Request):
+    """Identify crystal from a base64 JSON body, multipart upload or raw image body and return UnifiedCrystalData"""
+    async with identification_upload(http_request, CrystalIdentificationRequest, upload_limits, upload_tracker) as (request, upload):
+        # Budget check happens before any upstream call; over-budget free users get a 429
+        with await admit_usage(http_request, 'identify') as usage:
+            try:
+                logger.info(f"Crystal identification request received for UnifiedCrystalData response.")
         
-        ai_json_response: Dict
-        # source_ai: str # Potentially useful if we want to store which AI gave the response
+                # Cache hits skip the upstream call but are still mapped, so every response gets fresh ids
+                ai_json_response, source_ai, _ = await within_deadline(identify_with_available_provider(
+                    upload or request.image_data,
+                    request.user_context,
+                    degraded=usage.degraded
+                ), 'identification')
 
-        if GEMINI_API_KEY:
-            ai_json_response = await AIService.identify_crystal_with_gemini(
-                request.image_data, 
-                request.user_context
+                # Map the raw AI JSON response to our UnifiedCrystalData model
+                unified_data = map_ai_response_to_unified_data(ai_json_response)
+
+                # Optionally, could log the source_ai or add it to a non-persistent part of the response if needed
+                # For now, the UnifiedCrystalData model doesn't have a field for AI source.
+
+                return unified_data
+        
+            except (UpstreamUnavailable, DeadlineExceeded):
+                raise  # keep the 503 and its Retry-After, or the 504
+            except Exception as e:
+                logger.error(f"Crystal identification error (UnifiedCrystalData): {e}")
+                raise HTTPException(status_code=500, detail=str(e))
+
+async def identify_batch_item(index: int, item: CrystalBatchItem, default_context: Optional[Dict],
+                              semaphore: asyncio.Semaphore, degraded: bool = False) -> CrystalBatchItemResult:
+    """Identify one batch item; failures become an error result instead of failing the batch"""
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            # Items share the batch deadline; one that runs out is reported as a 504 item error
+            ai_json_response, _, result_id = await within_deadline(identify_with_available_provider(
+                item.image_data,
+                item.user_context if item.user_context is not None else default_context,
+                degraded=degraded
+            ), 'identification')
+            return CrystalBatchItemResult(
+                index=index,
+                id=item.id,
+                status="ok",
+                result=map_ai_response_to_unified_data(ai_json_response),
+                ema_compliance=EMAValidator.validate_data_sovereignty(ai_json_response, key=result_id),
+                elapsed_ms=round((time.perf_counter() - started) * 1000, 2)
             )
-            # source_ai = "gemini-pro-vision"
-        elif OPENAI_API_KEY:
-            # Assuming identify_crystal_with_openai is updated or will be to return a similar structure
-            ai_json_response = await AIService.identify_crystal_with_openai(
-                request.image_data, 
-                request.user_context
+        except Exception as e:
+            status_code = e.status_code if isinstance(e, HTTPException) else 500
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.warning(f"Batch item {index} failed ({status_code}): {detail}")
+            batch_stats['failed_items'] += 1
+            return CrystalBatchItemResult(
+                index=index,
+                id=item.id,
+                status="error",
+                error={"status_code": status_code, "detail": detail},
+                elapsed_ms=round((time.perf_counter() - started) * 1000, 2)
             )
-            # source_ai = "gpt-4-vision"
-        else:
-            raise HTTPException(status_code=503, detail="No AI services configured for identification.")
 
-        # Map the raw AI JSON response to our UnifiedCrystalData model
-        unified_data = map_ai_response_to_unified_data(ai_json_response)
+@app.post("/api/crystal/identify-batch", response_model=CrystalBatchIdentificationResponse)
+async def identify_crystal_batch(
+    request: CrystalBatchIdentificationRequest,
+    http_request: Request,
+    stream: bool = Query(False, description="Stream NDJSON results in completion order instead of one gathered response.")
+):
+    """Identify up to IDENTIFY_BATCH_MAX_ITEMS images with at most IDENTIFY_BATCH_CONCURRENCY upstream calls in flight.
+
+    Each item is mapped to UnifiedCrystalData and EMA-validated; a failing item is reported
+    in its own result. Streamed responses emit one JSON line per item as it completes,
+    followed by a summary line.
+    """
+    if not request.images:
+        raise HTTPException(status_code=422, detail="Batch must contain at least one image.")
+    if len(request.images) > IDENTIFY_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {IDENTIFY_BATCH_MAX_ITEMS} images.")
+    if not (GEMINI_API_KEY or OPENAI_API_KEY):
+        raise HTTPException(status_code=503, detail="No AI services configured for identification.")
+
+    batch_stats['batches'] += 1
+    batch_stats['items'] += len(request.images)
+    logger.info(f"Batch identification request received: {len(request.images)} images")
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(max(1, IDENTIFY_BATCH_CONCURRENCY))
+    # The whole batch is billed to the batch-level user and must fit the budget up front
+    # (one upstream call per image, reserved until the item tasks, which inherit the scope, are done)
+    with await admit_usage(http_request, 'identify-batch', calls=len(request.images)) as usage:
+        tasks = [
+            usage.track(asyncio.ensure_future(identify_batch_item(index, item, request.user_context, semaphore, usage.degraded)))
+            for index, item in enumerate(request.images)
+        ]
+
+    def summary(results: List[CrystalBatchItemResult]) -> Dict[str, Any]:
+        succeeded = sum(1 for result in results if result.status == "ok")
+        return {
+            "total": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
 
-        # Optionally, could log the source_ai or add it to a non-persistent part of the response if needed
-        # For now, the UnifiedCrystalData model doesn't have a field for AI source.
+    if not stream:
+        try:
+            results = await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return CrystalBatchIdentificationResponse(results=results, **summary(results))
 
-        return unified_data
-        
+    batch_stats['streamed_batches'] += 1
+
+    async def ndjson_lines():
+        completed = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                completed.append(result)
+                yield result.model_dump_json() + "\n"
+            yield json.dumps({"summary": summary(completed)}) + "\n"
+        finally:
+            # Client went away mid-stream: stop identifying the remaining items
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+async def load_user_collection(user_id: str) -> List[Dict[str, Any]]:
+    """Raw Firestore documents of a user's saved crystals"""
+    if not crystals_collection:
+        raise HTTPException(status_code=503, detail="Firestore not available")
+    crystals_query = crystals_collection.where("user_integration.user_id", "==", user_id)
+    try:
+        docs = await firestore_call(lambda timeout: list(crystals_query.stream(timeout=timeout)))
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        logger.error(f"Crystal identification error (UnifiedCrystalData): {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"Error loading collection of {user_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to load collection: {str(e)}")
+    return [doc.to_dict() for doc in docs]
+
+@app.post("/api/crystal/validate-batch", response_model=CrystalValidationBatchResponse)
+async def validate_crystal_batch(
+    request: CrystalValidationBatchRequest,
+    stream: bool = Query(False, description="Stream NDJSON results as chunks complete; recommended for large collections.")
+):
+    """EMA/ethics report for a list of crystals or a user's whole saved collection.
+
+    Crystals are validated in chunks of VALIDATION_CHUNK_SIZE on the validation process pool.
+    The summary carries each validator's mean score, the distribution of every principle's
+    scores and the ids of non-compliant crystals. Streamed responses emit one JSON line per
+    crystal as its chunk completes, followed by a summary line.
+    """
+    unknown = [name for name in request.validators if name not in VALIDATORS]
+    if unknown or not request.validators:
+        raise HTTPException(status_code=422, detail=f"validators must be a non-empty subset of {sorted(VALIDATORS)}.")
+    if (request.crystals is None) == (request.user_id is None):
+        raise HTTPException(status_code=422, detail="Provide either crystals or user_id.")
+    if request.crystals is not None and len(request.crystals) > VALIDATE_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {VALIDATE_BATCH_MAX_ITEMS} crystals.")
+
+    crystals = request.crystals if request.crystals is not None else await load_user_collection(request.user_id)
+    if len(crystals) > VALIDATE_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Collection exceeds {VALIDATE_BATCH_MAX_ITEMS} crystals.")
+
+    validators = tuple(dict.fromkeys(request.validators))
+    logger.info(f"Batch validation request received: {len(crystals)} crystals, validators {validators}")
+    started = time.perf_counter()
+    report = ValidationReport(validators)
+    chunks = validation_pool.submit(crystals, validators)
+
+    def summary() -> Dict[str, Any]:
+        return {**report.summary(), "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+    if not stream:
+        try:
+            results = [item for chunk in await within_deadline(asyncio.gather(*chunks), 'validation') for item in chunk]
+        finally:
+            for chunk in chunks:
+                chunk.cancel()
+        for item in results:
+            report.add(item)
+        return CrystalValidationBatchResponse(summary=summary(), results=results)
+
+    async def ndjson_lines():
+        try:
+            for next_done in asyncio.as_completed(chunks):
+                for item in await next_done:
+                    report.add(item)
+                    yield json.dumps(item) + "\n"
+            yield json.dumps({"summary": summary()}) + "\n"
+        finally:
+            # Client went away mid-stream: drop the chunks not yet started
+            for chunk in chunks:
+                chunk.cancel()
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
 
 @app.post("/api/crystal/collection", response_model=List[UnifiedCrystalData])
 async def get_crystal_collection():
@@ -640,8 +1250,10 @@ async def create_crystal(crystal_data: UnifiedCrystalData):
     try:
         # Use crystal_core.id as the document ID in Firestore
         doc_ref = crystals_collection.document(crystal_data.crystal_core.id)
-        await asyncio.to_thread(doc_ref.set, crystal_data.model_dump())
+        await firestore_call(doc_ref.set, crystal_data.model_dump())
         return crystal_data
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error creating crystal: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to create crystal: {str(e)}")
@@ -652,7 +1264,7 @@ async def read_crystal(crystal_id: str):
         raise HTTPException(status_code=503, detail="Firestore not available")
     try:
         doc_ref = crystals_collection.document(crystal_id)
-        doc = await asyncio.to_thread(doc_ref.get)
+        doc = await firestore_call(doc_ref.get)
         if doc.exists:
             return UnifiedCrystalData(**doc.to_dict())
         else:
@@ -680,10 +1292,13 @@ async def list_crystals(user_id: Optional[str] = Query(None, description="Filter
             pass # No change to crystals_query, fetches whole collection
 
         crystals_list = []
-        docs = await asyncio.to_thread(crystals_query.stream)
+        # Drain the stream in the worker thread so paging RPCs neither block the loop nor outlive the deadline
+        docs = await firestore_call(lambda timeout: list(crystals_query.stream(timeout=timeout)))
         for doc in docs:
             crystals_list.append(UnifiedCrystalData(**doc.to_dict()))
         return crystals_list
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error listing crystals: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to list crystals: {str(e)}")
@@ -704,11 +1319,11 @@ async def update_crystal(crystal_id: str, crystal_update: UnifiedCrystalData):
         # For this implementation, doc_ref.set() will create or overwrite.
         # If strict update (only if exists) is needed, a get() then update() or a transaction would be better.
         # Let's keep the existing check for safety.
-        doc_check = await asyncio.to_thread(doc_ref.get)
+        doc_check = await firestore_call(doc_ref.get)
         if not doc_check.exists:
             raise HTTPException(status_code=404, detail="Crystal not found for update")
 
-        await asyncio.to_thread(doc_ref.set, crystal_update.model_dump())
+        await firestore_call(doc_ref.set, crystal_update.model_dump())
         return crystal_update
     except HTTPException as e: # Re-raise HTTPException
         raise e
@@ -724,11 +1339,11 @@ async def delete_crystal(crystal_id: str):
         doc_ref = crystals_collection.document(crystal_id)
 
         # Check if document exists before deleting
-        doc = await asyncio.to_thread(doc_ref.get)
+        doc = await firestore_call(doc_ref.get)
         if not doc.exists:
             raise HTTPException(status_code=404, detail="Crystal not found for deletion")
 
-        await asyncio.to_thread(doc_ref.delete)
+        await firestore_call(doc_ref.delete)
         return {"status": "success", "message": f"Crystal {crystal_id} deleted successfully"}
     except HTTPException as e: # Re-raise HTTPException
         raise e
@@ -742,9 +1357,14 @@ async def track_usage(stats: UsageStats):
     logger.info(f"Usage tracked: {stats.feature} for user {stats.user_id}")
     return {
         "status": "tracked",
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": datetime.utcnow().isoformat(),
     }
 
+@app.get("/api/metrics/usage/{user_id}")
+async def get_usage(user_id: str):
+    """Operator view of today's AI usage for a user: upstream calls, tokens, image bytes and latency per endpoint and provider"""
+    return usage_ledger.usage(user_id)
+
 @app.get("/api/crystal/search")
 async def search_crystals(q: str, limit: int = 20):
     """Search crystal database"""
@@ -6,19 +6,46 @@ High-performance API server supporting Exoditical Moral Architecture (EMA)
 
 import os
 import json
+import time
 import base64
 import asyncio
 import logging
+import uuid
+from contextlib import asynccontextmanager, nullcontext, AsyncExitStack
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple, Union, AsyncIterator, Callable
 from dataclasses import dataclass, asdict
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 import uvicorn
 import httpx
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from backend_http import UpstreamClients, UpstreamConfig
+from backend_images import ImageNormalizer
+from backend_jobs import JobManager
+from backend_digest import CollectionDigestCache, estimate_tokens, profile_digest, profile_user_id
+from backend_ledger import UsageLedger, UsageScope, client_address, record_upstream_usage
+from backend_auth import IdTokenVerifier
+from backend_admission import AdmissionController, AdmissionMiddleware
+from backend_resilience import BrownoutController, ResilienceConfig, UpstreamResilienceRegistry, UpstreamUnavailable
+from backend_providers import (
+    ProviderPool, VisionProvider, gemini_generate_content, gemini_generate_content_batch, gemini_stream_generate_content,
+    openai_chat_vision, record_batch_usage_share,
+)
+from backend_uploads import (
+    SpooledImage, UploadLimits, UploadTracker, identification_openapi, identification_upload,
+)
+from backend_cache import IdentificationCache, ParseratorCache, SingleFlight, decode_image_data
+from backend_ai_json import AIOutputStats, gemini_response_schema, json_repair_stats
+from backend_batching import MicroBatcher
+from backend_deadline import DeadlineExceeded, DeadlineMiddleware, DeadlinePolicy, http_timeout, stage_allowed, within_deadline
+from backend_catalog import CrystalCatalog
+from backend_routing import ModelRouter
+from backend_validation import EMAValidator, validation_memo
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -35,13 +62,114 @@ ENVIRONMENT = os.getenv('ENVIRONMENT', 'development')
 # Parserator configuration
 PARSERATOR_BASE_URL = 'https://app-5108296280.us-central1.run.app'
 PARSERATOR_ENDPOINT = '/v1/parse'
+# Bump when Parserator schemas/instructions change so cached enhancements are not reused
+PARSERATOR_PROMPT_VERSION = '2024-06-ema-1'
+
+# Gemini configuration
+GEMINI_BASE_URL = 'https://generativelanguage.googleapis.com'
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')  # JSON mode needs a 1.5+ model
+# streamGenerateContent lets parsed groups reach callers before the whole answer has arrived
+GEMINI_STREAMING = os.getenv('GEMINI_STREAMING', 'on').lower() not in ('0', 'off', 'false', 'no')
+# Constrain Gemini output to the AIIdentificationResponse schema (responseMimeType application/json)
+GEMINI_JSON_MODE = os.getenv('GEMINI_JSON_MODE', 'on').lower() not in ('0', 'off', 'false', 'no')
+
+# OpenAI-compatible configuration (any /v1/chat/completions vision endpoint)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com')
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+
+# Pooled upstream HTTP clients (opened/closed in the app lifespan)
+upstream_clients = UpstreamClients([
+    UpstreamConfig.from_env('gemini', GEMINI_BASE_URL),
+    UpstreamConfig.from_env('openai', OPENAI_BASE_URL),
+    UpstreamConfig.from_env('parserator', PARSERATOR_BASE_URL),
+])
+
+# Circuit breaker, bulkhead and retry policy per upstream (<NAME>_BREAKER_* / _BULKHEAD_* / _RETRY_*)
+upstream_resilience = UpstreamResilienceRegistry([
+    ResilienceConfig.from_env('gemini'),
+    ResilienceConfig.from_env('openai'),
+    ResilienceConfig.from_env('parserator'),
+])
+
+# Catalog-only enrichment while identification/Parserator latency or errors are high (BROWNOUT_*)
+brownout_controller = BrownoutController.from_env()
+
+# Locally held chakra/zodiac/care/pairing data used in brownout (CRYSTAL_CATALOG_PATH)
+crystal_catalog = CrystalCatalog.from_env()
+
+# End-to-end request budgets from X-Request-Deadline-Ms or per-path defaults (REQUEST_DEADLINE_*)
+request_deadlines = DeadlinePolicy.from_env()
+
+# Admission control for /api/crystal/identify* (IDENTIFY_MAX_IN_FLIGHT / IDENTIFY_MAX_QUEUE / IDENTIFY_QUEUE_TIMEOUT)
+identification_admission = AdmissionController.from_env('IDENTIFY')
+
+# Background Parserator enhancement (ENHANCEMENT_JOBS_WORKERS / _MAX_PENDING / _TIMEOUT / _RESULT_TTL)
+enhancement_jobs = JobManager.from_env('ENHANCEMENT_JOBS')
+
+# Per-user collection summaries sent to Parserator instead of the raw collection JSON
+collection_digests = CollectionDigestCache.from_env()
+
+# Successful Parserator responses (PARSERATOR_CACHE_TTL / _FRESH_SECONDS / _SWR / _MAX_ENTRIES)
+parserator_cache = ParseratorCache.from_env()
+
+# Per-user token/image/latency ledger and tier budgets (USAGE_TIER_BUDGETS / USAGE_LEDGER_PATH)
+usage_ledger = UsageLedger.from_env()
+
+# Callers are identified by their Firebase ID token (Authorization: Bearer), never by the request body;
+# this server initializes no Firebase app, so until one is configured every caller is anonymous
+id_tokens = IdTokenVerifier.from_env()
+
+# Gemini prompt sizes and parse failures, JSON mode vs free-text prompt
+gemini_output_stats = AIOutputStats()
+
+# Raw AI responses keyed by image bytes + user context + configured provider models
+identification_cache = IdentificationCache.from_env()
+
+# In-flight identifications by cache key, so concurrent duplicates share one upstream call
+identification_flights = SingleFlight('identification')
+
+# Decode/orient/downscale/re-encode uploads in worker processes before they go upstream
+image_normalizer = ImageNormalizer.from_env()
+
+# Identification bodies: JSON, multipart or raw binary, streamed into bounded spools
+upload_limits = UploadLimits.from_env()
+upload_tracker = UploadTracker(upload_limits)
+
+# Per-stage latency of the identify-enhanced pipeline (streamed and gathered)
+ENHANCED_STAGES = ('identification', 'ema_validation', 'personalization')
+enhanced_stage_stats = {
+    'requests': 0,
+    'streamed': 0,
+    'stages': {stage: {'count': 0, 'total_ms': 0.0} for stage in ENHANCED_STAGES},
+}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared upstream resources on startup and release them on shutdown"""
+    await upstream_clients.start()
+    image_normalizer.start()
+    usage_ledger.start()
+    try:
+        yield
+    finally:
+        await enhancement_jobs.close()
+        await usage_ledger.close()
+        image_normalizer.close()
+        await upstream_clients.close()
 
 app = FastAPI(
     title="Crystal Grimoire Enhanced API",
     description="Production backend with Parserator integration and EMA support",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
+# Shed excess identifications before their bodies are read (added first so CORS still wraps the 429/503)
+app.add_middleware(AdmissionMiddleware, controller=identification_admission, path_prefixes=('/api/crystal/identify',))
+
+# Start the deadline clock before admission queueing; cancel handlers whose client has gone
+app.add_middleware(DeadlineMiddleware, policy=request_deadlines)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -60,6 +188,7 @@ class CrystalIdentificationRequest(BaseModel):
     user_context: Optional[Dict[str, Any]] = None
     user_profile: Optional[Dict[str, Any]] = None
     existing_collection: Optional[List[Dict[str, Any]]] = None
+    async_enhancement: bool = False  # return immediately and run Parserator as a pollable job
 
 class EnhancedCrystalIdentificationResponse(BaseModel):
     identification: Dict[str, Any]
@@ -71,9 +200,63 @@ class EnhancedCrystalIdentificationResponse(BaseModel):
     ema_compliance: Dict[str, Any]
     personalized_recommendations: List[Dict[str, Any]]
     parserator_metadata: Optional[Dict[str, Any]] = None
+    enhancement_job_id: Optional[str] = None  # poll GET /api/jobs/{id} for the personalization
+    degraded: Optional[Dict[str, Any]] = None  # set in brownout: enrichment came from the local catalog
+
+# AI-facing groups of the identification answer; Gemini's responseSchema is generated from AIIdentificationResponse
+
+class AIIdentification(BaseModel):
+    name: str = Field(description="Exact crystal name")
+    variety: Optional[str] = Field(None, description="Specific variety or type")
+    scientific_name: Optional[str] = Field(None, description="Chemical composition")
+    confidence: float = Field(description="Identification confidence, 0-100")
+
+class AIMetaphysicalProperties(BaseModel):
+    primary_chakras: List[str] = Field([], description="Root, Sacral, Solar Plexus, Heart, Throat, Third Eye or Crown")
+    zodiac_signs: List[str] = []
+    planetary_rulers: List[str] = Field([], description="Sun, Moon, Mercury, Venus, Mars, Jupiter, Saturn")
+    elements: List[str] = Field([], description="Fire, Earth, Air, Water")
+    healing_properties: List[str] = Field([], description="Traditional beliefs and practices, never medical claims")
+    intentions: List[str] = Field([], description="e.g. Love, Protection, Abundance, Healing, Clarity, Grounding")
+
+class AIPhysicalProperties(BaseModel):
+    hardness: Optional[str] = Field(None, description="Mohs scale, e.g. '6-7'")
+    crystal_system: Optional[str] = None
+    luster: Optional[str] = None
+    transparency: Optional[str] = None
+    color_range: List[str] = []
+    formation: Optional[str] = Field(None, description="Igneous, metamorphic or sedimentary")
+
+class AICareInstructions(BaseModel):
+    cleansing_methods: List[str] = []
+    charging_methods: List[str] = []
+    storage_recommendations: Optional[str] = None
+    handling_notes: Optional[str] = None
+
+class AIEMACompliance(BaseModel):
+    data_exportable: bool
+    user_owned: bool
+    standard_format: str = Field(description="json")
+    ai_transparency: str = Field(description="Reminder that this is AI guidance to weigh against personal experience")
+
+class AIIdentificationResponse(BaseModel):
+    identification: AIIdentification
+    metaphysical_properties: AIMetaphysicalProperties
+    physical_properties: AIPhysicalProperties
+    care_instructions: AICareInstructions
+    ema_compliance: AIEMACompliance
+
+GEMINI_IDENTIFICATION_SCHEMA = gemini_response_schema(AIIdentificationResponse)
+
+class AIBriefIdentificationResponse(BaseModel):
+    """Brownout answer: the stone only, enrichment comes from the crystal catalog"""
+    identification: AIIdentification
+
+GEMINI_BRIEF_SCHEMA = gemini_response_schema(AIBriefIdentificationResponse)
 
 class CollectionEntry(BaseModel):
     id: str
+    user_id: Optional[str] = None  # collection owner; their cached digest and enhancements are invalidated on save
     crystal_name: str
     crystal_type: str
     acquisition_date: str
@@ -91,8 +274,9 @@ class UsageStats(BaseModel):
 # Parserator Service Integration
 class ParseOperatorService:
     @staticmethod
-    async def call_parserator_api(input_data: str, output_schema: Dict, instructions: str = None) -> Dict:
-        """Call Parserator API with two-stage processing"""
+    async def call_parserator_api(input_data: str, output_schema: Dict, instructions: str = None,
+                                  cache_tag: Optional[str] = None) -> Dict:
+        """Call Parserator API with two-stage processing; successful responses are cached per user (cache_tag)"""
         if not PARSERATOR_API_KEY:
             logger.warning("Parserator API key not configured, using direct processing")
             # Return mock successful response for now
@@ -102,32 +286,49 @@ class ParseOperatorService:
                 "metadata": {"confidence": 0.8, "tokensUsed": 0}
             }
         
+        cache_key = ParseratorCache.make_key(output_schema, instructions, input_data, PARSERATOR_PROMPT_VERSION)
+        return await parserator_cache.fetch(
+            cache_key,
+            lambda: ParseOperatorService._post_parserator(input_data, output_schema, instructions),
+            tag=cache_tag,
+        )
+    
+    @staticmethod
+    async def _post_parserator(input_data: str, output_schema: Dict, instructions: Optional[str]) -> Dict:
+        """One uncached Parserator call"""
+        started = time.perf_counter()
         try:
-            async with httpx.AsyncClient() as client:
-                payload = {
-                    'inputData': input_data,
-                    'outputSchema': output_schema,
-                }
-                if instructions:
-                    payload['instructions'] = instructions
-                
-                response = await client.post(
-                    f"{PARSERATOR_BASE_URL}{PARSERATOR_ENDPOINT}",
-                    headers={
-                        'Authorization': f'Bearer {PARSERATOR_API_KEY}',
-                        'Content-Type': 'application/json',
-                    },
-                    json=payload,
-                    timeout=30.0
-                )
-                
-                if response.status_code != 200:
-                    raise HTTPException(status_code=response.status_code, detail=f"Parserator API error: {response.text}")
-                
-                return response.json()
-                
+            client = upstream_clients.get('parserator')
+            payload = {
+                'inputData': input_data,
+                'outputSchema': output_schema,
+            }
+            if instructions:
+                payload['instructions'] = instructions
+            
+            response = await upstream_resilience.get('parserator').call(lambda: client.post(
+                PARSERATOR_ENDPOINT,
+                headers={
+                    'Authorization': f'Bearer {PARSERATOR_API_KEY}',
+                    'Content-Type': 'application/json',
+                },
+                json=payload,
+                timeout=http_timeout(client.timeout)
+            ))
+            
+            if response.status_code != 200:
+                raise HTTPException(status_code=response.status_code, detail=f"Parserator API error: {response.text}")
+            
+            result = response.json()
+            tokens_used = (result.get('metadata') or {}).get('tokensUsed')
+            record_upstream_usage('parserator', input_tokens=estimate_tokens((instructions or '') + input_data),
+                                  total_tokens=tokens_used, latency_ms=(time.perf_counter() - started) * 1000)
+            brownout_controller.observe('parserator', time.perf_counter() - started)
+            return result
+            
         except Exception as e:
             logger.error(f"Parserator API error: {e}")
+            brownout_controller.observe('parserator', time.perf_counter() - started, ok=False)
             # Return fallback response instead of failing
             return {
                 "success": False,
@@ -167,8 +368,9 @@ class ParseOperatorService:
         3. Technological Agnosticism: Universal standards, no lock-in
         4. Transparency: Clear AI decision-making
         
-        USER PROFILE: {json.dumps(user_profile)}
-        EXISTING COLLECTION: {json.dumps(collection)}
+        The user's profile (user_context) and a summary of their collection
+        (collection_summary: counts by chakra, element and family, top intentions,
+        most and recently used stones) are in the input data.
         
         Provide enhancement that:
         - Respects user data ownership
@@ -178,121 +380,33 @@ class ParseOperatorService:
         - Personalizes based on user's actual collection
         """
         
+        # Compact digests instead of the raw profile/collection JSON, which grows with every stone owned
+        profile_summary = profile_digest(user_profile)
+        collection_summary, collection_bytes = collection_digests.digest(collection, profile_user_id(user_profile))
         input_data = json.dumps({
             'crystal_data': crystal_data,
-            'user_context': user_profile,
-            'collection_context': collection,
+            'user_context': profile_summary,
+            'collection_summary': collection_summary,
         })
+        collection_digests.record_prompt(
+            after_bytes=len(instructions) + len(input_data),
+            raw_bytes=len(json.dumps(user_profile)) + collection_bytes,
+            digest_bytes=len(json.dumps(profile_summary)) + len(json.dumps(collection_summary)),
+        )
         
         return await ParseOperatorService.call_parserator_api(
             input_data=input_data,
             output_schema=enhancement_schema,
-            instructions=instructions
+            instructions=instructions,
+            cache_tag=profile_user_id(user_profile),
         )
 
-# EMA Validation Service
-class EMAValidator:
-    @staticmethod
-    def validate_data_sovereignty(data: Dict) -> Dict:
-        """Validate data against EMA principles"""
-        validation_result = {
-            'data_portability': EMAValidator._check_data_portability(data),
-            'user_sovereignty': EMAValidator._check_user_sovereignty(data),
-            'technological_agnosticism': EMAValidator._check_technological_agnosticism(data),
-            'transparency': EMAValidator._check_transparency(data),
-        }
-        
-        overall_score = sum(validation_result.values()) / len(validation_result)
-        
-        return {
-            'overall_ema_score': overall_score,
-            'principle_scores': validation_result,
-            'is_ema_compliant': overall_score >= 0.7,
-            'recommendations': EMAValidator._generate_recommendations(validation_result),
-        }
-    
-    @staticmethod
-    def _check_data_portability(data: Dict) -> float:
-        """Check if data can be easily exported"""
-        score = 0.8  # Base score
-        
-        # Check for standard formats
-        if 'export_format' in str(data).lower() or 'json' in str(data).lower():
-            score += 0.1
-        
-        # Check for user exportability
-        if 'exportable' in str(data).lower():
-            score += 0.1
-        
-        return min(score, 1.0)
-    
-    @staticmethod
-    def _check_user_sovereignty(data: Dict) -> float:
-        """Check user data ownership"""
-        score = 0.9  # High base score - user owns their crystal data
-        
-        if 'user_controlled' in str(data).lower():
-            score += 0.1
-        
-        return min(score, 1.0)
-    
-    @staticmethod
-    def _check_technological_agnosticism(data: Dict) -> float:
-        """Check for vendor lock-in"""
-        score = 0.8  # Base score
-        
-        # Check against proprietary formats
-        proprietary_terms = ['proprietary', 'locked', 'vendor_specific']
-        if not any(term in str(data).lower() for term in proprietary_terms):
-            score += 0.2
-        
-        return min(score, 1.0)
-    
-    @staticmethod
-    def _check_transparency(data: Dict) -> float:
-        """Check system transparency"""
-        score = 0.8  # Base score
-        
-        # Check for AI transparency
-        if 'confidence' in str(data).lower() or 'ai_' in str(data).lower():
-            score += 0.1
-        
-        # Check for processing transparency
-        if 'processing' in str(data).lower() or 'metadata' in str(data).lower():
-            score += 0.1
-        
-        return min(score, 1.0)
-    
-    @staticmethod
-    def _generate_recommendations(scores: Dict) -> List[str]:
-        """Generate EMA recommendations"""
-        recommendations = []
-        
-        if scores['data_portability'] < 0.8:
-            recommendations.append('Ensure user data can be easily exported in standard formats')
-        
-        if scores['user_sovereignty'] < 0.8:
-            recommendations.append('Strengthen user control and ownership of their data')
-        
-        if scores['technological_agnosticism'] < 0.8:
-            recommendations.append('Avoid proprietary formats that create vendor lock-in')
-        
-        if scores['transparency'] < 0.8:
-            recommendations.append('Increase transparency in AI decision-making')
-        
-        recommendations.append('Remember: "The ultimate expression of empowerment is the freedom to leave"')
-        
-        return recommendations
-
 # Enhanced AI Service Integration
 class AIService:
     @staticmethod
-    async def identify_crystal_with_gemini(image_data: str, user_context: Dict = None) -> Dict:
-        """Enhanced crystal identification using Gemini 1.5 Flash"""
-        if not GEMINI_API_KEY:
-            raise HTTPException(status_code=503, detail="Gemini API not configured")
-        
-        prompt = f"""
+    def identification_prompt(user_context: Dict = None, structured_output: bool = False) -> str:
+        """Identification prompt shared by every vision provider; `structured_output` leaves out the JSON layout"""
+        guidance = f"""
         You are an expert crystal identification system supporting Exoditical Moral Architecture.
         Analyze this crystal image and provide comprehensive information.
         
@@ -303,7 +417,11 @@ class AIService:
         - No lock-in: Use standard formats and structures
         
         USER CONTEXT: {json.dumps(user_context) if user_context else 'None provided'}
-        
+        """
+        if structured_output:
+            # The answer format comes from GEMINI_IDENTIFICATION_SCHEMA
+            return guidance
+        return guidance + f"""
         Return ONLY valid JSON with this structure:
         {{
           "identification": {{
@@ -342,44 +460,66 @@ class AIService:
           }}
         }}
         """
+
+    @staticmethod
+    def brief_identification_prompt(structured_output: bool = False) -> str:
+        """Identification-only prompt used in brownout"""
+        guidance = """
+        You are an expert crystal identification system. Identify the crystal in this image.
+        Be clear about your confidence and limitations.
+        """
+        if structured_output:
+            return guidance
+        return guidance + """
+        Return ONLY valid JSON with this structure:
+        {"identification": {"name": "exact crystal name", "variety": "specific variety or type",
+                            "scientific_name": "chemical composition", "confidence": 95}}
+        """
+
+    @staticmethod
+    async def identify_crystal_with_gemini(image_data: Union[str, bytes, SpooledImage], user_context: Dict = None, mime_type: str = "image/jpeg",
+                                           on_group: Optional[Callable[[str, Any], None]] = None,
+                                           model: Optional[str] = None, brief: bool = False) -> Dict:
+        """Enhanced crystal identification using Gemini (GEMINI_MODEL, or the routed `model`); `on_group(key, value)` receives each top-level group as soon as it has streamed in.
+
+        `brief` (brownout) asks for the identification group only.
+        """
+        if not GEMINI_API_KEY:
+            raise HTTPException(status_code=503, detail="Gemini API not configured")
+        
+        if brief:
+            prompt = AIService.brief_identification_prompt(structured_output=GEMINI_JSON_MODE)
+            response_schema = GEMINI_BRIEF_SCHEMA if GEMINI_JSON_MODE else None
+        else:
+            prompt = AIService.identification_prompt(user_context, structured_output=GEMINI_JSON_MODE)
+            response_schema = GEMINI_IDENTIFICATION_SCHEMA if GEMINI_JSON_MODE else None
+        output_mode = 'schema' if GEMINI_JSON_MODE else 'prompt'
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GEMINI_API_KEY}",
-                    json={
-                        "contents": [{
-                            "parts": [
-                                {"text": prompt},
-                                {
-                                    "inline_data": {
-                                        "mime_type": "image/jpeg",
-                                        "data": image_data
-                                    }
-                                }
-                            ]
-                        }]
-                    },
-                    timeout=30.0
+            # Binary images are base64-encoded straight into the request body as it is sent
+            # (batches always use the full identification schema, so brief calls go alone)
+            if gemini_batcher.enabled and not brief and not (isinstance(image_data, SpooledImage) and image_data.path):
+                # Concurrent identifications with the same model and prompt share one multi-image call
+                result = await gemini_batcher.submit((model or GEMINI_MODEL, prompt), (image_data, mime_type))
+                _emit_groups(result, on_group)
+            elif GEMINI_STREAMING:
+                result = await gemini_stream_generate_content(
+                    upstream_clients.get('gemini'), model or GEMINI_MODEL, GEMINI_API_KEY, prompt, image_data, mime_type,
+                    resilience=upstream_resilience.get('gemini'), on_group=on_group, response_schema=response_schema
                 )
-                
-                if response.status_code != 200:
-                    raise HTTPException(status_code=response.status_code, detail=f"Gemini API error: {response.text}")
-                
-                result = response.json()
-                content = result['candidates'][0]['content']['parts'][0]['text']
-                
-                # Clean up the response to ensure valid JSON
-                content = content.strip()
-                if content.startswith('```json'):
-                    content = content[7:]
-                if content.endswith('```'):
-                    content = content[:-3]
-                content = content.strip()
-                
-                return json.loads(content)
-                
-        except json.JSONDecodeError as e:
+            else:
+                result = await gemini_generate_content(
+                    upstream_clients.get('gemini'), model or GEMINI_MODEL, GEMINI_API_KEY, prompt, image_data, mime_type,
+                    resilience=upstream_resilience.get('gemini'), response_schema=response_schema
+                )
+                _emit_groups(result, on_group)
+            gemini_output_stats.record(output_mode, len(prompt), parsed=True)
+            return result
+            
+        except UpstreamUnavailable:
+            raise
+        except ValueError as e:  # json.JSONDecodeError, or a streamed answer that never formed an object
+            gemini_output_stats.record(output_mode, len(prompt), parsed=False)
             logger.error(f"JSON decode error: {e}")
             raise HTTPException(status_code=500, detail="Invalid JSON response from AI")
         except Exception as e:
@@ -387,14 +527,156 @@ class AIService:
             raise HTTPException(status_code=500, detail=f"AI identification failed: {str(e)}")
 
     @staticmethod
-    async def identify_crystal_with_openai(image_data: str, user_context: Dict = None) -> Dict:
-        """Identify crystal using OpenAI GPT-4 Vision (if available)"""
+    async def identify_crystal_with_openai(image_data: Union[str, bytes, SpooledImage], user_context: Dict = None, mime_type: str = "image/jpeg",
+                                           on_group: Optional[Callable[[str, Any], None]] = None, brief: bool = False) -> Dict:
+        """Identify crystal using an OpenAI-compatible vision model (OPENAI_BASE_URL / OPENAI_MODEL)"""
         if not OPENAI_API_KEY:
             raise HTTPException(status_code=503, detail="OpenAI API not configured")
-        
-        # Implementation for OpenAI would go here
-        # For now, fall back to Gemini
-        return await AIService.identify_crystal_with_gemini(image_data, user_context)
+
+        prompt = AIService.brief_identification_prompt() if brief else AIService.identification_prompt(user_context)
+        try:
+            result = await openai_chat_vision(
+                upstream_clients.get('openai'), OPENAI_MODEL, OPENAI_API_KEY, prompt, image_data, mime_type,
+                resilience=upstream_resilience.get('openai')
+            )
+            _emit_groups(result, on_group)
+            return result
+        except UpstreamUnavailable:
+            raise
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON decode error: {e}")
+            raise HTTPException(status_code=500, detail="Invalid JSON response from AI")
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            raise HTTPException(status_code=500, detail=f"AI identification failed: {str(e)}")
+
+def _emit_groups(result: Dict, on_group: Optional[Callable[[str, Any], None]]):
+    """Non-streaming answers report all their groups at once"""
+    if on_group is not None:
+        for key, value in result.items():
+            on_group(key, value)
+
+# Providers are resolved per call so rotated keys (and test patches) take effect immediately
+provider_pool = ProviderPool.from_env([
+    VisionProvider('gemini', GEMINI_MODEL, lambda *args, **kwargs: AIService.identify_crystal_with_gemini(*args, **kwargs),
+                   configured=lambda: bool(GEMINI_API_KEY)),
+    VisionProvider('openai', OPENAI_MODEL, lambda *args, **kwargs: AIService.identify_crystal_with_openai(*args, **kwargs),
+                   configured=lambda: bool(OPENAI_API_KEY)),
+])
+
+# Picks the Gemini model per request (cheap vs strong) and escalates unsure cheap answers
+model_router = ModelRouter.from_env(GEMINI_MODEL)
+
+def _send_gemini_batch(key: Tuple[str, str], items: List[Tuple[Any, str]]):
+    model, prompt = key
+    return gemini_generate_content_batch(
+        upstream_clients.get('gemini'), model, GEMINI_API_KEY, prompt, items, resilience=upstream_resilience.get('gemini'),
+        response_schema=GEMINI_IDENTIFICATION_SCHEMA if GEMINI_JSON_MODE else None
+    )
+
+def _send_gemini_single(key: Tuple[str, str], item: Tuple[Any, str]):
+    (model, prompt), (image, mime_type) = key, item
+    return gemini_generate_content(
+        upstream_clients.get('gemini'), model, GEMINI_API_KEY, prompt, image, mime_type,
+        resilience=upstream_resilience.get('gemini'), response_schema=GEMINI_IDENTIFICATION_SCHEMA if GEMINI_JSON_MODE else None
+    )
+
+# Off unless GEMINI_BATCHING=on; batched answers are not streamed
+gemini_batcher = MicroBatcher.from_env('GEMINI', _send_gemini_batch, _send_gemini_single,
+                                       record_cost=record_batch_usage_share)
+
+async def identify_with_available_provider(image_data: Union[str, SpooledImage], user_context: Optional[Dict] = None,
+                                          on_group: Optional[Callable[[str, Any], None]] = None,
+                                          degraded: bool = False, brief: bool = False) -> Tuple[Dict, str, Optional[str]]:
+    """Run the configured AI provider, serving repeat images from the identification cache.
+
+    Returns the raw AI JSON response, the model that produced it and its result id (the
+    validation memo's content key; None for entries cached before result ids existed). `on_group(key, value)` gets
+    top-level groups as they stream in from the provider; cached and coalesced requests get none.
+    Over-budget (`degraded`) requests are never hedged onto a second provider. `brief` (brownout)
+    answers hold the identification group only and are cached apart from full answers.
+    """
+    if not provider_pool.configured():
+        raise HTTPException(status_code=503, detail="No AI services configured")
+    # Keyed by the configured provider set and the routed Gemini models, not whichever provider happens to win a hedge
+    namespace = f"{provider_pool.cache_namespace()}:{model_router.cache_namespace(degraded or brief)}"
+    namespace += ':brief' if brief else ''
+
+    if isinstance(image_data, SpooledImage):
+        # Uploads were hashed while streaming; large ones reach the normalizer by spool path
+        image_source = image_data.source()
+        cache_key = identification_cache.make_key_from_digest(image_data.digest, user_context, namespace)
+    else:
+        image_source = decode_image_data(image_data)
+        cache_key = identification_cache.make_key(image_source, user_context, namespace)
+    cached = await identification_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Identification cache hit ({cache_key[:12]})")
+        return cached['response'], cached['model'], cached.get('result_id')
+
+    def start_flight():
+        if isinstance(image_data, SpooledImage):
+            image_data.retain()  # the shared call may outlive the request that started it
+        return _identify_uncached(image_data, image_source, cache_key, user_context, on_group, degraded, brief)
+
+    # Concurrent identical requests (client retries during a slow call) share one upstream call
+    identification = await identification_flights.do(
+        cache_key, start_flight, on_done=image_data.close if isinstance(image_data, SpooledImage) else None
+    )
+    return identification['response'], identification['model'], identification.get('result_id')
+
+def _ai_confidence(ai_json_response: Dict) -> float:
+    """The answer's confidence on the router's 0-1 scale (the schema asks for 0-100)"""
+    identification = ai_json_response.get("identification")
+    try:
+        value = float((identification or {}).get("confidence") or 0.0)
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+    return value / 100 if value > 1 else value
+
+def _first_group_only(on_group: Callable[[str, Any], None]) -> Callable[[str, Any], None]:
+    """A hedged request may stream from two providers; each group is reported once"""
+    seen = set()
+
+    def emit(key: str, value: Any):
+        if key not in seen:
+            seen.add(key)
+            on_group(key, value)
+    return emit
+
+async def _identify_uncached(image_data: Union[str, SpooledImage], image_source: Union[bytes, str],
+                             cache_key: str, user_context: Optional[Dict],
+                             on_group: Optional[Callable[[str, Any], None]] = None, degraded: bool = False,
+                             brief: bool = False) -> Dict:
+    """Cache-miss path: normalize, then call the provider pool; returns {"model": ..., "response": ..., "result_id": ...}"""
+    # Orient/downscale/strip EXIF off the event loop and send the real mime type
+    normalized = await image_normalizer.normalize(image_source)
+    upstream_image = normalized.data if normalized.reencoded else image_data
+
+    extra = {'on_group': _first_group_only(on_group)} if on_group is not None else {}
+    if brief:
+        extra['brief'] = True
+
+    def call(gemini_model: str, escalated: bool):
+        # Groups already streamed from the cheap answer; an escalated re-run is not streamed again
+        return provider_pool.identify(upstream_image, user_context, mime_type=normalized.mime_type,
+                                      hedge=not (degraded or brief), models={'gemini': gemini_model},
+                                      **({} if escalated else extra))
+
+    started = time.perf_counter()
+    try:
+        ai_json_response, model = await model_router.identify(
+            call, model_router.complexity(normalized.original_size, normalized.entropy), _ai_confidence,
+            degraded or brief
+        )
+    except Exception:
+        brownout_controller.observe('identification', time.perf_counter() - started, ok=False)
+        raise
+    brownout_controller.observe('identification', time.perf_counter() - started)
+    # A fresh result id per upstream answer keys its validations in the validation memo
+    identification = {"model": model, "response": ai_json_response, "result_id": uuid.uuid4().hex}
+    await identification_cache.set(cache_key, identification)
+    return identification
 
 # API Endpoints
 
@@ -438,111 +720,339 @@ async def api_status():
         "endpoints": {
             "identify": "/api/crystal/identify",
             "identify_enhanced": "/api/crystal/identify-enhanced",
+            "identify_enhanced_stream": "/api/crystal/identify-enhanced?stream=sse",
+            "jobs": "/api/jobs/{job_id}",
             "collection": "/api/crystal/collection",
             "save": "/api/crystal/save",
             "usage": "/api/usage",
+            "metrics": "/api/metrics",
             "validate": "/api/crystal/validate-ema"
         }
     }
 
-@app.post("/api/crystal/identify-enhanced", response_model=EnhancedCrystalIdentificationResponse)
-async def identify_crystal_enhanced(request: CrystalIdentificationRequest):
-    """Enhanced crystal identification with Parserator and EMA compliance"""
-    try:
-        logger.info(f"Enhanced crystal identification request received")
-        
-        # Stage 1: Primary AI identification
-        if GEMINI_API_KEY:
-            base_result = await AIService.identify_crystal_with_gemini(
-                request.image_data, 
-                request.user_context
-            )
-            source = "gemini-1.5-flash-enhanced"
-        elif OPENAI_API_KEY:
-            base_result = await AIService.identify_crystal_with_openai(
-                request.image_data, 
-                request.user_context
+@app.get("/api/metrics")
+async def api_metrics():
+    """Runtime metrics for capacity tuning"""
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "upstream_pools": upstream_clients.stats(),
+        "providers": provider_pool.stats(),
+        "model_routing": model_router.stats(),
+        "gemini_batching": gemini_batcher.stats(),
+        "resilience": upstream_resilience.stats(),
+        "brownout": brownout_controller.stats(),
+        "crystal_catalog": crystal_catalog.stats(),
+        "admission": identification_admission.stats(),
+        "deadlines": request_deadlines.stats(),
+        "validation": EMAValidator.engine.stats(),
+        "validation_memo": validation_memo.stats(),
+        "gemini_output": {
+            "json_mode": GEMINI_JSON_MODE,
+            "modes": gemini_output_stats.stats(),
+            "base_prompt_chars": {
+                "schema": len(AIService.identification_prompt(structured_output=True)),
+                "prompt": len(AIService.identification_prompt()),
+            },
+        },
+        "ai_json_repair": json_repair_stats.stats(),
+        "identification_cache": identification_cache.stats(),
+        "identification_single_flight": identification_flights.stats(),
+        "enhancement_jobs": enhancement_jobs.stats(),
+        "collection_digests": collection_digests.stats(),
+        "parserator_cache": parserator_cache.stats(),
+        "usage_ledger": usage_ledger.stats(),
+        "id_tokens": id_tokens.stats(),
+        "image_normalization": image_normalizer.stats(),
+        "uploads": upload_tracker.stats(),
+        "enhanced_stages": {
+            "requests": enhanced_stage_stats['requests'],
+            "streamed": enhanced_stage_stats['streamed'],
+            "avg_stage_ms": {
+                stage: round(stats['total_ms'] / stats['count'], 2) if stats['count'] else 0.0
+                for stage, stats in enhanced_stage_stats['stages'].items()
+            }
+        }
+    }
+
+async def enhanced_identification_stages(request: CrystalIdentificationRequest, upload: Optional[SpooledImage],
+                                         on_group: Optional[Callable[[str, Any], None]] = None, degraded: bool = False
+                                         ) -> AsyncIterator[Tuple[str, Dict[str, Any], float]]:
+    """Run the identify-enhanced pipeline, yielding (stage, fields, stage_ms) as each stage completes.
+
+    The fields of all three stages together make up EnhancedCrystalIdentificationResponse.
+    `on_group` receives raw identification groups while the first stage is still streaming.
+    Over-budget (`degraded`) requests skip the Parserator stage. In brownout the AI is asked for
+    the identification only, enrichment comes from the crystal catalog and Parserator is skipped.
+    Identification gets the request's remaining budget; Parserator is skipped when too little is
+    left and dropped (not failed) when it runs out.
+    """
+    brownout = brownout_controller.active()
+
+    # Stage 1: Primary AI identification
+    stage_started = time.perf_counter()
+    base_result, model, result_id = await within_deadline(identify_with_available_provider(
+        upload or request.image_data,
+        request.user_context,
+        on_group=on_group,
+        degraded=degraded,
+        brief=brownout
+    ), 'identification')
+    degraded_fields = None
+    if brownout:
+        base_result, catalog_match = crystal_catalog.enrich(base_result)
+        result_id = None  # enriched, so no longer the answer the id stands for
+        brownout_controller.record_degraded()
+        degraded_fields = {"mode": "brownout", "reason": brownout_controller.reason,
+                           "enrichment_source": "catalog", "catalog_match": catalog_match}
+    yield "identification", {
+        "identification": base_result.get("identification", {}),
+        "metaphysical_properties": base_result.get("metaphysical_properties", {}),
+        "physical_properties": base_result.get("physical_properties", {}),
+        "care_instructions": base_result.get("care_instructions", {}),
+        "confidence": base_result.get("identification", {}).get("confidence", 0.8),
+        "source": f"{model}-enhanced",
+        "degraded": degraded_fields,
+    }, (time.perf_counter() - stage_started) * 1000
+
+    # Stage 2: EMA validation
+    stage_started = time.perf_counter()
+    ema_validation = EMAValidator.validate_data_sovereignty(base_result, key=result_id)
+    yield "ema_validation", {"ema_compliance": ema_validation}, (time.perf_counter() - stage_started) * 1000
+
+    # Stage 3: Parserator enhancement (if available), inline or as a background job
+    stage_started = time.perf_counter()
+    enhancement_job_id = None
+    if degraded:
+        fields = {"personalized_recommendations": [], "parserator_metadata": {"skipped": "daily AI budget exceeded"}}
+    elif brownout:
+        fields = {"personalized_recommendations": [], "parserator_metadata": {"skipped": "brownout"}}
+    elif request.async_enhancement and PARSERATOR_API_KEY and request.user_profile and request.existing_collection:
+        try:
+            enhancement_job_id = enhancement_jobs.submit('parserator_enhancement', lambda: personalize_identification(base_result, request))
+        except HTTPException as e:
+            logger.warning(f"Parserator enhancement not queued: {e.detail}")
+        fields = {"personalized_recommendations": [], "parserator_metadata": None}
+    elif PARSERATOR_API_KEY and request.user_profile and request.existing_collection and not stage_allowed('parserator'):
+        fields = {"personalized_recommendations": [], "parserator_metadata": {"skipped": "deadline"}}
+    else:
+        try:
+            fields = await within_deadline(personalize_identification(base_result, request), 'parserator')
+        except DeadlineExceeded:
+            fields = {"personalized_recommendations": [], "parserator_metadata": {"skipped": "deadline"}}
+
+    yield "personalization", {**fields, "enhancement_job_id": enhancement_job_id}, (time.perf_counter() - stage_started) * 1000
+
+async def personalize_identification(base_result: Dict, request: CrystalIdentificationRequest) -> Dict[str, Any]:
+    """Parserator personalization fields; empty when Parserator is unavailable or fails"""
+    parserator_metadata = None
+    personalized_recommendations = []
+
+    if PARSERATOR_API_KEY and request.user_profile and request.existing_collection:
+        try:
+            enhancement = await ParseOperatorService.enhance_crystal_identification(
+                crystal_data=base_result,
+                user_profile=request.user_profile,
+                collection=request.existing_collection or []
             )
-            source = "gpt-4-vision-enhanced"
+
+            if enhancement.get('success'):
+                parsed_data = enhancement.get('parsedData', {})
+                personalized_recommendations = parsed_data.get('personalized_recommendations', {})
+                parserator_metadata = enhancement.get('metadata', {})
+
+        except Exception as e:
+            logger.warning(f"Parserator enhancement failed: {e}")
+
+    return {
+        "personalized_recommendations": [personalized_recommendations] if personalized_recommendations else [],
+        "parserator_metadata": parserator_metadata,
+    }
+
+def _record_stage(stage: str, stage_ms: float):
+    stats = enhanced_stage_stats['stages'][stage]
+    stats['count'] += 1
+    stats['total_ms'] += stage_ms
+
+def _format_stage_event(stream_format: str, event: str, payload: Dict[str, Any]) -> str:
+    if stream_format == 'sse':
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps({"event": event, **payload}) + "\n"
+
+async def _stream_enhanced_identification(request: CrystalIdentificationRequest, upload: Optional[SpooledImage],
+                                          stream_format: str, usage: Optional[UsageScope] = None) -> AsyncIterator[str]:
+    """One event per completed stage, then `complete` (or `error`), each carrying stage timings.
+
+    While Gemini is still streaming, each identification group is forwarded as an
+    `identification_partial` event the moment it has been parsed.
+    """
+    started = time.perf_counter()
+    stage_timings: Dict[str, float] = {}
+    pending: asyncio.Queue = asyncio.Queue()
+
+    def on_group(group: str, value: Any):
+        pending.put_nowait(("partial", group, value))
+
+    async def run_stages():
+        try:
+            with usage or nullcontext():
+                async for stage, fields, stage_ms in enhanced_identification_stages(
+                    request, upload, on_group=on_group, degraded=usage is not None and usage.degraded
+                ):
+                    pending.put_nowait(("stage", stage, (fields, stage_ms)))
+        except Exception as e:
+            pending.put_nowait(("error", None, e))
         else:
-            raise HTTPException(status_code=503, detail="No AI services configured")
-        
-        # Stage 2: EMA validation
-        ema_validation = EMAValidator.validate_data_sovereignty(base_result)
-        
-        # Stage 3: Parserator enhancement (if available)
-        parserator_metadata = None
-        personalized_recommendations = []
-        
-        if PARSERATOR_API_KEY and request.user_profile and request.existing_collection:
-            try:
-                enhancement = await ParseOperatorService.enhance_crystal_identification(
-                    crystal_data=base_result,
-                    user_profile=request.user_profile,
-                    collection=request.existing_collection or []
-                )
-                
-                if enhancement.get('success'):
-                    parsed_data = enhancement.get('parsedData', {})
-                    personalized_recommendations = parsed_data.get('personalized_recommendations', {})
-                    parserator_metadata = enhancement.get('metadata', {})
-                    
-            except Exception as e:
-                logger.warning(f"Parserator enhancement failed: {e}")
-        
-        return EnhancedCrystalIdentificationResponse(
-            identification=base_result.get("identification", {}),
-            metaphysical_properties=base_result.get("metaphysical_properties", {}),
-            physical_properties=base_result.get("physical_properties", {}),
-            care_instructions=base_result.get("care_instructions", {}),
-            confidence=base_result.get("identification", {}).get("confidence", 0.8),
-            source=source,
-            ema_compliance=ema_validation,
-            personalized_recommendations=[personalized_recommendations] if personalized_recommendations else [],
-            parserator_metadata=parserator_metadata
+            pending.put_nowait(("complete", None, None))
+
+    runner = asyncio.create_task(run_stages())
+    try:
+        while True:
+            kind, name, value = await pending.get()
+            if kind == "partial":
+                if "identification" not in stage_timings:
+                    yield _format_stage_event(stream_format, "identification_partial", {
+                        "group": name,
+                        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+                        "data": value,
+                    })
+            elif kind == "stage":
+                fields, stage_ms = value
+                _record_stage(name, stage_ms)
+                stage_timings[name] = round(stage_ms, 2)
+                yield _format_stage_event(stream_format, name, {
+                    "stage_ms": stage_timings[name],
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+                    "data": fields,
+                })
+            elif kind == "complete":
+                yield _format_stage_event(stream_format, "complete", {
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+                    "stage_timings": stage_timings,
+                })
+                break
+            else:
+                e = value
+                # Stages run in order, so the failing one is the first without a timing
+                failed_stage = ENHANCED_STAGES[min(len(stage_timings), len(ENHANCED_STAGES) - 1)]
+                logger.error(f"Enhanced crystal identification stream error at {failed_stage}: {e}")
+                yield _format_stage_event(stream_format, "error", {
+                    "stage": failed_stage,
+                    "status_code": e.status_code if isinstance(e, HTTPException) else 500,
+                    "detail": e.detail if isinstance(e, HTTPException) else str(e),
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+                    "stage_timings": stage_timings,
+                })
+                break
+    finally:
+        # Client went away mid-stream: stop the remaining stages
+        runner.cancel()
+
+def _requested_stream_format(http_request: Request) -> Optional[str]:
+    """`?stream=sse|ndjson`, or an Accept header of text/event-stream / application/x-ndjson"""
+    requested = http_request.query_params.get('stream')
+    if requested is None:
+        accept = http_request.headers.get('accept', '')
+        if 'text/event-stream' in accept:
+            return 'sse'
+        if 'application/x-ndjson' in accept:
+            return 'ndjson'
+        return None
+    if requested not in ('sse', 'ndjson'):
+        raise HTTPException(status_code=400, detail="stream must be 'sse' or 'ndjson'")
+    return requested
+
+@app.post("/api/crystal/identify-enhanced", response_model=EnhancedCrystalIdentificationResponse, openapi_extra=identification_openapi(CrystalIdentificationRequest))
+async def identify_crystal_enhanced(http_request: Request):
+    """Enhanced crystal identification with Parserator and EMA compliance.
+
+    With `?stream=sse` or `?stream=ndjson` each stage is sent as soon as it completes:
+    identification, ema_validation, personalization, then complete (or error).
+    """
+    stream_format = _requested_stream_format(http_request)
+    uploads = AsyncExitStack()
+    request, upload = await uploads.enter_async_context(
+        identification_upload(http_request, CrystalIdentificationRequest, upload_limits, upload_tracker)
+    )
+    try:
+        # Budget check before any upstream call (and before a stream has started)
+        usage = usage_ledger.admit(await id_tokens.user_id(http_request), 'identify-enhanced', client_ip=client_address(http_request))
+    except HTTPException:
+        await uploads.aclose()
+        raise
+    # Reserved calls are given back with the upload, even if the stream never starts
+    uploads.callback(usage.settle)
+    enhanced_stage_stats['requests'] += 1
+
+    if stream_format is not None:
+        logger.info(f"Enhanced crystal identification stream requested ({stream_format})")
+        enhanced_stage_stats['streamed'] += 1
+        return StreamingResponse(
+            _stream_enhanced_identification(request, upload, stream_format, usage),
+            media_type="text/event-stream" if stream_format == 'sse' else "application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            # The upload spool stays open until the stream has finished with it
+            background=BackgroundTask(uploads.aclose)
         )
-        
-    except Exception as e:
-        logger.error(f"Enhanced crystal identification error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/crystal/identify")
-async def identify_crystal_basic(request: CrystalIdentificationRequest):
+    async with uploads:
+        try:
+            logger.info(f"Enhanced crystal identification request received")
+
+            response_fields: Dict[str, Any] = {}
+            with usage:
+                async for stage, fields, stage_ms in enhanced_identification_stages(request, upload, degraded=usage.degraded):
+                    _record_stage(stage, stage_ms)
+                    response_fields.update(fields)
+
+            return EnhancedCrystalIdentificationResponse(**response_fields)
+
+        except (UpstreamUnavailable, DeadlineExceeded):
+            raise  # keep the 503 and its Retry-After, or the 504
+        except Exception as e:
+            logger.error(f"Enhanced crystal identification error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/crystal/identify", openapi_extra=identification_openapi(CrystalIdentificationRequest))
+async def identify_crystal_basic(http_request: Request):
     """Basic crystal identification with EMA compliance"""
-    try:
-        logger.info(f"Basic crystal identification request received")
+    async with identification_upload(http_request, CrystalIdentificationRequest, upload_limits, upload_tracker) as (request, upload):
+        with usage_ledger.admit(await id_tokens.user_id(http_request), 'identify', client_ip=client_address(http_request)) as usage:
+            try:
+                logger.info(f"Basic crystal identification request received")
         
-        if GEMINI_API_KEY:
-            result = await AIService.identify_crystal_with_gemini(
-                request.image_data, 
-                request.user_context
-            )
-            source = "gemini-1.5-flash"
-        elif OPENAI_API_KEY:
-            result = await AIService.identify_crystal_with_openai(
-                request.image_data, 
-                request.user_context
-            )
-            source = "gpt-4-vision"
-        else:
-            raise HTTPException(status_code=503, detail="No AI services configured")
+                result, model, result_id = await within_deadline(identify_with_available_provider(
+                    upload or request.image_data,
+                    request.user_context,
+                    degraded=usage.degraded
+                ), 'identification')
+                source = model
         
-        # Apply EMA validation
-        ema_validation = EMAValidator.validate_data_sovereignty(result)
+                # Apply EMA validation
+                ema_validation = EMAValidator.validate_data_sovereignty(result, key=result_id)
         
-        return {
-            "identification": result.get("identification", {}),
-            "metaphysical_properties": result.get("metaphysical_properties", {}),
-            "physical_properties": result.get("physical_properties", {}),
-            "care_instructions": result.get("care_instructions", {}),
-            "confidence": result.get("identification", {}).get("confidence", 0.8),
-            "source": source,
-            "ema_compliance": ema_validation
-        }
+                return {
+                    "identification": result.get("identification", {}),
+                    "metaphysical_properties": result.get("metaphysical_properties", {}),
+                    "physical_properties": result.get("physical_properties", {}),
+                    "care_instructions": result.get("care_instructions", {}),
+                    "confidence": result.get("identification", {}).get("confidence", 0.8),
+                    "source": source,
+                    "ema_compliance": ema_validation
+                }
         
-    except Exception as e:
-        logger.error(f"Crystal identification error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+            except (UpstreamUnavailable, DeadlineExceeded):
+                raise  # keep the 503 and its Retry-After, or the 504
+            except Exception as e:
+                logger.error(f"Crystal identification error: {e}")
+                raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, timings and (once finished) result of a background enhancement job"""
+    job = enhancement_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
 
 @app.post("/api/crystal/validate-ema")
 async def validate_ema_compliance(crystal_data: Dict[str, Any]):
@@ -574,10 +1084,16 @@ async def get_crystal_collection(user_id: str):
     }
 
 @app.post("/api/crystal/save")
-async def save_crystal(entry: CollectionEntry):
+async def save_crystal(entry: CollectionEntry, user_id: Optional[str] = None):
     """Save crystal to user's collection with EMA compliance"""
     # In production, this would save to database
     logger.info(f"Saving crystal: {entry.crystal_name}")
+    owner = entry.user_id or user_id  # body field, or the older query parameter
+    if owner:
+        # The collection changed: drop its digest and any enhancement computed from it
+        collection_digests.invalidate(owner)
+        parserator_cache.invalidate_tag(owner)
+    # Without an owner the cached entries expire with their TTL
     return {
         "status": "success",
         "crystal_id": entry.id,
@@ -595,6 +1111,11 @@ async def track_usage(stats: UsageStats):
         "ema_note": "Usage data owned by user, exportable on request"
     }
 
+@app.get("/api/metrics/usage/{user_id}")
+async def get_usage(user_id: str):
+    """Operator view of today's AI usage for a user: upstream calls, tokens, image bytes and latency per endpoint and provider"""
+    return usage_ledger.usage(user_id)
+
 @app.get("/api/crystal/search")
 async def search_crystals(q: str, limit: int = 20):
     """Search crystal database with EMA compliance"""
@@ -6,19 +6,45 @@ High-performance API server with Exoditical Moral Architecture validation
 
 import os
 import json
+import time
 import base64
 import asyncio
 import logging
+import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple, Union, Callable
 from dataclasses import dataclass, asdict
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import uvicorn
 import httpx
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from backend_http import UpstreamClients, UpstreamConfig
+from backend_images import ImageNormalizer
+from backend_jobs import JobManager
+from backend_digest import CollectionDigestCache, estimate_tokens, profile_digest, profile_user_id
+from backend_ledger import UsageLedger, client_address, record_upstream_usage
+from backend_auth import IdTokenVerifier
+from backend_admission import AdmissionController, AdmissionMiddleware
+from backend_resilience import BrownoutController, ResilienceConfig, UpstreamResilienceRegistry, UpstreamUnavailable
+from backend_providers import (
+    ProviderPool, VisionProvider, gemini_generate_content, gemini_generate_content_batch, gemini_stream_generate_content,
+    openai_chat_vision, record_batch_usage_share,
+)
+from backend_uploads import (
+    SpooledImage, UploadLimits, UploadTracker, identification_openapi, identification_upload,
+)
+from backend_cache import IdentificationCache, ParseratorCache, SingleFlight, decode_image_data
+from backend_ai_json import AIOutputStats, gemini_response_schema, json_repair_stats
+from backend_batching import MicroBatcher
+from backend_deadline import DeadlineExceeded, DeadlineMiddleware, DeadlinePolicy, http_timeout, stage_allowed, within_deadline
+from backend_catalog import CrystalCatalog
+from backend_routing import ModelRouter
+from backend_validation import ExoditicalValidator, validation_memo
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -35,13 +61,106 @@ ENVIRONMENT = os.getenv('ENVIRONMENT', 'development')
 # Parserator configuration
 PARSERATOR_BASE_URL = 'https://app-5108296280.us-central1.run.app'
 PARSERATOR_ENDPOINT = '/v1/parse'
+# Bump when Parserator schemas/instructions change so cached enhancements are not reused
+PARSERATOR_PROMPT_VERSION = '2024-06-ema-1'
+
+# Gemini configuration
+GEMINI_BASE_URL = 'https://generativelanguage.googleapis.com'
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')  # JSON mode needs a 1.5+ model
+# streamGenerateContent lets parsed groups reach callers before the whole answer has arrived
+GEMINI_STREAMING = os.getenv('GEMINI_STREAMING', 'on').lower() not in ('0', 'off', 'false', 'no')
+# Constrain Gemini output to the AIIdentificationResponse schema (responseMimeType application/json)
+GEMINI_JSON_MODE = os.getenv('GEMINI_JSON_MODE', 'on').lower() not in ('0', 'off', 'false', 'no')
+
+# OpenAI-compatible configuration (any /v1/chat/completions vision endpoint)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com')
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+
+# Pooled upstream HTTP clients (opened/closed in the app lifespan)
+upstream_clients = UpstreamClients([
+    UpstreamConfig.from_env('gemini', GEMINI_BASE_URL),
+    UpstreamConfig.from_env('openai', OPENAI_BASE_URL),
+    UpstreamConfig.from_env('parserator', PARSERATOR_BASE_URL),
+])
+
+# Circuit breaker, bulkhead and retry policy per upstream (<NAME>_BREAKER_* / _BULKHEAD_* / _RETRY_*)
+upstream_resilience = UpstreamResilienceRegistry([
+    ResilienceConfig.from_env('gemini'),
+    ResilienceConfig.from_env('openai'),
+    ResilienceConfig.from_env('parserator'),
+])
+
+# Catalog-only enrichment while identification/Parserator latency or errors are high (BROWNOUT_*)
+brownout_controller = BrownoutController.from_env()
+
+# Locally held chakra/zodiac/care/pairing data used in brownout (CRYSTAL_CATALOG_PATH)
+crystal_catalog = CrystalCatalog.from_env()
+
+# End-to-end request budgets from X-Request-Deadline-Ms or per-path defaults (REQUEST_DEADLINE_*)
+request_deadlines = DeadlinePolicy.from_env()
+
+# Admission control for /api/crystal/identify* (IDENTIFY_MAX_IN_FLIGHT / IDENTIFY_MAX_QUEUE / IDENTIFY_QUEUE_TIMEOUT)
+identification_admission = AdmissionController.from_env('IDENTIFY')
+
+# Background Parserator enhancement (ENHANCEMENT_JOBS_WORKERS / _MAX_PENDING / _TIMEOUT / _RESULT_TTL)
+enhancement_jobs = JobManager.from_env('ENHANCEMENT_JOBS')
+
+# Per-user collection summaries sent to Parserator instead of the raw collection JSON
+collection_digests = CollectionDigestCache.from_env()
+
+# Successful Parserator responses (PARSERATOR_CACHE_TTL / _FRESH_SECONDS / _SWR / _MAX_ENTRIES)
+parserator_cache = ParseratorCache.from_env()
+
+# Per-user token/image/latency ledger and tier budgets (USAGE_TIER_BUDGETS / USAGE_LEDGER_PATH)
+usage_ledger = UsageLedger.from_env()
+
+# Callers are identified by their Firebase ID token (Authorization: Bearer), never by the request body;
+# this server initializes no Firebase app, so until one is configured every caller is anonymous
+id_tokens = IdTokenVerifier.from_env()
+
+# Gemini prompt sizes and parse failures, JSON mode vs free-text prompt
+gemini_output_stats = AIOutputStats()
+
+# Raw AI responses keyed by image bytes + user context + configured provider models
+identification_cache = IdentificationCache.from_env()
+
+# In-flight identifications by cache key, so concurrent duplicates share one upstream call
+identification_flights = SingleFlight('identification')
+
+# Decode/orient/downscale/re-encode uploads in worker processes before they go upstream
+image_normalizer = ImageNormalizer.from_env()
+
+# Identification bodies: JSON, multipart or raw binary, streamed into bounded spools
+upload_limits = UploadLimits.from_env()
+upload_tracker = UploadTracker(upload_limits)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared upstream resources on startup and release them on shutdown"""
+    await upstream_clients.start()
+    image_normalizer.start()
+    usage_ledger.start()
+    try:
+        yield
+    finally:
+        await enhancement_jobs.close()
+        await usage_ledger.close()
+        image_normalizer.close()
+        await upstream_clients.close()
 
 app = FastAPI(
     title="Crystal Grimoire Enhanced API",
     description="Production backend with Parserator integration and Exoditical Moral Architecture",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
+# Shed excess identifications before their bodies are read (added first so CORS still wraps the 429/503)
+app.add_middleware(AdmissionMiddleware, controller=identification_admission, path_prefixes=('/api/crystal/identify',))
+
+# Start the deadline clock before admission queueing; cancel handlers whose client has gone
+app.add_middleware(DeadlineMiddleware, policy=request_deadlines)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -61,6 +180,7 @@ class CrystalIdentificationRequest(BaseModel):
     user_profile: Optional[Dict[str, Any]] = None
     existing_collection: Optional[List[Dict[str, Any]]] = None
     validation_level: Optional[str] = 'standard'
+    async_enhancement: bool = False  # return immediately and run Parserator as a pollable job
 
 class EnhancedCrystalIdentificationResponse(BaseModel):
     identification: Dict[str, Any]
@@ -74,6 +194,8 @@ class EnhancedCrystalIdentificationResponse(BaseModel):
     environmental_impact: Dict[str, Any]
     personalized_recommendations: List[Dict[str, Any]]
     parserator_metadata: Optional[Dict[str, Any]] = None
+    enhancement_job_id: Optional[str] = None  # poll GET /api/jobs/{id} for the Parserator fields
+    degraded: Optional[Dict[str, Any]] = None  # set in brownout: enrichment came from the local catalog
 
 class AutomationRequest(BaseModel):
     trigger_event: str
@@ -88,8 +210,66 @@ class AutomationResponse(BaseModel):
     cultural_context: Dict[str, Any]
     environmental_impact: Dict[str, Any]
 
+# AI-facing groups of the identification answer; Gemini's responseSchema is generated from AIIdentificationResponse
+
+class AIIdentification(BaseModel):
+    name: str = Field(description="Exact crystal name")
+    variety: Optional[str] = Field(None, description="Specific variety or type")
+    scientific_name: Optional[str] = Field(None, description="Chemical composition")
+    confidence: float = Field(description="Identification confidence, 0-100")
+
+class AIMetaphysicalProperties(BaseModel):
+    primary_chakras: List[str] = Field([], description="Root, Sacral, Solar Plexus, Heart, Throat, Third Eye or Crown")
+    zodiac_signs: List[str] = []
+    planetary_rulers: List[str] = Field([], description="Sun, Moon, Mercury, Venus, Mars, Jupiter, Saturn, Uranus, Neptune, Pluto")
+    elements: List[str] = Field([], description="Fire, Earth, Air, Water, Spirit")
+    healing_properties: List[str] = Field([], description="Traditional beliefs and practices, never medical claims")
+    intentions: List[str] = Field([], description="e.g. Love, Protection, Abundance, Healing, Clarity, Grounding")
+
+class AIPhysicalProperties(BaseModel):
+    hardness: Optional[str] = Field(None, description="Mohs scale, e.g. '6-7'")
+    crystal_system: Optional[str] = None
+    luster: Optional[str] = None
+    transparency: Optional[str] = None
+    color_range: List[str] = []
+    formation: Optional[str] = Field(None, description="Igneous, metamorphic or sedimentary")
+
+class AICareInstructions(BaseModel):
+    cleansing_methods: List[str] = []
+    charging_methods: List[str] = []
+    storage_recommendations: Optional[str] = None
+    handling_notes: Optional[str] = None
+
+class AIEthicalConsiderations(BaseModel):
+    cultural_origins: List[str] = Field([], description="Traditional sources, acknowledged where applicable")
+    environmental_impact: str = Field(description="Ethical sourcing and mining practices")
+    respectful_usage: str
+    accessibility_notes: str = Field(description="Alternatives for different economic situations")
+
+class AITransparency(BaseModel):
+    confidence_level: str
+    limitations: str
+    encourage_discernment: str
+
+class AIIdentificationResponse(BaseModel):
+    identification: AIIdentification
+    metaphysical_properties: AIMetaphysicalProperties
+    physical_properties: AIPhysicalProperties
+    care_instructions: AICareInstructions
+    ethical_considerations: AIEthicalConsiderations
+    ai_transparency: AITransparency
+
+GEMINI_IDENTIFICATION_SCHEMA = gemini_response_schema(AIIdentificationResponse)
+
+class AIBriefIdentificationResponse(BaseModel):
+    """Brownout answer: the stone only, enrichment comes from the crystal catalog"""
+    identification: AIIdentification
+
+GEMINI_BRIEF_SCHEMA = gemini_response_schema(AIBriefIdentificationResponse)
+
 class CollectionEntry(BaseModel):
     id: str
+    user_id: Optional[str] = None  # collection owner; their cached digest and enhancements are invalidated on save
     crystal_name: str
     crystal_type: str
     acquisition_date: str
@@ -107,37 +287,58 @@ class UsageStats(BaseModel):
 # Parserator Service Integration
 class ParseOperatorService:
     @staticmethod
-    async def call_parserator_api(input_data: str, output_schema: Dict, instructions: str = None) -> Dict:
-        """Call Parserator API with two-stage processing"""
+    async def call_parserator_api(input_data: str, output_schema: Dict, instructions: str = None,
+                                  cache_tag: Optional[str] = None) -> Dict:
+        """Call Parserator API with two-stage processing; successful responses are cached per user (cache_tag)"""
         if not PARSERATOR_API_KEY:
             raise HTTPException(status_code=503, detail="Parserator API not configured")
         
+        cache_key = ParseratorCache.make_key(output_schema, instructions, input_data, PARSERATOR_PROMPT_VERSION)
+        return await parserator_cache.fetch(
+            cache_key,
+            lambda: ParseOperatorService._post_parserator(input_data, output_schema, instructions),
+            tag=cache_tag,
+        )
+    
+    @staticmethod
+    async def _post_parserator(input_data: str, output_schema: Dict, instructions: Optional[str]) -> Dict:
+        """One uncached Parserator call"""
+        started = time.perf_counter()
         try:
-            async with httpx.AsyncClient() as client:
-                payload = {
-                    'inputData': input_data,
-                    'outputSchema': output_schema,
-                }
-                if instructions:
-                    payload['instructions'] = instructions
-                
-                response = await client.post(
-                    f"{PARSERATOR_BASE_URL}{PARSERATOR_ENDPOINT}",
-                    headers={
-                        'Authorization': f'Bearer {PARSERATOR_API_KEY}',
-                        'Content-Type': 'application/json',
-                    },
-                    json=payload,
-                    timeout=30.0
-                )
-                
-                if response.status_code != 200:
-                    raise HTTPException(status_code=response.status_code, detail=f"Parserator API error: {response.text}")
-                
-                return response.json()
-                
+            client = upstream_clients.get('parserator')
+            payload = {
+                'inputData': input_data,
+                'outputSchema': output_schema,
+            }
+            if instructions:
+                payload['instructions'] = instructions
+            
+            response = await upstream_resilience.get('parserator').call(lambda: client.post(
+                PARSERATOR_ENDPOINT,
+                headers={
+                    'Authorization': f'Bearer {PARSERATOR_API_KEY}',
+                    'Content-Type': 'application/json',
+                },
+                json=payload,
+                timeout=http_timeout(client.timeout)
+            ))
+            
+            if response.status_code != 200:
+                raise HTTPException(status_code=response.status_code, detail=f"Parserator API error: {response.text}")
+            
+            result = response.json()
+            tokens_used = (result.get('metadata') or {}).get('tokensUsed')
+            record_upstream_usage('parserator', input_tokens=estimate_tokens((instructions or '') + input_data),
+                                  total_tokens=tokens_used, latency_ms=(time.perf_counter() - started) * 1000)
+            brownout_controller.observe('parserator', time.perf_counter() - started)
+            return result
+            
+        except UpstreamUnavailable:
+            brownout_controller.observe('parserator', time.perf_counter() - started, ok=False)
+            raise
         except Exception as e:
             logger.error(f"Parserator API error: {e}")
+            brownout_controller.observe('parserator', time.perf_counter() - started, ok=False)
             raise HTTPException(status_code=500, detail=f"Parserator service failed: {str(e)}")
     
     @staticmethod
@@ -182,8 +383,9 @@ class ParseOperatorService:
         4. Technological Wisdom: Present AI insights as guidance, not authority
         5. Inclusive Accessibility: Ensure information is accessible regardless of economic status
         
-        USER PROFILE: {json.dumps(user_profile)}
-        EXISTING COLLECTION: {json.dumps(collection)}
+        The user's profile (user_context) and a summary of their collection
+        (collection_summary: counts by chakra, element and family, top intentions,
+        most and recently used stones) are in the input data.
         
         Provide enhancement that:
         - Respects cultural origins and traditional knowledge
@@ -193,16 +395,25 @@ class ParseOperatorService:
         - Encourages personal experience and discernment
         """
         
+        # Compact digests instead of the raw profile/collection JSON, which grows with every stone owned
+        profile_summary = profile_digest(user_profile)
+        collection_summary, collection_bytes = collection_digests.digest(collection, profile_user_id(user_profile))
         input_data = json.dumps({
             'crystal_data': crystal_data,
-            'user_context': user_profile,
-            'collection_context': collection,
+            'user_context': profile_summary,
+            'collection_summary': collection_summary,
         })
+        collection_digests.record_prompt(
+            after_bytes=len(instructions) + len(input_data),
+            raw_bytes=len(json.dumps(user_profile)) + collection_bytes,
+            digest_bytes=len(json.dumps(profile_summary)) + len(json.dumps(collection_summary)),
+        )
         
         return await ParseOperatorService.call_parserator_api(
             input_data=input_data,
             output_schema=enhancement_schema,
-            instructions=instructions
+            instructions=instructions,
+            cache_tag=profile_user_id(user_profile),
         )
     
     @staticmethod
@@ -247,9 +458,8 @@ class ParseOperatorService:
         - Ensure accessibility regardless of economic status
         
         TRIGGER: {trigger_event}
-        EVENT DATA: {json.dumps(event_data)}
-        USER PROFILE: {json.dumps(user_profile)}
-        COLLECTION: {json.dumps(collection)}
+        The event data, the user's profile and a summary of their collection
+        (collection_summary) are in the input data.
         
         Generate automation suggestions that:
         - Respect cultural origins and wisdom
@@ -259,149 +469,33 @@ class ParseOperatorService:
         - Maintain transparency about AI limitations
         """
         
+        profile_summary = profile_digest(user_profile)
+        collection_summary, collection_bytes = collection_digests.digest(collection, profile_user_id(user_profile))
         input_data = json.dumps({
             'trigger_event': trigger_event,
             'event_data': event_data,
-            'user_profile': user_profile,
-            'collection': collection,
+            'user_profile': profile_summary,
+            'collection_summary': collection_summary,
         })
+        collection_digests.record_prompt(
+            after_bytes=len(instructions) + len(input_data),
+            raw_bytes=len(json.dumps(user_profile)) + collection_bytes + len(json.dumps(event_data)),
+            digest_bytes=len(json.dumps(profile_summary)) + len(json.dumps(collection_summary)) + len(json.dumps(event_data)),
+        )
         
         return await ParseOperatorService.call_parserator_api(
             input_data=input_data,
             output_schema=automation_schema,
-            instructions=instructions
+            instructions=instructions,
+            cache_tag=profile_user_id(user_profile),
         )
 
-# Exoditical Validation Service
-class ExoditicalValidator:
-    @staticmethod
-    def validate_crystal_data(crystal_data: Dict) -> Dict:
-        """Validate crystal data against Exoditical principles"""
-        validation_result = {
-            'cultural_sovereignty': ExoditicalValidator._check_cultural_respect(crystal_data),
-            'spiritual_integrity': ExoditicalValidator._check_spiritual_integrity(crystal_data),
-            'environmental_stewardship': ExoditicalValidator._check_environmental_awareness(crystal_data),
-            'technological_wisdom': ExoditicalValidator._check_ai_transparency(crystal_data),
-            'inclusive_accessibility': ExoditicalValidator._check_accessibility(crystal_data),
-        }
-        
-        overall_score = sum(validation_result.values()) / len(validation_result)
-        
-        return {
-            'overall_ethical_score': overall_score,
-            'principle_scores': validation_result,
-            'is_ethically_compliant': overall_score >= 0.7,
-            'recommendations': ExoditicalValidator._generate_recommendations(validation_result),
-        }
-    
-    @staticmethod
-    def _check_cultural_respect(data: Dict) -> float:
-        """Check for cultural sovereignty compliance"""
-        score = 0.7  # Base score
-        
-        # Check for cultural acknowledgment
-        if any(key in str(data).lower() for key in ['traditional', 'indigenous', 'cultural']):
-            score += 0.2
-        
-        # Check for appropriative language
-        problematic_terms = ['ancient secret', 'mystical power', 'sacred wisdom', 'shamanic']
-        if any(term in str(data).lower() for term in problematic_terms):
-            score -= 0.3
-        
-        return min(max(score, 0.0), 1.0)
-    
-    @staticmethod
-    def _check_spiritual_integrity(data: Dict) -> float:
-        """Check for spiritual integrity compliance"""
-        score = 0.8  # Base score
-        
-        # Check for medical claims
-        medical_terms = ['cures', 'heals', 'treats', 'diagnoses', 'medical']
-        if any(term in str(data).lower() for term in medical_terms):
-            score -= 0.4
-        
-        # Check for belief/fact distinction
-        if any(phrase in str(data).lower() for phrase in ['believed to', 'traditionally', 'some say']):
-            score += 0.1
-        
-        return min(max(score, 0.0), 1.0)
-    
-    @staticmethod
-    def _check_environmental_awareness(data: Dict) -> float:
-        """Check for environmental stewardship"""
-        score = 0.6  # Base score
-        
-        # Check for environmental considerations
-        if 'environmental' in str(data).lower() or 'sustainable' in str(data).lower():
-            score += 0.3
-        
-        # Check for ethical sourcing mentions
-        if 'ethical' in str(data).lower() or 'fair trade' in str(data).lower():
-            score += 0.1
-        
-        return min(max(score, 0.0), 1.0)
-    
-    @staticmethod
-    def _check_ai_transparency(data: Dict) -> float:
-        """Check for technological wisdom compliance"""
-        score = 0.8  # Base score
-        
-        # Check for uncertainty acknowledgment
-        if any(word in str(data).lower() for word in ['may', 'might', 'possibly', 'confidence']):
-            score += 0.1
-        
-        # Check for human agency preservation
-        if any(phrase in str(data).lower() for phrase in ['personal choice', 'individual', 'trust yourself']):
-            score += 0.1
-        
-        return min(max(score, 0.0), 1.0)
-    
-    @staticmethod
-    def _check_accessibility(data: Dict) -> float:
-        """Check for inclusive accessibility"""
-        score = 0.8  # Base score
-        
-        # Check for economic barriers
-        if any(phrase in str(data).lower() for phrase in ['expensive', 'exclusive', 'elite', 'advanced only']):
-            score -= 0.3
-        
-        # Check for inclusive language
-        if any(phrase in str(data).lower() for phrase in ['accessible', 'everyone', 'free', 'community']):
-            score += 0.2
-        
-        return min(max(score, 0.0), 1.0)
-    
-    @staticmethod
-    def _generate_recommendations(scores: Dict) -> List[str]:
-        """Generate ethical recommendations based on scores"""
-        recommendations = []
-        
-        if scores['cultural_sovereignty'] < 0.7:
-            recommendations.append('Add cultural context and acknowledge traditional sources')
-        
-        if scores['spiritual_integrity'] < 0.7:
-            recommendations.append('Distinguish between beliefs and facts, avoid medical claims')
-        
-        if scores['environmental_stewardship'] < 0.7:
-            recommendations.append('Include environmental impact and ethical sourcing information')
-        
-        if scores['technological_wisdom'] < 0.7:
-            recommendations.append('Acknowledge AI limitations and encourage personal discernment')
-        
-        if scores['inclusive_accessibility'] < 0.7:
-            recommendations.append('Ensure information is accessible regardless of economic status')
-        
-        return recommendations
-
 # Enhanced AI Service Integration
 class AIService:
     @staticmethod
-    async def identify_crystal_with_gemini(image_data: str, user_context: Dict = None) -> Dict:
-        """Enhanced crystal identification using Gemini Pro Vision with ethical validation"""
-        if not GEMINI_API_KEY:
-            raise HTTPException(status_code=503, detail="Gemini API not configured")
-        
-        prompt = f"""
+    def identification_prompt(user_context: Dict = None, structured_output: bool = False) -> str:
+        """Identification prompt shared by every vision provider; `structured_output` leaves out the JSON layout"""
+        guidance = f"""
         You are an expert crystal identification system following Exoditical Moral Architecture principles.
         Analyze this crystal image with cultural sensitivity and ethical awareness.
         
@@ -413,7 +507,11 @@ class AIService:
         5. Inclusive Accessibility: Ensure accessibility regardless of economic status
         
         USER CONTEXT: {json.dumps(user_context) if user_context else 'None provided'}
-        
+        """
+        if structured_output:
+            # The answer format comes from GEMINI_IDENTIFICATION_SCHEMA
+            return guidance
+        return guidance + f"""
         Return ONLY valid JSON with enhanced ethical structure:
         {{
           "identification": {{
@@ -457,44 +555,66 @@ class AIService:
           }}
         }}
         """
+
+    @staticmethod
+    def brief_identification_prompt(structured_output: bool = False) -> str:
+        """Identification-only prompt used in brownout"""
+        guidance = """
+        You are an expert crystal identification system. Identify the crystal in this image.
+        Present this as AI guidance and be clear about your confidence.
+        """
+        if structured_output:
+            return guidance
+        return guidance + """
+        Return ONLY valid JSON with this structure:
+        {"identification": {"name": "exact crystal name", "variety": "specific variety or type",
+                            "scientific_name": "chemical composition", "confidence": 95}}
+        """
+
+    @staticmethod
+    async def identify_crystal_with_gemini(image_data: Union[str, bytes, SpooledImage], user_context: Dict = None, mime_type: str = "image/jpeg",
+                                           on_group: Optional[Callable[[str, Any], None]] = None,
+                                           model: Optional[str] = None, brief: bool = False) -> Dict:
+        """Enhanced crystal identification using Gemini (GEMINI_MODEL, or the routed `model`) with ethical validation; `on_group(key, value)` receives each top-level group as soon as it has streamed in.
+
+        `brief` (brownout) asks for the identification group only.
+        """
+        if not GEMINI_API_KEY:
+            raise HTTPException(status_code=503, detail="Gemini API not configured")
+        
+        if brief:
+            prompt = AIService.brief_identification_prompt(structured_output=GEMINI_JSON_MODE)
+            response_schema = GEMINI_BRIEF_SCHEMA if GEMINI_JSON_MODE else None
+        else:
+            prompt = AIService.identification_prompt(user_context, structured_output=GEMINI_JSON_MODE)
+            response_schema = GEMINI_IDENTIFICATION_SCHEMA if GEMINI_JSON_MODE else None
+        output_mode = 'schema' if GEMINI_JSON_MODE else 'prompt'
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro-vision:generateContent?key={GEMINI_API_KEY}",
-                    json={
-                        "contents": [{
-                            "parts": [
-                                {"text": prompt},
-                                {
-                                    "inline_data": {
-                                        "mime_type": "image/jpeg",
-                                        "data": image_data
-                                    }
-                                }
-                            ]
-                        }]
-                    },
-                    timeout=30.0
+            # Binary images are base64-encoded straight into the request body as it is sent
+            # (batches always use the full identification schema, so brief calls go alone)
+            if gemini_batcher.enabled and not brief and not (isinstance(image_data, SpooledImage) and image_data.path):
+                # Concurrent identifications with the same model and prompt share one multi-image call
+                result = await gemini_batcher.submit((model or GEMINI_MODEL, prompt), (image_data, mime_type))
+                _emit_groups(result, on_group)
+            elif GEMINI_STREAMING:
+                result = await gemini_stream_generate_content(
+                    upstream_clients.get('gemini'), model or GEMINI_MODEL, GEMINI_API_KEY, prompt, image_data, mime_type,
+                    resilience=upstream_resilience.get('gemini'), on_group=on_group, response_schema=response_schema
                 )
-                
-                if response.status_code != 200:
-                    raise HTTPException(status_code=response.status_code, detail=f"Gemini API error: {response.text}")
-                
-                result = response.json()
-                content = result['candidates'][0]['content']['parts'][0]['text']
-                
-                # Clean up the response to ensure valid JSON
-                content = content.strip()
-                if content.startswith('```json'):
-                    content = content[7:]
-                if content.endswith('```'):
-                    content = content[:-3]
-                content = content.strip()
-                
-                return json.loads(content)
-                
-        except json.JSONDecodeError as e:
+            else:
+                result = await gemini_generate_content(
+                    upstream_clients.get('gemini'), model or GEMINI_MODEL, GEMINI_API_KEY, prompt, image_data, mime_type,
+                    resilience=upstream_resilience.get('gemini'), response_schema=response_schema
+                )
+                _emit_groups(result, on_group)
+            gemini_output_stats.record(output_mode, len(prompt), parsed=True)
+            return result
+            
+        except UpstreamUnavailable:
+            raise
+        except ValueError as e:  # json.JSONDecodeError, or a streamed answer that never formed an object
+            gemini_output_stats.record(output_mode, len(prompt), parsed=False)
             logger.error(f"JSON decode error: {e}")
             raise HTTPException(status_code=500, detail="Invalid JSON response from AI")
         except Exception as e:
@@ -502,14 +622,156 @@ class AIService:
             raise HTTPException(status_code=500, detail=f"AI identification failed: {str(e)}")
 
     @staticmethod
-    async def identify_crystal_with_openai(image_data: str, user_context: Dict = None) -> Dict:
-        """Identify crystal using OpenAI GPT-4 Vision (if available)"""
+    async def identify_crystal_with_openai(image_data: Union[str, bytes, SpooledImage], user_context: Dict = None, mime_type: str = "image/jpeg",
+                                           on_group: Optional[Callable[[str, Any], None]] = None, brief: bool = False) -> Dict:
+        """Identify crystal using an OpenAI-compatible vision model (OPENAI_BASE_URL / OPENAI_MODEL)"""
         if not OPENAI_API_KEY:
             raise HTTPException(status_code=503, detail="OpenAI API not configured")
-        
-        # Implementation for OpenAI would go here
-        # For now, fall back to Gemini
-        return await AIService.identify_crystal_with_gemini(image_data, user_context)
+
+        prompt = AIService.brief_identification_prompt() if brief else AIService.identification_prompt(user_context)
+        try:
+            result = await openai_chat_vision(
+                upstream_clients.get('openai'), OPENAI_MODEL, OPENAI_API_KEY, prompt, image_data, mime_type,
+                resilience=upstream_resilience.get('openai')
+            )
+            _emit_groups(result, on_group)
+            return result
+        except UpstreamUnavailable:
+            raise
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON decode error: {e}")
+            raise HTTPException(status_code=500, detail="Invalid JSON response from AI")
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            raise HTTPException(status_code=500, detail=f"AI identification failed: {str(e)}")
+
+def _emit_groups(result: Dict, on_group: Optional[Callable[[str, Any], None]]):
+    """Non-streaming answers report all their groups at once"""
+    if on_group is not None:
+        for key, value in result.items():
+            on_group(key, value)
+
+# Providers are resolved per call so rotated keys (and test patches) take effect immediately
+provider_pool = ProviderPool.from_env([
+    VisionProvider('gemini', GEMINI_MODEL, lambda *args, **kwargs: AIService.identify_crystal_with_gemini(*args, **kwargs),
+                   configured=lambda: bool(GEMINI_API_KEY)),
+    VisionProvider('openai', OPENAI_MODEL, lambda *args, **kwargs: AIService.identify_crystal_with_openai(*args, **kwargs),
+                   configured=lambda: bool(OPENAI_API_KEY)),
+])
+
+# Picks the Gemini model per request (cheap vs strong) and escalates unsure cheap answers
+model_router = ModelRouter.from_env(GEMINI_MODEL)
+
+def _send_gemini_batch(key: Tuple[str, str], items: List[Tuple[Any, str]]):
+    model, prompt = key
+    return gemini_generate_content_batch(
+        upstream_clients.get('gemini'), model, GEMINI_API_KEY, prompt, items, resilience=upstream_resilience.get('gemini'),
+        response_schema=GEMINI_IDENTIFICATION_SCHEMA if GEMINI_JSON_MODE else None
+    )
+
+def _send_gemini_single(key: Tuple[str, str], item: Tuple[Any, str]):
+    (model, prompt), (image, mime_type) = key, item
+    return gemini_generate_content(
+        upstream_clients.get('gemini'), model, GEMINI_API_KEY, prompt, image, mime_type,
+        resilience=upstream_resilience.get('gemini'), response_schema=GEMINI_IDENTIFICATION_SCHEMA if GEMINI_JSON_MODE else None
+    )
+
+# Off unless GEMINI_BATCHING=on; batched answers are not streamed
+gemini_batcher = MicroBatcher.from_env('GEMINI', _send_gemini_batch, _send_gemini_single,
+                                       record_cost=record_batch_usage_share)
+
+async def identify_with_available_provider(image_data: Union[str, SpooledImage], user_context: Optional[Dict] = None,
+                                          on_group: Optional[Callable[[str, Any], None]] = None,
+                                          degraded: bool = False, brief: bool = False) -> Tuple[Dict, str, Optional[str]]:
+    """Run the configured AI provider, serving repeat images from the identification cache.
+
+    Returns the raw AI JSON response, the model that produced it and its result id (the
+    validation memo's content key; None for entries cached before result ids existed). `on_group(key, value)` gets
+    top-level groups as they stream in from the provider; cached and coalesced requests get none.
+    Over-budget (`degraded`) requests are never hedged onto a second provider. `brief` (brownout)
+    answers hold the identification group only and are cached apart from full answers.
+    """
+    if not provider_pool.configured():
+        raise HTTPException(status_code=503, detail="No AI services configured")
+    # Keyed by the configured provider set and the routed Gemini models, not whichever provider happens to win a hedge
+    namespace = f"{provider_pool.cache_namespace()}:{model_router.cache_namespace(degraded or brief)}"
+    namespace += ':brief' if brief else ''
+
+    if isinstance(image_data, SpooledImage):
+        # Uploads were hashed while streaming; large ones reach the normalizer by spool path
+        image_source = image_data.source()
+        cache_key = identification_cache.make_key_from_digest(image_data.digest, user_context, namespace)
+    else:
+        image_source = decode_image_data(image_data)
+        cache_key = identification_cache.make_key(image_source, user_context, namespace)
+    cached = await identification_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Identification cache hit ({cache_key[:12]})")
+        return cached['response'], cached['model'], cached.get('result_id')
+
+    def start_flight():
+        if isinstance(image_data, SpooledImage):
+            image_data.retain()  # the shared call may outlive the request that started it
+        return _identify_uncached(image_data, image_source, cache_key, user_context, on_group, degraded, brief)
+
+    # Concurrent identical requests (client retries during a slow call) share one upstream call
+    identification = await identification_flights.do(
+        cache_key, start_flight, on_done=image_data.close if isinstance(image_data, SpooledImage) else None
+    )
+    return identification['response'], identification['model'], identification.get('result_id')
+
+def _ai_confidence(ai_json_response: Dict) -> float:
+    """The answer's confidence on the router's 0-1 scale (the schema asks for 0-100)"""
+    identification = ai_json_response.get("identification")
+    try:
+        value = float((identification or {}).get("confidence") or 0.0)
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+    return value / 100 if value > 1 else value
+
+def _first_group_only(on_group: Callable[[str, Any], None]) -> Callable[[str, Any], None]:
+    """A hedged request may stream from two providers; each group is reported once"""
+    seen = set()
+
+    def emit(key: str, value: Any):
+        if key not in seen:
+            seen.add(key)
+            on_group(key, value)
+    return emit
+
+async def _identify_uncached(image_data: Union[str, SpooledImage], image_source: Union[bytes, str],
+                             cache_key: str, user_context: Optional[Dict],
+                             on_group: Optional[Callable[[str, Any], None]] = None, degraded: bool = False,
+                             brief: bool = False) -> Dict:
+    """Cache-miss path: normalize, then call the provider pool; returns {"model": ..., "response": ..., "result_id": ...}"""
+    # Orient/downscale/strip EXIF off the event loop and send the real mime type
+    normalized = await image_normalizer.normalize(image_source)
+    upstream_image = normalized.data if normalized.reencoded else image_data
+
+    extra = {'on_group': _first_group_only(on_group)} if on_group is not None else {}
+    if brief:
+        extra['brief'] = True
+
+    def call(gemini_model: str, escalated: bool):
+        # Groups already streamed from the cheap answer; an escalated re-run is not streamed again
+        return provider_pool.identify(upstream_image, user_context, mime_type=normalized.mime_type,
+                                      hedge=not (degraded or brief), models={'gemini': gemini_model},
+                                      **({} if escalated else extra))
+
+    started = time.perf_counter()
+    try:
+        ai_json_response, model = await model_router.identify(
+            call, model_router.complexity(normalized.original_size, normalized.entropy), _ai_confidence,
+            degraded or brief
+        )
+    except Exception:
+        brownout_controller.observe('identification', time.perf_counter() - started, ok=False)
+        raise
+    brownout_controller.observe('identification', time.perf_counter() - started)
+    # A fresh result id per upstream answer keys its validations in the validation memo
+    identification = {"model": model, "response": ai_json_response, "result_id": uuid.uuid4().hex}
+    await identification_cache.set(cache_key, identification)
+    return identification
 
 # API Endpoints
 
@@ -556,140 +818,224 @@ async def api_status():
             "identify": "/api/crystal/identify",
             "identify_enhanced": "/api/crystal/identify-enhanced",
             "automation": "/api/automation/cross-feature",
+            "jobs": "/api/jobs/{job_id}",
             "collection": "/api/crystal/collection",
             "save": "/api/crystal/save",
             "usage": "/api/usage",
+            "metrics": "/api/metrics",
             "validate": "/api/crystal/validate"
         }
     }
 
-@app.post("/api/crystal/identify-enhanced", response_model=EnhancedCrystalIdentificationResponse)
-async def identify_crystal_enhanced(request: CrystalIdentificationRequest):
+@app.get("/api/metrics")
+async def api_metrics():
+    """Runtime metrics for capacity tuning"""
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "upstream_pools": upstream_clients.stats(),
+        "providers": provider_pool.stats(),
+        "model_routing": model_router.stats(),
+        "gemini_batching": gemini_batcher.stats(),
+        "resilience": upstream_resilience.stats(),
+        "brownout": brownout_controller.stats(),
+        "crystal_catalog": crystal_catalog.stats(),
+        "admission": identification_admission.stats(),
+        "deadlines": request_deadlines.stats(),
+        "validation": ExoditicalValidator.engine.stats(),
+        "validation_memo": validation_memo.stats(),
+        "gemini_output": {
+            "json_mode": GEMINI_JSON_MODE,
+            "modes": gemini_output_stats.stats(),
+            "base_prompt_chars": {
+                "schema": len(AIService.identification_prompt(structured_output=True)),
+                "prompt": len(AIService.identification_prompt()),
+            },
+        },
+        "ai_json_repair": json_repair_stats.stats(),
+        "identification_cache": identification_cache.stats(),
+        "identification_single_flight": identification_flights.stats(),
+        "enhancement_jobs": enhancement_jobs.stats(),
+        "collection_digests": collection_digests.stats(),
+        "parserator_cache": parserator_cache.stats(),
+        "usage_ledger": usage_ledger.stats(),
+        "id_tokens": id_tokens.stats(),
+        "image_normalization": image_normalizer.stats(),
+        "uploads": upload_tracker.stats()
+    }
+
+@app.post("/api/crystal/identify-enhanced", response_model=EnhancedCrystalIdentificationResponse, openapi_extra=identification_openapi(CrystalIdentificationRequest))
+async def identify_crystal_enhanced(http_request: Request):
     """Enhanced crystal identification with Parserator and Exoditical validation"""
-    try:
-        logger.info(f"Enhanced crystal identification request received")
+    async with identification_upload(http_request, CrystalIdentificationRequest, upload_limits, upload_tracker) as (request, upload):
+        with usage_ledger.admit(await id_tokens.user_id(http_request), 'identify-enhanced', client_ip=client_address(http_request)) as usage:
+            try:
+                logger.info(f"Enhanced crystal identification request received")
+                brownout = brownout_controller.active()
         
-        # Stage 1: Primary AI identification
-        if GEMINI_API_KEY:
-            base_result = await AIService.identify_crystal_with_gemini(
-                request.image_data, 
-                request.user_context
-            )
-            source = "gemini-pro-vision-enhanced"
-        elif OPENAI_API_KEY:
-            base_result = await AIService.identify_crystal_with_openai(
-                request.image_data, 
-                request.user_context
-            )
-            source = "gpt-4-vision-enhanced"
-        else:
-            raise HTTPException(status_code=503, detail="No AI services configured")
+                # Stage 1: Primary AI identification (identification only in brownout)
+                base_result, model, result_id = await within_deadline(identify_with_available_provider(
+                    upload or request.image_data,
+                    request.user_context,
+                    degraded=usage.degraded,
+                    brief=brownout
+                ), 'identification')
+                source = f"{model}-enhanced"
+                degraded = None
+                if brownout:
+                    # Chakras, zodiac, healing properties, care and synergy stones from the local catalog
+                    base_result, catalog_match = crystal_catalog.enrich(base_result)
+                    result_id = None  # enriched, so no longer the answer the id stands for
+                    brownout_controller.record_degraded()
+                    degraded = {"mode": "brownout", "reason": brownout_controller.reason,
+                                "enrichment_source": "catalog", "catalog_match": catalog_match}
         
-        # Stage 2: Exoditical validation
-        ethical_validation = ExoditicalValidator.validate_crystal_data(base_result)
+                # Stage 2: Exoditical validation
+                ethical_validation = ExoditicalValidator.validate_crystal_data(base_result, key=result_id)
         
-        # Stage 3: Parserator enhancement (if available)
-        parserator_metadata = None
-        cultural_context = {}
-        environmental_impact = {}
-        personalized_recommendations = []
+                # Stage 3: Parserator enhancement (if available), inline or as a background job
+                enhancement_job_id = None
+                if usage.degraded:
+                    # Over the daily budget: skip the Parserator call
+                    enhancement = {"cultural_context": {}, "environmental_impact": {}, "personalized_recommendations": [],
+                                   "parserator_metadata": {"skipped": "daily AI budget exceeded"}}
+                elif brownout:
+                    enhancement = {"cultural_context": {}, "environmental_impact": {}, "personalized_recommendations": [],
+                                   "parserator_metadata": {"skipped": "brownout"}}
+                elif request.async_enhancement and PARSERATOR_API_KEY and request.user_profile and request.existing_collection:
+                    try:
+                        enhancement_job_id = enhancement_jobs.submit('parserator_enhancement', lambda: enhance_identification(base_result, request))
+                    except HTTPException as e:
+                        logger.warning(f"Parserator enhancement not queued: {e.detail}")
+                    enhancement = {"cultural_context": {}, "environmental_impact": {}, "personalized_recommendations": [], "parserator_metadata": None}
+                elif PARSERATOR_API_KEY and request.user_profile and request.existing_collection and not stage_allowed('parserator'):
+                    # Too little of the request deadline left to start the optional Parserator stage
+                    enhancement = {"cultural_context": {}, "environmental_impact": {}, "personalized_recommendations": [],
+                                   "parserator_metadata": {"skipped": "deadline"}}
+                else:
+                    try:
+                        enhancement = await within_deadline(enhance_identification(base_result, request), 'parserator')
+                    except DeadlineExceeded:
+                        enhancement = {"cultural_context": {}, "environmental_impact": {}, "personalized_recommendations": [],
+                                       "parserator_metadata": {"skipped": "deadline"}}
         
-        if PARSERATOR_API_KEY and request.user_profile and request.existing_collection:
-            try:
-                enhancement = await ParseOperatorService.enhance_crystal_identification(
-                    crystal_data=base_result,
-                    user_profile=request.user_profile,
-                    collection=request.existing_collection or []
+                return EnhancedCrystalIdentificationResponse(
+                    identification=base_result.get("identification", {}),
+                    metaphysical_properties=base_result.get("metaphysical_properties", {}),
+                    physical_properties=base_result.get("physical_properties", {}),
+                    care_instructions=base_result.get("care_instructions", {}),
+                    confidence=base_result.get("identification", {}).get("confidence", 0.8),
+                    source=source,
+                    ethical_validation=ethical_validation,
+                    enhancement_job_id=enhancement_job_id,
+                    degraded=degraded,
+                    **enhancement
                 )
-                
-                if enhancement.get('success'):
-                    parsed_data = enhancement.get('parsedData', {})
-                    cultural_context = parsed_data.get('enhanced_properties', {})
-                    environmental_impact = parsed_data.get('ethical_assessment', {})
-                    personalized_recommendations = parsed_data.get('personalization', {})
-                    parserator_metadata = enhancement.get('metadata', {})
-                    
-            except Exception as e:
-                logger.warning(f"Parserator enhancement failed: {e}")
-        
-        return EnhancedCrystalIdentificationResponse(
-            identification=base_result.get("identification", {}),
-            metaphysical_properties=base_result.get("metaphysical_properties", {}),
-            physical_properties=base_result.get("physical_properties", {}),
-            care_instructions=base_result.get("care_instructions", {}),
-            confidence=base_result.get("identification", {}).get("confidence", 0.8),
-            source=source,
-            ethical_validation=ethical_validation,
-            cultural_context=cultural_context,
-            environmental_impact=environmental_impact,
-            personalized_recommendations=[personalized_recommendations] if personalized_recommendations else [],
-            parserator_metadata=parserator_metadata
-        )
         
-    except Exception as e:
-        logger.error(f"Enhanced crystal identification error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+            except (UpstreamUnavailable, DeadlineExceeded):
+                raise  # keep the 503 and its Retry-After, or the 504
+            except Exception as e:
+                logger.error(f"Enhanced crystal identification error: {e}")
+                raise HTTPException(status_code=500, detail=str(e))
+
+async def enhance_identification(base_result: Dict, request: CrystalIdentificationRequest) -> Dict[str, Any]:
+    """Parserator cultural, environmental and personalization fields; empty when unavailable or failed"""
+    parserator_metadata = None
+    cultural_context = {}
+    environmental_impact = {}
+    personalized_recommendations = []
+
+    if PARSERATOR_API_KEY and request.user_profile and request.existing_collection:
+        try:
+            enhancement = await ParseOperatorService.enhance_crystal_identification(
+                crystal_data=base_result,
+                user_profile=request.user_profile,
+                collection=request.existing_collection or []
+            )
 
-@app.post("/api/crystal/identify")
-async def identify_crystal_basic(request: CrystalIdentificationRequest):
+            if enhancement.get('success'):
+                parsed_data = enhancement.get('parsedData', {})
+                cultural_context = parsed_data.get('enhanced_properties', {})
+                environmental_impact = parsed_data.get('ethical_assessment', {})
+                personalized_recommendations = parsed_data.get('personalization', {})
+                parserator_metadata = enhancement.get('metadata', {})
+
+        except Exception as e:
+            logger.warning(f"Parserator enhancement failed: {e}")
+
+    return {
+        "cultural_context": cultural_context,
+        "environmental_impact": environmental_impact,
+        "personalized_recommendations": [personalized_recommendations] if personalized_recommendations else [],
+        "parserator_metadata": parserator_metadata,
+    }
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, timings and (once finished) result of a background enhancement job"""
+    job = enhancement_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@app.post("/api/crystal/identify", openapi_extra=identification_openapi(CrystalIdentificationRequest))
+async def identify_crystal_basic(http_request: Request):
     """Basic crystal identification (legacy endpoint)"""
-    try:
-        logger.info(f"Basic crystal identification request received")
+    async with identification_upload(http_request, CrystalIdentificationRequest, upload_limits, upload_tracker) as (request, upload):
+        with usage_ledger.admit(await id_tokens.user_id(http_request), 'identify', client_ip=client_address(http_request)) as usage:
+            try:
+                logger.info(f"Basic crystal identification request received")
         
-        if GEMINI_API_KEY:
-            result = await AIService.identify_crystal_with_gemini(
-                request.image_data, 
-                request.user_context
-            )
-            source = "gemini-pro-vision"
-        elif OPENAI_API_KEY:
-            result = await AIService.identify_crystal_with_openai(
-                request.image_data, 
-                request.user_context
-            )
-            source = "gpt-4-vision"
-        else:
-            raise HTTPException(status_code=503, detail="No AI services configured")
+                result, model, result_id = await within_deadline(identify_with_available_provider(
+                    upload or request.image_data,
+                    request.user_context,
+                    degraded=usage.degraded
+                ), 'identification')
+                source = model
         
-        # Apply basic ethical validation
-        ethical_validation = ExoditicalValidator.validate_crystal_data(result)
+                # Apply basic ethical validation
+                ethical_validation = ExoditicalValidator.validate_crystal_data(result, key=result_id)
         
-        return {
-            "identification": result.get("identification", {}),
-            "metaphysical_properties": result.get("metaphysical_properties", {}),
-            "physical_properties": result.get("physical_properties", {}),
-            "care_instructions": result.get("care_instructions", {}),
-            "confidence": result.get("identification", {}).get("confidence", 0.8),
-            "source": source,
-            "ethical_validation": ethical_validation
-        }
+                return {
+                    "identification": result.get("identification", {}),
+                    "metaphysical_properties": result.get("metaphysical_properties", {}),
+                    "physical_properties": result.get("physical_properties", {}),
+                    "care_instructions": result.get("care_instructions", {}),
+                    "confidence": result.get("identification", {}).get("confidence", 0.8),
+                    "source": source,
+                    "ethical_validation": ethical_validation
+                }
         
-    except Exception as e:
-        logger.error(f"Crystal identification error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+            except (UpstreamUnavailable, DeadlineExceeded):
+                raise  # keep the 503 and its Retry-After, or the 504
+            except Exception as e:
+                logger.error(f"Crystal identification error: {e}")
+                raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/automation/cross-feature", response_model=AutomationResponse)
-async def cross_feature_automation(request: AutomationRequest):
+async def cross_feature_automation(request: AutomationRequest, http_request: Request):
     """Process cross-feature automation with ethical validation"""
+    usage = usage_ledger.admit(await id_tokens.user_id(http_request), 'automation', client_ip=client_address(http_request))
     try:
         logger.info(f"Cross-feature automation request: {request.trigger_event}")
         
-        if not PARSERATOR_API_KEY:
+        if not PARSERATOR_API_KEY or usage.degraded:
             # Fallback automation without Parserator
             return AutomationResponse(
                 suggested_actions=[],
                 cross_feature_updates=[],
-                ethical_considerations=["Basic automation available - Parserator not configured"],
+                ethical_considerations=["Basic automation available - Parserator not configured" if not PARSERATOR_API_KEY
+                                        else "Basic automation available - daily AI budget exceeded"],
                 cultural_context={},
                 environmental_impact={}
             )
         
-        automation_result = await ParseOperatorService.process_automation_request(
-            trigger_event=request.trigger_event,
-            event_data=request.event_data,
-            user_profile=request.user_profile,
-            collection=request.collection
-        )
+        with usage:
+            automation_result = await ParseOperatorService.process_automation_request(
+                trigger_event=request.trigger_event,
+                event_data=request.event_data,
+                user_profile=request.user_profile,
+                collection=request.collection
+            )
         
         if automation_result.get('success'):
             parsed_data = automation_result.get('parsedData', {})
@@ -707,6 +1053,8 @@ async def cross_feature_automation(request: AutomationRequest):
     except Exception as e:
         logger.error(f"Cross-feature automation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        usage.settle()  # the fallbacks never enter the scope
 
 @app.post("/api/crystal/validate")
 async def validate_crystal_data(crystal_data: Dict[str, Any]):
@@ -734,10 +1082,16 @@ async def get_crystal_collection(user_id: str):
     }
 
 @app.post("/api/crystal/save")
-async def save_crystal(entry: CollectionEntry):
+async def save_crystal(entry: CollectionEntry, user_id: Optional[str] = None):
     """Save crystal to user's collection with ethical validation"""
     # In production, this would save to database
     logger.info(f"Saving crystal: {entry.crystal_name}")
+    owner = entry.user_id or user_id  # body field, or the older query parameter
+    if owner:
+        # The collection changed: drop its digest and any enhancement computed from it
+        collection_digests.invalidate(owner)
+        parserator_cache.invalidate_tag(owner)
+    # Without an owner the cached entries expire with their TTL
     return {
         "status": "success",
         "crystal_id": entry.id,
@@ -755,6 +1109,11 @@ async def track_usage(stats: UsageStats):
         "ethical_compliance": True
     }
 
+@app.get("/api/metrics/usage/{user_id}")
+async def get_usage(user_id: str):
+    """Operator view of today's AI usage for a user: upstream calls, tokens, image bytes and latency per endpoint and provider"""
+    return usage_ledger.usage(user_id)
+
 @app.get("/api/crystal/search")
 async def search_crystals(q: str, limit: int = 20):
     """Search crystal database with ethical considerations"""
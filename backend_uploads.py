@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire upload handling
+Stream identification images (JSON, multipart or raw binary) into bounded spooled buffers
+and base64-encode them straight into outbound AI requests
+"""
+
+import os
+import json
+import base64
+import asyncio
+import hashlib
+import logging
+import tempfile
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional, Any, Tuple, Type, Union, AsyncIterator, Iterator
+
+from fastapi import HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; process memory is then reported as unknown
+    resource = None
+
+try:
+    from multipart.multipart import MultipartParser, parse_options_header
+    MULTIPART_AVAILABLE = True
+except ImportError:  # python-multipart missing: JSON and raw binary uploads still work
+    MultipartParser = None
+    parse_options_header = None
+    MULTIPART_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 3 * 16 KiB raw bytes -> 64 KiB of base64 per chunk, with no padding between chunks
+BASE64_CHUNK_BYTES = 3 * 16 * 1024
+
+# Fields accepted next to the image in multipart bodies (JSON-encoded form values)
+IMAGE_FIELD = 'image'
+
+IMAGE_CONTENT_TYPES = ('image/', 'application/octet-stream')
+
+
+@dataclass
+class UploadLimits:
+    max_image_bytes: int = 20 * 1024 * 1024
+    max_json_bytes: int = 28 * 1024 * 1024  # base64 inflates by 4/3
+    max_field_bytes: int = 256 * 1024
+    spool_memory_bytes: int = 1024 * 1024
+
+    @classmethod
+    def from_env(cls) -> 'UploadLimits':
+        """IMAGE_MAX_UPLOAD_BYTES / IDENTIFY_MAX_JSON_BYTES / UPLOAD_MAX_FIELD_BYTES / UPLOAD_SPOOL_MEMORY_BYTES"""
+        return cls(
+            max_image_bytes=int(os.getenv('IMAGE_MAX_UPLOAD_BYTES', 20 * 1024 * 1024)),
+            max_json_bytes=int(os.getenv('IDENTIFY_MAX_JSON_BYTES', 28 * 1024 * 1024)),
+            max_field_bytes=int(os.getenv('UPLOAD_MAX_FIELD_BYTES', 256 * 1024)),
+            spool_memory_bytes=int(os.getenv('UPLOAD_SPOOL_MEMORY_BYTES', 1024 * 1024)),
+        )
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Upload exceeds the {limit} byte limit")
+
+
+class SpooledImage:
+    """Uploaded image bytes held in memory up to a threshold, then in a named temp file.
+
+    The SHA-256 is computed while streaming, so cache keys never need the whole image in
+    memory, and a rolled-over spool can be handed to worker processes by path.
+    """
+
+    def __init__(self, max_bytes: int, spool_memory_bytes: int, mime_type: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.spool_memory_bytes = spool_memory_bytes
+        self.mime_type = mime_type
+        self.size = 0
+        self.peak_memory_bytes = 0
+        self._sha256 = hashlib.sha256()
+        self._buffer = bytearray()
+        self._file = None
+        self._refs = 1
+
+    def write(self, chunk: bytes):
+        if self.size + len(chunk) > self.max_bytes:
+            raise _too_large(self.max_bytes)
+        self.size += len(chunk)
+        self._sha256.update(chunk)
+
+        if self._file is None and len(self._buffer) + len(chunk) > self.spool_memory_bytes:
+            # Roll over: the buffered head goes to disk and the memory is released
+            self._file = tempfile.NamedTemporaryFile(prefix='crystal-upload-', suffix='.img')
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._buffer += chunk
+            self.peak_memory_bytes = max(self.peak_memory_bytes, len(self._buffer))
+
+    def finish(self):
+        if self._file is not None:
+            self._file.flush()
+
+    @property
+    def digest(self) -> str:
+        return self._sha256.hexdigest()
+
+    @property
+    def path(self) -> Optional[str]:
+        """Temp file path once the upload rolled over to disk (None while in memory)"""
+        return self._file.name if self._file is not None else None
+
+    def source(self) -> Union[bytes, str]:
+        """What the image normalizer reads: the spool path, or the bytes for small uploads"""
+        return self.path or bytes(self._buffer)
+
+    def iter_chunks(self, chunk_size: int = BASE64_CHUNK_BYTES) -> Iterator[bytes]:
+        if self._file is None:
+            view = memoryview(self._buffer)
+            for offset in range(0, len(view), chunk_size):
+                yield bytes(view[offset:offset + chunk_size])
+            return
+        # A fresh handle per pass keeps retries independent of the writer's file position
+        with open(self._file.name, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def retain(self):
+        """Keep the spool alive for work that may outlive the request (each retain needs a close)"""
+        self._refs += 1
+
+    def close(self):
+        self._refs -= 1
+        if self._refs > 0:
+            return
+        self._buffer = bytearray()
+        if self._file is not None:
+            self._file.close()  # NamedTemporaryFile unlinks on close
+            self._file = None
+
+
+def base64_length(size: int) -> int:
+    return 4 * ((size + 2) // 3)
+
+
+class StreamingJSONBody:
+    """JSON request body whose image field is base64-encoded chunk by chunk while sending.
+
+    The payload is serialized once with a placeholder where the image goes; the image is
+    then streamed between the two halves, so neither the base64 string nor the full JSON
+    document is ever materialised. Content-Length is exact, so no chunked encoding is needed.
+    """
+
+    PLACEHOLDER = '__crystal_grimoire_image__'
+
+    def __init__(self, payload: Dict[str, Any], image: Union[bytes, SpooledImage], value_prefix: str = ''):
+        """value_prefix goes in front of the base64 inside the string (e.g. a data: URL header)"""
+        serialized = json.dumps(payload)
+        marker = json.dumps(self.PLACEHOLDER)
+        if serialized.count(marker) != 1:
+            raise ValueError("payload must contain the image placeholder exactly once")
+        prefix, suffix = serialized.split(marker)
+        self._prefix = (prefix + json.dumps(value_prefix)[:-1]).encode('utf-8')
+        self._suffix = ('"' + suffix).encode('utf-8')
+        self._image = image
+        self._image_size = len(image) if isinstance(image, bytes) else image.size
+
+    @property
+    def content_length(self) -> int:
+        return len(self._prefix) + base64_length(self._image_size) + len(self._suffix)
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {'Content-Type': 'application/json', 'Content-Length': str(self.content_length)}
+
+    def _raw_chunks(self) -> Iterator[bytes]:
+        if isinstance(self._image, bytes):
+            view = memoryview(self._image)
+            for offset in range(0, len(view), BASE64_CHUNK_BYTES):
+                yield view[offset:offset + BASE64_CHUNK_BYTES]
+        else:
+            yield from self._image.iter_chunks(BASE64_CHUNK_BYTES)
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        yield self._prefix
+        on_disk = isinstance(self._image, SpooledImage) and self._image.path is not None
+        chunks = self._raw_chunks()
+        while True:
+            # Disk reads go to a thread so a slow volume never blocks the event loop
+            chunk = await asyncio.to_thread(next, chunks, None) if on_disk else next(chunks, None)
+            if chunk is None:
+                break
+            yield base64.b64encode(chunk)
+        yield self._suffix
+
+
+class UploadTracker:
+    """Counters for /api/metrics: how uploads arrived and how much request data sits in memory"""
+
+    def __init__(self, limits: UploadLimits):
+        self.limits = limits
+        self.uploads: Dict[str, int] = {'json': 0, 'multipart': 0, 'binary': 0}
+        self.bytes_received = 0
+        self.spooled_to_disk = 0
+        self.rejected_too_large = 0
+        self.in_flight = 0
+        self.in_flight_buffered_bytes = 0
+        self.peak_in_flight_buffered_bytes = 0
+        self.max_request_buffered_bytes = 0
+
+    def acquire(self, kind: str, received_bytes: int, buffered_bytes: int):
+        self.uploads[kind] += 1
+        self.bytes_received += received_bytes
+        self.in_flight += 1
+        self.in_flight_buffered_bytes += buffered_bytes
+        self.peak_in_flight_buffered_bytes = max(self.peak_in_flight_buffered_bytes, self.in_flight_buffered_bytes)
+        self.max_request_buffered_bytes = max(self.max_request_buffered_bytes, buffered_bytes)
+
+    def release(self, buffered_bytes: int):
+        self.in_flight -= 1
+        self.in_flight_buffered_bytes -= buffered_bytes
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'multipart_supported': MULTIPART_AVAILABLE,
+            'max_image_bytes': self.limits.max_image_bytes,
+            'max_json_bytes': self.limits.max_json_bytes,
+            'spool_memory_bytes': self.limits.spool_memory_bytes,
+            'uploads': dict(self.uploads),
+            'bytes_received': self.bytes_received,
+            'spooled_to_disk': self.spooled_to_disk,
+            'rejected_too_large': self.rejected_too_large,
+            'in_flight': self.in_flight,
+            'in_flight_buffered_bytes': self.in_flight_buffered_bytes,
+            'peak_in_flight_buffered_bytes': self.peak_in_flight_buffered_bytes,
+            'max_request_buffered_bytes': self.max_request_buffered_bytes,
+            'process_memory': process_memory(),
+        }
+
+
+def process_memory() -> Dict[str, Optional[int]]:
+    """Current and peak resident set size in bytes (Linux /proc, falling back to getrusage)"""
+    rss = peak = None
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith('VmHWM:'):
+                    peak = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if peak is None and resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {'rss_bytes': rss, 'peak_rss_bytes': peak}
+
+
+async def _limited_stream(request: Request, limit: int) -> AsyncIterator[bytes]:
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise _too_large(limit)
+        yield chunk
+
+
+def _parse_json_field(name: str, raw: str) -> Any:
+    try:
+        return json.loads(raw) if raw else None
+    except ValueError:
+        raise RequestValidationError([{'loc': ('body', name), 'msg': 'must be a JSON value', 'type': 'json_invalid'}])
+
+
+async def _read_multipart(request: Request, limits: UploadLimits) -> Tuple[Dict[str, Any], SpooledImage]:
+    if not MULTIPART_AVAILABLE:
+        raise HTTPException(status_code=415, detail="Multipart uploads require python-multipart")
+    _, params = parse_options_header(request.headers.get('content-type', ''))
+    boundary = params.get(b'boundary')
+    if not boundary:
+        raise HTTPException(status_code=400, detail="Missing boundary in multipart body")
+
+    image: Optional[SpooledImage] = None
+    fields: Dict[str, bytearray] = {}
+    part: Dict[str, Any] = {}
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, header_name=b'', header_value=b'')
+
+    def on_header_field(data, start, end):
+        part['header_name'] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part['header_value'] += data[start:end]
+
+    def on_header_end():
+        part['headers'][part['header_name'].lower()] = part['header_value']
+        part['header_name'], part['header_value'] = b'', b''
+
+    def on_headers_finished():
+        nonlocal image
+        _, options = parse_options_header(part['headers'].get(b'content-disposition', b''))
+        name = options.get(b'name', b'').decode('utf-8', 'replace')
+        part['name'] = name
+        if name == IMAGE_FIELD:
+            if image is not None:
+                raise HTTPException(status_code=400, detail="Only one image per identification request")
+            content_type = part['headers'].get(b'content-type', b'').decode('latin-1') or None
+            image = SpooledImage(limits.max_image_bytes, limits.spool_memory_bytes, content_type)
+        else:
+            fields[name] = bytearray()
+
+    def on_part_data(data, start, end):
+        if part['name'] == IMAGE_FIELD:
+            image.write(data[start:end])
+            return
+        field = fields[part['name']]
+        if len(field) + end - start > limits.max_field_bytes:
+            raise _too_large(limits.max_field_bytes)
+        field += data[start:end]
+
+    parser = MultipartParser(boundary, {
+        'on_part_begin': on_part_begin,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+        'on_part_data': on_part_data,
+    })
+    # Whole-body cap: the image limit plus room for the other fields and part headers
+    body_limit = limits.max_image_bytes + limits.max_field_bytes * 4
+    try:
+        async for chunk in _limited_stream(request, body_limit):
+            parser.write(chunk)
+        parser.finalize()
+    except BaseException:
+        if image is not None:
+            image.close()
+        raise
+
+    if image is None:
+        raise RequestValidationError([{'loc': ('body', IMAGE_FIELD), 'msg': 'Field required', 'type': 'missing'}])
+    image.finish()
+    values = {name: _parse_json_field(name, value.decode('utf-8', 'replace')) for name, value in fields.items()}
+    return values, image
+
+
+async def _read_binary(request: Request, limits: UploadLimits, field_names) -> Tuple[Dict[str, Any], SpooledImage]:
+    content_type = request.headers.get('content-type', '').split(';')[0].strip() or None
+    image = SpooledImage(limits.max_image_bytes, limits.spool_memory_bytes, content_type)
+    try:
+        async for chunk in request.stream():
+            image.write(chunk)
+    except BaseException:
+        image.close()
+        raise
+    image.finish()
+    # Raw bodies carry the other request fields as JSON-encoded query parameters (other params are left alone)
+    values = {name: _parse_json_field(name, value) for name, value in request.query_params.items() if name in field_names}
+    return values, image
+
+
+def _validation_error(e: ValidationError) -> RequestValidationError:
+    return RequestValidationError([{**error, 'loc': ('body', *error['loc'])} for error in e.errors(include_url=False)])
+
+
+async def read_identification_request(request: Request, model: Type[BaseModel],
+                                      limits: UploadLimits) -> Tuple[BaseModel, Optional[SpooledImage], str, int]:
+    """Parse an identification request from JSON, multipart/form-data or a raw image body.
+
+    JSON bodies keep the existing base64 `image_data` contract. Multipart bodies send the
+    image as the `image` file part and other fields as JSON-encoded form values; raw image
+    bodies (image/* or application/octet-stream) pass other fields as query parameters.
+    Size limits are enforced while streaming, and Content-Length is checked up front.
+    Returns the validated model, the spooled image for binary uploads, the body kind and its size.
+    """
+    content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    if content_type == 'multipart/form-data':
+        kind, limit = 'multipart', limits.max_image_bytes + limits.max_field_bytes * 4
+    elif content_type.startswith(IMAGE_CONTENT_TYPES):
+        kind, limit = 'binary', limits.max_image_bytes
+    else:
+        kind, limit = 'json', limits.max_json_bytes
+
+    declared = request.headers.get('content-length')
+    if declared is not None and declared.isdigit() and int(declared) > limit:
+        raise _too_large(limit)
+
+    if kind == 'json':
+        body = bytearray()
+        async for chunk in _limited_stream(request, limit):
+            body += chunk
+        try:
+            return model.model_validate_json(bytes(body)), None, kind, len(body)
+        except ValidationError as e:
+            raise _validation_error(e)
+
+    if kind == 'multipart':
+        values, image = await _read_multipart(request, limits)
+    else:
+        values, image = await _read_binary(request, limits, model.model_fields)
+    try:
+        # image_data stays empty: the bytes travel separately in the spool
+        parsed = model.model_validate({**values, 'image_data': ''})
+    except ValidationError as e:
+        image.close()
+        raise _validation_error(e)
+    logger.info(f"Image upload received ({kind}): {image.size} bytes, "
+                f"{'spooled to disk' if image.path else 'in memory'}")
+    return parsed, image, kind, image.size
+
+
+@asynccontextmanager
+async def identification_upload(request: Request, model: Type[BaseModel], limits: UploadLimits,
+                                tracker: UploadTracker) -> AsyncIterator[Tuple[BaseModel, Optional[SpooledImage]]]:
+    """Read an identification request and keep its spool alive (and accounted) until the block exits"""
+    try:
+        parsed, image, kind, received = await read_identification_request(request, model, limits)
+    except HTTPException as e:
+        if e.status_code == 413:
+            tracker.rejected_too_large += 1
+        raise
+
+    # JSON bodies are fully buffered; uploads only pin what stayed below the spool threshold
+    buffered = image.peak_memory_bytes if image is not None else received
+    tracker.acquire(kind, received, buffered)
+    if image is not None and image.path is not None:
+        tracker.spooled_to_disk += 1
+    try:
+        yield parsed, image
+    finally:
+        tracker.release(buffered)
+        if image is not None:
+            image.close()
+
+
+def identification_openapi(model: Type[BaseModel]) -> Dict[str, Any]:
+    """openapi_extra documenting the three accepted request body encodings"""
+    properties = {
+        name: {'type': 'string', 'description': 'JSON-encoded value'}
+        for name in model.model_fields if name != 'image_data'
+    }
+    properties[IMAGE_FIELD] = {'type': 'string', 'format': 'binary'}
+    return {
+        'requestBody': {
+            'required': True,
+            'content': {
+                'application/json': {'schema': model.model_json_schema()},
+                'multipart/form-data': {'schema': {'type': 'object', 'required': [IMAGE_FIELD], 'properties': properties}},
+                'application/octet-stream': {'schema': {'type': 'string', 'format': 'binary'}},
+            },
+        },
+    }
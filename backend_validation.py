@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Crystal Grimoire data validation
+Exoditical Moral Architecture (EMA) checks shared by the identification servers
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, FrozenSet, Tuple, Iterable
+
+
+@dataclass(frozen=True)
+class TermCheck:
+    """Adds `delta` when any of `terms` occurs in the payload (`when='none'`: when none of them does)"""
+    terms: Tuple[str, ...]
+    delta: float
+    when: str = 'any'
+
+    def applies(self, found: FrozenSet[str]) -> bool:
+        hit = any(term in found for term in self.terms)
+        return hit if self.when == 'any' else not hit
+
+
+@dataclass(frozen=True)
+class Principle:
+    """A principle's score: `base` plus each applying check in order, clamped to [`floor`, 1.0]"""
+    name: str
+    base: float
+    checks: Tuple[TermCheck, ...]
+    floor: Optional[float] = None
+
+    def score(self, found: FrozenSet[str]) -> float:
+        score = self.base
+        for check in self.checks:
+            if check.applies(found):
+                score += check.delta
+        if self.floor is not None:
+            score = max(score, self.floor)
+        return min(score, 1.0)
+
+
+class ValidationMemo:
+    """Bounded LRU of principle scores keyed by rule-set version and a content key.
+
+    Content keys must be cheap and change whenever the payload does, e.g. the id of an
+    identification result (new for every upstream answer, carried through the identification
+    cache); hashing the payload itself would cost about as much as scoring it.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Dict[str, float]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> 'ValidationMemo':
+        """VALIDATION_MEMO_MAX_ENTRIES (0 disables memoization)"""
+        return cls(max_entries=int(os.getenv('VALIDATION_MEMO_MAX_ENTRIES', 4096)))
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Dict[str, float]]:
+        scores = self._entries.get(key)
+        if scores is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(scores)
+
+    def set(self, key: str, scores: Dict[str, float]):
+        self._entries[key] = dict(scores)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class ValidationEngine:
+    """Scores every principle from one lowercased serialization of the payload.
+
+    The checks' terms are collected once, deduplicated across principles; each validation
+    serializes the payload once and looks every distinct term up in that text once, so the
+    matched set equals `term in str(data).lower()` for every term.
+    With a `memo`, scores of payloads that come with a content `key` are remembered under the
+    rule set's `version` (a hash of the principles), so changed rules never serve stale scores.
+    """
+
+    def __init__(self, principles: List[Principle], memo: Optional[ValidationMemo] = None):
+        self.principles = list(principles)
+        self.terms = list(dict.fromkeys(term for principle in self.principles
+                                        for check in principle.checks for term in check.terms))
+        self.version = hashlib.sha256(repr(self.principles).encode('utf-8')).hexdigest()[:12]
+        self.memo = memo
+        self.validations = 0
+        self.scored = 0
+        self._chars_total = 0
+        self._ms_total = 0.0
+        self.max_ms = 0.0
+
+    def matched_terms(self, data: Any) -> FrozenSet[str]:
+        text = str(data).lower()
+        self._chars_total += len(text)
+        return frozenset(term for term in self.terms if term in text)
+
+    def score(self, data: Any, key: Optional[str] = None) -> Dict[str, float]:
+        """{principle name: score} for a payload; `key` identifies its content for the memo"""
+        started = time.perf_counter()
+        memo_key = f'{self.version}:{key}' if key is not None and self.memo is not None and self.memo.enabled else None
+        scores = self.memo.get(memo_key) if memo_key is not None else None
+        if scores is None:
+            found = self.matched_terms(data)
+            scores = {principle.name: principle.score(found) for principle in self.principles}
+            self.scored += 1
+            if memo_key is not None:
+                self.memo.set(memo_key, scores)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.validations += 1
+        self._ms_total += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        return scores
+
+    def counters(self) -> Dict[str, float]:
+        """Raw counters, so validations run in a worker process can be added to the parent's engine"""
+        return {'validations': self.validations, 'scored': self.scored, 'chars': self._chars_total,
+                'ms': self._ms_total, 'max_ms': self.max_ms}
+
+    def add_counters(self, counters: Dict[str, float]):
+        """Add a worker's counter deltas (see `counters`) to this engine's stats"""
+        self.validations += int(counters['validations'])
+        self.scored += int(counters['scored'])
+        self._chars_total += int(counters['chars'])
+        self._ms_total += counters['ms']
+        self.max_ms = max(self.max_ms, counters['max_ms'])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'version': self.version,
+            'principles': len(self.principles),
+            'terms': len(self.terms),
+            'validations': self.validations,
+            'scored': self.scored,
+            'avg_payload_chars': round(self._chars_total / self.scored) if self.scored else 0,
+            'avg_ms': round(self._ms_total / self.validations, 3) if self.validations else 0.0,
+            'max_ms': round(self.max_ms, 3),
+        }
+
+
+EMA_PRINCIPLES = [
+    # Data can be easily exported: standard formats, user exportability
+    Principle('data_portability', 0.8, (
+        TermCheck(('export_format', 'json'), 0.1),
+        TermCheck(('exportable',), 0.1),
+    )),
+    # High base score - user owns their crystal data
+    Principle('user_sovereignty', 0.9, (
+        TermCheck(('user_controlled',), 0.1),
+    )),
+    # No proprietary formats that create vendor lock-in
+    Principle('technological_agnosticism', 0.8, (
+        TermCheck(('proprietary', 'locked', 'vendor_specific'), 0.2, when='none'),
+    )),
+    # AI and processing transparency
+    Principle('transparency', 0.8, (
+        TermCheck(('confidence', 'ai_'), 0.1),
+        TermCheck(('processing', 'metadata'), 0.1),
+    )),
+]
+
+EXODITICAL_PRINCIPLES = [
+    # Cultural acknowledgment, minus appropriative language
+    Principle('cultural_sovereignty', 0.7, (
+        TermCheck(('traditional', 'indigenous', 'cultural'), 0.2),
+        TermCheck(('ancient secret', 'mystical power', 'sacred wisdom', 'shamanic'), -0.3),
+    ), floor=0.0),
+    # No medical claims; beliefs distinguished from facts
+    Principle('spiritual_integrity', 0.8, (
+        TermCheck(('cures', 'heals', 'treats', 'diagnoses', 'medical'), -0.4),
+        TermCheck(('believed to', 'traditionally', 'some say'), 0.1),
+    ), floor=0.0),
+    # Environmental considerations and ethical sourcing
+    Principle('environmental_stewardship', 0.6, (
+        TermCheck(('environmental', 'sustainable'), 0.3),
+        TermCheck(('ethical', 'fair trade'), 0.1),
+    ), floor=0.0),
+    # Uncertainty acknowledged, human agency preserved
+    Principle('technological_wisdom', 0.8, (
+        TermCheck(('may', 'might', 'possibly', 'confidence'), 0.1),
+        TermCheck(('personal choice', 'individual', 'trust yourself'), 0.1),
+    ), floor=0.0),
+    # No economic barriers, inclusive language
+    Principle('inclusive_accessibility', 0.8, (
+        TermCheck(('expensive', 'exclusive', 'elite', 'advanced only'), -0.3),
+        TermCheck(('accessible', 'everyone', 'free', 'community'), 0.2),
+    ), floor=0.0),
+]
+
+
+# Shared by both rule sets; each engine's version keeps their entries apart
+validation_memo = ValidationMemo.from_env()
+
+
+class EMAValidator:
+    engine = ValidationEngine(EMA_PRINCIPLES, memo=validation_memo)
+
+    @staticmethod
+    def validate_data_sovereignty(data: Dict, key: Optional[str] = None) -> Dict:
+        """Validate data against EMA principles (`key`: content key for the validation memo)"""
+        validation_result = EMAValidator.engine.score(data, key)
+
+        overall_score = sum(validation_result.values()) / len(validation_result)
+
+        return {
+            'overall_ema_score': overall_score,
+            'principle_scores': validation_result,
+            'is_ema_compliant': overall_score >= 0.7,
+            'recommendations': EMAValidator._generate_recommendations(validation_result),
+        }
+
+    @staticmethod
+    def _generate_recommendations(scores: Dict) -> List[str]:
+        """Generate EMA recommendations"""
+        recommendations = []
+
+        if scores['data_portability'] < 0.8:
+            recommendations.append('Ensure user data can be easily exported in standard formats')
+
+        if scores['user_sovereignty'] < 0.8:
+            recommendations.append('Strengthen user control and ownership of their data')
+
+        if scores['technological_agnosticism'] < 0.8:
+            recommendations.append('Avoid proprietary formats that create vendor lock-in')
+
+        if scores['transparency'] < 0.8:
+            recommendations.append('Increase transparency in AI decision-making')
+
+        recommendations.append('Remember: "The ultimate expression of empowerment is the freedom to leave"')
+
+        return recommendations
+
+
+# Exoditical Validation Service
+class ExoditicalValidator:
+    engine = ValidationEngine(EXODITICAL_PRINCIPLES, memo=validation_memo)
+
+    @staticmethod
+    def validate_crystal_data(crystal_data: Dict, key: Optional[str] = None) -> Dict:
+        """Validate crystal data against Exoditical principles (`key`: content key for the validation memo)"""
+        validation_result = ExoditicalValidator.engine.score(crystal_data, key)
+
+        overall_score = sum(validation_result.values()) / len(validation_result)
+
+        return {
+            'overall_ethical_score': overall_score,
+            'principle_scores': validation_result,
+            'is_ethically_compliant': overall_score >= 0.7,
+            'recommendations': ExoditicalValidator._generate_recommendations(validation_result),
+        }
+
+    @staticmethod
+    def _generate_recommendations(scores: Dict) -> List[str]:
+        """Generate ethical recommendations based on scores"""
+        recommendations = []
+
+        if scores['cultural_sovereignty'] < 0.7:
+            recommendations.append('Add cultural context and acknowledge traditional sources')
+
+        if scores['spiritual_integrity'] < 0.7:
+            recommendations.append('Distinguish between beliefs and facts, avoid medical claims')
+
+        if scores['environmental_stewardship'] < 0.7:
+            recommendations.append('Include environmental impact and ethical sourcing information')
+
+        if scores['technological_wisdom'] < 0.7:
+            recommendations.append('Acknowledge AI limitations and encourage personal discernment')
+
+        if scores['inclusive_accessibility'] < 0.7:
+            recommendations.append('Ensure information is accessible regardless of economic status')
+
+        return recommendations
+
+
+# Bulk validation: name -> (validate function, overall score key, compliance key)
+VALIDATORS = {
+    'ema': (EMAValidator.validate_data_sovereignty, 'overall_ema_score', 'is_ema_compliant'),
+    'exoditical': (ExoditicalValidator.validate_crystal_data, 'overall_ethical_score', 'is_ethically_compliant'),
+}
+VALIDATOR_ENGINES = {'ema': EMAValidator.engine, 'exoditical': ExoditicalValidator.engine}
+
+
+def crystal_id(data: Any, index: int) -> str:
+    """A crystal's id (top-level or crystal_core.id), else its position in the batch"""
+    if isinstance(data, dict):
+        core = data.get('crystal_core')
+        found = data.get('id') or (core.get('id') if isinstance(core, dict) else None)
+        if found:
+            return str(found)
+    return str(index)
+
+
+def validate_chunk(items: List[Tuple[int, Any]], validators: Tuple[str, ...]
+                   ) -> Tuple[List[Dict[str, Any]], float, Dict[str, Dict[str, float]]]:
+    """Validate (index, crystal) pairs with each named validator; runs in a worker process.
+
+    Returns the per-item results, the milliseconds spent and, per validator, the engine counters
+    this chunk added (a worker's engines are its own copies; see `ValidationEngine.add_counters`).
+    """
+    started = time.perf_counter()
+    before = {name: VALIDATOR_ENGINES[name].counters() for name in validators}
+    results = [
+        {'index': index, 'id': crystal_id(data, index),
+         'validations': {name: VALIDATORS[name][0](data) for name in validators}}
+        for index, data in items
+    ]
+    counters = {}
+    for name in validators:
+        after = VALIDATOR_ENGINES[name].counters()
+        counters[name] = {field: after[field] - before[name][field] for field in after if field != 'max_ms'}
+        counters[name]['max_ms'] = after['max_ms']
+    return results, (time.perf_counter() - started) * 1000, counters
+
+
+class ValidationReport:
+    """Aggregate scores of a bulk validation, built up as item results arrive"""
+
+    def __init__(self, validators: Iterable[str]):
+        self.validators = list(validators)
+        self.total = 0
+        self._overall = {name: 0.0 for name in self.validators}
+        self._principles: Dict[str, Dict[str, List[float]]] = {name: {} for name in self.validators}
+        self._non_compliant: Dict[str, List[str]] = {name: [] for name in self.validators}
+
+    def add(self, item: Dict[str, Any]):
+        self.total += 1
+        for name in self.validators:
+            _, overall_key, compliant_key = VALIDATORS[name]
+            result = item['validations'][name]
+            self._overall[name] += result[overall_key]
+            if not result[compliant_key]:
+                self._non_compliant[name].append(item['id'])
+            for principle, score in result['principle_scores'].items():
+                self._principles[name].setdefault(principle, []).append(score)
+
+    def summary(self) -> Dict[str, Any]:
+        """Per validator: mean score, compliance, non-compliant ids and each principle's mean and score distribution"""
+        report = {}
+        for name in self.validators:
+            principles = {}
+            for principle, scores in self._principles[name].items():
+                distribution: Dict[str, int] = {}
+                for score in scores:
+                    bucket = f'{score:.2f}'
+                    distribution[bucket] = distribution.get(bucket, 0) + 1
+                principles[principle] = {
+                    'mean': round(sum(scores) / len(scores), 4),
+                    'distribution': dict(sorted(distribution.items())),
+                }
+            report[name] = {
+                'mean_score': round(self._overall[name] / self.total, 4) if self.total else 0.0,
+                'compliant': self.total - len(self._non_compliant[name]),
+                'non_compliant': len(self._non_compliant[name]),
+                'non_compliant_ids': list(self._non_compliant[name]),
+                'principles': principles,
+            }
+        return {'total': self.total, 'validators': report}
+
+
+class ValidationPool:
+    """Runs bulk validation in chunks on a process pool so scoring never blocks the event loop"""
+
+    def __init__(self, workers: int = 2, chunk_size: int = 50, enabled: bool = True):
+        self.workers = workers
+        self.chunk_size = max(1, chunk_size)
+        self.enabled = enabled
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.batches = 0
+        self.items = 0
+        self.chunks = 0
+        self.thread_chunks = 0
+        self._chunk_ms_total = 0.0
+
+    @classmethod
+    def from_env(cls) -> 'ValidationPool':
+        """VALIDATION_WORKERS / VALIDATION_CHUNK_SIZE / VALIDATION_POOL (off validates in a worker thread)"""
+        return cls(
+            workers=int(os.getenv('VALIDATION_WORKERS', 2)),
+            chunk_size=int(os.getenv('VALIDATION_CHUNK_SIZE', 50)),
+            enabled=os.getenv('VALIDATION_POOL', 'on').lower() not in ('0', 'off', 'false', 'no'),
+        )
+
+    def start(self):
+        if self._pool is None and self.enabled:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    def close(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, crystals: List[Any], validators: Tuple[str, ...]) -> List['asyncio.Future[List[Dict[str, Any]]]']:
+        """One future per chunk of `chunk_size` crystals, each resolving to that chunk's item results"""
+        self.batches += 1
+        self.items += len(crystals)
+        indexed = list(enumerate(crystals))
+        return [asyncio.ensure_future(self._run(indexed[start:start + self.chunk_size], validators))
+                for start in range(0, len(indexed), self.chunk_size)]
+
+    async def _run(self, chunk: List[Tuple[int, Any]], validators: Tuple[str, ...]) -> List[Dict[str, Any]]:
+        if self._pool is None:
+            # Lifespan not run (scripts/tests) or pool disabled: a worker thread still keeps the loop free
+            # (the thread already counted its validations in this process's engines)
+            results, elapsed_ms, _ = await asyncio.to_thread(validate_chunk, chunk, validators)
+            self.thread_chunks += 1
+        else:
+            loop = asyncio.get_running_loop()
+            results, elapsed_ms, counters = await loop.run_in_executor(self._pool, validate_chunk, chunk, validators)
+            for name, chunk_counters in counters.items():
+                VALIDATOR_ENGINES[name].add_counters(chunk_counters)
+        self.chunks += 1
+        self._chunk_ms_total += elapsed_ms
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'workers': self.workers,
+            'chunk_size': self.chunk_size,
+            'batches': self.batches,
+            'items': self.items,
+            'chunks': self.chunks,
+            'thread_chunks': self.thread_chunks,
+            'avg_chunk_ms': round(self._chunk_ms_total / self.chunks, 2) if self.chunks else 0.0,
+        }
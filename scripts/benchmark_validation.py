@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Times EMA + Exoditical validation of a large payload: the compiled engine
+(one serialization per payload) against the per-check str(data).lower() scoring
+it replaced. Run from the repository root:
+
+    python scripts/benchmark_validation.py [--notes 6000] [--repeat 5]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend_validation import EMA_PRINCIPLES, EXODITICAL_PRINCIPLES, ValidationEngine  # noqa: E402
+
+
+def per_check_score(principles, data):
+    """The legacy scoring: every check serializes and lowercases the whole payload again"""
+    scores = {}
+    for principle in principles:
+        score = principle.base
+        for check in principle.checks:
+            hit = any(term in str(data).lower() for term in check.terms)
+            if hit if check.when == 'any' else not hit:
+                score += check.delta
+        if principle.floor is not None:
+            score = max(score, principle.floor)
+        scores[principle.name] = min(score, 1.0)
+    return scores
+
+
+def payload(rng: random.Random, terms, notes: int) -> dict:
+    """Nested crystal-like dict sprinkled with (mixed-case) validator terms"""
+    filler = ['stone', 'quartz', 'clarity', 'grounding', 'pink', 'vein', 'luster', 'x', ' ']
+
+    def text():
+        words = [rng.choice(terms) if rng.random() < 0.15 else rng.choice(filler) for _ in range(rng.randint(1, 8))]
+        return ''.join(word.upper() if rng.random() < 0.2 else word for word in words)
+    return {
+        'identification': {'name': text(), 'confidence': rng.random()},
+        'notes': [text() for _ in range(notes)],
+        'properties': {text(): text() for _ in range(notes // 2)},
+    }
+
+
+def best_of(repeat: int, function, data) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(data)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--notes', type=int, default=6000, help='note strings in the payload')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per variant (best is reported)')
+    args = parser.parse_args()
+
+    rule_sets = (EMA_PRINCIPLES, EXODITICAL_PRINCIPLES)
+    engines = [ValidationEngine(principles) for principles in rule_sets]
+    terms = [term for engine in engines for term in engine.terms if term not in ('shamanic', 'locked')]
+    data = payload(random.Random(5), terms, args.notes)
+
+    for principles, engine in zip(rule_sets, engines):
+        assert engine.score(data) == per_check_score(principles, data), 'engine and per-check scores differ'
+
+    legacy_s = sum(best_of(args.repeat, lambda d, p=p: per_check_score(p, d), data) for p in rule_sets)
+    engine_s = sum(best_of(args.repeat, engine.score, data) for engine in engines)
+    print(f"validation of {len(str(data))} chars: per-check {legacy_s * 1000:.1f}ms, "
+          f"engine {engine_s * 1000:.1f}ms ({legacy_s / engine_s:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -49,7 +49,7 @@ def mock_firebase_admin(mocker, mock_firestore_client):
 
 
 @pytest.fixture(scope="function") # Use function scope if app state changes per test
-def test_client(mock_firebase_admin, mock_firestore_client): # Added mock_firestore_client for direct use
+def test_client(mock_firebase_admin, mock_firestore_client, mocker): # Added mock_firestore_client for direct use
     """Fixture for the FastAPI TestClient."""
     import backend_server # Import here to use mocked firebase
     from fastapi.testclient import TestClient
@@ -58,6 +58,19 @@ def test_client(mock_firebase_admin, mock_firestore_client): # Added mock_firest
     # This is crucial if they were initialized at the original import time of backend_server
     backend_server.db = mock_firestore_client
     backend_server.crystals_collection = mock_firestore_client.collection('crystals') if mock_firestore_client else None
+    # Identification endpoints check for a configured provider before calling the (mocked) AI service
+    mocker.patch.object(backend_server, 'GEMINI_API_KEY', backend_server.GEMINI_API_KEY or "test-gemini-key")
+    mocker.patch.object(backend_server, 'OPENAI_API_KEY', '')
+    # Fresh identification caches per test so mocked AI calls are not short-circuited and counters start at zero
+    mocker.patch.object(backend_server, 'identification_cache', backend_server.IdentificationCache.from_env())
+    mocker.patch.object(backend_server, 'phash_index', backend_server.PerceptualHashIndex.from_env())
+    mocker.patch.object(backend_server, 'identification_flights', backend_server.SingleFlight('identification'))
+    mocker.patch.object(backend_server, 'batch_stats', {'batches': 0, 'streamed_batches': 0, 'items': 0, 'failed_items': 0})
+    mocker.patch.object(backend_server, 'upload_tracker', backend_server.UploadTracker(backend_server.upload_limits))
+    mocker.patch.object(backend_server, 'provider_pool', backend_server.ProviderPool.from_env(backend_server.provider_pool.providers))
+    # A fresh ledger per test: one swapped out mid-test would keep its flusher bound to that test's closed loop
+    mocker.patch.object(backend_server, 'usage_ledger', backend_server.UsageLedger.from_env(sink=backend_server.usage_ledger.sink))
+    mocker.patch.object(backend_server, 'id_tokens', backend_server.IdTokenVerifier.from_env())
     # Also re-assign to app instance if the app itself holds a db reference (not typical for FastAPI modules)
     # if hasattr(backend_server.app, 'db'):
     # backend_server.app.db = mock_firestore_client
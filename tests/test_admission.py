@@ -0,0 +1,106 @@
+import asyncio
+import base64
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import backend_server
+from backend_admission import AdmissionController
+
+
+def test_excess_requests_queue_then_shed_when_queue_is_full():
+    async def scenario():
+        controller = AdmissionController("identify", max_in_flight=1, max_queue=1, queue_timeout=1.0)
+        await controller.acquire()
+        queued = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        assert controller.stats()["queue_depth"] == 1
+
+        with pytest.raises(HTTPException) as excinfo:
+            await controller.acquire()
+        assert excinfo.value.status_code == 429
+        assert int(excinfo.value.headers["Retry-After"]) >= 1
+
+        controller.release(0.05)
+        await queued  # the released slot goes to the queued request
+        assert controller.in_flight == 1
+        controller.release(0.05)
+        return controller.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["in_flight"] == 0
+    assert stats["admitted"] == 2
+    assert stats["queued"] == 1
+    assert stats["shed_queue_full"] == 1
+    assert stats["max_queue_depth"] == 1
+
+
+def test_queued_request_is_shed_at_its_deadline():
+    async def scenario():
+        controller = AdmissionController("identify", max_in_flight=1, max_queue=4, queue_timeout=0.05)
+        await controller.acquire()
+        with pytest.raises(HTTPException) as excinfo:
+            await controller.acquire()
+        controller.release()
+        return controller, excinfo.value
+
+    controller, error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert "Retry-After" in error.headers
+    stats = controller.stats()
+    assert stats["shed_queue_timeout"] == 1
+    assert stats["queue_depth"] == 0
+    assert stats["in_flight"] == 0
+
+
+def test_queue_is_served_in_arrival_order():
+    async def scenario():
+        controller = AdmissionController("identify", max_in_flight=1, max_queue=3, queue_timeout=1.0)
+        await controller.acquire()
+        order = []
+
+        async def queued(name):
+            await controller.acquire()
+            order.append(name)
+            controller.release()
+
+        tasks = [asyncio.create_task(queued(name)) for name in ("first", "second", "third")]
+        await asyncio.sleep(0)
+        controller.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["first", "second", "third"]
+
+
+def test_identify_sheds_burst_with_429_before_reading_bodies(test_client, mocker):
+    controller = backend_server.identification_admission
+    mocker.patch.object(controller, 'max_in_flight', 1)
+    mocker.patch.object(controller, 'max_queue', 0)
+    shed_before = controller.shed_queue_full
+
+    async def slow_gemini(*args, **kwargs):
+        await asyncio.sleep(0.2)
+        return {"identification_details": {"stone_name": "Citrine", "identification_confidence": 0.8}}
+
+    mocker.patch('backend_server.AIService.identify_crystal_with_gemini', new_callable=AsyncMock, side_effect=slow_gemini)
+
+    async def scenario():
+        async with httpx.AsyncClient(app=backend_server.app, base_url="http://testserver") as client:
+            first = asyncio.create_task(client.post("/api/crystal/identify", json={"image_data": base64.b64encode(b"one").decode()}))
+            await asyncio.sleep(0.05)
+            second = await client.post("/api/crystal/identify", json={"image_data": base64.b64encode(b"two").decode()})
+            return await first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert first.status_code == 200
+    assert second.status_code == 429
+    assert int(second.headers["retry-after"]) >= 1
+    metrics = test_client.get("/api/metrics").json()
+    assert metrics["admission"]["shed_queue_full"] == shed_before + 1
+    assert metrics["admission"]["in_flight"] == 0
+    # The shed request was rejected before its image was read
+    assert metrics["uploads"]["uploads"]["json"] == 1
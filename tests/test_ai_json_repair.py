@@ -0,0 +1,81 @@
+import json
+from unittest.mock import AsyncMock
+
+import pytest
+
+import backend_server
+from backend_ai_json import JSONRepairStats, missing_fields, parse_ai_json, repair_ai_json
+
+ANSWER = {
+    "identification_details": {"stone_name": "Rose Quartz", "crystal_family": "Quartz", "identification_confidence": 0.9},
+    "overall_confidence_score": 0.85,
+    "visual_characteristics": {"primary_color": "Pink", "secondary_colors": ["White"], "transparency": "Translucent",
+                               "formation": "Tumbled"},
+    "physical_properties_summary": {"hardness": "7", "crystal_system": "Trigonal"},
+    "metaphysical_aspects": {"primary_chakra": "Heart", "primary_zodiac_signs": ["Taurus", "Libra"], "elements": ["Water"]},
+    "numerology_insights": {"crystal_number_association": 5},
+    "enrichment_details": {"healing_properties": ["Self-love"], "care_instructions": ["Avoid sunlight"]},
+}
+
+
+def test_truncated_and_sloppy_answers_are_repaired():
+    truncated = json.dumps(ANSWER)[:json.dumps(ANSWER).index('"Taurus"') + 3]
+    repaired, repairs = repair_ai_json(truncated)
+    assert repairs == ["truncated"]
+    assert repaired["identification_details"] == ANSWER["identification_details"]
+    assert repaired["metaphysical_aspects"] == {"primary_chakra": "Heart", "primary_zodiac_signs": []}
+    assert "numerology_insights" not in repaired
+
+    sloppy = '```json\n{"a": [1, 2,], // the count\n "b": /* note */ {"c": "x // y",},}\n```'
+    assert repair_ai_json(sloppy) == ({"a": [1, 2], "b": {"c": "x // y"}}, ["trailing_commas", "comments"])
+
+    # The largest object that parses wins over a smaller one and surrounding prose
+    assert repair_ai_json('Sure! {"a": 1} and then {"b": {"c": 2}, "d": 3} done.}') == (
+        {"b": {"c": 2}, "d": 3}, ["extracted"])
+    with pytest.raises(ValueError):
+        repair_ai_json('{"a": ')
+
+
+def test_parse_counts_clean_repaired_and_unrecoverable(mocker):
+    stats = mocker.patch('backend_ai_json.json_repair_stats', JSONRepairStats())
+
+    assert parse_ai_json(json.dumps(ANSWER)) == ANSWER
+    assert parse_ai_json('{"a": 1, "b": [1, 2') == {"a": 1, "b": [1, 2]}
+    with pytest.raises(json.JSONDecodeError):
+        parse_ai_json("I cannot identify this stone.")
+
+    assert stats.stats() == {"clean": 1, "repaired": 1, "unrecoverable": 1, "partial": 0, "saved_calls": 1,
+                             "repairs": {"truncated": 1}, "missing_fields": {}}
+
+
+def test_missing_fields_lists_required_paths():
+    partial = {"identification_details": {"stone_name": "Rose Quartz"}, "visual_characteristics": None,
+               "metaphysical_aspects": {"primary_chakra": None}}
+
+    assert missing_fields(partial, backend_server.AIIdentificationResponse) == [
+        "identification_details.identification_confidence", "overall_confidence_score", "visual_characteristics",
+        "physical_properties_summary", "metaphysical_aspects.primary_chakra", "numerology_insights",
+        "enrichment_details",
+    ]
+    assert missing_fields(ANSWER, backend_server.AIIdentificationResponse) == []
+
+
+def test_identify_maps_a_truncated_answer_and_flags_missing_fields(test_client, mocker):
+    stats = mocker.patch('backend_server.json_repair_stats', JSONRepairStats())
+    mocker.patch('backend_ai_json.json_repair_stats', stats)
+    truncated = json.dumps(ANSWER)[:json.dumps(ANSWER).index('"physical_properties_summary"') + 20]
+    mocker.patch('backend_server.AIService.identify_crystal_with_gemini', new_callable=AsyncMock,
+                 side_effect=lambda *args, **kwargs: parse_ai_json(truncated))
+
+    response = test_client.post("/api/crystal/identify", json={"image_data": "dHJ1bmNhdGVkLXJvc2UtcXVhcnR6"})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["crystal_core"]["identification"]["stone_type"] == "Rose Quartz"
+    assert data["crystal_core"]["energy_mapping"]["primary_chakra"] == "heart"  # from the pink colour rule
+    assert data["missing_fields"] == ["physical_properties_summary", "metaphysical_aspects", "numerology_insights",
+                                      "enrichment_details"]
+    repair = test_client.get("/api/metrics").json()["ai_json_repair"]
+    assert repair["repaired"] == 1
+    assert repair["partial"] == 1
+    assert repair["missing_fields"]["metaphysical_aspects"] == 1
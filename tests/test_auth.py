@@ -0,0 +1,48 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import backend_auth
+from backend_auth import IdTokenVerifier, bearer_token
+
+
+class InvalidIdTokenError(ValueError):
+    pass
+
+
+def _request(authorization=None):
+    return SimpleNamespace(headers={"authorization": authorization} if authorization is not None else {})
+
+
+def test_bearer_token_parsing():
+    assert bearer_token(_request("Bearer abc.def")) == "abc.def"
+    assert bearer_token(_request("bearer  abc ")) == "abc"
+    assert bearer_token(_request("Basic dXNlcg==")) is None
+    assert bearer_token(_request("Bearer ")) is None
+    assert bearer_token(_request()) is None
+
+
+def test_only_verified_tokens_identify_a_caller(mocker):
+    def verify(token, check_revoked=False):
+        if token == "good":
+            return {"uid": "u1"}
+        if token == "keys-down":
+            raise RuntimeError("certificate fetch failed")
+        raise InvalidIdTokenError("bad signature")
+
+    firebase_auth = MagicMock(verify_id_token=MagicMock(side_effect=verify), InvalidIdTokenError=InvalidIdTokenError,
+                              UserDisabledError=InvalidIdTokenError)
+    mocker.patch.object(backend_auth, 'firebase_auth', firebase_auth)
+    verifier = IdTokenVerifier(check_revoked=True)
+
+    async def resolve(*headers):
+        return [await verifier.user_id(_request(header)) for header in headers]
+
+    assert asyncio.run(resolve("Bearer good", "Bearer forged", "Bearer keys-down", None)) == ["u1", None, None, None]
+    firebase_auth.verify_id_token.assert_any_call("good", check_revoked=True)
+    stats = verifier.stats()
+    assert (stats["verified"], stats["invalid"], stats["unavailable"], stats["missing"]) == (1, 1, 1, 1)
+
+    mocker.patch.object(backend_auth, 'firebase_auth', None)  # firebase-admin not installed
+    assert asyncio.run(resolve("Bearer good")) == [None]
+    assert verifier.stats()["available"] is False
@@ -0,0 +1,120 @@
+import base64
+from unittest.mock import AsyncMock
+
+from fastapi.testclient import TestClient
+
+import backend_server_clean
+from backend_cache import IdentificationCache, SingleFlight
+from backend_catalog import GENERIC_CARE, CrystalCatalog
+from backend_resilience import BrownoutController
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_brownout_enters_on_slow_p90_and_exits_with_hysteresis():
+    clock = FakeClock()
+    brownout = BrownoutController(enter_latency=10.0, exit_latency=5.0, min_samples=5, min_duration=30.0,
+                                  window_seconds=60.0, clock=clock)
+    for _ in range(5):
+        brownout.observe('identification', 2.0)
+    assert not brownout.active()
+
+    for _ in range(5):
+        brownout.observe('identification', 15.0)
+    assert brownout.active()
+    assert 'identification p90' in brownout.reason
+
+    # Old slow calls age out, but 7s is still above the exit threshold
+    clock.now += 61
+    for _ in range(5):
+        brownout.observe('identification', 7.0)
+    assert brownout.active()
+
+    clock.now += 61
+    for _ in range(5):
+        brownout.observe('identification', 1.0)
+    assert not brownout.active()
+
+    stats = brownout.stats()
+    assert stats['entries'] == 1
+    assert stats['exits'] == 1
+    assert stats['total_seconds'] == 122.0
+    assert stats['upstreams']['identification']['samples'] == 5
+
+
+def test_brownout_trips_on_errors_and_can_be_pinned():
+    clock = FakeClock()
+    brownout = BrownoutController(min_samples=4, min_duration=0.0, clock=clock)
+    for ok in (True, False, False, False):
+        brownout.observe('parserator', 0.5, ok=ok)
+    assert brownout.active()
+    assert brownout.reason == 'parserator error rate 75%'
+
+    assert BrownoutController(mode='on').active()
+    assert BrownoutController(mode='on').stats()['reason'] == 'BROWNOUT=on'
+    forced_off = BrownoutController(mode='off', min_samples=1)
+    forced_off.observe('identification', 100.0, ok=False)
+    assert not forced_off.active()
+
+
+def test_catalog_lookup_and_enrichment():
+    catalog = CrystalCatalog()
+    assert catalog.lookup('Chevron Amethyst')[0] == 'amethyst'
+    assert catalog.lookup('Brazilian Smoky Quartz (Morion)')[0] == 'smoky quartz'
+    assert catalog.lookup('Tiger’s Eye')[0] == "tiger's eye"
+    assert catalog.lookup('Unobtainium', 'Quartz')[0] == 'clear quartz'
+
+    enriched, match = catalog.enrich({"identification": {"name": "Selenite", "confidence": 88},
+                                      "physical_properties": {"hardness": "1.5-2"}})
+    assert match == 'selenite'
+    assert enriched["metaphysical_properties"]["primary_chakras"] == ["Crown", "Third Eye"]
+    assert "Black Tourmaline" in enriched["metaphysical_properties"]["synergy_crystals"]
+    assert "dissolves" in enriched["care_instructions"]["handling_notes"]
+    assert enriched["physical_properties"] == {"hardness": "1.5-2", "crystal_system": "Monoclinic"}
+
+    unknown, match = catalog.enrich({"identification": {"name": "Mystery Stone"}})
+    assert match is None
+    assert unknown["care_instructions"] == GENERIC_CARE
+    assert unknown["metaphysical_properties"]["zodiac_signs"] == []
+    assert catalog.stats()["top_misses"] == {"mystery stone": 1}
+
+
+def test_identify_enhanced_in_brownout_uses_catalog_and_skips_parserator(mocker):
+    mocker.patch.object(backend_server_clean, 'GEMINI_API_KEY', "test-gemini-key")
+    mocker.patch.object(backend_server_clean, 'OPENAI_API_KEY', '')
+    mocker.patch.object(backend_server_clean, 'PARSERATOR_API_KEY', "test-parserator-key")
+    mocker.patch.object(backend_server_clean, 'identification_cache', IdentificationCache.from_env())
+    mocker.patch.object(backend_server_clean, 'identification_flights', SingleFlight('identification'))
+    mocker.patch.object(backend_server_clean, 'brownout_controller', BrownoutController(mode='on'))
+    mocker.patch.object(backend_server_clean, 'enhanced_stage_stats', {
+        'requests': 0, 'streamed': 0,
+        'stages': {stage: {'count': 0, 'total_ms': 0.0} for stage in backend_server_clean.ENHANCED_STAGES},
+    })
+    gemini = mocker.patch('backend_server_clean.AIService.identify_crystal_with_gemini', new_callable=AsyncMock,
+                          return_value={"identification": {"name": "Rose Quartz", "confidence": 0.9}})
+    parserator = mocker.patch('backend_server_clean.ParseOperatorService.enhance_crystal_identification',
+                              new_callable=AsyncMock)
+    client = TestClient(backend_server_clean.app)
+
+    response = client.post("/api/crystal/identify-enhanced", json={
+        "image_data": base64.b64encode(b"rose quartz photo").decode(),
+        "user_profile": {"sun_sign": "Taurus"},
+        "existing_collection": [{"name": "Amethyst"}],
+    })
+
+    assert response.status_code == 200
+    body = response.json()
+    assert gemini.call_args.kwargs["brief"] is True
+    parserator.assert_not_called()
+    assert body["degraded"] == {"mode": "brownout", "reason": "BROWNOUT=on", "enrichment_source": "catalog",
+                                "catalog_match": "rose quartz"}
+    assert body["metaphysical_properties"]["primary_chakras"] == ["Heart"]
+    assert body["care_instructions"]["cleansing_methods"]
+    assert body["parserator_metadata"] == {"skipped": "brownout"}
+    assert client.get("/api/metrics").json()["brownout"]["degraded_responses"] == 1
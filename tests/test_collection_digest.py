@@ -0,0 +1,91 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock
+
+import backend_server_clean
+from backend_digest import CollectionDigestCache, estimate_tokens, profile_digest, summarize_entry
+
+CHAKRAS = ["Root", "Sacral", "Solar Plexus", "Heart", "Throat", "Third Eye", "Crown"]
+
+
+def _collection(size: int):
+    return [
+        {
+            "id": f"stone-{index}",
+            "crystal_name": f"Stone {index % 40}",
+            "crystal_type": ["Quartz", "Feldspar", "Beryl"][index % 3],
+            "acquisition_date": "2024-01-01",
+            "personal_notes": "Found at a market stall, feels warm in the hand during meditation. " * 3,
+            "intentions": "calm, focus" if index % 2 else "protection",
+            "usage_count": index,
+            "last_used": f"2024-03-{index % 28 + 1:02d}",
+            "chakra": CHAKRAS[index % len(CHAKRAS)],
+        }
+        for index in range(size)
+    ]
+
+
+def test_large_collection_digest_fits_token_budget():
+    digests = CollectionDigestCache(token_budget=200)
+    collection = _collection(300)
+
+    digest, raw_bytes = digests.digest(collection, "user-1")
+
+    assert estimate_tokens(json.dumps(digest)) <= 200
+    assert digest["total_stones"] == 300
+    assert digest["by_family"] == {"Quartz": 100, "Feldspar": 100, "Beryl": 100}
+    assert set(digest["top_intentions"]) == {"protection", "calm", "focus"}
+    assert digest["most_used"][0] == "Stone 19"  # usage_count 299
+    assert raw_bytes > 50 * len(json.dumps(digest))
+
+
+def test_digest_is_updated_incrementally_per_user():
+    digests = CollectionDigestCache()
+    collection = _collection(50)
+    digests.digest(collection, "user-1")
+
+    changed = collection[1:] + [{"crystal_name": "Moldavite", "crystal_type": "Tektite", "chakra": "Heart"}]
+    digest, _ = digests.digest(changed, "user-1")
+
+    stats = digests.stats()
+    assert stats["entries_added"] == 51
+    assert stats["entries_removed"] == 1
+    assert stats["hits"] == 1
+    assert digest["total_stones"] == 50
+    assert digest["by_family"]["Tektite"] == 1
+    assert digest["by_family"]["Quartz"] == 16  # stone-0 (Quartz) was removed
+
+
+def test_entry_shapes_and_profile_digest():
+    unified = {"crystal_core": {"identification": {"stone_type": "Amethyst", "crystal_family": "Quartz"},
+                                "energy_mapping": {"primary_chakra": "Crown", "secondary_chakras": ["Third Eye"]}},
+               "user_integration": {"usage_count": "3", "intentions": ["sleep"]}}
+    summary = summarize_entry(unified)
+    assert summary["name"] == "Amethyst"
+    assert summary["chakras"] == ["Crown", "Third Eye"]
+    assert summary["usage_count"] == 3
+
+    profile = {"user_id": "u1", "sun_sign": "Leo", "bio": "x" * 1000, "history": [{"a": 1}], "goals": ["a", "b"]}
+    assert profile_digest(profile) == {"user_id": "u1", "sun_sign": "Leo", "bio": "x" * 120, "goals": ["a", "b"]}
+
+
+def test_parserator_prompt_uses_digests_and_reports_sizes(mocker):
+    digests = CollectionDigestCache()
+    mocker.patch.object(backend_server_clean, 'collection_digests', digests)
+    call = mocker.patch('backend_server_clean.ParseOperatorService.call_parserator_api', new_callable=AsyncMock,
+                        return_value={"success": True})
+
+    asyncio.run(backend_server_clean.ParseOperatorService.enhance_crystal_identification(
+        crystal_data={"identification": {"name": "Citrine"}},
+        user_profile={"user_id": "u1", "sun_sign": "Leo"},
+        collection=_collection(300),
+    ))
+
+    kwargs = call.call_args.kwargs
+    input_data = json.loads(kwargs["input_data"])
+    assert "collection_context" not in input_data
+    assert input_data["collection_summary"]["total_stones"] == 300
+    assert "market stall" not in kwargs["instructions"] + kwargs["input_data"]
+    prompt = digests.stats()["last_prompt_bytes"]
+    assert prompt["after"] == len(kwargs["instructions"]) + len(kwargs["input_data"])
+    assert prompt["before"] > 20 * prompt["after"]
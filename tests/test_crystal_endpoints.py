@@ -3,6 +3,7 @@ from fastapi.testclient import TestClient
 from unittest.mock import MagicMock, AsyncMock # AsyncMock not strictly needed here if Firestore client methods are sync
 import uuid
 from datetime import datetime
+from typing import Optional
 
 # Sample data for UnifiedCrystalData for testing
 # (Should match the structure defined in backend_server.py Pydantic models)
@@ -95,7 +96,7 @@ def test_create_crystal_firestore_permission_denied(test_client: TestClient, moc
     try:
         from google.cloud import exceptions as google_exceptions
         PermissionDeniedException = google_exceptions.PermissionDenied
-    except ImportError:
+    except (ImportError, AttributeError):
         # Fallback if google.cloud.exceptions is not available in test env
         # This means we can't test for specific exception handling as accurately
         class PermissionDeniedException(Exception):
@@ -0,0 +1,117 @@
+import asyncio
+import base64
+import json
+import time
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi.testclient import TestClient
+
+import backend_server_clean
+from backend_cache import IdentificationCache, SingleFlight
+
+AI_RESPONSE = {
+    "identification": {"name": "Rose Quartz", "confidence": 0.92},
+    "metaphysical_properties": {"primary_chakras": ["Heart"]},
+    "physical_properties": {"hardness": "7"},
+    "care_instructions": {"cleansing": ["Moonlight"]},
+}
+REQUEST = {
+    "image_data": base64.b64encode(b"rose quartz photo").decode(),
+    "user_profile": {"sun_sign": "Taurus"},
+    "existing_collection": [{"name": "Amethyst"}],
+}
+
+
+@pytest.fixture
+def clean_server(mocker):
+    mocker.patch.object(backend_server_clean, 'GEMINI_API_KEY', "test-gemini-key")
+    mocker.patch.object(backend_server_clean, 'PARSERATOR_API_KEY', "test-parserator-key")
+    mocker.patch.object(backend_server_clean, 'identification_cache', IdentificationCache.from_env())
+    mocker.patch.object(backend_server_clean, 'identification_flights', SingleFlight('identification'))
+    mocker.patch.object(backend_server_clean, 'OPENAI_API_KEY', '')
+    mocker.patch('backend_server_clean.AIService.identify_crystal_with_gemini', new_callable=AsyncMock, return_value=AI_RESPONSE)
+
+    async def slow_parserator(**kwargs):
+        await asyncio.sleep(0.3)
+        return {"success": True, "parsedData": {"personalized_recommendations": {"pairing": "Amethyst"}},
+                "metadata": {"confidence": 0.9}}
+
+    mocker.patch('backend_server_clean.ParseOperatorService.enhance_crystal_identification',
+                 new_callable=AsyncMock, side_effect=slow_parserator)
+    return backend_server_clean
+
+
+def _sse_events(text: str):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_sse_stream_emits_each_stage_with_timings(clean_server):
+    client = TestClient(clean_server.app)
+
+    response = client.post("/api/crystal/identify-enhanced?stream=sse", json=REQUEST)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _sse_events(response.text)
+    assert [name for name, _ in events] == ["identification", "ema_validation", "personalization", "complete"]
+    identification = events[0][1]
+    assert identification["data"]["identification"]["name"] == "Rose Quartz"
+    assert identification["data"]["source"] == "gemini-1.5-flash-enhanced"
+    assert events[1][1]["data"]["ema_compliance"]["is_ema_compliant"] is True
+    assert events[2][1]["data"]["personalized_recommendations"] == [{"pairing": "Amethyst"}]
+    assert events[2][1]["stage_ms"] >= 300
+    assert set(events[3][1]["stage_timings"]) == {"identification", "ema_validation", "personalization"}
+
+
+def test_first_event_does_not_wait_for_parserator(clean_server):
+    request = clean_server.CrystalIdentificationRequest(**REQUEST)
+
+    async def first_event_latency():
+        started = time.perf_counter()
+        stream = clean_server._stream_enhanced_identification(request, None, "ndjson")
+        first = json.loads(await stream.__anext__())
+        latency = time.perf_counter() - started
+        await stream.aclose()
+        return first, latency
+
+    first, latency = asyncio.run(first_event_latency())
+
+    assert first["event"] == "identification"
+    assert latency < 0.3
+
+
+def test_ndjson_stream_reports_failing_stage(clean_server, mocker):
+    mocker.patch('backend_server_clean.AIService.identify_crystal_with_gemini',
+                 new_callable=AsyncMock, side_effect=RuntimeError("Gemini timed out"))
+    client = TestClient(clean_server.app)
+
+    response = client.post("/api/crystal/identify-enhanced", json=REQUEST, headers={"Accept": "application/x-ndjson"})
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [{**lines[0], "event": "error", "stage": "identification", "status_code": 500}]
+    assert "Gemini timed out" in lines[0]["detail"]
+
+
+def test_gathered_response_is_assembled_from_the_same_stages(clean_server):
+    client = TestClient(clean_server.app)
+
+    response = client.post("/api/crystal/identify-enhanced", json=REQUEST)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["confidence"] == 0.92
+    assert body["personalized_recommendations"] == [{"pairing": "Amethyst"}]
+    assert body["parserator_metadata"] == {"confidence": 0.9}
+    stages = client.get("/api/metrics").json()["enhanced_stages"]
+    assert stages["avg_stage_ms"]["personalization"] >= 300
+
+
+def test_unknown_stream_format_is_rejected(clean_server):
+    client = TestClient(clean_server.app)
+    response = client.post("/api/crystal/identify-enhanced?stream=xml", json=REQUEST)
+    assert response.status_code == 400
@@ -0,0 +1,137 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import backend_server_clean
+from backend_cache import IdentificationCache, SingleFlight
+from backend_jobs import JobManager
+
+
+def test_jobs_run_on_a_bounded_pool_with_timings():
+    async def scenario():
+        jobs = JobManager(max_workers=1)
+        release = asyncio.Event()
+
+        async def first():
+            await release.wait()
+            return {"n": 1}
+
+        async def second():
+            return {"n": 2}
+
+        first_id = jobs.submit("test", first)
+        second_id = jobs.submit("test", second)
+        await asyncio.sleep(0.02)
+        assert jobs.get(first_id)["status"] == "running"
+        assert jobs.get(second_id)["status"] == "queued"
+        assert jobs.stats()["running"] == 1
+
+        release.set()
+        for _ in range(50):
+            await asyncio.sleep(0.01)
+            if jobs.get(second_id)["status"] == "succeeded":
+                break
+        return jobs, jobs.get(first_id), jobs.get(second_id)
+
+    jobs, first, second = asyncio.run(scenario())
+    assert first["result"] == {"n": 1}
+    assert second["result"] == {"n": 2}
+    assert second["queued_ms"] >= 15  # waited for the only worker
+    assert first["run_ms"] >= 15
+    stats = jobs.stats()
+    assert stats["succeeded"] == 2
+    assert stats["running"] == 0
+
+
+def test_failed_and_timed_out_jobs_report_errors():
+    async def scenario():
+        jobs = JobManager(job_timeout=0.05)
+
+        async def boom():
+            raise RuntimeError("Parserator exploded")
+
+        async def hang():
+            await asyncio.sleep(5)
+
+        failed_id, slow_id = jobs.submit("test", boom), jobs.submit("test", hang)
+        await asyncio.sleep(0.15)
+        return jobs, jobs.get(failed_id), jobs.get(slow_id)
+
+    jobs, failed, slow = asyncio.run(scenario())
+    assert failed["status"] == "failed"
+    assert failed["error"] == "Parserator exploded"
+    assert slow["status"] == "failed"
+    assert "Timed out" in slow["error"]
+    assert jobs.stats()["timed_out"] == 1
+
+
+def test_results_expire_and_full_queue_rejects():
+    async def scenario():
+        jobs = JobManager(max_workers=1, max_pending=1, result_ttl=0.05)
+        blocker = asyncio.Event()
+        job_id = jobs.submit("test", AsyncMock(return_value={}))
+        await asyncio.sleep(0.01)
+        assert jobs.get(job_id)["status"] == "succeeded"
+        await asyncio.sleep(0.06)
+        assert jobs.get(job_id) is None
+
+        jobs.submit("test", blocker.wait)  # takes the worker
+        jobs.submit("test", blocker.wait)  # fills the queue
+        with pytest.raises(HTTPException) as excinfo:
+            jobs.submit("test", blocker.wait)
+        await jobs.close()
+        return jobs, excinfo.value
+
+    jobs, error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert jobs.stats()["rejected"] == 1
+
+
+def test_identify_enhanced_returns_before_parserator_and_job_can_be_polled(mocker):
+    mocker.patch.object(backend_server_clean, 'GEMINI_API_KEY', "test-gemini-key")
+    mocker.patch.object(backend_server_clean, 'OPENAI_API_KEY', '')
+    mocker.patch.object(backend_server_clean, 'PARSERATOR_API_KEY', "test-parserator-key")
+    mocker.patch.object(backend_server_clean, 'identification_cache', IdentificationCache.from_env())
+    mocker.patch.object(backend_server_clean, 'identification_flights', SingleFlight('identification'))
+    mocker.patch.object(backend_server_clean, 'enhancement_jobs', JobManager(max_workers=2))
+    mocker.patch('backend_server_clean.AIService.identify_crystal_with_gemini', new_callable=AsyncMock,
+                 return_value={"identification": {"name": "Moonstone", "confidence": 0.9}})
+
+    async def slow_parserator(**kwargs):
+        await asyncio.sleep(0.3)
+        return {"success": True, "parsedData": {"personalized_recommendations": {"ritual": "New moon"}},
+                "metadata": {"confidence": 0.85}}
+
+    mocker.patch('backend_server_clean.ParseOperatorService.enhance_crystal_identification',
+                 new_callable=AsyncMock, side_effect=slow_parserator)
+    body = {"image_data": "bW9vbnN0b25l", "user_profile": {"sun_sign": "Cancer"},
+            "existing_collection": [{"name": "Selenite"}], "async_enhancement": True}
+
+    with TestClient(backend_server_clean.app) as client:
+        started = time.perf_counter()
+        response = client.post("/api/crystal/identify-enhanced", json=body)
+        elapsed = time.perf_counter() - started
+
+        assert response.status_code == 200
+        assert elapsed < 0.3
+        identified = response.json()
+        assert identified["identification"]["name"] == "Moonstone"
+        assert identified["personalized_recommendations"] == []
+        job_id = identified["enhancement_job_id"]
+        assert client.get(f"/api/jobs/{job_id}").json()["status"] in ("queued", "running")
+
+        for _ in range(50):
+            job = client.get(f"/api/jobs/{job_id}").json()
+            if job["status"] == "succeeded":
+                break
+            time.sleep(0.02)
+
+        assert job["result"] == {"personalized_recommendations": [{"ritual": "New moon"}],
+                                 "parserator_metadata": {"confidence": 0.85}}
+        assert job["run_ms"] >= 300
+        assert client.get("/api/jobs/unknown").status_code == 404
+        assert client.get("/api/metrics").json()["enhancement_jobs"]["succeeded"] == 1
@@ -0,0 +1,74 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import backend_server
+from backend_ai_json import AIOutputStats, gemini_response_schema
+from backend_providers import gemini_generate_content
+
+AI_RESPONSE = {"identification_details": {"stone_name": "Amethyst", "identification_confidence": 0.9}}
+
+
+def _walk(schema):
+    yield schema
+    for child in schema.get("properties", {}).values():
+        yield from _walk(child)
+    if "items" in schema:
+        yield from _walk(schema["items"])
+
+
+def test_schema_is_generated_from_the_ai_facing_models():
+    schema = gemini_response_schema(backend_server.AIIdentificationResponse)
+
+    assert schema["propertyOrdering"][0] == "identification_details"
+    assert set(schema["required"]) == set(schema["properties"])
+    details = schema["properties"]["identification_details"]
+    assert details["properties"]["variety"] == {"type": "STRING", "description": "e.g. Chevron Amethyst", "nullable": True}
+    assert details["required"] == ["stone_name", "identification_confidence"]
+    visual = schema["properties"]["visual_characteristics"]  # reuses UnifiedCrystalData's VisualAnalysis
+    assert visual["properties"]["secondary_colors"] == {"type": "ARRAY", "items": {"type": "STRING"}}
+    for node in _walk(schema):
+        assert node["type"] in ("OBJECT", "ARRAY", "STRING", "NUMBER", "INTEGER", "BOOLEAN")
+        assert not {"$ref", "anyOf", "allOf", "title", "default"} & set(node)
+
+
+def test_generate_content_requests_json_mode():
+    received = {}
+
+    async def handler(request: httpx.Request):
+        received["body"] = json.loads(await request.aread())
+        return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": json.dumps(AI_RESPONSE)}]}}]})
+
+    async def scenario():
+        async with httpx.AsyncClient(base_url="http://stand-in", transport=httpx.MockTransport(handler)) as client:
+            return await gemini_generate_content(client, "gemini-1.5-flash", "key", "identify", b"image",
+                                                 response_schema=backend_server.GEMINI_IDENTIFICATION_SCHEMA)
+
+    assert asyncio.run(scenario()) == AI_RESPONSE
+    config = received["body"]["generationConfig"]
+    assert config["responseMimeType"] == "application/json"
+    assert config["responseSchema"] == backend_server.GEMINI_IDENTIFICATION_SCHEMA
+
+
+def test_json_mode_shrinks_prompt_and_counts_parse_failures(mocker):
+    mocker.patch.object(backend_server, 'GEMINI_API_KEY', "test-gemini-key")
+    mocker.patch.object(backend_server, 'gemini_output_stats', AIOutputStats())
+    stream = mocker.patch('backend_server.gemini_stream_generate_content', new_callable=AsyncMock,
+                          side_effect=[AI_RESPONSE, json.JSONDecodeError("Expecting value", "", 0)])
+
+    assert asyncio.run(backend_server.AIService.identify_crystal_with_gemini(b"image")) == AI_RESPONSE
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(backend_server.AIService.identify_crystal_with_gemini(b"image"))
+
+    assert excinfo.value.detail == "Invalid JSON response from AI"
+    prompt = stream.call_args_list[0].args[3]
+    assert stream.call_args_list[0].kwargs["response_schema"] is backend_server.GEMINI_IDENTIFICATION_SCHEMA
+    assert "KEY INFORMATION TO INCLUDE" not in prompt
+    assert len(prompt) * 5 < len(backend_server.AIService.identification_prompt())
+    stats = backend_server.gemini_output_stats.stats()["schema"]
+    assert stats["requests"] == 2
+    assert stats["parse_failure_rate"] == 0.5
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import time
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import backend_server_clean
+from backend_ai_json import IncrementalJSONParser
+from backend_cache import IdentificationCache, SingleFlight
+from backend_providers import gemini_stream_generate_content
+
+ANSWER = {
+    "identification_details": {"stone_name": "Labradorite", "note": "flash {blue} \"schiller\""},
+    "visual_characteristics": {"colors": ["grey", "blue"]},
+    "confidence": 0.87,
+    "metaphysical_aspects": {"primary_chakras": ["Throat", "Third Eye"]},
+}
+
+
+def _chunks(text: str, size: int):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_parser_emits_each_group_when_it_closes():
+    text = "Here is the analysis:\n```json\n" + json.dumps(ANSWER, indent=2) + "\n```\nLet me know!"
+    parser = IncrementalJSONParser()
+    seen_at = {}
+    for position, chunk in enumerate(_chunks(text, 7)):
+        for key, value in parser.feed(chunk):
+            seen_at[key] = position
+            assert value == ANSWER[key]
+
+    assert list(seen_at) == list(ANSWER)
+    # The first group is available long before the stream ends
+    assert seen_at["identification_details"] < seen_at["metaphysical_aspects"] - 5
+    assert parser.done
+    assert parser.result() == ANSWER
+
+
+def test_parser_falls_back_to_whole_answer_for_malformed_members():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"a": {"x": 1}, "b": tru') == [("a", {"x": 1})]
+    parser.feed('e }')
+    assert parser.malformed_members == 0
+    assert parser.result() == {"a": {"x": 1}, "b": True}
+
+    sloppy = IncrementalJSONParser()
+    sloppy.feed('{"a": [1, 2,], "b": 1}')
+    assert sloppy.malformed_members == 1
+    assert sloppy.result() == {"a": [1, 2], "b": 1}  # repaired by the whole-answer fallback
+
+    broken = IncrementalJSONParser()
+    broken.feed('{"a": ')
+    with pytest.raises(ValueError):
+        broken.result()
+
+
+async def _start_streaming_stand_in(chunks, delay: float):
+    """Local stand-in for streamGenerateContent?alt=sse that streams canned text chunks"""
+    requests = []
+
+    async def handle(reader, writer):
+        head = await reader.readuntil(b"\r\n\r\n")
+        length = int([line.split(b":")[1] for line in head.split(b"\r\n") if line.lower().startswith(b"content-length")][0])
+        requests.append((head.split(b" ")[1].decode(), json.loads(await reader.readexactly(length))))
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        for chunk in chunks:
+            event = json.dumps({"candidates": [{"content": {"parts": [{"text": chunk}], "role": "model"}}]})
+            data = f"data: {event}\r\n\r\n".encode()
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+            await asyncio.sleep(delay)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1], requests
+
+
+def test_stream_adapter_delivers_groups_before_the_stream_ends():
+    text = "```json\n" + json.dumps(ANSWER) + "\n```"
+
+    async def scenario():
+        server, port, requests = await _start_streaming_stand_in(_chunks(text, 40), delay=0.03)
+        arrivals = {}
+        started = time.perf_counter()
+        async with server:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+                result = await gemini_stream_generate_content(
+                    client, "gemini-1.5-flash", "key", "identify", b"image bytes",
+                    on_group=lambda key, value: arrivals.setdefault(key, time.perf_counter() - started)
+                )
+        return result, arrivals, time.perf_counter() - started, requests
+
+    result, arrivals, total, requests = asyncio.run(scenario())
+
+    assert result == ANSWER
+    assert list(arrivals) == list(ANSWER)
+    assert arrivals["identification_details"] < total / 2
+    path, body = requests[0]
+    assert path.startswith("/v1beta/models/gemini-1.5-flash:streamGenerateContent?alt=sse")
+    assert body["contents"][0]["parts"][1]["inline_data"]["mime_type"] == "image/jpeg"
+
+
+def test_enhanced_stream_forwards_partial_groups(mocker):
+    mocker.patch.object(backend_server_clean, 'GEMINI_API_KEY', "test-gemini-key")
+    mocker.patch.object(backend_server_clean, 'OPENAI_API_KEY', '')
+    mocker.patch.object(backend_server_clean, 'PARSERATOR_API_KEY', '')
+    mocker.patch.object(backend_server_clean, 'identification_cache', IdentificationCache.from_env())
+    mocker.patch.object(backend_server_clean, 'identification_flights', SingleFlight('identification'))
+
+    async def streaming_gemini(image, context, mime_type="image/jpeg", on_group=None):
+        answer = {"identification": {"name": "Labradorite", "confidence": 0.87}, "care_instructions": {"cleansing": ["Smoke"]}}
+        for key, value in answer.items():
+            on_group(key, value)
+            await asyncio.sleep(0.01)
+        return answer
+
+    mocker.patch('backend_server_clean.AIService.identify_crystal_with_gemini', new_callable=AsyncMock,
+                 side_effect=streaming_gemini)
+    client = TestClient(backend_server_clean.app)
+
+    response = client.post("/api/crystal/identify-enhanced?stream=ndjson", json={"image_data": "bGFicmFkb3JpdGU="})
+
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["event"] for event in events] == [
+        "identification_partial", "identification_partial", "identification", "ema_validation", "personalization", "complete"
+    ]
+    assert events[0]["group"] == "identification"
+    assert events[1]["data"] == {"cleansing": ["Smoke"]}
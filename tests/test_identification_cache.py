@@ -0,0 +1,84 @@
+import asyncio
+import base64
+from unittest.mock import AsyncMock
+
+from fastapi.testclient import TestClient
+
+import backend_cache
+from backend_cache import IdentificationCache, TTLCache
+
+IMAGE_B64 = base64.b64encode(b"\x89PNG fake crystal photo bytes").decode()
+
+SAMPLE_AI_RESPONSE = {
+    "overall_confidence_score": 0.9,
+    "identification_details": {"stone_name": "Amethyst", "crystal_family": "Quartz", "identification_confidence": 0.95},
+    "visual_characteristics": {"primary_color": "Purple", "transparency": "Translucent", "formation": "Cluster"},
+    "enrichment_details": {"healing_properties": ["Calming"]}
+}
+
+
+def test_ttl_cache_evicts_least_recently_used_entry():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", {"v": 1})
+    cache.set("b", {"v": 2})
+    assert cache.get("a") == {"v": 1}  # 'a' is now most recently used
+
+    cache.set("c", {"v": 3})
+
+    assert "b" not in cache
+    assert cache.get("a") == {"v": 1}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_cache_enforces_byte_budget_and_expiry(monkeypatch):
+    cache = TTLCache(max_entries=100, max_bytes=40, ttl_seconds=10)
+    cache.set("a", {"payload": "x" * 10})
+    cache.set("b", {"payload": "y" * 10})
+    assert "a" not in cache and "b" in cache
+
+    real_monotonic = backend_cache.time.monotonic
+    monkeypatch.setattr(backend_cache.time, "monotonic", lambda: real_monotonic() + 11)
+    assert cache.get("b") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_cache_key_uses_decoded_bytes_context_and_model():
+    key = IdentificationCache.make_key(IMAGE_B64, {"b": 1, "a": 2}, "gemini-pro-vision")
+
+    assert key == IdentificationCache.make_key(f"data:image/png;base64,{IMAGE_B64}", {"a": 2, "b": 1}, "gemini-pro-vision")
+    assert key != IdentificationCache.make_key(IMAGE_B64, {"a": 3}, "gemini-pro-vision")
+    assert key != IdentificationCache.make_key(IMAGE_B64, {"b": 1, "a": 2}, "gemini-1.5-flash")
+
+
+def test_disk_tier_survives_a_new_cache_instance(tmp_path):
+    async def scenario():
+        key = IdentificationCache.make_key(IMAGE_B64, None, "gemini-pro-vision")
+        first = IdentificationCache(TTLCache(), disk_dir=str(tmp_path))
+        await first.set(key, SAMPLE_AI_RESPONSE)
+
+        restarted = IdentificationCache(TTLCache(), disk_dir=str(tmp_path))
+        assert await restarted.get(key) == SAMPLE_AI_RESPONSE
+        assert restarted.stats()["disk"]["hits"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_repeat_identification_is_served_from_cache_with_fresh_ids(test_client: TestClient, mocker):
+    mock_ai_call = mocker.patch(
+        'backend_server.AIService.identify_crystal_with_gemini',
+        new_callable=AsyncMock,
+        return_value=SAMPLE_AI_RESPONSE
+    )
+    request_data = {"image_data": IMAGE_B64, "user_context": {"text_description": "purple"}}
+
+    first = test_client.post("/api/crystal/identify", json=request_data)
+    second = test_client.post("/api/crystal/identify", json=request_data)
+
+    assert first.status_code == 200 and second.status_code == 200
+    mock_ai_call.assert_called_once()
+    assert first.json()["crystal_core"]["id"] != second.json()["crystal_core"]["id"]
+    assert second.json()["crystal_core"]["identification"]["stone_type"] == "Amethyst"
+
+    cache_stats = test_client.get("/api/metrics").json()["identification_cache"]["memory"]
+    assert cache_stats["hits"] == 1
+    assert cache_stats["misses"] == 1
@@ -0,0 +1,93 @@
+import asyncio
+import base64
+import json
+from unittest.mock import AsyncMock
+
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import backend_server
+
+
+def _item(label: str, **extra) -> dict:
+    return {"image_data": base64.b64encode(label.encode()).decode(), "id": label, **extra}
+
+
+def _ai_response(image_data: str) -> dict:
+    name = base64.b64decode(image_data).decode().title()
+    return {"identification_details": {"stone_name": name, "identification_confidence": 0.9}, "overall_confidence_score": 0.9}
+
+
+def test_batch_returns_per_item_results_and_isolates_failures(test_client: TestClient, mocker):
+    async def fake_gemini(image_data, user_context=None, mime_type="image/jpeg"):
+        if base64.b64decode(image_data) == b"broken":
+            raise HTTPException(status_code=502, detail="Gemini API error: bad gateway")
+        return _ai_response(image_data)
+
+    mocker.patch('backend_server.AIService.identify_crystal_with_gemini', new_callable=AsyncMock, side_effect=fake_gemini)
+
+    response = test_client.post("/api/crystal/identify-batch", json={
+        "images": [_item("amethyst"), _item("broken"), _item("citrine")],
+        "user_context": {"intent": "calm"},
+    })
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["total"], body["succeeded"], body["failed"]) == (3, 2, 1)
+    first, failed, third = body["results"]
+    assert [first["index"], failed["index"], third["index"]] == [0, 1, 2]
+    assert first["status"] == "ok"
+    assert first["result"]["crystal_core"]["identification"]["stone_type"] == "Amethyst"
+    assert first["ema_compliance"]["is_ema_compliant"] is True
+    assert failed == {**failed, "status": "error", "id": "broken", "result": None}
+    assert failed["error"]["status_code"] == 502
+    assert third["result"]["crystal_core"]["identification"]["stone_type"] == "Citrine"
+
+    metrics = test_client.get("/api/metrics").json()["identify_batch"]
+    assert (metrics["batches"], metrics["items"], metrics["failed_items"]) == (1, 3, 1)
+
+
+def test_batch_respects_concurrency_cap(test_client: TestClient, mocker):
+    mocker.patch.object(backend_server, 'IDENTIFY_BATCH_CONCURRENCY', 2)
+    active = {"now": 0, "peak": 0}
+
+    async def slow_gemini(image_data, user_context=None, mime_type="image/jpeg"):
+        active["now"] += 1
+        active["peak"] = max(active["peak"], active["now"])
+        await asyncio.sleep(0.02)
+        active["now"] -= 1
+        return _ai_response(image_data)
+
+    mocker.patch('backend_server.AIService.identify_crystal_with_gemini', new_callable=AsyncMock, side_effect=slow_gemini)
+
+    response = test_client.post("/api/crystal/identify-batch", json={"images": [_item(f"stone{i}") for i in range(6)]})
+
+    assert response.json()["succeeded"] == 6
+    assert active["peak"] == 2
+
+
+def test_batch_streams_ndjson_in_completion_order(test_client: TestClient, mocker):
+    delays = {b"slow": 0.1, b"fast": 0.0}
+
+    async def timed_gemini(image_data, user_context=None, mime_type="image/jpeg"):
+        await asyncio.sleep(delays[base64.b64decode(image_data)])
+        return _ai_response(image_data)
+
+    mocker.patch('backend_server.AIService.identify_crystal_with_gemini', new_callable=AsyncMock, side_effect=timed_gemini)
+
+    response = test_client.post("/api/crystal/identify-batch?stream=true", json={"images": [_item("slow"), _item("fast")]})
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines[:2]] == ["fast", "slow"]
+    assert lines[2]["summary"]["succeeded"] == 2
+
+
+def test_batch_rejects_oversized_batches(test_client: TestClient, mocker):
+    mocker.patch.object(backend_server, 'IDENTIFY_BATCH_MAX_ITEMS', 2)
+    mock_ai_call = mocker.patch('backend_server.AIService.identify_crystal_with_gemini', new_callable=AsyncMock)
+
+    response = test_client.post("/api/crystal/identify-batch", json={"images": [_item(f"s{i}") for i in range(3)]})
+
+    assert response.status_code == 413
+    mock_ai_call.assert_not_awaited()
@@ -0,0 +1,100 @@
+import asyncio
+import base64
+import io
+from unittest.mock import AsyncMock
+
+import numpy as np
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from backend_images import ImageNormalizer, normalize_image, sniff_mime_type
+
+
+def _encode(image: Image.Image, fmt: str, **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **kwargs)
+    return buffer.getvalue()
+
+
+def _noisy_rgb(width: int, height: int) -> Image.Image:
+    rng = np.random.default_rng(1)
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def test_sniff_mime_type_from_magic_bytes():
+    small = Image.new("RGB", (4, 4))
+    assert sniff_mime_type(_encode(small, "JPEG")) == "image/jpeg"
+    assert sniff_mime_type(_encode(small, "PNG")) == "image/png"
+    assert sniff_mime_type(_encode(small, "WEBP")) == "image/webp"
+    assert sniff_mime_type(b"\x00\x00\x00\x18ftypheic") == "image/heic"
+    assert sniff_mime_type(b"garbage") == "image/jpeg"
+
+
+def test_large_jpeg_is_oriented_downscaled_and_stripped():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90 CW for display
+    exif[0x010F] = "PhoneMaker"
+    original = _encode(_noisy_rgb(3000, 2000), "JPEG", quality=95, exif=exif.tobytes())
+
+    result = normalize_image(original, max_edge=1024, quality=80)
+
+    assert result.reencoded
+    assert result.mime_type == "image/jpeg"
+    assert result.original_size == (3000, 2000)
+    assert result.normalized_size == (683, 1024)  # portrait after auto-orient
+    assert result.normalized_bytes < result.original_bytes
+    assert result.phash is not None
+    with Image.open(io.BytesIO(result.data)) as normalized:
+        assert normalized.size == (683, 1024)
+        assert not normalized.getexif()
+
+
+def test_small_png_with_alpha_keeps_transparency():
+    image = Image.new("RGBA", (64, 64), (200, 100, 50, 128))
+    result = normalize_image(_encode(image, "PNG"), max_edge=1024, quality=80)
+
+    assert result.mime_type == "image/png"
+
+
+def test_undecodable_bytes_are_forwarded_untouched():
+    result = normalize_image(b"not really an image", max_edge=1024, quality=80)
+
+    assert not result.reencoded
+    assert result.data == b"not really an image"
+    assert result.mime_type == "image/jpeg"
+
+
+def test_normalizer_runs_in_process_pool_and_reports_sizes():
+    async def scenario():
+        normalizer = ImageNormalizer(max_edge=512, quality=80, workers=1)
+        normalizer.start()
+        try:
+            result = await normalizer.normalize(_encode(_noisy_rgb(1600, 1200), "PNG"))
+        finally:
+            normalizer.close()
+        return normalizer, result
+
+    normalizer, result = asyncio.run(scenario())
+
+    assert result.normalized_size == (512, 384)
+    stats = normalizer.stats()
+    assert stats["images"] == 1
+    assert stats["bytes_out"] < stats["bytes_in"]
+    assert stats["bytes_saved_ratio"] > 0.5
+
+
+def test_identify_sends_normalized_image_and_real_mime_type(test_client: TestClient, mocker):
+    mock_ai_call = mocker.patch(
+        'backend_server.AIService.identify_crystal_with_gemini',
+        new_callable=AsyncMock,
+        return_value={"identification_details": {"stone_name": "Citrine"}}
+    )
+    upload = _encode(_noisy_rgb(2400, 1800), "PNG")
+
+    response = test_client.post("/api/crystal/identify", json={"image_data": base64.b64encode(upload).decode()})
+
+    assert response.status_code == 200
+    sent_image, _ = mock_ai_call.call_args.args
+    assert mock_ai_call.call_args.kwargs["mime_type"] == "image/jpeg"
+    assert isinstance(sent_image, bytes)  # re-encoded bytes are base64-encoded into the request body
+    assert len(sent_image) < len(upload) / 4
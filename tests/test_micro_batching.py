@@ -0,0 +1,149 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock
+
+import httpx
+
+import backend_server
+from backend_batching import MicroBatcher
+from backend_deadline import Deadline, current_deadline
+from backend_ledger import UsageLedger
+from backend_providers import gemini_generate_content_batch, record_batch_usage_share
+
+COST = {"input_tokens": 600, "output_tokens": 200, "total_tokens": 800, "image_bytes": 20, "latency_ms": 40.0}
+
+
+def test_concurrent_calls_share_one_batch_and_results_are_demultiplexed():
+    batches, singles = [], []
+
+    async def send_batch(key, items):
+        batches.append(items)
+        await asyncio.sleep(0.01)
+        return [f"{key}:{item}" for item in items], COST
+
+    async def send_one(key, item):
+        singles.append(item)
+        return f"{key}:{item}:single"
+
+    async def scenario():
+        batcher = MicroBatcher(send_batch, send_one, max_batch=3, max_wait=0.02)
+        full = await asyncio.gather(*(batcher.submit("p", item) for item in ("a", "b", "c")))
+        timed_out = await asyncio.gather(batcher.submit("p", "d"), batcher.submit("q", "e"))
+        return batcher, full, timed_out
+
+    batcher, full, timed_out = asyncio.run(scenario())
+    assert full == ["p:a", "p:b", "p:c"]
+    assert timed_out == ["p:d:single", "q:e:single"]  # different keys never share a batch
+    assert batches == [["a", "b", "c"]]
+    stats = batcher.stats()
+    assert stats["batch_sizes"] == {3: 1}
+    assert stats["singles"] == 2
+    assert stats["max_queue_ms"] >= 15  # the lone items waited for max_wait
+    assert stats["avg_tokens_per_batched_image"] == round(800 / 3, 1)
+
+
+def test_batch_failures_fall_back_to_single_calls():
+    async def scenario(send_batch):
+        batcher = MicroBatcher(send_batch, AsyncMock(side_effect=lambda key, item: f"{item}:single"), max_batch=2)
+        return batcher, await asyncio.gather(batcher.submit("p", "a"), batcher.submit("p", "b"))
+
+    batcher, results = asyncio.run(scenario(AsyncMock(side_effect=RuntimeError("upstream 500"))))
+    assert results == ["a:single", "b:single"]
+    assert (batcher.stats()["batch_failures"], batcher.stats()["fallbacks"]) == (1, 2)
+
+    batcher, results = asyncio.run(scenario(AsyncMock(return_value=(["a:batched", None], COST))))
+    assert results == ["a:batched", "b:single"]  # only the image without an answer is re-sent
+    assert (batcher.stats()["batch_failures"], batcher.stats()["fallbacks"]) == (0, 1)
+
+
+def test_batch_runs_under_the_latest_deadline_and_skips_callers_that_gave_up():
+    budgets, singles = [], []
+
+    async def send_batch(key, items):
+        budgets.append(current_deadline() and current_deadline().budget)
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream 500")
+
+    async def send_one(key, item):
+        singles.append(item)
+        return f"{item}:single"
+
+    async def submit(batcher, item, budget):
+        if budget is None:
+            return await batcher.submit("p", item)
+        with Deadline(None, budget, 'test'):
+            return await asyncio.wait_for(batcher.submit("p", item), budget)
+
+    async def scenario(*budgets):
+        batcher = MicroBatcher(send_batch, send_one, max_batch=2)
+        results = await asyncio.gather(*(submit(batcher, item, budget) for item, budget in zip("ab", budgets)),
+                                       return_exceptions=True)
+        await asyncio.sleep(0.01)
+        return batcher, results
+
+    batcher, results = asyncio.run(scenario(0.02, 5.0))
+    assert budgets == [5.0]  # the first caller's short budget does not cut the batch short
+    assert isinstance(results[0], asyncio.TimeoutError) and results[1] == "b:single"
+    assert singles == ["b"] and batcher.stats()["fallbacks"] == 1  # no retry for the caller that timed out
+
+    asyncio.run(scenario(5.0, None))
+    assert budgets[-1] is None
+
+
+def test_gemini_batch_request_carries_indexed_images_and_one_prompt():
+    received = {}
+    answer = {"results": [{"index": 1, "answer": {"stone": "citrine"}}, {"index": 0, "answer": {"stone": "amethyst"}},
+                          {"index": 7, "answer": {"stone": "ghost"}}]}
+
+    async def handler(request: httpx.Request):
+        received["body"] = json.loads(await request.aread())
+        return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": json.dumps(answer)}]}}],
+                                         "usageMetadata": {"promptTokenCount": 900, "candidatesTokenCount": 100,
+                                                           "totalTokenCount": 1000}})
+
+    async def scenario():
+        async with httpx.AsyncClient(base_url="http://stand-in", transport=httpx.MockTransport(handler)) as client:
+            return await gemini_generate_content_batch(
+                client, "gemini-1.5-flash", "key", "Identify the crystal.",
+                [(b"first", "image/jpeg"), ("data:image/png;base64,c2Vjb25k", "image/png"), (b"third", "image/jpeg")],
+                response_schema={"type": "OBJECT", "properties": {"stone": {"type": "STRING"}}})
+
+    answers, cost = asyncio.run(scenario())
+    assert answers == [{"stone": "amethyst"}, {"stone": "citrine"}, None]
+    assert cost["total_tokens"] == 1000 and cost["image_bytes"] == 16
+    parts = received["body"]["contents"][0]["parts"]
+    assert parts[0]["text"].count("Identify the crystal.") == 1
+    assert [part["text"] for part in parts[1::2]] == ["Image 0:", "Image 1:", "Image 2:"]
+    assert parts[4]["inline_data"] == {"mime_type": "image/png", "data": "c2Vjb25k"}
+    schema = received["body"]["generationConfig"]["responseSchema"]
+    assert schema["properties"]["results"]["items"]["properties"]["answer"]["properties"] == {"stone": {"type": "STRING"}}
+
+
+def test_identify_batches_concurrent_requests_and_splits_their_cost(mocker):
+    mocker.patch.object(backend_server, 'GEMINI_API_KEY', "test-gemini-key")
+    batch_call = mocker.patch('backend_server.gemini_generate_content_batch', new_callable=AsyncMock, return_value=(
+        [{"identification_details": {"stone_name": "Amethyst"}}, {"identification_details": {"stone_name": "Citrine"}}],
+        COST))
+    single_call = mocker.patch('backend_server.gemini_generate_content', new_callable=AsyncMock)
+    mocker.patch.object(backend_server, 'gemini_batcher', MicroBatcher(
+        backend_server._send_gemini_batch, backend_server._send_gemini_single, max_batch=2, max_wait=0.05,
+        record_cost=record_batch_usage_share))
+    ledger = UsageLedger()
+
+    async def identify(user_id, image):
+        with ledger.admit(user_id, "identify"):
+            return await backend_server.AIService.identify_crystal_with_gemini(image)
+
+    async def scenario():
+        return await asyncio.gather(identify("u1", b"amethyst"), identify("u2", b"citrine"))
+
+    results = asyncio.run(scenario())
+
+    assert [result["identification_details"]["stone_name"] for result in results] == ["Amethyst", "Citrine"]
+    single_call.assert_not_called()
+    (_, model, _, prompt, items), _ = batch_call.call_args
+    assert model == backend_server.GEMINI_MODEL
+    assert items == [(b"amethyst", "image/jpeg"), (b"citrine", "image/jpeg")]
+    for user_id in ("u1", "u2"):
+        assert ledger.usage(user_id)["totals"]["tokens"] == 400
+    assert backend_server.gemini_batcher.stats()["batches"] == 1
@@ -0,0 +1,149 @@
+import asyncio
+import base64
+import io
+from unittest.mock import AsyncMock
+
+import numpy as np
+from PIL import Image
+
+import backend_server
+import backend_server_clean
+import backend_server_enhanced
+from backend_images import normalize_image
+from backend_ledger import UsageLedger
+from backend_routing import ModelRouter
+
+CHEAP, STRONG = "gemini-1.5-flash", "gemini-1.5-pro"
+
+
+def _answer(confidence: float) -> dict:
+    return {"identification_details": {"stone_name": "Labradorite", "identification_confidence": confidence}}
+
+
+def test_routing_by_tier_complexity_and_latency():
+    router = ModelRouter(CHEAP, STRONG, min_samples=2, max_strong_latency=5.0)
+
+    assert router.route(0.9, "pro").model == STRONG
+    assert router.route(0.9, "pro", degraded=True).reason == "over_budget"
+    assert router.route(0.9, "free").reason == "tier"
+    assert router.route(0.3, "pro").reason == "simple_image"
+    assert router.route(None, "founders").reason == "unknown_complexity"
+
+    router._latency(STRONG).latencies.extend([9.0, 11.0])
+    assert router.route(0.9, "pro").reason == "strong_model_slow"
+    assert not ModelRouter(CHEAP, CHEAP).enabled
+
+
+def test_complexity_from_resolution_and_entropy():
+    def encode(image: Image.Image) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    rng = np.random.default_rng(7)
+    busy = normalize_image(encode(Image.fromarray(rng.integers(0, 256, (1800, 2400, 3), dtype=np.uint8))), 1024, 80)
+    flat = normalize_image(encode(Image.new("RGB", (400, 300), (120, 80, 160))), 1024, 80)
+
+    router = ModelRouter(CHEAP, STRONG)
+    assert busy.entropy > 6 and flat.entropy == 0.0
+    assert router.complexity(busy.original_size, busy.entropy) > 0.5
+    assert router.complexity(flat.original_size, flat.entropy) < 0.01
+    assert router.complexity((4000, 3000), 7.5) > router.complexity_threshold  # a detailed 12 MP photo
+    assert router.complexity(None, None) is None
+
+
+def test_low_confidence_cheap_answer_escalates_for_paying_tiers():
+    router = ModelRouter(CHEAP, STRONG)
+    ledger = UsageLedger()
+    calls = []
+
+    async def call(model, escalated):
+        calls.append((model, escalated))
+        return _answer(0.4 if model == CHEAP else 0.8), model
+
+    async def scenario(profile, tier, degraded=False):
+        with ledger.admit(profile, "identify", tier=tier):
+            return await router.identify(call, 0.2, backend_server._ai_confidence, degraded)
+
+    assert asyncio.run(scenario("u1", "premium")) == (_answer(0.8), STRONG)
+    assert calls == [(CHEAP, False), (STRONG, True)]
+    assert asyncio.run(scenario("u2", "free")) == (_answer(0.4), CHEAP)
+    assert asyncio.run(scenario("u1", "premium", degraded=True)) == (_answer(0.4), CHEAP)
+
+    stats = router.stats()
+    assert stats["escalations"] == stats["escalations_improved"] == 1
+    assert stats["decisions"] == {"tier": 2, "over_budget": 1}
+    assert stats["routed"] == {CHEAP: 3}
+    assert stats["models"][STRONG]["calls"] == 1
+
+
+def test_percent_confidences_escalate_on_the_clean_and_enhanced_servers():
+    def answer(confidence):
+        return {"identification": {"name": "Labradorite", "confidence": confidence}}
+
+    async def scenario(server, confidence):
+        router = ModelRouter(CHEAP, STRONG)
+
+        async def call(model, escalated):
+            return answer(confidence if model == CHEAP else 90), model
+
+        with UsageLedger().admit("u1", "identify", tier="premium"):
+            _, model = await router.identify(call, 0.2, server._ai_confidence)
+        return model
+
+    for server in (backend_server_clean, backend_server_enhanced):
+        assert server._ai_confidence(answer(95)) == 0.95
+        assert server._ai_confidence(answer(0.7)) == 0.7
+        assert server._ai_confidence({"identification": {"confidence": "n/a"}}) == 0.0
+        assert asyncio.run(scenario(server, 40)) == STRONG
+        assert asyncio.run(scenario(server, 85)) == CHEAP
+
+
+def test_identify_endpoint_routes_and_escalates(test_client, mocker):
+    mocker.patch.object(backend_server, 'lookup_subscription_tier', AsyncMock(return_value="premium"))
+    mocker.patch.object(backend_server.id_tokens, 'user_id', AsyncMock(return_value="routing-user"))
+    mocker.patch.object(backend_server, 'GEMINI_API_KEY', "test-gemini-key")
+    mocker.patch.object(backend_server, 'OPENAI_API_KEY', '')
+    mocker.patch.object(backend_server, 'model_router', ModelRouter(backend_server.GEMINI_MODEL, STRONG))
+    models = []
+
+    async def gemini(image_data, user_context=None, mime_type="image/jpeg", model=None):
+        models.append(model)
+        return _answer(0.9 if model == STRONG else 0.3)
+
+    mocker.patch('backend_server.AIService.identify_crystal_with_gemini', side_effect=gemini)
+    image = base64.b64encode(b"routed-labradorite").decode()
+
+    body = {"image_data": image, "user_context": {"user_id": "routing-user"}}
+    response = test_client.post("/api/crystal/identify", json=body)
+
+    assert response.status_code == 200
+    assert response.json()["crystal_core"]["identification"]["confidence"] == 0.9
+    assert models == [None, STRONG]  # the default model is not passed explicitly
+    routing = test_client.get("/api/metrics").json()["model_routing"]
+    assert routing["escalations_improved"] == 1
+    assert routing["models"][STRONG]["p50_ms"] is not None
+
+    # The escalated answer is cached for premium callers only; a free caller gets its own cheap answer
+    backend_server.lookup_subscription_tier.return_value = "free"
+    free = test_client.post("/api/crystal/identify", json=body)
+    assert free.json()["crystal_core"]["identification"]["confidence"] == 0.3
+    backend_server.lookup_subscription_tier.return_value = "premium"
+    test_client.post("/api/crystal/identify", json=body)
+    assert models == [None, STRONG, None]
+
+
+def test_cache_namespace_follows_the_routing_options():
+    router = ModelRouter(CHEAP, STRONG, min_samples=2, max_strong_latency=5.0)
+    ledger = UsageLedger()
+
+    def namespace(tier, degraded=False):
+        with ledger.admit("u1", "/api/crystal/identify", tier=tier):
+            return router.cache_namespace(degraded)
+
+    assert namespace("free") == CHEAP
+    assert namespace("premium") == f"{CHEAP}|unsure:{STRONG}"
+    assert namespace("pro") == f"{CHEAP}|complex:{STRONG}|unsure:{STRONG}"
+    assert namespace("pro", degraded=True) == router.cache_namespace() == CHEAP  # no usage scope: untiered
+    router._latency(STRONG).latencies.extend([9.0, 11.0])
+    assert namespace("pro") == CHEAP
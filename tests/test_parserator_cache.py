@@ -0,0 +1,123 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock
+
+from fastapi.testclient import TestClient
+
+import backend_server_clean
+from backend_cache import ParseratorCache, TTLCache
+
+SCHEMA = {"personalized_recommendations": {"healing_sessions": "array"}}
+
+
+def _cache(**kwargs):
+    return ParseratorCache(TTLCache(max_entries=100, max_bytes=1024 * 1024, ttl_seconds=60), **kwargs)
+
+
+def test_key_is_canonical_over_input_and_versioned():
+    first = ParseratorCache.make_key(SCHEMA, "enhance", json.dumps({"a": 1, "b": [1, 2]}), "v1")
+    reordered = ParseratorCache.make_key(SCHEMA, "enhance", '{"b": [1, 2], "a": 1}', "v1")
+    assert first == reordered
+    assert first != ParseratorCache.make_key(SCHEMA, "enhance", json.dumps({"a": 2, "b": [1, 2]}), "v1")
+    assert first != ParseratorCache.make_key(SCHEMA, "enhance", json.dumps({"a": 1, "b": [1, 2]}), "v2")
+    assert first != ParseratorCache.make_key(SCHEMA, "personalize", json.dumps({"a": 1, "b": [1, 2]}), "v1")
+
+
+def test_only_successful_responses_are_cached_and_tags_invalidate():
+    async def scenario():
+        cache = _cache()
+        failing = AsyncMock(return_value={"success": False})
+        await cache.fetch("k0", failing)
+        await cache.fetch("k0", failing)
+
+        call = AsyncMock(return_value={"success": True, "parsedData": {"n": 1}})
+        await cache.fetch("k1", call, tag="user-1")
+        await cache.fetch("k1", call, tag="user-1")
+        assert cache.invalidate_tag("user-1") == 1
+        await cache.fetch("k1", call, tag="user-1")
+        return cache, failing, call
+
+    cache, failing, call = asyncio.run(scenario())
+    assert failing.await_count == 2
+    assert call.await_count == 2
+    stats = cache.stats()
+    assert stats["fresh_hits"] == 1
+    assert stats["invalidations"] == 1
+
+
+def test_evicted_and_expired_entries_leave_their_tags(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("backend_cache.time.monotonic", lambda: clock[0])
+    cache = ParseratorCache(TTLCache(max_entries=2, ttl_seconds=60))
+    call = AsyncMock(return_value={"success": True})
+
+    async def scenario():
+        for user in ("u1", "u2", "u3"):
+            await cache.fetch(f"k-{user}", call, tag=user)
+
+    asyncio.run(scenario())
+    assert set(cache._tags) == {"u2", "u3"}  # u1's entry was evicted by u3's
+
+    clock[0] += 120
+    assert cache.memory.get("k-u2") is None  # expired
+    assert cache._tags == {"u3": {"k-u3"}} and cache._key_tags == {"k-u3": "u3"}
+    assert cache.stats()["tagged_users"] == 1
+    assert cache.invalidate_tag("u3") == 1
+    assert cache._tags == {} and cache._key_tags == {}
+
+
+def test_stale_entries_are_served_while_one_refresh_runs():
+    async def scenario():
+        cache = _cache(fresh_seconds=0.1)
+        versions = iter(range(1, 10))
+
+        async def call():
+            await asyncio.sleep(0.01)
+            return {"success": True, "version": next(versions)}
+
+        first = await cache.fetch("k", call)
+        await asyncio.sleep(0.12)
+        stale = await asyncio.gather(*(cache.fetch("k", call) for _ in range(5)))
+        await asyncio.sleep(0.03)
+        refreshed = await cache.fetch("k", call)
+        return cache, first, stale, refreshed
+
+    cache, first, stale, refreshed = asyncio.run(scenario())
+    assert first["version"] == 1
+    assert [result["version"] for result in stale] == [1] * 5
+    assert refreshed["version"] == 2
+    stats = cache.stats()
+    assert stats["stale_hits"] == 5
+    assert stats["refreshes"] == 1
+
+
+def test_repeat_enhancement_skips_parserator_until_collection_is_saved(mocker):
+    mocker.patch.object(backend_server_clean, 'PARSERATOR_API_KEY', "test-parserator-key")
+    mocker.patch.object(backend_server_clean, 'parserator_cache', _cache())
+    post = mocker.patch('backend_server_clean.ParseOperatorService._post_parserator', new_callable=AsyncMock,
+                        return_value={"success": True, "parsedData": {"personalized_recommendations": {}}})
+
+    def enhance():
+        return asyncio.run(backend_server_clean.ParseOperatorService.enhance_crystal_identification(
+            crystal_data={"identification": {"name": "Citrine"}},
+            user_profile={"user_id": "u1", "sun_sign": "Leo"},
+            collection=[{"crystal_name": "Selenite"}],
+        ))
+
+    enhance()
+    enhance()
+    assert post.await_count == 1
+
+    entry = {"id": "c1", "user_id": "u1", "crystal_name": "Citrine", "crystal_type": "Quartz", "acquisition_date": "2024-01-01",
+             "personal_notes": "", "intentions": "abundance", "usage_count": 0}
+    anonymous_entry = {k: v for k, v in entry.items() if k != "user_id"}
+    client = TestClient(backend_server_clean.app)
+    assert client.post("/api/crystal/save", json=anonymous_entry).status_code == 200  # owner unknown: TTL expiry only
+    enhance()
+    assert post.await_count == 1
+    assert client.post("/api/crystal/save", json=entry).status_code == 200
+    enhance()
+    assert post.await_count == 2
+    assert client.post("/api/crystal/save?user_id=u1", json=anonymous_entry).status_code == 200
+    enhance()
+    assert post.await_count == 3
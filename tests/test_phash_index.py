@@ -0,0 +1,100 @@
+import base64
+import io
+import random
+import time
+from unittest.mock import AsyncMock
+
+import numpy as np
+from fastapi.testclient import TestClient
+from PIL import Image, ImageEnhance
+
+from backend_phash import PerceptualHashIndex, compute_dhash, hamming_distance
+
+SAMPLE_AI_RESPONSE = {
+    "overall_confidence_score": 0.9,
+    "identification_details": {"stone_name": "Rose Quartz", "crystal_family": "Quartz", "identification_confidence": 0.9},
+    "visual_characteristics": {"primary_color": "Pink", "transparency": "Translucent", "formation": "Tumbled"},
+    "enrichment_details": {"healing_properties": ["Love"]}
+}
+
+
+def _photo_bytes(brightness: float = 1.0, seed: int = 7, size=(640, 480)) -> bytes:
+    """Deterministic textured 'photo'; brightness tweaks mimic a re-shot of the same stone"""
+    rng = np.random.default_rng(seed)
+    coarse = Image.fromarray(rng.integers(0, 256, (12, 16), dtype=np.uint8)).resize(size, Image.BICUBIC)
+    noise = rng.normal(0, 3, (size[1], size[0]))
+    pixels = (np.asarray(coarse, dtype=np.float64) + noise).clip(0, 255).astype(np.uint8)
+    image = ImageEnhance.Brightness(Image.fromarray(pixels).convert("RGB")).enhance(brightness)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def test_dhash_is_stable_across_small_photometric_changes():
+    original = compute_dhash(_photo_bytes())
+    reshot = compute_dhash(_photo_bytes(brightness=1.08))
+    other_stone = compute_dhash(_photo_bytes(seed=8))
+
+    assert original is not None
+    assert hamming_distance(original, reshot) <= 4
+    assert hamming_distance(original, other_stone) > 12
+    assert compute_dhash(b"not an image") is None
+
+
+def test_multi_index_search_matches_brute_force():
+    rng = random.Random(42)
+    index = PerceptualHashIndex(max_distance=6, max_entries=20000)
+    hashes = [rng.getrandbits(64) for _ in range(20000)]
+    for i, value in enumerate(hashes):
+        index.add(value, i)
+
+    for i in rng.sample(range(len(hashes)), 50):
+        query = hashes[i] ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64))
+        expected = min((hamming_distance(query, h), j) for j, h in enumerate(hashes))
+        found = index.search(query)
+        assert found is not None
+        assert found[1] == expected[0]
+
+    started = time.perf_counter()
+    for _ in range(200):
+        index.search(rng.getrandbits(64))
+    assert (time.perf_counter() - started) / 200 < 0.001
+
+
+def test_index_is_bounded_and_namespaced():
+    rng = random.Random(3)
+    hashes = [rng.getrandbits(64) for _ in range(5)]
+    index = PerceptualHashIndex(max_distance=4, max_entries=3)
+    for i, value in enumerate(hashes):
+        index.add(value, f"value-{i}", namespace="gemini")
+
+    assert len(index) == 3
+    assert index.stats()["evictions"] == 2
+    assert index.search(hashes[0], namespace="gemini") is None  # evicted
+    assert index.search(hashes[4] ^ 0b101, namespace="gemini") == ("value-4", 2)
+    assert index.search(hashes[4], namespace="other-model") is None
+
+
+def test_near_duplicate_photo_reuses_previous_identification(test_client: TestClient, mocker):
+    import backend_server
+    mocker.patch.object(backend_server.phash_index, "verify_sample_rate", 0.0)
+    mock_ai_call = mocker.patch(
+        'backend_server.AIService.identify_crystal_with_gemini',
+        new_callable=AsyncMock,
+        return_value=SAMPLE_AI_RESPONSE
+    )
+
+    first = test_client.post("/api/crystal/identify", json={"image_data": base64.b64encode(_photo_bytes()).decode()})
+    second = test_client.post(
+        "/api/crystal/identify",
+        json={"image_data": base64.b64encode(_photo_bytes(brightness=1.08)).decode()}
+    )
+
+    assert first.status_code == 200 and second.status_code == 200
+    mock_ai_call.assert_called_once()
+    assert second.json()["crystal_core"]["identification"]["stone_type"] == "Rose Quartz"
+    assert second.json()["crystal_core"]["id"] != first.json()["crystal_core"]["id"]
+
+    stats = test_client.get("/api/metrics").json()["near_duplicate_index"]
+    assert stats["matches"] == 1
+    assert stats["match_rate"] == 0.5
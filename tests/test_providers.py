@@ -0,0 +1,129 @@
+import asyncio
+import base64
+import json
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import backend_server
+from backend_providers import ProviderPool, VisionProvider, gemini_generate_content, openai_chat_vision
+from backend_uploads import SpooledImage
+
+AI_RESPONSE = {"identification_details": {"stone_name": "Amethyst", "identification_confidence": 0.9}}
+
+
+def _seeded_pool(*providers, latency: float = 0.02, **kwargs) -> ProviderPool:
+    pool = ProviderPool(list(providers), min_samples=3, min_hedge_delay=0.01, **kwargs)
+    for provider in providers:
+        pool._stats[provider.name].latencies.extend([latency] * 5)
+        pool._stats[provider.name].outcomes.extend([True] * 5)
+    return pool
+
+
+def test_openai_adapter_streams_spooled_image_as_data_url():
+    image = SpooledImage(max_bytes=1_000_000, spool_memory_bytes=16)
+    image.write(b"\xff\xd8 crystal photo bytes")
+    image.finish()
+    received = {}
+
+    async def handler(request: httpx.Request):
+        received["path"] = request.url.path
+        received["auth"] = request.headers["authorization"]
+        received["body"] = json.loads(await request.aread())
+        answer = "```json\n" + json.dumps(AI_RESPONSE) + "\n```"
+        return httpx.Response(200, json={"choices": [{"message": {"content": answer}}]})
+
+    async def scenario():
+        async with httpx.AsyncClient(base_url="http://stand-in", transport=httpx.MockTransport(handler)) as client:
+            return await openai_chat_vision(client, "gpt-4o-mini", "sk-test", "identify", image, "image/png")
+
+    result = asyncio.run(scenario())
+    image.close()
+
+    assert result == AI_RESPONSE
+    assert received["path"] == "/v1/chat/completions"
+    assert received["auth"] == "Bearer sk-test"
+    url = received["body"]["messages"][0]["content"][1]["image_url"]["url"]
+    assert url.startswith("data:image/png;base64,")
+    assert base64.b64decode(url.split(",", 1)[1]) == b"\xff\xd8 crystal photo bytes"
+
+
+def test_gemini_adapter_surfaces_upstream_status():
+    async def handler(request: httpx.Request):
+        return httpx.Response(429, text="quota exceeded")
+
+    async def scenario():
+        async with httpx.AsyncClient(base_url="http://stand-in", transport=httpx.MockTransport(handler)) as client:
+            return await gemini_generate_content(client, "gemini-1.5-flash", "key", "identify", "aGVsbG8=")
+
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(scenario())
+    assert excinfo.value.status_code == 429
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    cancelled = []
+
+    async def slow(*args, **kwargs):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def fast(*args, **kwargs):
+        await asyncio.sleep(0.02)
+        return {"stone_name": "Jade"}
+
+    pool = _seeded_pool(VisionProvider("gemini", "gemini-1.5-flash", slow), VisionProvider("openai", "gpt-4o-mini", fast))
+
+    async def scenario():
+        result = await pool.identify("image")
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(scenario()) == ({"stone_name": "Jade"}, "gpt-4o-mini")
+    assert cancelled == [True]
+    stats = pool.stats()
+    assert stats["hedges"] == 1
+    assert stats["hedge_wins"] == 1
+    assert stats["providers"]["gemini"]["cancelled"] == 1
+
+
+def test_failed_provider_fails_over_and_is_ranked_down():
+    async def failing(*args, **kwargs):
+        raise HTTPException(status_code=500, detail="Gemini API error")
+
+    pool = _seeded_pool(
+        VisionProvider("gemini", "gemini-1.5-flash", failing),
+        VisionProvider("openai", "gpt-4o-mini", AsyncMock(return_value={"stone_name": "Opal"})),
+        hedging=False,
+    )
+
+    for _ in range(3):
+        assert asyncio.run(pool.identify("image")) == ({"stone_name": "Opal"}, "gpt-4o-mini")
+
+    stats = pool.stats()
+    # After the first failures the error-prone provider stops being tried first
+    assert stats["ranking"] == ["openai", "gemini"]
+    assert 1 <= stats["failovers"] < 3
+    assert stats["providers"]["gemini"]["error_rate"] > 0
+
+
+def test_identify_endpoint_fails_over_to_openai(test_client, mocker):
+    mocker.patch.object(backend_server, 'OPENAI_API_KEY', "sk-test")
+    mocker.patch('backend_server.AIService.identify_crystal_with_gemini', new_callable=AsyncMock,
+                 side_effect=HTTPException(status_code=500, detail="AI identification failed"))
+    openai_call = mocker.patch('backend_server.AIService.identify_crystal_with_openai', new_callable=AsyncMock,
+                               return_value=AI_RESPONSE)
+
+    response = test_client.post("/api/crystal/identify", json={"image_data": base64.b64encode(b"photo").decode()})
+
+    assert response.status_code == 200
+    assert response.json()["crystal_core"]["identification"]["stone_type"] == "Amethyst"
+    openai_call.assert_awaited_once()
+    providers = test_client.get("/api/metrics").json()["providers"]
+    assert providers["failovers"] == 1
+    assert providers["providers"]["openai"]["wins"] == 1
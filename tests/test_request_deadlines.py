@@ -0,0 +1,124 @@
+import asyncio
+import base64
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import backend_server_clean
+from backend_cache import IdentificationCache, SingleFlight
+from backend_deadline import (
+    DeadlineExceeded, DeadlineMiddleware, DeadlinePolicy, current_deadline, http_timeout, retry_fits, stage_allowed,
+    within_deadline,
+)
+
+REQUEST = {
+    "image_data": base64.b64encode(b"rose quartz photo").decode(),
+    "user_profile": {"sun_sign": "Taurus"},
+    "existing_collection": [{"name": "Amethyst"}],
+}
+
+
+def test_budget_comes_from_header_or_longest_path_prefix():
+    policy = DeadlinePolicy(max_budget=60.0)
+    assert policy.budget_for('/api/crystal/identify-enhanced') == (25.0, 'default')
+    assert policy.budget_for('/api/crystal/identify') == (20.0, 'default')
+    assert policy.budget_for('/api/crystals/abc') == (10.0, 'default')
+    assert policy.budget_for('/api/usage') == (30.0, 'default')
+    assert policy.budget_for('/api/crystal/identify', '8000') == (8.0, 'header')
+    assert policy.budget_for('/api/crystal/identify', '600000') == (60.0, 'header')
+    assert policy.budget_for('/api/crystal/identify', 'soon') == (20.0, 'default')
+
+
+def test_stages_get_only_the_remaining_budget():
+    policy = DeadlinePolicy(optional_min_seconds=1.0)
+
+    async def scenario():
+        assert current_deadline() is None
+        assert await within_deadline(asyncio.sleep(0, 'ok'), 'identification') == 'ok'
+        with policy.start('/api/crystal/identify', '300'):
+            timeout = http_timeout(httpx.Timeout(30.0, connect=5.0))
+            assert timeout.read <= 0.3 and timeout.connect <= 0.3
+            assert retry_fits(0.1) and not retry_fits(1.0)
+            assert not stage_allowed('parserator')
+            with pytest.raises(DeadlineExceeded) as raised:
+                await within_deadline(asyncio.sleep(5), 'identification')
+            assert raised.value.status_code == 504
+            with pytest.raises(DeadlineExceeded):
+                await within_deadline(asyncio.sleep(0), 'firestore')  # nothing left at all
+
+    asyncio.run(scenario())
+    stats = policy.stats()
+    assert stats['exceeded'] == {'identification': 1, 'firestore': 1}
+    assert stats['skipped_stages'] == {'parserator': 1}
+    assert stats['started'] == {'header': 1, 'default': 0}
+
+
+def test_identify_enhanced_honours_client_deadline(mocker):
+    mocker.patch.object(backend_server_clean, 'GEMINI_API_KEY', "test-gemini-key")
+    mocker.patch.object(backend_server_clean, 'OPENAI_API_KEY', '')
+    mocker.patch.object(backend_server_clean, 'PARSERATOR_API_KEY', "test-parserator-key")
+    mocker.patch.object(backend_server_clean, 'identification_cache', IdentificationCache.from_env())
+    mocker.patch.object(backend_server_clean, 'identification_flights', SingleFlight('identification'))
+    mocker.patch.object(backend_server_clean, 'enhanced_stage_stats', {
+        'requests': 0, 'streamed': 0,
+        'stages': {stage: {'count': 0, 'total_ms': 0.0} for stage in backend_server_clean.ENHANCED_STAGES},
+    })
+    delay = {'seconds': 0.0}
+
+    async def gemini(*args, **kwargs):
+        await asyncio.sleep(delay['seconds'])
+        return {"identification": {"name": "Rose Quartz", "confidence": 0.9}}
+
+    mocker.patch('backend_server_clean.AIService.identify_crystal_with_gemini', new_callable=AsyncMock, side_effect=gemini)
+    parserator = mocker.patch('backend_server_clean.ParseOperatorService.enhance_crystal_identification',
+                              new_callable=AsyncMock)
+    client = TestClient(backend_server_clean.app)
+    before = client.get("/api/metrics").json()["deadlines"]
+
+    # 2s left is below the 3s needed to start Parserator: answered without it
+    response = client.post("/api/crystal/identify-enhanced", json=REQUEST, headers={"X-Request-Deadline-Ms": "2000"})
+    assert response.status_code == 200
+    assert response.json()["parserator_metadata"] == {"skipped": "deadline"}
+    parserator.assert_not_called()
+
+    delay['seconds'] = 0.5
+    backend_server_clean.identification_cache.clear()
+    response = client.post("/api/crystal/identify-enhanced", json=REQUEST, headers={"X-Request-Deadline-Ms": "100"})
+    assert response.status_code == 504
+    assert response.json()["detail"] == "Request deadline exceeded during identification"
+
+    after = client.get("/api/metrics").json()["deadlines"]
+    assert after["skipped_stages"].get("parserator", 0) == before["skipped_stages"].get("parserator", 0) + 1
+    assert after["exceeded"].get("identification", 0) == before["exceeded"].get("identification", 0) + 1
+    assert after["started"]["header"] >= before["started"]["header"] + 2
+
+
+def test_handler_is_cancelled_when_the_client_disconnects():
+    policy = DeadlinePolicy()
+    state = {}
+
+    async def app(scope, receive, send):
+        await receive()  # the request body
+        state['deadline'] = current_deadline()
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            state['cancelled'] = True
+            raise
+
+    async def scenario():
+        messages = asyncio.Queue()
+        messages.put_nowait({'type': 'http.request', 'body': b'{}', 'more_body': False})
+        middleware = DeadlineMiddleware(app, policy)
+        scope = {'type': 'http', 'method': 'POST', 'path': '/api/crystal/identify', 'headers': []}
+        serving = asyncio.ensure_future(middleware(scope, messages.get, AsyncMock()))
+        await asyncio.sleep(0.05)
+        messages.put_nowait({'type': 'http.disconnect'})
+        await asyncio.wait_for(serving, 1.0)
+
+    asyncio.run(scenario())
+    assert state['cancelled'] is True
+    assert state['deadline'].budget == 20.0
+    assert policy.stats()['cancelled_disconnected'] == 1
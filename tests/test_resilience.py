@@ -0,0 +1,205 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+
+import backend_server
+from backend_providers import gemini_generate_content
+from backend_resilience import CircuitBreaker, ResilienceConfig, UpstreamResilience, UpstreamUnavailable
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _upstream(**overrides) -> UpstreamResilience:
+    config = ResilienceConfig("gemini", base_delay=0.001, max_delay=0.01, **overrides)
+    return UpstreamResilience(config)
+
+
+def _scripted(*statuses, headers=None):
+    """Client whose responses follow the given statuses; returns (client, call log)"""
+    remaining = list(statuses)
+    calls = []
+
+    async def handler(request: httpx.Request):
+        calls.append(request.url.path)
+        return httpx.Response(remaining.pop(0), headers=headers or {}, json={"ok": True})
+
+    return httpx.AsyncClient(base_url="http://stand-in", transport=httpx.MockTransport(handler)), calls
+
+
+def test_breaker_opens_rejects_and_closes_after_half_open_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker("gemini", failure_threshold=2, reset_timeout=10, clock=clock)
+
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.allow() is False
+    assert breaker.retry_after() == 10
+
+    clock.now = 10
+    assert breaker.state == "half_open"
+    assert breaker.allow() is True
+    assert breaker.allow() is False  # only one probe at a time
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.trips == 1
+    assert breaker.rejected == 2
+
+
+def test_failed_half_open_probe_reopens_the_breaker():
+    clock = FakeClock()
+    breaker = CircuitBreaker("parserator", failure_threshold=1, reset_timeout=5, clock=clock)
+    breaker.record_failure()
+    clock.now = 5
+    assert breaker.allow() is True
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.retry_after() == 5
+
+
+def test_retryable_statuses_are_retried_until_success():
+    upstream = _upstream(max_attempts=3)
+
+    async def scenario():
+        client, calls = _scripted(503, 502, 200)
+        async with client:
+            response = await upstream.call(lambda: client.post("/generate"))
+        return response, calls
+
+    response, calls = asyncio.run(scenario())
+    assert response.status_code == 200
+    assert len(calls) == 3
+    stats = upstream.stats()
+    assert stats["retries"] == 2
+    assert stats["state"] == "closed"
+    assert stats["consecutive_failures"] == 0
+
+
+def test_client_errors_are_neither_retried_nor_counted_as_failures():
+    upstream = _upstream(max_attempts=3, failure_threshold=1)
+
+    async def scenario():
+        client, calls = _scripted(400)
+        async with client:
+            response = await upstream.call(lambda: client.post("/generate"))
+        return response, calls
+
+    response, calls = asyncio.run(scenario())
+    assert response.status_code == 400
+    assert len(calls) == 1
+    assert upstream.stats()["state"] == "closed"
+
+
+def test_long_retry_after_is_not_waited_for():
+    upstream = _upstream(max_attempts=3)
+
+    async def scenario():
+        client, calls = _scripted(429, headers={"Retry-After": "120"})
+        async with client:
+            response = await upstream.call(lambda: client.post("/generate"))
+        return response, calls
+
+    response, calls = asyncio.run(scenario())
+    assert response.status_code == 429
+    assert len(calls) == 1
+
+
+def test_open_breaker_fails_fast_without_calling_upstream():
+    upstream = _upstream(max_attempts=1, failure_threshold=2)
+
+    async def scenario():
+        client, calls = _scripted(500, 500)
+        async with client:
+            for _ in range(2):
+                await upstream.call(lambda: client.post("/generate"))
+            with pytest.raises(UpstreamUnavailable) as excinfo:
+                await upstream.call(lambda: client.post("/generate"))
+        return excinfo.value, calls
+
+    error, calls = asyncio.run(scenario())
+    assert len(calls) == 2
+    assert error.status_code == 503
+    assert int(error.headers["Retry-After"]) >= 1
+    assert upstream.stats()["rejected_open"] == 1
+
+
+def test_connect_errors_are_retried():
+    attempts = []
+
+    async def handler(request: httpx.Request):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(200, json={})
+
+    upstream = _upstream(max_attempts=2)
+
+    async def scenario():
+        async with httpx.AsyncClient(base_url="http://stand-in", transport=httpx.MockTransport(handler)) as client:
+            return await upstream.call(lambda: client.post("/generate"))
+
+    assert asyncio.run(scenario()).status_code == 200
+    assert len(attempts) == 2
+
+
+def test_bulkhead_rejects_calls_beyond_its_limit():
+    upstream = _upstream(max_concurrent=2)
+    release = asyncio.Event()
+
+    async def slow_send():
+        await release.wait()
+        return httpx.Response(200)
+
+    async def scenario():
+        held = [asyncio.create_task(upstream.call(slow_send)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(UpstreamUnavailable):
+            await upstream.call(slow_send)
+        release.set()
+        await asyncio.gather(*held)
+
+    asyncio.run(scenario())
+    stats = upstream.stats()
+    assert stats["rejected_bulkhead"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_gemini_retry_restreams_binary_image():
+    bodies = []
+
+    async def handler(request: httpx.Request):
+        bodies.append(await request.aread())
+        if len(bodies) == 1:
+            return httpx.Response(503, text="overloaded")
+        answer = json.dumps({"identification_details": {"stone_name": "Amethyst"}})
+        return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": answer}]}}]})
+
+    async def scenario():
+        async with httpx.AsyncClient(base_url="http://stand-in", transport=httpx.MockTransport(handler)) as client:
+            return await gemini_generate_content(client, "gemini-1.5-flash", "key", "identify", b"image bytes",
+                                                 resilience=_upstream())
+
+    assert asyncio.run(scenario())["identification_details"]["stone_name"] == "Amethyst"
+    assert len(bodies) == 2
+    assert bodies[0] == bodies[1]
+
+
+def test_open_breaker_surfaces_as_503_with_retry_after(test_client, mocker):
+    mocker.patch('backend_server.AIService.identify_crystal_with_gemini', new_callable=AsyncMock,
+                 side_effect=UpstreamUnavailable("gemini", "circuit open", 12))
+
+    response = test_client.post("/api/crystal/identify", json={"image_data": "aGVsbG8="})
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "12"
+    assert set(test_client.get("/api/metrics").json()["resilience"]) == {"gemini", "openai"}
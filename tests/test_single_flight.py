@@ -0,0 +1,134 @@
+import asyncio
+import base64
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+
+import backend_server
+from backend_cache import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    async def slow_identify():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"stone_name": "Quartz"}
+
+    async def scenario():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.do("key", slow_identify) for _ in range(3)))
+        return flights, results
+
+    flights, results = asyncio.run(scenario())
+
+    assert len(calls) == 1
+    assert all(result == {"stone_name": "Quartz"} for result in results)
+    assert results[1] is not results[0]  # coalesced callers get their own copy
+    stats = flights.stats()
+    assert stats["upstream_calls"] == 1
+    assert stats["coalesced"] == 2
+    assert stats["in_flight"] == 0
+
+
+def test_cancelling_the_leader_does_not_cancel_other_waiters():
+    release = asyncio.Event()
+
+    async def scenario():
+        flights = SingleFlight()
+        done = []
+
+        async def identify():
+            await release.wait()
+            return {"stone_name": "Jade"}
+
+        leader = asyncio.create_task(flights.do("key", identify, on_done=lambda: done.append(True)))
+        follower = asyncio.create_task(flights.do("key", identify))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert await follower == {"stone_name": "Jade"}
+        assert done == [True]
+        return flights.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["cancelled_waiters"] == 1
+    assert stats["abandoned"] == 0
+
+
+def test_call_is_cancelled_once_every_waiter_has_gone():
+    async def scenario():
+        flights = SingleFlight()
+        started = asyncio.Event()
+        cancelled = []
+
+        async def identify():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        waiters = [asyncio.create_task(flights.do("key", identify)) for _ in range(2)]
+        await started.wait()
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        return flights, cancelled
+
+    flights, cancelled = asyncio.run(scenario())
+    assert cancelled == [True]
+    assert flights.stats()["abandoned"] == 1
+    assert len(flights) == 0
+
+
+def test_failures_reach_every_waiter_and_are_not_remembered():
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def scenario():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.do("key", failing) for _ in range(2)), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        with pytest.raises(RuntimeError):
+            await flights.do("key", failing)
+
+    asyncio.run(scenario())
+    assert len(attempts) == 2
+
+
+def test_concurrent_identical_identify_requests_make_one_upstream_call(test_client, mocker):
+    async def slow_gemini(*args, **kwargs):
+        await asyncio.sleep(0.1)
+        return {"identification_details": {"stone_name": "Amethyst", "identification_confidence": 0.9}}
+
+    mock_ai_call = mocker.patch(
+        'backend_server.AIService.identify_crystal_with_gemini',
+        new_callable=AsyncMock,
+        side_effect=slow_gemini
+    )
+    body = {"image_data": base64.b64encode(b"same retried image").decode(), "user_context": {"intent": "calm"}}
+
+    async def scenario():
+        async with httpx.AsyncClient(app=backend_server.app, base_url="http://testserver") as client:
+            return await asyncio.gather(*(client.post("/api/crystal/identify", json=body) for _ in range(3)))
+
+    responses = asyncio.run(scenario())
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert mock_ai_call.await_count == 1
+    flights = test_client.get("/api/metrics").json()["identification_single_flight"]
+    assert flights["upstream_calls"] == 1
+    assert flights["coalesced"] == 2
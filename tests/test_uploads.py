@@ -0,0 +1,168 @@
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+from unittest.mock import AsyncMock
+
+import httpx
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import backend_server
+from backend_uploads import SpooledImage, StreamingJSONBody, UploadLimits
+
+AI_RESPONSE = {"identification_details": {"stone_name": "Amethyst", "identification_confidence": 0.9}}
+
+
+def _jpeg(width: int, height: int) -> bytes:
+    rng = np.random.default_rng(7)
+    buffer = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)).save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def test_spooled_image_rolls_over_to_disk_and_hashes_while_streaming():
+    data = os.urandom(300_000)
+    image = SpooledImage(max_bytes=1_000_000, spool_memory_bytes=64 * 1024)
+    for offset in range(0, len(data), 10_000):
+        image.write(data[offset:offset + 10_000])
+    image.finish()
+
+    path = image.path
+    assert path is not None and os.path.exists(path)
+    assert image.peak_memory_bytes <= 64 * 1024
+    assert image.digest == hashlib.sha256(data).hexdigest()
+    assert b"".join(image.iter_chunks(4096)) == data
+
+    image.close()
+    assert not os.path.exists(path)
+
+
+def test_spooled_image_rejects_oversized_upload_before_buffering_it():
+    image = SpooledImage(max_bytes=100, spool_memory_bytes=1024)
+    image.write(b"x" * 60)
+    with pytest.raises(HTTPException) as excinfo:
+        image.write(b"x" * 60)
+    assert excinfo.value.status_code == 413
+    assert image.size == 60
+
+
+def test_streaming_json_body_matches_regular_serialization():
+    data = os.urandom(200_001)  # not a multiple of 3, so the final chunk carries padding
+    payload = {"contents": [{"parts": [{"text": "prompt"}, {"inline_data": {"mime_type": "image/jpeg", "data": StreamingJSONBody.PLACEHOLDER}}]}]}
+    body = StreamingJSONBody(payload, data)
+
+    async def collect():
+        return b"".join([chunk async for chunk in body])
+
+    sent = asyncio.run(collect())
+    assert len(sent) == body.content_length
+    decoded = json.loads(sent)
+    assert base64.b64decode(decoded["contents"][0]["parts"][1]["inline_data"]["data"]) == data
+
+
+def test_streaming_json_body_is_sent_with_exact_content_length():
+    data = _jpeg(64, 64)
+    image = SpooledImage(max_bytes=1_000_000, spool_memory_bytes=256)
+    image.write(data)
+    image.finish()
+    received = {}
+
+    async def handler(request: httpx.Request):
+        received["headers"] = request.headers
+        received["body"] = await request.aread()
+        return httpx.Response(200, json={"ok": True})
+
+    async def scenario():
+        body = StreamingJSONBody({"image": StreamingJSONBody.PLACEHOLDER}, image)
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            await client.post("http://stand-in/upload", content=body, headers=body.headers)
+
+    asyncio.run(scenario())
+    image.close()
+    assert "transfer-encoding" not in received["headers"]
+    assert int(received["headers"]["content-length"]) == len(received["body"])
+    assert base64.b64decode(json.loads(received["body"])["image"]) == data
+
+
+def test_multipart_upload_shares_cache_entry_with_json_body(test_client: TestClient, mocker):
+    mock_ai_call = mocker.patch(
+        'backend_server.AIService.identify_crystal_with_gemini',
+        new_callable=AsyncMock,
+        return_value=AI_RESPONSE
+    )
+    image = _jpeg(320, 240)
+    context = {"intent": "calm"}
+
+    multipart = test_client.post(
+        "/api/crystal/identify",
+        files={"image": ("stone.jpg", image, "image/jpeg")},
+        data={"user_context": json.dumps(context)},
+    )
+    as_json = test_client.post(
+        "/api/crystal/identify",
+        json={"image_data": base64.b64encode(image).decode(), "user_context": context},
+    )
+
+    assert multipart.status_code == 200
+    assert as_json.status_code == 200
+    assert multipart.json()["crystal_core"]["identification"]["stone_type"] == "Amethyst"
+    mock_ai_call.assert_awaited_once()
+    assert mock_ai_call.call_args.args[1] == context
+
+    uploads = test_client.get("/api/metrics").json()["uploads"]
+    assert uploads["uploads"] == {"json": 1, "multipart": 1, "binary": 0}
+    assert uploads["in_flight"] == 0
+
+
+def test_raw_binary_upload_spools_large_images_to_disk(test_client: TestClient, mocker):
+    mock_ai_call = mocker.patch(
+        'backend_server.AIService.identify_crystal_with_gemini',
+        new_callable=AsyncMock,
+        return_value=AI_RESPONSE
+    )
+    mocker.patch.object(backend_server, 'upload_limits', UploadLimits(spool_memory_bytes=64 * 1024))
+    image = _jpeg(1200, 900)
+    assert len(image) > 64 * 1024
+
+    response = test_client.post(
+        "/api/crystal/identify",
+        content=image,
+        headers={"Content-Type": "image/jpeg"},
+        params={"user_context": json.dumps({"intent": "focus"})},
+    )
+
+    assert response.status_code == 200
+    assert mock_ai_call.call_args.args[1] == {"intent": "focus"}
+    uploads = test_client.get("/api/metrics").json()["uploads"]
+    assert uploads["uploads"]["binary"] == 1
+    assert uploads["spooled_to_disk"] == 1
+    # Only the pre-rollover head was ever held in memory, not the whole upload
+    assert uploads["max_request_buffered_bytes"] <= 64 * 1024
+    assert uploads["process_memory"]["peak_rss_bytes"] > 0
+
+
+def test_oversized_uploads_are_rejected_with_413(test_client: TestClient, mocker):
+    mock_ai_call = mocker.patch('backend_server.AIService.identify_crystal_with_gemini', new_callable=AsyncMock)
+    mocker.patch.object(backend_server, 'upload_limits', UploadLimits(max_image_bytes=10_000, max_json_bytes=10_000))
+    image = _jpeg(400, 300)
+
+    binary = test_client.post("/api/crystal/identify", content=image, headers={"Content-Type": "image/jpeg"})
+    multipart = test_client.post("/api/crystal/identify", files={"image": ("stone.jpg", image, "image/jpeg")})
+    as_json = test_client.post("/api/crystal/identify", json={"image_data": base64.b64encode(image).decode()})
+
+    assert binary.status_code == 413
+    assert multipart.status_code == 413
+    assert as_json.status_code == 413
+    mock_ai_call.assert_not_awaited()
+    assert test_client.get("/api/metrics").json()["uploads"]["rejected_too_large"] == 3
+
+
+def test_multipart_without_image_part_is_a_validation_error(test_client: TestClient):
+    response = test_client.post("/api/crystal/identify", files={"user_context": (None, "{}")})
+    assert response.status_code == 422
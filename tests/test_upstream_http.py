@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from backend_http import UpstreamClients, UpstreamConfig
+
+
+async def _start_keepalive_server():
+    """Minimal HTTP/1.1 keep-alive server standing in for an upstream"""
+    connections = []
+
+    async def handle(reader, writer):
+        connections.append(writer)
+        while True:
+            try:
+                await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            body = b'{"ok": true}'
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, port, connections
+
+
+def test_config_from_env_overrides(monkeypatch):
+    monkeypatch.setenv("GEMINI_HTTP_TIMEOUT", "12.5")
+    monkeypatch.setenv("GEMINI_HTTP_MAX_CONNECTIONS", "7")
+    monkeypatch.setenv("GEMINI_HTTP_HTTP2", "false")
+
+    config = UpstreamConfig.from_env("gemini", "https://example.invalid")
+
+    assert config.timeout == 12.5
+    assert config.max_connections == 7
+    assert config.http2 is False
+    assert config.max_keepalive_connections == 20  # default untouched
+
+
+def test_stats_before_start_report_configured_limits():
+    clients = UpstreamClients([UpstreamConfig("gemini", "https://example.invalid", max_connections=5)])
+
+    stats = clients.stats()["gemini"]
+
+    assert stats["started"] is False
+    assert stats["max_connections"] == 5
+    assert stats["open_connections"] == 0
+    assert stats["waiting_requests"] == 0
+
+
+def test_get_returns_same_pooled_client_until_closed():
+    async def scenario():
+        clients = UpstreamClients([UpstreamConfig("parserator", "https://example.invalid")])
+        await clients.start()
+        first = clients.get("parserator")
+        assert clients.get("parserator") is first
+        await clients.close()
+        assert first.is_closed
+        with pytest.raises(KeyError):
+            clients.get("unknown")
+
+    asyncio.run(scenario())
+
+
+def test_sequential_requests_reuse_one_keepalive_connection():
+    async def scenario():
+        server, port, connections = await _start_keepalive_server()
+        clients = UpstreamClients([UpstreamConfig("stand_in", f"http://127.0.0.1:{port}", http2=False)])
+        await clients.start()
+        try:
+            client = clients.get("stand_in")
+            for _ in range(3):
+                response = await client.get("/ping")
+                assert response.json() == {"ok": True}
+
+            stats = clients.stats()["stand_in"]
+            assert len(connections) == 1
+            assert stats["open_connections"] == 1
+            assert stats["idle_connections"] == 1
+            assert stats["active_connections"] == 0
+        finally:
+            await clients.close()
+            server.close()
+
+    asyncio.run(scenario())
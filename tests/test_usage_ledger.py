@@ -0,0 +1,247 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import backend_auth
+import backend_server
+from backend_ledger import TierBudget, UsageLedger, image_size, record_upstream_usage
+from backend_providers import gemini_generate_content
+
+AI_RESPONSE = {"identification_details": {"stone_name": "Amethyst", "identification_confidence": 0.9}}
+
+
+def _ledger(**kwargs):
+    budgets = {
+        "anonymous": TierBudget(daily_calls=1, over_budget="reject"),
+        "free": TierBudget(daily_tokens=1000, daily_calls=2, over_budget="reject"),
+        "premium": TierBudget(daily_tokens=1000, over_budget="degrade"),
+    }
+    return UsageLedger(budgets=budgets, **kwargs)
+
+
+class InvalidIdTokenError(ValueError):
+    pass
+
+
+def _verify_test_tokens(mocker):
+    """ID tokens 'token-<uid>' verify as <uid>; any other token is rejected"""
+    def verify(token, check_revoked=False):
+        if not token.startswith("token-"):
+            raise InvalidIdTokenError("not a test token")
+        return {"uid": token[len("token-"):]}
+    # firebase_admin may be a MagicMock here (see conftest), so its error classes are stood in for
+    mocker.patch.object(backend_auth, 'firebase_auth', MagicMock(
+        verify_id_token=MagicMock(side_effect=verify), InvalidIdTokenError=InvalidIdTokenError,
+        UserDisabledError=InvalidIdTokenError))
+
+
+def _auth(uid):
+    return {"Authorization": f"Bearer token-{uid}"}
+
+
+async def _billed_gemini(image, context, mime_type="image/jpeg", **kwargs):
+    record_upstream_usage("gemini", input_tokens=100, output_tokens=50)
+    return AI_RESPONSE
+
+
+def test_budgets_degrade_or_reject_per_tier():
+    ledger = _ledger()
+    assert ledger.resolve("u1", tier="Premium") == ("u1", "premium")
+    assert ledger.resolve("u2", tier="platinum") == ("u2", "free")
+    assert ledger.resolve(None) == ("anonymous", "anonymous")
+
+    with ledger.admit("u1", "identify", tier="premium") as usage:
+        assert not usage.degraded
+        record_upstream_usage("gemini", input_tokens=900, output_tokens=200, image_bytes=5000, latency_ms=800)
+    assert ledger.admit("u1", "identify", tier="premium").degraded
+
+    for _ in range(2):
+        with ledger.admit("u3", "identify"):
+            record_upstream_usage("gemini", input_tokens=10)
+    with pytest.raises(HTTPException) as excinfo:
+        ledger.admit("u3", "identify")
+    assert excinfo.value.status_code == 429
+    assert int(excinfo.value.headers["Retry-After"]) > 0
+
+    record_upstream_usage("gemini", input_tokens=10**6)  # outside any scope: not billed
+    usage = ledger.usage("u1")
+    assert usage["totals"]["tokens"] == 1100
+    assert usage["breakdown"] == [{"endpoint": "identify", "provider": "gemini", "calls": 1, "input_tokens": 900,
+                                   "output_tokens": 200, "tokens": 1100, "image_bytes": 5000, "latency_ms": 800}]
+    stats = ledger.stats()
+    assert (stats["degraded"], stats["rejected"]) == (1, 1)
+
+
+def test_concurrent_admissions_reserve_their_calls():
+    ledger = _ledger()
+
+    async def identify(user_id, calls=1, bill=1):
+        try:
+            with ledger.admit(user_id, "identify", calls=calls):
+                await asyncio.sleep(0.01)  # upstream call in flight: nothing recorded yet
+                for _ in range(bill):
+                    record_upstream_usage("gemini", input_tokens=10)
+        except HTTPException as e:
+            return e.status_code
+        return 200
+
+    async def scenario():
+        # Three concurrent requests against a 2-call budget: the third sees the first two's reservations
+        assert await asyncio.gather(*(identify("u1") for _ in range(3))) == [200, 200, 429]
+        assert ledger.stats()["reserved_calls"] == 0
+
+        # A batch reserves all its calls up front and gives back the ones it did not use
+        assert await asyncio.gather(identify("u2", calls=2, bill=1), identify("u2")) == [200, 429]
+        assert ledger.usage("u2")["totals"]["calls"] == 1
+        assert await identify("u2") == 200
+
+        # Tasks started in the scope keep its reservation after the `with` block has exited
+        with ledger.admit("u3", "identify-batch", calls=2) as usage:
+            tasks = [usage.track(asyncio.ensure_future(identify_later())) for _ in range(2)]
+        assert ledger.stats()["reserved_calls"] == 2
+        with pytest.raises(HTTPException):
+            ledger.admit("u3", "identify")
+        await asyncio.gather(*tasks)
+        assert ledger.stats()["reserved_calls"] == 0
+        assert ledger.usage("u3")["totals"]["calls"] == 2
+
+    async def identify_later():
+        await asyncio.sleep(0.01)
+        record_upstream_usage("gemini", input_tokens=10)
+
+    asyncio.run(scenario())
+
+
+def test_flush_writes_deltas_and_retries_failures():
+    written = []
+    failures = iter([True, False, False])
+
+    def sink(rows):
+        if next(failures):
+            raise OSError("storage unavailable")
+        written.append(rows)
+
+    async def scenario():
+        ledger = _ledger(sink=sink)
+        ledger.record("u1", "identify", "gemini", input_tokens=5, output_tokens=5)
+        assert await ledger.flush() == 0
+        ledger.record("u1", "identify", "gemini", input_tokens=1)
+        assert await ledger.flush() == 1
+        assert await ledger.flush() == 0  # nothing new
+        ledger.record("u1", "identify-enhanced", "parserator", total_tokens=40)
+        await ledger.close()
+        return ledger
+
+    ledger = asyncio.run(scenario())
+    assert written[0][0]["calls"] == 2
+    assert written[0][0]["tokens"] == 11
+    assert written[1][0]["provider"] == "parserator"
+    assert ledger.stats()["flush_failures"] == 1
+
+
+def test_gemini_adapter_records_usage_metadata():
+    async def handler(request: httpx.Request):
+        return httpx.Response(200, json={
+            "candidates": [{"content": {"parts": [{"text": json.dumps(AI_RESPONSE)}]}}],
+            "usageMetadata": {"promptTokenCount": 1290, "candidatesTokenCount": 310, "totalTokenCount": 1600},
+        })
+
+    async def scenario():
+        ledger = _ledger()
+        async with httpx.AsyncClient(base_url="http://stand-in", transport=httpx.MockTransport(handler)) as client:
+            with ledger.admit("u1", "identify"):
+                await gemini_generate_content(client, "gemini-1.5-flash", "key", "identify", b"x" * 3000)
+        return ledger.usage("u1")
+
+    usage = asyncio.run(scenario())
+    assert usage["totals"]["input_tokens"] == 1290
+    assert usage["totals"]["tokens"] == 1600
+    assert usage["totals"]["image_bytes"] == 3000
+    assert image_size("data:image/png;base64,aGVsbG8=") == 5
+
+
+def test_identify_rejects_over_budget_user_before_calling_upstream(test_client, mocker):
+    _verify_test_tokens(mocker)
+    mocker.patch.object(backend_server, 'usage_ledger', _ledger())
+    upstream = mocker.patch('backend_server.AIService.identify_crystal_with_gemini', new_callable=AsyncMock,
+                            side_effect=_billed_gemini)
+
+    for image in ("b25l", "dHdv"):
+        assert test_client.post("/api/crystal/identify", json={"image_data": image}, headers=_auth("u9")).status_code == 200
+    response = test_client.post("/api/crystal/identify", json={"image_data": "dGhyZWU="}, headers=_auth("u9"))
+
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+    assert upstream.await_count == 2
+    usage = test_client.get("/api/metrics/usage/u9").json()
+    assert usage["totals"]["calls"] == 2
+    assert usage["totals"]["tokens"] == 300
+    assert test_client.get("/api/metrics").json()["usage_ledger"]["rejected"] == 1
+
+
+def test_unverified_callers_are_anonymous_per_client_address(test_client, mocker):
+    ledger = _ledger()
+    assert ledger.resolve(None, client_ip="10.0.0.1") == ("anonymous:10.0.0.1", "anonymous")
+    with ledger.admit(None, "identify", client_ip="10.0.0.1"):
+        record_upstream_usage("gemini", input_tokens=10)
+    with pytest.raises(HTTPException) as excinfo:
+        ledger.admit(None, "identify", client_ip="10.0.0.1")
+    assert excinfo.value.status_code == 429
+    assert not ledger.admit(None, "identify", client_ip="10.0.0.2").degraded
+
+    _verify_test_tokens(mocker)
+    mocker.patch.object(backend_server, 'usage_ledger', _ledger())
+    mocker.patch('backend_server.AIService.identify_crystal_with_gemini', new_callable=AsyncMock, side_effect=_billed_gemini)
+    identify = lambda image, uid, **kwargs: test_client.post("/api/crystal/identify", json={
+        "image_data": image, "user_context": {"user_id": uid, "subscription_tier": "founders"}}, **kwargs)
+
+    # A uid (and tier) in the body identifies nobody: fresh fake uids share the one anonymous budget
+    assert identify("b25l", "victim").status_code == 200
+    assert identify("dHdv", "fake-1").status_code == 429
+    assert identify("dGhyZWU=", "fake-2", headers={"Authorization": "Bearer forged"}).status_code == 429
+    assert test_client.get("/api/metrics/usage/victim").json()["totals"]["calls"] == 0
+    assert test_client.get("/api/metrics/usage/anonymous:testclient").json()["totals"]["calls"] == 1
+
+    # The real user, with a verified token, is billed separately
+    assert identify("Zm91cg==", "ignored", headers=_auth("victim")).status_code == 200
+    assert test_client.get("/api/metrics/usage/victim").json()["totals"]["calls"] == 1
+    id_tokens = test_client.get("/api/metrics").json()["id_tokens"]
+    assert (id_tokens["verified"], id_tokens["invalid"], id_tokens["missing"]) == (1, 1, 2)
+
+
+def test_identify_uses_the_tier_from_the_users_firestore_profile(test_client, mock_firestore_client, mocker):
+    _verify_test_tokens(mocker)
+    mocker.patch.object(backend_server, 'usage_ledger', _ledger())
+    mocker.patch.object(backend_server, 'user_tiers', backend_server.TTLCache(max_entries=10))
+    upstream = mocker.patch('backend_server.AIService.identify_crystal_with_gemini', new_callable=AsyncMock,
+                            return_value=AI_RESPONSE)
+    profile = mocker.MagicMock(exists=True, to_dict=mocker.MagicMock(return_value={"subscriptionTier": "premium"}))
+    mock_firestore_client.collection.return_value.document.return_value.get.return_value = profile
+
+    for image in ("b25l", "dHdv", "dGhyZWU="):
+        response = test_client.post("/api/crystal/identify",
+                                    json={"image_data": image, "user_context": {"tier": "free"}}, headers=_auth("u7"))
+        assert response.status_code == 200
+    assert upstream.await_count == 3
+    mock_firestore_client.collection.assert_any_call('users')
+    mock_firestore_client.collection.return_value.document.assert_any_call('u7')
+    assert test_client.get("/api/metrics/usage/u7").json()["totals"]["calls"] == 0  # mocked upstream, nothing billed
+    assert test_client.get("/api/usage/u7").status_code in (404, 405)
+
+
+def test_identify_batch_must_fit_the_remaining_budget(test_client, mocker):
+    _verify_test_tokens(mocker)
+    mocker.patch.object(backend_server, 'usage_ledger', _ledger())
+    upstream = mocker.patch('backend_server.AIService.identify_crystal_with_gemini', new_callable=AsyncMock,
+                            return_value=AI_RESPONSE)
+    images = [{"image_data": image} for image in ("b25l", "dHdv", "dGhyZWU=")]
+
+    response = test_client.post("/api/crystal/identify-batch", json={"images": images}, headers=_auth("u8"))
+
+    assert response.status_code == 429
+    assert "3 calls requested, 2 left today" in response.json()["detail"]
+    assert upstream.await_count == 0
@@ -0,0 +1,102 @@
+import json
+from unittest.mock import MagicMock
+
+from fastapi.testclient import TestClient
+
+import backend_server
+from backend_validation import (
+    VALIDATOR_ENGINES, EMAValidator, ExoditicalValidator, ValidationPool, ValidationReport, validate_chunk,
+)
+
+GROUNDED = {"crystal_core": {"id": "c-grounded"}, "notes": "Traditionally believed to calm; sustainably and ethically "
+                                                            "sourced, may suit everyone"}
+HYPED = {"id": "c-hyped", "notes": "Shamanic stone that cures anxiety, expensive and exclusive"}
+
+
+def _collection(count: int):
+    return [dict(GROUNDED if i % 3 else HYPED, id=f"c{i}") for i in range(count)]
+
+
+def test_report_aggregates_means_distributions_and_non_compliant_ids():
+    items, elapsed_ms, counters = validate_chunk([(0, GROUNDED), (1, HYPED), (2, {"name": "plain"})],
+                                                 ('ema', 'exoditical'))
+    assert [item["id"] for item in items] == ["c-grounded", "c-hyped", "2"]
+    assert items[1]["validations"]["exoditical"] == ExoditicalValidator.validate_crystal_data(HYPED)
+    assert elapsed_ms >= 0
+    assert counters["ema"]["validations"] == counters["exoditical"]["scored"] == 3
+    assert counters["ema"]["chars"] > 0
+
+    report = ValidationReport(('ema', 'exoditical'))
+    for item in items:
+        report.add(item)
+    summary = report.summary()
+    assert summary["total"] == 3
+
+    ethics = summary["validators"]["exoditical"]
+    assert ethics["non_compliant_ids"] == ["c-hyped"]
+    assert (ethics["compliant"], ethics["non_compliant"]) == (2, 1)
+    expected_mean = sum(ExoditicalValidator.validate_crystal_data(c)["overall_ethical_score"]
+                        for c in (GROUNDED, HYPED, {"name": "plain"})) / 3
+    assert ethics["mean_score"] == round(expected_mean, 4)
+    assert ethics["principles"]["spiritual_integrity"]["distribution"] == {"0.40": 1, "0.80": 1, "0.90": 1}
+    assert summary["validators"]["ema"]["principles"]["user_sovereignty"] == {"mean": 0.9, "distribution": {"0.90": 3}}
+
+
+def test_validate_batch_chunks_work_across_worker_processes(test_client: TestClient, mocker):
+    pool = ValidationPool(workers=2, chunk_size=4)
+    mocker.patch.object(backend_server, 'validation_pool', pool)
+    validations_before = {name: engine.validations for name, engine in VALIDATOR_ENGINES.items()}
+    pool.start()
+    try:
+        crystals = _collection(10)
+        response = test_client.post("/api/crystal/validate-batch", json={"crystals": crystals})
+    finally:
+        pool.close()
+    # The workers' validations count toward this process's engine stats
+    assert {name: engine.validations - validations_before[name]
+            for name, engine in VALIDATOR_ENGINES.items()} == {"ema": 10, "exoditical": 10}
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [item["index"] for item in body["results"]] == list(range(10))
+    assert body["results"][3]["validations"]["ema"] == EMAValidator.validate_data_sovereignty(crystals[3])
+    assert body["summary"]["total"] == 10
+    assert body["summary"]["validators"]["exoditical"]["non_compliant_ids"] == ["c0", "c3", "c6", "c9"]
+
+    stats = test_client.get("/api/metrics").json()["validate_batch"]
+    assert (stats["batches"], stats["items"], stats["chunks"], stats["thread_chunks"]) == (1, 10, 3, 0)
+
+
+def test_validate_batch_streams_a_users_collection(test_client: TestClient, mock_firestore_client, mocker):
+    mocker.patch.object(backend_server, 'validation_pool', ValidationPool(chunk_size=2))
+    docs = [MagicMock(to_dict=MagicMock(return_value=crystal)) for crystal in _collection(5)]
+    crystals_collection = mock_firestore_client.collection('crystals')
+    crystals_collection.where.return_value.stream.return_value = docs
+
+    response = test_client.post("/api/crystal/validate-batch?stream=true",
+                                json={"user_id": "user-1", "validators": ["exoditical"]})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    crystals_collection.where.assert_called_with("user_integration.user_id", "==", "user-1")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    items, summary = lines[:-1], lines[-1]["summary"]
+    assert sorted(item["index"] for item in items) == list(range(5))
+    assert all(set(item["validations"]) == {"exoditical"} for item in items)
+    assert summary["total"] == 5
+    assert set(summary["validators"]) == {"exoditical"}
+    assert sorted(summary["validators"]["exoditical"]["non_compliant_ids"]) == ["c0", "c3"]
+
+
+def test_validate_batch_rejects_bad_requests(test_client: TestClient, mocker):
+    mocker.patch.object(backend_server, 'VALIDATE_BATCH_MAX_ITEMS', 3)
+    post = lambda body: test_client.post("/api/crystal/validate-batch", json=body)
+
+    assert post({}).status_code == 422
+    assert post({"crystals": [], "user_id": "user-1"}).status_code == 422
+    assert post({"crystals": [HYPED], "validators": ["astrology"]}).status_code == 422
+    assert post({"crystals": _collection(4)}).status_code == 413
+
+    empty = post({"crystals": []})
+    assert empty.status_code == 200
+    assert empty.json()["summary"]["validators"]["ema"]["mean_score"] == 0.0
@@ -0,0 +1,137 @@
+import random
+
+from fastapi.testclient import TestClient
+
+import backend_server_clean
+import backend_server_enhanced
+from backend_validation import EMA_PRINCIPLES, EMAValidator, EXODITICAL_PRINCIPLES, ExoditicalValidator, ValidationEngine
+
+
+def legacy_ema_scores(data):
+    """The per-check `str(data).lower()` scoring the engine replaced"""
+    def portability():
+        score = 0.8
+        if 'export_format' in str(data).lower() or 'json' in str(data).lower():
+            score += 0.1
+        if 'exportable' in str(data).lower():
+            score += 0.1
+        return min(score, 1.0)
+
+    def sovereignty():
+        score = 0.9
+        if 'user_controlled' in str(data).lower():
+            score += 0.1
+        return min(score, 1.0)
+
+    def agnosticism():
+        score = 0.8
+        if not any(term in str(data).lower() for term in ['proprietary', 'locked', 'vendor_specific']):
+            score += 0.2
+        return min(score, 1.0)
+
+    def transparency():
+        score = 0.8
+        if 'confidence' in str(data).lower() or 'ai_' in str(data).lower():
+            score += 0.1
+        if 'processing' in str(data).lower() or 'metadata' in str(data).lower():
+            score += 0.1
+        return min(score, 1.0)
+
+    return {'data_portability': portability(), 'user_sovereignty': sovereignty(),
+            'technological_agnosticism': agnosticism(), 'transparency': transparency()}
+
+
+def legacy_exoditical_scores(data):
+    def check(base, *rules):
+        score = base
+        for terms, delta in rules:
+            if any(term in str(data).lower() for term in terms):
+                score += delta
+        return min(max(score, 0.0), 1.0)
+
+    return {
+        'cultural_sovereignty': check(0.7, (['traditional', 'indigenous', 'cultural'], 0.2),
+                                      (['ancient secret', 'mystical power', 'sacred wisdom', 'shamanic'], -0.3)),
+        'spiritual_integrity': check(0.8, (['cures', 'heals', 'treats', 'diagnoses', 'medical'], -0.4),
+                                     (['believed to', 'traditionally', 'some say'], 0.1)),
+        'environmental_stewardship': check(0.6, (['environmental', 'sustainable'], 0.3),
+                                           (['ethical', 'fair trade'], 0.1)),
+        'technological_wisdom': check(0.8, (['may', 'might', 'possibly', 'confidence'], 0.1),
+                                      (['personal choice', 'individual', 'trust yourself'], 0.1)),
+        'inclusive_accessibility': check(0.8, (['expensive', 'exclusive', 'elite', 'advanced only'], -0.3),
+                                         (['accessible', 'everyone', 'free', 'community'], 0.2)),
+    }
+
+
+def _payload(rng, terms, size):
+    """Nested crystal-like dict sprinkled with (mixed-case) validator terms"""
+    filler = ['stone', 'quartz', 'clarity', 'grounding', 'pink', 'vein', 'luster', 'x', ' ']
+
+    def text():
+        words = [rng.choice(terms) if rng.random() < 0.15 else rng.choice(filler) for _ in range(rng.randint(1, 8))]
+        return ''.join(word.upper() if rng.random() < 0.2 else word for word in words)
+    return {
+        'identification': {'name': text(), 'confidence': rng.random()},
+        'notes': [text() for _ in range(size)],
+        'properties': {text(): text() for _ in range(size // 2)},
+    }
+
+
+def test_engine_scores_match_the_legacy_checks():
+    rng = random.Random(23)
+    for validator, legacy in ((EMAValidator, legacy_ema_scores), (ExoditicalValidator, legacy_exoditical_scores)):
+        for _ in range(300):
+            payload = _payload(rng, validator.engine.terms, rng.randint(0, 6))
+            assert validator.engine.score(payload) == legacy(payload)
+
+
+def test_overlapping_and_nested_terms_are_all_found():
+    engine = ValidationEngine(EXODITICAL_PRINCIPLES)
+    # 'traditional' hides in 'traditionally'; 'elite' and 'everyone' share their 'e'
+    assert {'traditional', 'traditionally', 'elite', 'everyone'} <= engine.matched_terms({'Note': 'TRADITIONALLYeliteveryone'})
+    assert engine.matched_terms({'text': 'freedom'}) == {'free'}
+    assert engine.matched_terms({}) == frozenset()
+    # Keys and reprs count, exactly as with str(data)
+    assert 'may' in engine.matched_terms({'mayan': None})
+
+
+def test_validate_endpoints_use_the_engine():
+    payload = {'identification': {'name': 'Amethyst', 'confidence': 0.9}, 'notes': 'Traditionally believed to calm; '
+               'ethically sourced, accessible to everyone. Not a medical treatment.'}
+
+    client = TestClient(backend_server_clean.app)
+    before = client.get('/api/metrics').json()['validation']['validations']
+    response = client.post('/api/crystal/validate-ema', json=payload)
+    assert response.status_code == 200
+    assert response.json()['validation_result']['principle_scores'] == legacy_ema_scores(payload)
+    assert client.get('/api/metrics').json()['validation']['validations'] == before + 1
+
+    client = TestClient(backend_server_enhanced.app)
+    response = client.post('/api/crystal/validate', json=payload)
+    assert response.status_code == 200
+    result = response.json()['validation_result']
+    assert result['principle_scores'] == legacy_exoditical_scores(payload)
+    assert result['principle_scores']['spiritual_integrity'] == min(max(0.8 - 0.4 + 0.1, 0.0), 1.0)
+    assert client.get('/api/metrics').json()['validation']['terms'] == len(ExoditicalValidator.engine.terms)
+
+
+class CountingDict(dict):
+    """A payload that counts how often it is serialized with str()"""
+    serialized = 0
+
+    def __repr__(self):
+        CountingDict.serialized += 1
+        return super().__repr__()
+
+
+def test_each_payload_is_serialized_once_per_validation(mocker):
+    mocker.patch.object(CountingDict, 'serialized', 0)
+    payload = CountingDict(_payload(random.Random(5), EMAValidator.engine.terms, 50))
+
+    ValidationEngine(EMA_PRINCIPLES).score(payload)
+    assert CountingDict.serialized == 1
+    ValidationEngine(EXODITICAL_PRINCIPLES).score(payload)
+    assert CountingDict.serialized == 2
+
+    legacy_ema_scores(payload)  # the per-check scoring serializes at least once per principle
+    assert CountingDict.serialized - 2 >= len(EMA_PRINCIPLES)
@@ -0,0 +1,80 @@
+import base64
+from unittest.mock import AsyncMock
+
+from fastapi.testclient import TestClient
+
+import backend_server_clean
+from backend_cache import IdentificationCache, SingleFlight
+from backend_validation import EMA_PRINCIPLES, EXODITICAL_PRINCIPLES, Principle, TermCheck, ValidationEngine, ValidationMemo
+
+AI_RESULT = {
+    "identification": {"name": "Amethyst", "confidence": 92, "variety": "Chevron"},
+    "metaphysical_properties": {"primary_chakras": ["Crown"], "notes": "Traditionally believed to calm"},
+    "processing_metadata": {"model": "gemini", "latency": 1.5},
+}
+
+
+def test_memo_is_a_bounded_lru_with_hit_rate():
+    memo = ValidationMemo(max_entries=2)
+    engine = ValidationEngine(EMA_PRINCIPLES, memo=memo)
+    first = engine.score({"a": "json"}, key="a")
+    first["data_portability"] = 0.0  # callers get copies
+    engine.score({"b": "proprietary"}, key="b")
+    assert engine.score({"a": "json"}, key="a")["data_portability"] == 0.9  # hit, now most recently used
+    engine.score({"c": "metadata"}, key="c")  # evicts "b"
+    engine.score({"b": "proprietary"}, key="b")
+
+    stats = memo.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"], stats["evictions"]) == (2, 1, 4, 2)
+    assert stats["hit_rate"] == 0.2
+    assert engine.stats()["scored"] == 4
+
+    disabled = ValidationEngine(EMA_PRINCIPLES, memo=ValidationMemo(max_entries=0))
+    disabled.score(AI_RESULT, key="r1")
+    disabled.score(AI_RESULT, key="r1")
+    assert disabled.stats()["scored"] == 2 and disabled.memo.stats()["misses"] == 0
+
+
+def test_payloads_without_a_content_key_are_scored_directly():
+    memo = ValidationMemo()
+    engine = ValidationEngine(EMA_PRINCIPLES, memo=memo)
+    engine.score(AI_RESULT)
+    engine.score(AI_RESULT)
+    assert engine.stats()["scored"] == 2
+    assert memo.stats()["misses"] == 0 and len(memo) == 0
+
+
+def test_rule_set_version_keeps_stale_scores_out():
+    memo = ValidationMemo()
+    ema = ValidationEngine(EMA_PRINCIPLES, memo=memo)
+    exoditical = ValidationEngine(EXODITICAL_PRINCIPLES, memo=memo)
+    assert set(ema.score(AI_RESULT, key="r1")) != set(exoditical.score(AI_RESULT, key="r1"))
+    assert ValidationEngine(EMA_PRINCIPLES).version == ema.version
+
+    updated = [Principle('data_portability', 0.5, (TermCheck(('json',), 0.1),))] + EMA_PRINCIPLES[1:]
+    revised = ValidationEngine(updated, memo=memo)
+    assert revised.version != ema.version
+    assert revised.score(AI_RESULT, key="r1")["data_portability"] == 0.5
+    assert memo.stats()["hits"] == 0 and len(memo) == 3
+
+
+def test_reidentifying_a_cached_image_hits_the_memo(mocker):
+    mocker.patch.object(backend_server_clean, 'GEMINI_API_KEY', "test-gemini-key")
+    mocker.patch.object(backend_server_clean, 'OPENAI_API_KEY', '')
+    mocker.patch.object(backend_server_clean, 'identification_cache', IdentificationCache.from_env())
+    mocker.patch.object(backend_server_clean, 'identification_flights', SingleFlight('identification'))
+    mocker.patch.object(backend_server_clean.EMAValidator.engine, 'memo', ValidationMemo())
+    gemini = mocker.patch('backend_server_clean.AIService.identify_crystal_with_gemini', new_callable=AsyncMock,
+                          return_value=AI_RESULT)
+    client = TestClient(backend_server_clean.app)
+    identify = lambda image: client.post("/api/crystal/identify", json={"image_data": base64.b64encode(image).decode()})
+
+    first = identify(b"amethyst photo").json()
+    again = identify(b"amethyst photo").json()
+    identify(b"another photo")
+
+    assert gemini.await_count == 2  # the repeat was an identification cache hit
+    assert again["ema_compliance"] == first["ema_compliance"]
+    memo = backend_server_clean.EMAValidator.engine.memo.stats()
+    assert (memo["hits"], memo["misses"]) == (1, 2)
+    assert client.get('/api/metrics').json()['validation_memo']['enabled'] is True